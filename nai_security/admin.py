@@ -16,7 +16,8 @@ except ImportError:
 from .models import (
     BlockedCountry, BlockedIP, BlockedEmail, BlockedDomain,
     BlockedUserAgent, WhitelistedIP, WhitelistedUser, AllowedCountry,
-    RateLimitRule, LoginHistory, SecurityLog, SecuritySettings,
+    RateLimitRule, LoginHistory, SecurityLog, SecuritySettings, BlockedASN,
+    SecurityRouteRollup,
 )
 
 try:
@@ -108,7 +109,7 @@ class BlockedCountryAdmin(ModelAdmin):
 
 @admin.register(BlockedIP)
 class BlockedIPAdmin(ModelAdmin):
-    list_display = ["ip_address", "is_active", "status_badge", "is_auto_blocked", "country_code", "expires_at"]
+    list_display = ["ip_address", "prefix_length", "is_active", "status_badge", "is_auto_blocked", "country_code", "expires_at"]
     list_filter = ["is_active", "is_auto_blocked", "country_code", "created_at"]
     search_fields = ["ip_address", "reason"]
     list_editable = ["is_active"]
@@ -125,6 +126,19 @@ class BlockedIPAdmin(ModelAdmin):
     status_badge.short_description = "Status"
 
 
+@admin.register(BlockedASN)
+class BlockedASNAdmin(ModelAdmin):
+    list_display = ["asn_display", "organization", "is_active", "block_count", "created_at"]
+    list_filter = ["is_active", "created_at"]
+    search_fields = ["asn", "organization", "reason"]
+    list_editable = ["is_active"]
+    ordering = ["asn"]
+
+    @admin.display(description="ASN")
+    def asn_display(self, obj):
+        return f"AS{obj.asn}"
+
+
 @admin.register(BlockedEmail)
 class BlockedEmailAdmin(ImportExportModelAdmin, ModelAdmin):
     resource_class = BlockedEmailResource if BlockedEmailResource is not None else None
@@ -173,7 +187,7 @@ class BlockedUserAgentAdmin(ModelAdmin):
 
 @admin.register(WhitelistedIP)
 class WhitelistedIPAdmin(ModelAdmin):
-    list_display = ["ip_address", "description", "is_active", "created_by", "created_at"]
+    list_display = ["ip_address", "prefix_length", "description", "is_active", "created_by", "created_at"]
     list_filter = ["is_active", "created_at"]
     search_fields = ["ip_address", "description"]
     list_editable = ["is_active"]
@@ -230,7 +244,8 @@ class RateLimitRuleAdmin(ModelAdmin):
 class LoginHistoryAdmin(ModelAdmin):
     list_display = ["created_at", "user", "ip_address", "country_code", "device_type", "suspicious_badge"]
     list_filter = ["is_suspicious", "country_code", "device_type", "created_at"]
-    search_fields = ["user__email", "ip_address", "country_code"]
+    search_fields = ["user__email", "ip_address", "country_code", "user_agent_string__value"]
+    list_select_related = ["user", "user_agent_string"]
     readonly_fields = [
         "user", "ip_address", "country_code", "city", "user_agent",
         "device_type", "browser", "os", "is_suspicious", "suspicious_reason",
@@ -258,9 +273,10 @@ class LoginHistoryAdmin(ModelAdmin):
 class SecurityLogAdmin(ModelAdmin):
     list_display = ["created_at", "action_badge", "severity_badge", "ip_address", "country_code", "path_short"]
     list_filter = ["action", "severity", "country_code", "created_at"]
-    search_fields = ["ip_address", "path", "details", "user_email"]
+    search_fields = ["ip_address", "path", "route", "details", "user_email", "user_agent_string__value"]
+    list_select_related = ["user_agent_string"]
     readonly_fields = [
-        "ip_address", "country_code", "action", "severity", "path",
+        "ip_address", "country_code", "action", "severity", "path", "route",
         "method", "user_agent", "details", "user_email", "created_at",
     ]
     ordering = ["-created_at"]
@@ -277,6 +293,7 @@ class SecurityLogAdmin(ModelAdmin):
         "SUSPICIOUS_LOGIN": "#ffc107",
         "AUTO_BLOCK_IP": "#dc3545",
         "AUTO_BLOCK_COUNTRY": "#dc3545",
+        "ASN_BLOCK": "#dc3545",
     }
 
     SEVERITY_COLORS = {
@@ -307,6 +324,22 @@ class SecurityLogAdmin(ModelAdmin):
         return False
 
 
+@admin.register(SecurityRouteRollup)
+class SecurityRouteRollupAdmin(ModelAdmin):
+    """Top targeted routes: hourly counts per route, busiest first within each hour."""
+    list_display = ["hour", "route", "action", "count"]
+    list_filter = ["action", "hour"]
+    search_fields = ["route"]
+    date_hierarchy = "hour"
+    ordering = ["-hour", "-count"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(SecuritySettings)
 class SecuritySettingsAdmin(ModelAdmin):
     list_display = [
@@ -334,6 +367,8 @@ class SecuritySettingsAdmin(ModelAdmin):
             "fields": (
                 "auto_block_ip_threshold", "auto_block_ip_window_hours",
                 "auto_block_ip_duration_hours",
+                "auto_block_subnet_threshold", "auto_block_subnet_prefix_v4",
+                "auto_block_subnet_prefix_v6",
             )
         }),
         ("Auto-Block Country Settings", {
@@ -342,6 +377,9 @@ class SecuritySettingsAdmin(ModelAdmin):
                 "auto_block_country_window_hours",
             )
         }),
+        ("Retention", {
+            "fields": ("security_log_retention_days",),
+        }),
         ("Login Anomaly Detection", {
             "fields": (
                 "alert_on_new_country", "alert_on_new_ip", "max_countries_per_day",
@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Fill empty country_code on SecurityLog and LoginHistory rows from the GeoIP database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model',
+            choices=['security_log', 'login_history', 'all'],
+            default='all',
+            help='Which table to backfill (default: all)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Distinct IP addresses resolved per batch (default: 5000)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Resolve and count, but do not update any rows',
+        )
+
+    def handle(self, *args, **options):
+        from nai_security.models import LoginHistory, SecurityLog
+        from nai_security.services.geoip_ranges import get_country_range_table
+
+        table = get_country_range_table()
+        if table is None:
+            raise CommandError("GeoIP database not available; check GEOIP_PATH")
+
+        models = {'security_log': SecurityLog, 'login_history': LoginHistory}
+        if options['model'] != 'all':
+            models = {options['model']: models[options['model']]}
+
+        for name, model in models.items():
+            ips, rows = self.backfill(model, table, options['batch_size'], options['dry_run'])
+            verb = "Would update" if options['dry_run'] else "Updated"
+            self.stdout.write(self.style.SUCCESS(
+                f"{name}: {verb} {rows} rows across {ips} resolved IP addresses"
+            ))
+
+    @staticmethod
+    def backfill(model, table, batch_size, dry_run=False) -> tuple[int, int]:
+        """
+        Walk the distinct IPs of rows without a country in address order (keyset
+        pagination, so updated rows never shift the walk) and update each batch
+        with one UPDATE per country. Returns (resolved ips, updated rows).
+        """
+        pending = model.objects.filter(country_code='')
+        resolved_ips = updated_rows = 0
+        last_ip = None
+        while True:
+            batch = pending.order_by('ip_address')
+            if last_ip is not None:
+                batch = batch.filter(ip_address__gt=last_ip)
+            ips = list(batch.values_list('ip_address', flat=True).distinct()[:batch_size])
+            if not ips:
+                return resolved_ips, updated_rows
+            last_ip = ips[-1]
+
+            by_country: dict[str, list[str]] = {}
+            for ip, country_code in table.lookup_many(ips).items():
+                if country_code:
+                    by_country.setdefault(country_code, []).append(ip)
+            for country_code, country_ips in by_country.items():
+                resolved_ips += len(country_ips)
+                matching = pending.filter(ip_address__in=country_ips)
+                updated_rows += (
+                    matching.count() if dry_run else matching.update(country_code=country_code)
+                )
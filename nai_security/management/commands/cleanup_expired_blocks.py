@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Deactivate expired IP blocks in bounded chunks, invalidating their cache entries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=None,
+            help='Blocks deactivated per UPDATE (default: NAI_SECURITY_EXPIRY_CHUNK_SIZE, 1000)',
+        )
+
+    def handle(self, *args, **options):
+        from nai_security.services import AutoBlocker
+
+        chunk_size = options['chunk_size']
+        if chunk_size is not None and chunk_size < 1:
+            raise CommandError("--chunk-size must be at least 1")
+
+        def progress(count):
+            self.stdout.write(f"  {count} deactivated...")
+
+        count = AutoBlocker.cleanup_expired_blocks(chunk_size=chunk_size, progress=progress)
+        self.stdout.write(self.style.SUCCESS(f"Deactivated {count} expired IP blocks"))
@@ -1,14 +1,18 @@
 import os
+import tempfile
 import urllib.request
 from django.core.management.base import BaseCommand
 from django.conf import settings
-from nai_security.utils import resolve_geoip_db_path
+from nai_security.utils import GEOIP_EDITION_FILENAMES, get_geoip_asn_path, resolve_geoip_db_path
 
 
 class Command(BaseCommand):
-    help = 'Download MaxMind GeoLite2 Country database'
+    help = 'Download MaxMind GeoLite2 Country (or ASN) database'
     
-    DOWNLOAD_URL = "https://github.com/P3TERX/GeoLite.mmdb/releases/latest/download/GeoLite2-Country.mmdb"
+    DOWNLOAD_URLS = {
+        'country': "https://github.com/P3TERX/GeoLite.mmdb/releases/latest/download/GeoLite2-Country.mmdb",
+        'asn': "https://github.com/P3TERX/GeoLite.mmdb/releases/latest/download/GeoLite2-ASN.mmdb",
+    }
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -16,39 +20,69 @@ class Command(BaseCommand):
             type=str,
             help='Output path for the database file',
         )
+        parser.add_argument(
+            '--edition',
+            choices=sorted(self.DOWNLOAD_URLS),
+            default='country',
+            help='Which database to download (default: country)',
+        )
 
     def handle(self, *args, **options):
+        edition = options['edition']
+        filename = GEOIP_EDITION_FILENAMES[edition]
+        download_url = self.DOWNLOAD_URLS[edition]
         output_path = options.get('output')
 
+        if output_path:
+            output_path = resolve_geoip_db_path(output_path, edition)
+        elif edition == 'asn':
+            output_path = get_geoip_asn_path()
+        else:
+            output_path = resolve_geoip_db_path(getattr(settings, 'GEOIP_PATH', None))
         if not output_path:
-            output_path = getattr(settings, 'GEOIP_PATH', None)
-
-        output_path = resolve_geoip_db_path(output_path)
-        if not output_path:
-            output_path = os.path.join(settings.BASE_DIR, 'geoip', 'GeoLite2-Country.mmdb')
+            output_path = os.path.join(settings.BASE_DIR, 'geoip', filename)
         
         output_dir = os.path.dirname(output_path)
         if output_dir and not os.path.exists(output_dir):
             os.makedirs(output_dir)
             self.stdout.write(f"Created directory: {output_dir}")
         
-        self.stdout.write(f"Downloading GeoLite2-Country database...")
-        self.stdout.write(f"URL: {self.DOWNLOAD_URL}")
+        self.stdout.write(f"Downloading {filename[:-len('.mmdb')]} database...")
+        self.stdout.write(f"URL: {download_url}")
         self.stdout.write(f"Output: {output_path}")
         
         try:
-            urllib.request.urlretrieve(self.DOWNLOAD_URL, output_path)
+            # Download next to the target and rename over it, so running workers
+            # (which memory-map the file) never see a partially written database
+            # and pick up the new one by its changed inode.
+            fd, tmp_path = tempfile.mkstemp(
+                dir=output_dir or None, prefix=f'.{filename[:-len(".mmdb")]}.', suffix='.tmp',
+            )
+            os.close(fd)
+            try:
+                urllib.request.urlretrieve(download_url, tmp_path)
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, output_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
             self.stdout.write(self.style.SUCCESS(f"Downloaded to {output_path}"))
             self.stdout.write(self.style.SUCCESS(f"Size: {os.path.getsize(output_path)} bytes"))
             
             try:
-                import geoip2.database
-                reader = geoip2.database.Reader(output_path)
-                response = reader.country('8.8.8.8')
-                self.stdout.write(self.style.SUCCESS(f"Verified: 8.8.8.8 -> {response.country.iso_code}"))
-                reader.close()
+                self.stdout.write(self.style.SUCCESS(f"Verified: {self.verify(output_path, edition)}"))
             except Exception as e:
                 self.stdout.write(self.style.WARNING(f"Verification failed: {e}"))
             
         except Exception as e:
             self.stdout.write(self.style.ERROR(f"Download failed: {e}"))
+
+    @staticmethod
+    def verify(path, edition) -> str:
+        """Look up a well-known address in the new file."""
+        import geoip2.database
+        with geoip2.database.Reader(path) as reader:
+            if edition == 'asn':
+                return f"8.8.8.8 -> AS{reader.asn('8.8.8.8').autonomous_system_number}"
+            return f"8.8.8.8 -> {reader.country('8.8.8.8').country.iso_code}"
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Convert the SecurityLog table to daily or weekly range partitions (PostgreSQL only)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            choices=['day', 'week'],
+            default=None,
+            help='Partition size (default: NAI_SECURITY_LOG_PARTITIONING)',
+        )
+        parser.add_argument(
+            '--ahead',
+            type=int,
+            default=None,
+            help='Future partitions to create (default: NAI_SECURITY_LOG_PARTITIONS_AHEAD, 7)',
+        )
+
+    def handle(self, *args, **options):
+        from nai_security.services.log_retention import convert_to_partitioned, partitioning_interval
+
+        try:
+            interval = options['interval'] or partitioning_interval()
+            if interval is None:
+                raise CommandError("Pass --interval or set NAI_SECURITY_LOG_PARTITIONING")
+            created = convert_to_partitioned(interval, options['ahead'])
+        except (RuntimeError, ValueError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"SecurityLog partitioned by {interval}: {created} partitions plus a default partition"
+        ))
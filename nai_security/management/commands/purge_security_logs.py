@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Delete SecurityLog entries older than the retention period, in bounded batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=None,
+            help='Retention in days (default: SecuritySettings.security_log_retention_days)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Rows deleted per DELETE (default: NAI_SECURITY_LOG_PURGE_BATCH_SIZE, 5000)',
+        )
+
+    def handle(self, *args, **options):
+        from nai_security.services.log_retention import ensure_log_partitions, purge_security_logs
+
+        if options['days'] is not None and options['days'] < 1:
+            raise CommandError("--days must be at least 1")
+        if options['batch_size'] is not None and options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        def progress(count):
+            self.stdout.write(f"  {count} deleted...")
+
+        result = purge_security_logs(options['days'], options['batch_size'], progress=progress)
+        created = ensure_log_partitions()
+        self.stdout.write(self.style.SUCCESS(
+            f"Dropped {result['partitions_dropped']} partitions, deleted {result['deleted']} rows"
+            + (f", deleted {result['user_agents_deleted']} unused user agents" if result['user_agents_deleted'] else "")
+            + (f", created {created} partitions" if created else "")
+        ))
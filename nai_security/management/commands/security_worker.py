@@ -0,0 +1,92 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Consume security events from the Redis Streams event bus (NAI_SECURITY_EVENT_BUS)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--consumer',
+            action='append',
+            dest='consumers',
+            help='Consumer group to run: log_writer, auto_blocker, rollup or notifier. '
+                 'Repeat for several (default: all)',
+        )
+        parser.add_argument(
+            '--name',
+            default=None,
+            help='Consumer name within the groups (default: hostname-pid)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Events read and acknowledged per batch (default: NAI_SECURITY_EVENT_BUS_BATCH_SIZE, 100)',
+        )
+        parser.add_argument(
+            '--block-ms',
+            type=int,
+            default=None,
+            help='How long a read waits for new events (default: 5000)',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Process what is waiting, then exit',
+        )
+
+    def handle(self, *args, **options):
+        from nai_security.services.event_bus import CONSUMERS, build_consumer
+
+        names = options['consumers'] or list(CONSUMERS)
+        unknown = [name for name in names if name not in CONSUMERS]
+        if unknown:
+            raise CommandError(f"Unknown consumer(s): {', '.join(unknown)}")
+        if options['batch_size'] is not None and options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        consumers = [
+            build_consumer(
+                name, consumer=options['name'],
+                batch_size=options['batch_size'], block_ms=options['block_ms'],
+            )
+            for name in names
+        ]
+
+        if options['once']:
+            for consumer in consumers:
+                total = 0
+                while processed := consumer.run_once(block=False):
+                    total += processed
+                self.stdout.write(f"  {consumer.group}: {total} events")
+            self.stdout.write(self.style.SUCCESS("Event bus drained"))
+            return
+
+        stop = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())
+
+        def run(consumer):
+            while not stop.is_set():
+                try:
+                    consumer.run_once()
+                except Exception as e:
+                    # Redis unreachable and the like: retry after a pause.
+                    self.stderr.write(f"{consumer.group}: {e}")
+                    stop.wait(1)
+
+        threads = [
+            threading.Thread(target=run, args=(consumer,), name=f"security-worker-{consumer.group}", daemon=True)
+            for consumer in consumers
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"Consuming {', '.join(names)} as {consumers[0].consumer}")
+        while not stop.wait(1):
+            pass
+        for thread in threads:
+            thread.join()
+        self.stdout.write(self.style.SUCCESS("Stopped"))
@@ -1,3 +1,4 @@
 from .security import SecurityMiddleware, RateLimitLoggingMiddleware
+from .rate_limit import RateLimitMiddleware
 
-__all__ = ['SecurityMiddleware', 'RateLimitLoggingMiddleware']
+__all__ = ['SecurityMiddleware', 'RateLimitLoggingMiddleware', 'RateLimitMiddleware']
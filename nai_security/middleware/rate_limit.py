@@ -0,0 +1,119 @@
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings as django_settings
+from django.http import HttpResponse
+
+from ..models import RateLimitRule, SecurityLog
+from ..services.path_normalizer import request_route
+from ..services.policy_snapshot import UNREAD, get_policy_snapshot, get_policy_snapshot_async
+from ..services.rate_limiter import (
+    get_rate_limit_policy, get_rate_limit_policy_async, get_rate_limiter,
+)
+from ..utils import get_client_ip, increment_batched, increment_batched_async
+from .security import SecurityMiddleware, _aget_user
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitMiddleware:
+    """
+    Enforces active RateLimitRule rows per client IP.
+
+    A request matching a rule's path prefix (and method) past its rate gets a
+    429 with Retry-After and a RATE_LIMIT SecurityLog entry; request.limited and
+    request.rate_limit_rule are set so RateLimitLoggingMiddleware does not log
+    the same hit twice.
+    WhitelistedUser exemptions 'rate_limit' and 'all' bypass enforcement.
+    Counter errors fail open: the request is let through and the error logged.
+
+    Place AFTER AuthenticationMiddleware (exemptions need request.user).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.snapshot_mode = getattr(django_settings, 'NAI_SECURITY_POLICY_SNAPSHOT', False)
+        self.limiter = get_rate_limiter()
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        # SecurityMiddleware has usually read the policy generation already.
+        generation = getattr(request, 'security_policy_generation', UNREAD)
+        rule = get_rate_limit_policy(generation).match(request.path, request.method)
+        if rule is None:
+            return self.get_response(request)
+
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            snapshot = get_policy_snapshot(generation) if self.snapshot_mode else None
+            if SecurityMiddleware._get_user_exemption(user.pk, snapshot) in ('rate_limit', 'all'):
+                return self.get_response(request)
+
+        ip_address = get_client_ip(request)
+        result = self._hit(rule, ip_address)
+        if result is None or result.allowed:
+            return self.get_response(request)
+
+        increment_batched(RateLimitRule, rule.pk, f"sec_rl_count:{rule.pk}")
+        SecurityLog.record_event(**self._event(request, ip_address, rule))
+        return self._limited(request, ip_address, rule, result)
+
+    async def __acall__(self, request):
+        generation = getattr(request, 'security_policy_generation', UNREAD)
+        rule = (await get_rate_limit_policy_async(generation)).match(request.path, request.method)
+        if rule is None:
+            return await self.get_response(request)
+
+        user = await _aget_user(request)
+        if user is not None and user.is_authenticated:
+            snapshot = await get_policy_snapshot_async(generation) if self.snapshot_mode else None
+            exemption = await SecurityMiddleware._get_user_exemption_async(user.pk, snapshot)
+            if exemption in ('rate_limit', 'all'):
+                return await self.get_response(request)
+
+        ip_address = get_client_ip(request)
+        # The Redis client is synchronous; the counter round-trip runs in a thread.
+        result = await sync_to_async(self._hit, thread_sensitive=False)(rule, ip_address)
+        if result is None or result.allowed:
+            return await self.get_response(request)
+
+        await increment_batched_async(RateLimitRule, rule.pk, f"sec_rl_count:{rule.pk}")
+        await SecurityLog.record_event_async(**self._event(request, ip_address, rule))
+        return self._limited(request, ip_address, rule, result)
+
+    def _hit(self, rule, ip_address):
+        try:
+            return self.limiter.hit(rule, ip_address)
+        except Exception as e:
+            logger.error("Rate limit check failed for rule %s: %s", rule.pk, e)
+            return None
+
+    @staticmethod
+    def _event(request, ip_address, rule):
+        return dict(
+            ip_address=ip_address,
+            action='RATE_LIMIT',
+            path=request.path,
+            route=request_route(request),
+            method=request.method,
+            country_code=getattr(request, 'country_code', '') or '',
+            user_agent=request.META.get('HTTP_USER_AGENT', ''),
+            details=f"Rule {rule.pk}: {rule.limit} per {rule.window}s on {rule.path_pattern}",
+        )
+
+    @staticmethod
+    def _limited(request, ip_address, rule, result):
+        request.limited = True
+        request.rate_limit_rule = rule
+        logger.warning("RATE_LIMIT: %s - %s", ip_address, request.path)
+        response = HttpResponse("Too many requests", status=429)
+        response['Retry-After'] = str(result.retry_after)
+        return response
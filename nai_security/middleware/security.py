@@ -1,29 +1,61 @@
 import logging
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.conf import settings as django_settings
 from django.core.exceptions import ImproperlyConfigured
 from django.http import HttpResponseForbidden
 from django.core.cache import cache
-from django.db.models import F
 
-from ..utils import get_client_ip, get_country_from_ip
+from ..utils import (
+    block_cache_timeout, get_client_ip, get_country_from_ip, get_country_from_ip_async,
+    increment_batched, increment_batched_async,
+)
 from ..models import SecurityLog, SecuritySettings
+from ..services.country_ranges import get_country_policy_ranges, get_country_policy_ranges_async
+from ..services.path_normalizer import request_route
+from ..services.policy_snapshot import (
+    UNREAD, get_network_policy, get_network_policy_async, get_policy_snapshot, get_policy_snapshot_async,
+    read_policy_generation, read_policy_generation_async,
+)
 
 logger = logging.getLogger(__name__)
 
 
+async def _aget_user(request):
+    """
+    request.user resolves the session synchronously; AuthenticationMiddleware's
+    request.auser() does the same lookup without blocking the event loop.
+    """
+    if hasattr(request, 'auser'):
+        return await request.auser()
+    return getattr(request, 'user', None)
+
+
 class SecurityMiddleware:
     """
     Main security middleware that checks:
     1. Whitelisted IPs (bypass all checks)
     2. Whitelisted Users (bypass based on exemption_type)
-    3. Blocked IPs
+    3. Blocked IPs, then Blocked ASNs
     4. Blocked Countries / Allowed Countries
     5. Blocked User Agents
 
     MUST be placed AFTER django.contrib.auth.middleware.AuthenticationMiddleware
     in MIDDLEWARE settings. Raises ImproperlyConfigured on startup if misordered.
+
+    With NAI_SECURITY_POLICY_SNAPSHOT = True, checks 1-4 read from an in-process
+    PolicySnapshot (one generation check per request) instead of per-key cache
+    lookups.
+
+    With NAI_SECURITY_COUNTRY_RANGES = True, check 4 is one binary search in
+    the country policy compiled to IP ranges instead of per-country lookups.
+
+    Sync and async capable: under ASGI the checks run natively on the event loop
+    (cache.aget/aset, async ORM) instead of through a sync_to_async thread hop.
     """
 
+    sync_capable = True
+    async_capable = True
+
     DEFAULT_EXEMPT_PATHS = ['/health/', '/health', '/ready/', '/ready', '/favicon.ico']
 
     def __init__(self, get_response):
@@ -31,6 +63,11 @@ class SecurityMiddleware:
         self.exempt_paths = set(
             getattr(django_settings, 'NAI_SECURITY_EXEMPT_PATHS', self.DEFAULT_EXEMPT_PATHS)
         )
+        self.snapshot_mode = getattr(django_settings, 'NAI_SECURITY_POLICY_SNAPSHOT', False)
+        self.country_ranges_mode = getattr(django_settings, 'NAI_SECURITY_COUNTRY_RANGES', False)
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
         self._validate_middleware_order()
 
     def _validate_middleware_order(self):
@@ -73,6 +110,9 @@ class SecurityMiddleware:
             )
 
     def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
         # Skip exempt paths before touching the database. A health or readiness
         # probe is exempt precisely so it still answers when the database is
         # unreachable — loading settings first made every exempt path depend on
@@ -86,51 +126,142 @@ class SecurityMiddleware:
         if ip_address in ('127.0.0.1', 'localhost', '::1'):
             return self.get_response(request)
 
-        settings = SecuritySettings.get_settings()
+        # In snapshot mode, one generation read per request, shared by every
+        # policy cache below (and by RateLimitMiddleware, through the request).
+        # Otherwise the network and rate-limit caches check it now and then.
+        generation = request.security_policy_generation = (
+            read_policy_generation() if self.snapshot_mode else UNREAD
+        )
+        snapshot = get_policy_snapshot(generation) if self.snapshot_mode else None
+        network = get_network_policy(generation) if snapshot is None else None
+        settings = snapshot.settings if snapshot is not None else SecuritySettings.get_record()
 
         # Check IP whitelist first
-        if self._is_ip_whitelisted(ip_address):
+        if self._is_ip_whitelisted(ip_address, snapshot, network):
             return self.get_response(request)
 
         # Check user exemption (request.user guaranteed by middleware ordering)
         user = request.user
         user_exemption = None
         if user.is_authenticated:
-            user_exemption = self._get_user_exemption(user.pk)
+            user_exemption = self._get_user_exemption(user.pk, snapshot)
 
         # 'all' exemption bypasses entire middleware
         if user_exemption == 'all':
             return self.get_response(request)
 
         user_agent = request.META.get('HTTP_USER_AGENT', '')
-        country_code = get_country_from_ip(ip_address)
-        request.country_code = country_code
+        ranges = get_country_policy_ranges() if self.country_ranges_mode else None
+        country_code = request.country_code = get_country_from_ip(ip_address) or ''
 
         # Check IP blacklist — 'ip_block' exemption bypasses this
-        if settings.ip_blocking_enabled and self._is_ip_blocked(ip_address):
+        if settings.ip_blocking_enabled and self._is_ip_blocked(ip_address, snapshot, network):
             if user_exemption != 'ip_block':
                 self._log_block(ip_address, 'IP_BLOCK', request, country_code, user_agent)
                 return HttpResponseForbidden("Access denied")
 
+        # Check ASN rules — same switch and exemption as the IP blacklist
+        if settings.ip_blocking_enabled and user_exemption != 'ip_block':
+            asn_rule = self._get_blocked_asn(ip_address, snapshot, network)
+            if asn_rule is not None:
+                self._increment_asn_block_count(asn_rule)
+                self._log_block(ip_address, 'ASN_BLOCK', request, country_code, user_agent)
+                return HttpResponseForbidden("Access denied")
+
         # Check User Agent — no granular exemption, only 'all' bypasses (handled above)
         if settings.user_agent_blocking_enabled and self._is_user_agent_blocked(user_agent):
             self._log_block(ip_address, 'USER_AGENT_BLOCK', request, country_code, user_agent)
             return HttpResponseForbidden("Access denied")
 
         # Check country — 'geo_block' exemption bypasses this
-        if country_code and user_exemption != 'geo_block':
+        if ranges is not None:
+            if user_exemption != 'geo_block' and ranges.is_denied(ip_address):
+                self._log_block(ip_address, ranges.action, request, country_code, user_agent)
+                return HttpResponseForbidden("Access denied from your region")
+        elif country_code and user_exemption != 'geo_block':
             if settings.country_whitelist_mode:
-                if not self._is_country_allowed(country_code):
+                if not self._is_country_allowed(country_code, snapshot):
                     self._log_block(ip_address, 'COUNTRY_WHITELIST_BLOCK', request, country_code, user_agent)
                     return HttpResponseForbidden("Access denied from your region")
             elif settings.country_blocking_enabled:
-                if self._is_country_blocked(country_code):
+                if self._is_country_blocked(country_code, snapshot):
                     self._log_block(ip_address, 'COUNTRY_BLOCK', request, country_code, user_agent)
                     return HttpResponseForbidden("Access denied from your region")
 
         return self.get_response(request)
 
-    def _get_user_exemption(self, user_id):
+    async def __acall__(self, request):
+        """Async mirror of __call__ — same checks in the same order."""
+        if request.path in self.exempt_paths:
+            return await self.get_response(request)
+
+        ip_address = get_client_ip(request)
+
+        if ip_address in ('127.0.0.1', 'localhost', '::1'):
+            return await self.get_response(request)
+
+        generation = request.security_policy_generation = (
+            await read_policy_generation_async() if self.snapshot_mode else UNREAD
+        )
+        snapshot = await get_policy_snapshot_async(generation) if self.snapshot_mode else None
+        if snapshot is not None:
+            network = None
+            settings = snapshot.settings
+        else:
+            network = await get_network_policy_async(generation)
+            settings = await SecuritySettings.get_record_async()
+
+        if await self._is_ip_whitelisted_async(ip_address, snapshot, network):
+            return await self.get_response(request)
+
+        user = await _aget_user(request)
+        user_exemption = None
+        if user.is_authenticated:
+            user_exemption = await self._get_user_exemption_async(user.pk, snapshot)
+
+        if user_exemption == 'all':
+            return await self.get_response(request)
+
+        user_agent = request.META.get('HTTP_USER_AGENT', '')
+        ranges = await get_country_policy_ranges_async() if self.country_ranges_mode else None
+        country_code = request.country_code = await get_country_from_ip_async(ip_address) or ''
+
+        if settings.ip_blocking_enabled and await self._is_ip_blocked_async(ip_address, snapshot, network):
+            if user_exemption != 'ip_block':
+                await self._log_block_async(ip_address, 'IP_BLOCK', request, country_code, user_agent)
+                return HttpResponseForbidden("Access denied")
+
+        if settings.ip_blocking_enabled and user_exemption != 'ip_block':
+            asn_rule = await self._get_blocked_asn_async(ip_address, snapshot, network)
+            if asn_rule is not None:
+                await self._increment_asn_block_count_async(asn_rule)
+                await self._log_block_async(ip_address, 'ASN_BLOCK', request, country_code, user_agent)
+                return HttpResponseForbidden("Access denied")
+
+        if settings.user_agent_blocking_enabled and await self._is_user_agent_blocked_async(user_agent):
+            await self._log_block_async(ip_address, 'USER_AGENT_BLOCK', request, country_code, user_agent)
+            return HttpResponseForbidden("Access denied")
+
+        if ranges is not None:
+            if user_exemption != 'geo_block' and ranges.is_denied(ip_address):
+                await self._log_block_async(ip_address, ranges.action, request, country_code, user_agent)
+                return HttpResponseForbidden("Access denied from your region")
+        elif country_code and user_exemption != 'geo_block':
+            if settings.country_whitelist_mode:
+                if not await self._is_country_allowed_async(country_code, snapshot):
+                    await self._log_block_async(
+                        ip_address, 'COUNTRY_WHITELIST_BLOCK', request, country_code, user_agent,
+                    )
+                    return HttpResponseForbidden("Access denied from your region")
+            elif settings.country_blocking_enabled:
+                if await self._is_country_blocked_async(country_code, snapshot):
+                    await self._log_block_async(ip_address, 'COUNTRY_BLOCK', request, country_code, user_agent)
+                    return HttpResponseForbidden("Access denied from your region")
+
+        return await self.get_response(request)
+
+    @staticmethod
+    def _get_user_exemption(user_id, snapshot=None):
         """
         Get the exemption type for a whitelisted user.
         Returns exemption_type string ('all', 'ip_block', 'rate_limit') or None.
@@ -138,6 +269,8 @@ class SecurityMiddleware:
         """
         if user_id is None:
             return None
+        if snapshot is not None:
+            return snapshot.get_user_exemption(user_id)
 
         cache_key = f"sec_user_exempt:{user_id}"
         cached = cache.get(cache_key)
@@ -167,26 +300,88 @@ class SecurityMiddleware:
             logger.error("Failed to check user exemption for user_id=%s: %s", user_id, e)
             return None
 
+    @staticmethod
+    async def _get_user_exemption_async(user_id, snapshot=None):
+        if user_id is None:
+            return None
+        if snapshot is not None:
+            return snapshot.get_user_exemption(user_id)
+
+        cache_key = f"sec_user_exempt:{user_id}"
+        cached = await cache.aget(cache_key)
+        if cached is not None:
+            return cached if cached != '_none_' else None
+
+        from ..models import WhitelistedUser
+        from django.utils import timezone
+
+        try:
+            whitelist = await WhitelistedUser.objects.filter(
+                user_id=user_id,
+                is_active=True,
+            ).afirst()
+
+            if whitelist is None or (whitelist.expires_at and whitelist.expires_at < timezone.now()):
+                await cache.aset(cache_key, '_none_', 300)
+                return None
+
+            await cache.aset(cache_key, whitelist.exemption_type, 300)
+            return whitelist.exemption_type
+        except Exception as e:
+            logger.error("Failed to check user exemption for user_id=%s: %s", user_id, e)
+            return None
+
     # ------------------------------------------------------------------
     # IP whitelist
     # ------------------------------------------------------------------
 
-    def _is_ip_whitelisted(self, ip_address: str) -> bool:
+    def _is_ip_whitelisted(self, ip_address: str, snapshot=None, network=None) -> bool:
+        if snapshot is not None:
+            return snapshot.is_ip_whitelisted(ip_address)
+
+        # Networks are matched in-process so a new or removed subnet is never
+        # masked by a per-address verdict cached before the change.
+        if (network or get_network_policy()).is_ip_whitelisted(ip_address):
+            return True
+
         cache_key = f"sec_whitelist:{ip_address}"
         cached = cache.get(cache_key)
         if cached is not None:
             return cached
 
         from ..models import WhitelistedIP
-        result = WhitelistedIP.is_whitelisted(ip_address)
+        result = WhitelistedIP.objects.filter(ip_address=ip_address, is_active=True).exists()
         cache.set(cache_key, result, 300)
         return result
 
+    async def _is_ip_whitelisted_async(self, ip_address: str, snapshot=None, network=None) -> bool:
+        if snapshot is not None:
+            return snapshot.is_ip_whitelisted(ip_address)
+
+        if (network or await get_network_policy_async()).is_ip_whitelisted(ip_address):
+            return True
+
+        cache_key = f"sec_whitelist:{ip_address}"
+        cached = await cache.aget(cache_key)
+        if cached is not None:
+            return cached
+
+        from ..models import WhitelistedIP
+        result = await WhitelistedIP.objects.filter(ip_address=ip_address, is_active=True).aexists()
+        await cache.aset(cache_key, result, 300)
+        return result
+
     # ------------------------------------------------------------------
     # Blocking checks
     # ------------------------------------------------------------------
 
-    def _is_ip_blocked(self, ip_address: str) -> bool:
+    def _is_ip_blocked(self, ip_address: str, snapshot=None, network=None) -> bool:
+        if snapshot is not None:
+            return snapshot.is_ip_blocked(ip_address)
+
+        if (network or get_network_policy()).is_ip_blocked(ip_address):
+            return True
+
         cache_key = f"sec_blocked_ip:{ip_address}"
         cached = cache.get(cache_key)
         if cached is not None:
@@ -195,7 +390,7 @@ class SecurityMiddleware:
         from ..models import BlockedIP
         from django.utils import timezone
 
-        blocked = BlockedIP.objects.filter(ip_address=ip_address, is_active=True).first()
+        blocked = BlockedIP.objects.filter(ip_address=ip_address, prefix_length__isnull=True, is_active=True).first()
         if blocked is None:
             cache.set(cache_key, False, 300)
             return False
@@ -204,10 +399,44 @@ class SecurityMiddleware:
             cache.set(cache_key, False, 300)
             return False
 
-        cache.set(cache_key, True, 300)
+        cache.set(cache_key, True, block_cache_timeout(blocked.expires_at))
         return True
 
-    def _is_country_blocked(self, country_code: str) -> bool:
+    async def _is_ip_blocked_async(self, ip_address: str, snapshot=None, network=None) -> bool:
+        if snapshot is not None:
+            return snapshot.is_ip_blocked(ip_address)
+
+        if (network or await get_network_policy_async()).is_ip_blocked(ip_address):
+            return True
+
+        cache_key = f"sec_blocked_ip:{ip_address}"
+        cached = await cache.aget(cache_key)
+        if cached is not None:
+            return cached
+
+        from ..models import BlockedIP
+        from django.utils import timezone
+
+        blocked = await BlockedIP.objects.filter(ip_address=ip_address, prefix_length__isnull=True, is_active=True).afirst()
+        result = blocked is not None and not (blocked.expires_at and timezone.now() > blocked.expires_at)
+        await cache.aset(cache_key, result, block_cache_timeout(blocked.expires_at) if result else 300)
+        return result
+
+    @staticmethod
+    def _get_blocked_asn(ip_address: str, snapshot=None, network=None) -> int | None:
+        """pk of the BlockedASN rule covering ip_address, or None."""
+        policy = snapshot or network or get_network_policy()
+        return policy.get_blocked_asn(ip_address)
+
+    @staticmethod
+    async def _get_blocked_asn_async(ip_address: str, snapshot=None, network=None) -> int | None:
+        policy = snapshot or network or await get_network_policy_async()
+        return policy.get_blocked_asn(ip_address)
+
+    def _is_country_blocked(self, country_code: str, snapshot=None) -> bool:
+        if snapshot is not None:
+            return snapshot.is_country_blocked(country_code)
+
         cache_key = f"sec_blocked_country:{country_code}"
         cached = cache.get(cache_key)
         if cached is not None:
@@ -218,7 +447,24 @@ class SecurityMiddleware:
         cache.set(cache_key, result, 300)
         return result
 
-    def _is_country_allowed(self, country_code: str) -> bool:
+    async def _is_country_blocked_async(self, country_code: str, snapshot=None) -> bool:
+        if snapshot is not None:
+            return snapshot.is_country_blocked(country_code)
+
+        cache_key = f"sec_blocked_country:{country_code}"
+        cached = await cache.aget(cache_key)
+        if cached is not None:
+            return cached
+
+        from ..models import BlockedCountry
+        result = await BlockedCountry.objects.filter(code=country_code, is_active=True).aexists()
+        await cache.aset(cache_key, result, 300)
+        return result
+
+    def _is_country_allowed(self, country_code: str, snapshot=None) -> bool:
+        if snapshot is not None:
+            return snapshot.is_country_allowed(country_code)
+
         cache_key = f"sec_allowed_country:{country_code}"
         cached = cache.get(cache_key)
         if cached is not None:
@@ -229,6 +475,22 @@ class SecurityMiddleware:
         cache.set(cache_key, result, 300)
         return result
 
+    async def _is_country_allowed_async(self, country_code: str, snapshot=None) -> bool:
+        if snapshot is not None:
+            return snapshot.is_country_allowed(country_code)
+
+        cache_key = f"sec_allowed_country:{country_code}"
+        cached = await cache.aget(cache_key)
+        if cached is not None:
+            return cached
+
+        from ..models import AllowedCountry
+        allowed = AllowedCountry.objects.filter(is_active=True)
+        # No allowed countries = whitelist mode inactive, same as is_country_allowed()
+        result = not await allowed.aexists() or await allowed.filter(code=country_code).aexists()
+        await cache.aset(cache_key, result, 300)
+        return result
+
     def _is_user_agent_blocked(self, user_agent: str) -> bool:
         if not user_agent:
             return False
@@ -241,29 +503,60 @@ class SecurityMiddleware:
 
         return is_blocked
 
+    async def _is_user_agent_blocked_async(self, user_agent: str) -> bool:
+        if not user_agent:
+            return False
+
+        from ..models import BlockedUserAgent
+        is_blocked, pattern = await BlockedUserAgent.is_user_agent_blocked_async(user_agent)
+
+        if is_blocked and pattern:
+            await self._increment_ua_block_count_async(pattern.pk)
+
+        return is_blocked
+
     @staticmethod
     def _increment_ua_block_count(pattern_pk, flush_threshold=100):
         """Batch UA block count in cache, flush to DB every flush_threshold hits."""
         from ..models import BlockedUserAgent
+        increment_batched(BlockedUserAgent, pattern_pk, f"sec_ua_count:{pattern_pk}",
+                          flush_threshold=flush_threshold)
 
-        cache_key = f"sec_ua_count:{pattern_pk}"
-        try:
-            count = cache.incr(cache_key)
-        except ValueError:
-            cache.set(cache_key, 1, 3600)
-            return
-
-        if count >= flush_threshold:
-            BlockedUserAgent.objects.filter(pk=pattern_pk).update(
-                block_count=F('block_count') + count
-            )
-            cache.delete(cache_key)
+    @staticmethod
+    async def _increment_ua_block_count_async(pattern_pk, flush_threshold=100):
+        from ..models import BlockedUserAgent
+        await increment_batched_async(BlockedUserAgent, pattern_pk, f"sec_ua_count:{pattern_pk}",
+                                      flush_threshold=flush_threshold)
+
+    @staticmethod
+    def _increment_asn_block_count(rule_pk, flush_threshold=100):
+        from ..models import BlockedASN
+        increment_batched(BlockedASN, rule_pk, f"sec_asn_count:{rule_pk}", flush_threshold=flush_threshold)
+
+    @staticmethod
+    async def _increment_asn_block_count_async(rule_pk, flush_threshold=100):
+        from ..models import BlockedASN
+        await increment_batched_async(BlockedASN, rule_pk, f"sec_asn_count:{rule_pk}",
+                                      flush_threshold=flush_threshold)
 
     def _log_block(self, ip_address, action, request, country_code, user_agent):
-        SecurityLog.log_event(
+        SecurityLog.record_event(
+            ip_address=ip_address,
+            action=action,
+            path=request.path,
+            route=request_route(request),
+            method=request.method,
+            country_code=country_code or '',
+            user_agent=user_agent,
+        )
+        logger.warning("%s: %s (%s) - %s", action, ip_address, country_code, request.path)
+
+    async def _log_block_async(self, ip_address, action, request, country_code, user_agent):
+        await SecurityLog.record_event_async(
             ip_address=ip_address,
             action=action,
             path=request.path,
+            route=request_route(request),
             method=request.method,
             country_code=country_code or '',
             user_agent=user_agent,
@@ -279,14 +572,24 @@ class RateLimitLoggingMiddleware:
     MUST be placed AFTER django.contrib.auth.middleware.AuthenticationMiddleware.
     """
 
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
         response = self.get_response(request)
 
         was_limited = getattr(request, 'limited', False)
-        if not was_limited:
+        # RateLimitMiddleware logs its own 429s
+        if not was_limited or getattr(request, 'rate_limit_rule', None) is not None:
             return response
 
         # Check user exemption — 'rate_limit' or 'all' bypasses rate limit logging
@@ -300,10 +603,40 @@ class RateLimitLoggingMiddleware:
         country_code = getattr(request, 'country_code', '')
         user_agent = request.META.get('HTTP_USER_AGENT', '')
 
-        SecurityLog.log_event(
+        SecurityLog.record_event(
+            ip_address=ip_address,
+            action='RATE_LIMIT',
+            path=request.path,
+            route=request_route(request),
+            method=request.method,
+            country_code=country_code,
+            user_agent=user_agent,
+        )
+        logger.warning("RATE_LIMIT: %s - %s", ip_address, request.path)
+
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+
+        if not getattr(request, 'limited', False) or getattr(request, 'rate_limit_rule', None) is not None:
+            return response
+
+        user = await _aget_user(request)
+        if user and user.is_authenticated:
+            from ..models import WhitelistedUser
+            if await WhitelistedUser.is_whitelisted_async(user, check_type='rate_limit'):
+                return response
+
+        ip_address = get_client_ip(request)
+        country_code = getattr(request, 'country_code', '')
+        user_agent = request.META.get('HTTP_USER_AGENT', '')
+
+        await SecurityLog.record_event_async(
             ip_address=ip_address,
             action='RATE_LIMIT',
             path=request.path,
+            route=request_route(request),
             method=request.method,
             country_code=country_code,
             user_agent=user_agent,
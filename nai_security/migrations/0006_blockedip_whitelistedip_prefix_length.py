@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nai_security", "0005_alter_whitelisteduser_exemption_type"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blockedip",
+            name="prefix_length",
+            field=models.PositiveSmallIntegerField(
+                blank=True,
+                help_text="Block a whole network, e.g. 24 for 203.0.113.0/24. Leave empty for a single address",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="whitelistedip",
+            name="prefix_length",
+            field=models.PositiveSmallIntegerField(
+                blank=True,
+                help_text="Whitelist a whole network, e.g. 24 for 10.0.0.0/24. Leave empty for a single address",
+                null=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="blockedip",
+            name="ip_address",
+            field=models.GenericIPAddressField(
+                db_index=True,
+                help_text="IP address to block (IPv4 or IPv6), or the network address when a prefix length is set",
+                unique=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="whitelistedip",
+            name="ip_address",
+            field=models.GenericIPAddressField(
+                db_index=True,
+                help_text="IP address to whitelist (IPv4 or IPv6), or the network address when a prefix length is set",
+                unique=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nai_security", "0006_blockedip_whitelistedip_prefix_length"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BlockedASN",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "asn",
+                    models.PositiveIntegerField(
+                        db_index=True,
+                        help_text="Autonomous system number, e.g. 64496 for AS64496",
+                        unique=True,
+                    ),
+                ),
+                (
+                    "organization",
+                    models.CharField(
+                        blank=True, help_text="AS organization name", max_length=255
+                    ),
+                ),
+                (
+                    "reason",
+                    models.TextField(blank=True, help_text="Reason for blocking"),
+                ),
+                ("is_active", models.BooleanField(db_index=True, default=True)),
+                (
+                    "block_count",
+                    models.PositiveIntegerField(
+                        default=0, help_text="Requests blocked by this rule"
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Blocked ASN",
+                "verbose_name_plural": "Blocked ASNs",
+                "db_table": "security_blocked_asn",
+                "ordering": ["asn"],
+            },
+        ),
+        migrations.AlterField(
+            model_name="securitylog",
+            name="action",
+            field=models.CharField(
+                choices=[
+                    ("COUNTRY_BLOCK", "Blocked by Country"),
+                    ("COUNTRY_WHITELIST_BLOCK", "Blocked - Country Not in Whitelist"),
+                    ("IP_BLOCK", "Blocked by IP"),
+                    ("EMAIL_BLOCK", "Blocked by Email"),
+                    ("DOMAIN_BLOCK", "Blocked by Domain"),
+                    ("USER_AGENT_BLOCK", "Blocked by User Agent"),
+                    ("ASN_BLOCK", "Blocked by ASN"),
+                    ("RATE_LIMIT", "Rate Limited"),
+                    ("AXES_LOCK", "Login Locked (Axes)"),
+                    ("SUSPICIOUS_LOGIN", "Suspicious Login Detected"),
+                    ("AUTO_BLOCK_IP", "IP Auto-Blocked"),
+                    ("AUTO_BLOCK_COUNTRY", "Country Auto-Blocked"),
+                ],
+                db_index=True,
+                max_length=30,
+            ),
+        ),
+    ]
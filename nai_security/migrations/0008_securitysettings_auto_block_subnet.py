@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:39
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nai_security", "0007_blockedasn"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="securitysettings",
+            name="auto_block_subnet_prefix_v4",
+            field=models.PositiveSmallIntegerField(
+                default=24,
+                help_text="IPv4 subnet size (prefix length) for subnet aggregation",
+                validators=[
+                    django.core.validators.MinValueValidator(8),
+                    django.core.validators.MaxValueValidator(31),
+                ],
+            ),
+        ),
+        migrations.AddField(
+            model_name="securitysettings",
+            name="auto_block_subnet_prefix_v6",
+            field=models.PositiveSmallIntegerField(
+                default=64,
+                help_text="IPv6 subnet size (prefix length) for subnet aggregation",
+                validators=[
+                    django.core.validators.MinValueValidator(16),
+                    django.core.validators.MaxValueValidator(127),
+                ],
+            ),
+        ),
+        migrations.AddField(
+            model_name="securitysettings",
+            name="auto_block_subnet_threshold",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="Replace auto-blocked IPs with one network block once this many distinct addresses in the same subnet are auto-blocked. 0 = off",
+            ),
+        ),
+    ]
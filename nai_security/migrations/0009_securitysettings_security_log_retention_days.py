@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nai_security", "0008_securitysettings_auto_block_subnet"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="securitysettings",
+            name="security_log_retention_days",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="Delete security log entries older than this many days. 0 = keep forever",
+            ),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nai_security", "0009_securitysettings_security_log_retention_days"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RollupWatermark",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=50, unique=True)),
+                ("last_id", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Rollup Watermark",
+                "verbose_name_plural": "Rollup Watermarks",
+                "db_table": "security_rollup_watermark",
+            },
+        ),
+        migrations.CreateModel(
+            name="SecurityEventRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("hour", models.DateTimeField(help_text="Start of the hour (UTC)")),
+                ("action", models.CharField(max_length=30)),
+                ("country_code", models.CharField(blank=True, max_length=2)),
+                ("ip_address", models.GenericIPAddressField()),
+                ("count", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "verbose_name": "Security Event Rollup",
+                "verbose_name_plural": "Security Event Rollups",
+                "db_table": "security_event_rollup",
+                "ordering": ["-hour"],
+                "indexes": [
+                    models.Index(
+                        fields=["hour", "ip_address"],
+                        name="security_ev_hour_dc729b_idx",
+                    ),
+                    models.Index(
+                        fields=["hour", "country_code"],
+                        name="security_ev_hour_27f09c_idx",
+                    ),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("hour", "action", "country_code", "ip_address"),
+                        name="security_event_rollup_key",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:57
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nai_security", "0010_securityeventrollup"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="securitylog",
+            name="created_at",
+            field=models.DateTimeField(
+                db_index=True, default=django.utils.timezone.now, editable=False
+            ),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nai_security", "0011_securitylog_created_at_default"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserAgentString",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("hash", models.CharField(max_length=64, unique=True)),
+                ("value", models.TextField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "verbose_name": "User Agent String",
+                "verbose_name_plural": "User Agent Strings",
+                "db_table": "security_user_agent",
+            },
+        ),
+        migrations.AddField(
+            model_name="loginhistory",
+            name="user_agent_string",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="nai_security.useragentstring",
+            ),
+        ),
+        migrations.AddField(
+            model_name="securitylog",
+            name="user_agent_string",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="nai_security.useragentstring",
+            ),
+        ),
+    ]
@@ -0,0 +1,65 @@
+"""
+Point existing SecurityLog / LoginHistory rows at deduplicated
+UserAgentString rows. Walks each table in primary-key chunks of CHUNK_SIZE,
+each chunk its own transaction, so a large log is never locked as a whole.
+"""
+import hashlib
+
+from django.db import migrations, transaction
+
+CHUNK_SIZE = 5000
+MODELS = ("SecurityLog", "LoginHistory")
+
+
+def _hash(value):
+    return hashlib.sha256(value.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def _ids(UserAgentString, values):
+    digests = {_hash(value): value for value in values}
+    found = dict(UserAgentString.objects.filter(hash__in=list(digests)).values_list("hash", "id"))
+    new = [UserAgentString(hash=digest, value=value) for digest, value in digests.items() if digest not in found]
+    if new:
+        UserAgentString.objects.bulk_create(new, batch_size=500, ignore_conflicts=True)
+        found.update(UserAgentString.objects.filter(hash__in=[row.hash for row in new]).values_list("hash", "id"))
+    return {value: found[digest] for digest, value in digests.items()}
+
+
+def forwards(apps, schema_editor):
+    UserAgentString = apps.get_model("nai_security", "UserAgentString")
+    for name in MODELS:
+        model = apps.get_model("nai_security", name)
+        rows = model.objects.using(schema_editor.connection.alias).exclude(user_agent="")
+        last_pk = 0
+        while True:
+            chunk = list(rows.filter(pk__gt=last_pk).order_by("pk").values_list("pk", "user_agent")[:CHUNK_SIZE])
+            if not chunk:
+                break
+            by_value = {}
+            for pk, value in chunk:
+                by_value.setdefault(value, []).append(pk)
+            with transaction.atomic(using=schema_editor.connection.alias):
+                for value, ua_id in _ids(UserAgentString, by_value).items():
+                    model.objects.filter(pk__in=by_value[value]).update(user_agent_string_id=ua_id)
+            last_pk = chunk[-1][0]
+
+
+def backwards(apps, schema_editor):
+    UserAgentString = apps.get_model("nai_security", "UserAgentString")
+    for name in MODELS:
+        model = apps.get_model("nai_security", name)
+        for ua_id, value in UserAgentString.objects.values_list("id", "value").iterator():
+            model.objects.filter(user_agent_string_id=ua_id).update(user_agent=value)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("nai_security", "0012_useragentstring"),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nai_security", "0013_backfill_user_agent_strings"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SecurityRouteRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("hour", models.DateTimeField(help_text="Start of the hour (UTC)")),
+                ("route", models.CharField(max_length=255)),
+                ("action", models.CharField(max_length=30)),
+                ("count", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "verbose_name": "Security Route Rollup",
+                "verbose_name_plural": "Security Route Rollups",
+                "db_table": "security_route_rollup",
+                "ordering": ["-hour", "-count"],
+            },
+        ),
+        migrations.AddField(
+            model_name="securitylog",
+            name="route",
+            field=models.CharField(
+                blank=True,
+                help_text="URL pattern or normalized path (NAI_SECURITY_PATH_NORMALIZATION)",
+                max_length=255,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="securitylog",
+            index=models.Index(
+                fields=["route", "-created_at"], name="security_se_route_da4907_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="securityrouterollup",
+            constraint=models.UniqueConstraint(
+                fields=("hour", "route", "action"), name="security_route_rollup_key"
+            ),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nai_security", "0015_securitylog_route"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="blockedip",
+            name="ip_address",
+            field=models.GenericIPAddressField(
+                db_index=True,
+                help_text="IP address to block (IPv4 or IPv6), or the network address when a prefix length is set",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="whitelistedip",
+            name="ip_address",
+            field=models.GenericIPAddressField(
+                db_index=True,
+                help_text="IP address to whitelist (IPv4 or IPv6), or the network address when a prefix length is set",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="blockedip",
+            constraint=models.UniqueConstraint(
+                fields=("ip_address", "prefix_length"),
+                name="security_blocked_ip_network",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="blockedip",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("prefix_length__isnull", True)),
+                fields=("ip_address",),
+                name="security_blocked_ip_address",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="whitelistedip",
+            constraint=models.UniqueConstraint(
+                fields=("ip_address", "prefix_length"),
+                name="security_whitelisted_ip_network",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="whitelistedip",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("prefix_length__isnull", True)),
+                fields=("ip_address",),
+                name="security_whitelisted_ip_address",
+            ),
+        ),
+    ]
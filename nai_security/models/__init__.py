@@ -1,3 +1,4 @@
+from .user_agent_string import UserAgentString
 from .blocked_country import BlockedCountry
 from .blocked_ip import BlockedIP
 from .blocked_email import BlockedEmail
@@ -10,6 +11,8 @@ from .login_history import LoginHistory
 from .security_log import SecurityLog
 from .security_settings import SecuritySettings
 from .whitelisted_user import WhitelistedUser
+from .blocked_asn import BlockedASN
+from .security_event_rollup import RollupWatermark, SecurityEventRollup, SecurityRouteRollup
 
 __all__ = [
     'BlockedCountry',
@@ -24,4 +27,9 @@ __all__ = [
     'SecurityLog',
     'SecuritySettings',
     'WhitelistedUser',
+    'BlockedASN',
+    'SecurityEventRollup',
+    'SecurityRouteRollup',
+    'RollupWatermark',
+    'UserAgentString',
 ]
@@ -1,6 +1,8 @@
 from django.core.cache import cache
 from django.db import models
 
+from ..utils import bump_country_policy_version, bump_policy_generation
+
 
 class AllowedCountry(models.Model):
     """
@@ -58,11 +60,15 @@ class AllowedCountry(models.Model):
             self.name = dict(self.COUNTRY_CHOICES).get(self.code, self.code)
         super().save(*args, **kwargs)
         cache.delete(f"sec_allowed_country:{self.code}")
+        bump_policy_generation()
+        bump_country_policy_version()
 
     def delete(self, *args, **kwargs):
         code = self.code
         super().delete(*args, **kwargs)
         cache.delete(f"sec_allowed_country:{code}")
+        bump_policy_generation()
+        bump_country_policy_version()
 
     def __str__(self):
         return f"{self.name} ({self.code})"
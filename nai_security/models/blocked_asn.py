@@ -0,0 +1,41 @@
+from django.db import models
+
+from ..utils import bump_policy_generation
+
+
+class BlockedASN(models.Model):
+    """
+    Autonomous systems blocked from accessing the application. One rule covers
+    every address the provider announces, resolved with the GeoLite2 ASN database.
+    """
+
+    asn = models.PositiveIntegerField(
+        unique=True,
+        db_index=True,
+        help_text="Autonomous system number, e.g. 64496 for AS64496"
+    )
+    organization = models.CharField(max_length=255, blank=True, help_text="AS organization name")
+    reason = models.TextField(blank=True, help_text="Reason for blocking")
+    is_active = models.BooleanField(default=True, db_index=True)
+    block_count = models.PositiveIntegerField(default=0, help_text="Requests blocked by this rule")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "security_blocked_asn"
+        verbose_name = "Blocked ASN"
+        verbose_name_plural = "Blocked ASNs"
+        ordering = ['asn']
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        bump_policy_generation()
+
+    def delete(self, *args, **kwargs):
+        super().delete(*args, **kwargs)
+        bump_policy_generation()
+
+    def __str__(self):
+        if self.organization:
+            return f"AS{self.asn} ({self.organization})"
+        return f"AS{self.asn}"
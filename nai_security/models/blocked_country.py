@@ -1,6 +1,8 @@
 from django.core.cache import cache
 from django.db import models
 
+from ..utils import bump_country_policy_version, bump_policy_generation
+
 
 class BlockedCountry(models.Model):
     """Countries blocked from accessing the application."""
@@ -61,11 +63,15 @@ class BlockedCountry(models.Model):
             self.name = dict(self.COUNTRY_CHOICES).get(self.code, self.code)
         super().save(*args, **kwargs)
         cache.delete(f"sec_blocked_country:{self.code}")
+        bump_policy_generation()
+        bump_country_policy_version()
 
     def delete(self, *args, **kwargs):
         code = self.code
         super().delete(*args, **kwargs)
         cache.delete(f"sec_blocked_country:{code}")
+        bump_policy_generation()
+        bump_country_policy_version()
 
     def __str__(self):
         auto = " [AUTO]" if self.is_auto_blocked else ""
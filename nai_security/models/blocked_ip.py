@@ -1,15 +1,22 @@
 from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils import timezone
 
+from ..utils import bump_policy_generation, normalize_network
+
 
 class BlockedIP(models.Model):
     """Manually or automatically blocked IP addresses."""
     
     ip_address = models.GenericIPAddressField(
-        unique=True,
         db_index=True,
-        help_text="IP address to block (IPv4 or IPv6)"
+        help_text="IP address to block (IPv4 or IPv6), or the network address when a prefix length is set"
+    )
+    prefix_length = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        help_text="Block a whole network, e.g. 24 for 203.0.113.0/24. Leave empty for a single address"
     )
     reason = models.TextField(blank=True, help_text="Reason for blocking")
     is_active = models.BooleanField(default=True, db_index=True)
@@ -36,19 +43,42 @@ class BlockedIP(models.Model):
         verbose_name = "Blocked IP"
         verbose_name_plural = "Blocked IPs"
         ordering = ['-created_at']
+        constraints = [
+            # One row per network; single addresses (no prefix length) are
+            # unique on their own, since NULL prefix lengths never collide.
+            models.UniqueConstraint(fields=['ip_address', 'prefix_length'], name='security_blocked_ip_network'),
+            models.UniqueConstraint(
+                fields=['ip_address'], condition=models.Q(prefix_length__isnull=True), name='security_blocked_ip_address',
+            ),
+        ]
         indexes = [
             models.Index(fields=['ip_address', 'is_active']),
             models.Index(fields=['-created_at']),
         ]
 
+    @property
+    def cidr(self) -> str:
+        if self.prefix_length is None:
+            return self.ip_address
+        return f"{self.ip_address}/{self.prefix_length}"
+
+    def clean(self):
+        try:
+            normalize_network(self.ip_address, self.prefix_length)
+        except ValueError as e:
+            raise ValidationError({'prefix_length': str(e)})
+
     def save(self, *args, **kwargs):
+        self.ip_address, self.prefix_length = normalize_network(self.ip_address, self.prefix_length)
         super().save(*args, **kwargs)
         cache.delete(f"sec_blocked_ip:{self.ip_address}")
+        bump_policy_generation()
 
     def delete(self, *args, **kwargs):
         ip = self.ip_address
         super().delete(*args, **kwargs)
         cache.delete(f"sec_blocked_ip:{ip}")
+        bump_policy_generation()
 
     def is_expired(self):
         if self.expires_at is None:
@@ -61,4 +91,4 @@ class BlockedIP(models.Model):
             status = " [EXPIRED]"
         elif self.is_auto_blocked:
             status = " [AUTO]"
-        return f"{self.ip_address}{status}"
+        return f"{self.cidr}{status}"
@@ -1,8 +1,14 @@
+from typing import TYPE_CHECKING
+
 from django.core.cache import cache
 from django.db import models
 import re
 
+if TYPE_CHECKING:
+    from ..services.ua_matcher import UAPattern
+
 UA_PATTERN_CACHE_KEY = "sec_ua_patterns"
+UA_PATTERN_VERSION_KEY = "sec_ua_patterns_version"
 
 
 class BlockedUserAgent(models.Model):
@@ -59,11 +65,11 @@ class BlockedUserAgent(models.Model):
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
-        cache.delete(UA_PATTERN_CACHE_KEY)
+        cache.delete_many([UA_PATTERN_CACHE_KEY, UA_PATTERN_VERSION_KEY])
 
     def delete(self, *args, **kwargs):
         super().delete(*args, **kwargs)
-        cache.delete(UA_PATTERN_CACHE_KEY)
+        cache.delete_many([UA_PATTERN_CACHE_KEY, UA_PATTERN_VERSION_KEY])
 
     def __str__(self):
         return f"{self.pattern[:50]} ({self.get_category_display()})"
@@ -88,17 +94,26 @@ class BlockedUserAgent(models.Model):
         return False
 
     @classmethod
-    def is_user_agent_blocked(cls, user_agent: str) -> tuple[bool, 'BlockedUserAgent | None']:
-        """Check if user agent is blocked. Returns (is_blocked, matched_pattern)."""
+    def is_user_agent_blocked(cls, user_agent: str) -> tuple[bool, 'UAPattern | None']:
+        """
+        Check if user agent is blocked. Returns (is_blocked, matched_pattern),
+        where matched_pattern is a UAPattern (pk, pattern, block_type).
+        Uses the worker's compiled matcher (services.ua_matcher), rebuilt when
+        the pattern set changes.
+        """
         if not user_agent:
             return False, None
 
-        patterns = cache.get(UA_PATTERN_CACHE_KEY)
-        if patterns is None:
-            patterns = list(cls.objects.filter(is_active=True))
-            cache.set(UA_PATTERN_CACHE_KEY, patterns, 300)
+        from ..services.ua_matcher import get_ua_matcher
+        pattern = get_ua_matcher().match(user_agent)
+        return pattern is not None, pattern
+
+    @classmethod
+    async def is_user_agent_blocked_async(cls, user_agent: str) -> tuple[bool, 'UAPattern | None']:
+        """Async version of is_user_agent_blocked()."""
+        if not user_agent:
+            return False, None
 
-        for pattern in patterns:
-            if pattern.matches(user_agent):
-                return True, pattern
-        return False, None
+        from ..services.ua_matcher import get_ua_matcher_async
+        pattern = (await get_ua_matcher_async()).match(user_agent)
+        return pattern is not None, pattern
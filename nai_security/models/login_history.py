@@ -1,8 +1,10 @@
 from django.db import models
 from django.conf import settings
 
+from .user_agent_string import UserAgentModel
 
-class LoginHistory(models.Model):
+
+class LoginHistory(UserAgentModel):
     """Track successful login attempts for security monitoring."""
     
     user = models.ForeignKey(
@@ -14,7 +16,6 @@ class LoginHistory(models.Model):
     ip_address = models.GenericIPAddressField(db_index=True)
     country_code = models.CharField(max_length=2, blank=True, db_index=True)
     city = models.CharField(max_length=100, blank=True)
-    user_agent = models.TextField(blank=True)
     device_type = models.CharField(max_length=50, blank=True, help_text="mobile, desktop, tablet")
     browser = models.CharField(max_length=100, blank=True)
     os = models.CharField(max_length=100, blank=True)
@@ -1,5 +1,7 @@
 from django.db import models
 
+from ..utils import bump_policy_generation
+
 
 class RateLimitRule(models.Model):
     """Custom rate limit rules for specific paths."""
@@ -50,5 +52,13 @@ class RateLimitRule(models.Model):
         ordering = ['path_pattern']
         unique_together = ['path_pattern', 'method']
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        bump_policy_generation()
+
+    def delete(self, *args, **kwargs):
+        super().delete(*args, **kwargs)
+        bump_policy_generation()
+
     def __str__(self):
         return f"{self.name}: {self.path_pattern} ({self.rate})"
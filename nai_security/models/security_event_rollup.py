@@ -0,0 +1,74 @@
+from django.db import models
+
+
+class SecurityEventRollup(models.Model):
+    """
+    Hourly SecurityLog counts per (action, country, IP), maintained from the
+    log by services.event_rollups. Reports and auto-blocking read these
+    instead of scanning SecurityLog when NAI_SECURITY_EVENT_ROLLUPS is on.
+    """
+
+    hour = models.DateTimeField(help_text="Start of the hour (UTC)")
+    action = models.CharField(max_length=30)
+    country_code = models.CharField(max_length=2, blank=True)
+    ip_address = models.GenericIPAddressField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = "security_event_rollup"
+        verbose_name = "Security Event Rollup"
+        verbose_name_plural = "Security Event Rollups"
+        ordering = ['-hour']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['hour', 'action', 'country_code', 'ip_address'], name='security_event_rollup_key',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['hour', 'ip_address']),
+            models.Index(fields=['hour', 'country_code']),
+        ]
+
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H:00} {self.action} {self.ip_address}: {self.count}"
+
+
+class SecurityRouteRollup(models.Model):
+    """
+    Hourly SecurityLog counts per (route, action), for the "top targeted
+    routes" view. Only events with a route (NAI_SECURITY_PATH_NORMALIZATION)
+    are counted; maintained together with SecurityEventRollup.
+    """
+
+    hour = models.DateTimeField(help_text="Start of the hour (UTC)")
+    route = models.CharField(max_length=255)
+    action = models.CharField(max_length=30)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = "security_route_rollup"
+        verbose_name = "Security Route Rollup"
+        verbose_name_plural = "Security Route Rollups"
+        ordering = ['-hour', '-count']
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'route', 'action'], name='security_route_rollup_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H:00} {self.action} {self.route}: {self.count}"
+
+
+class RollupWatermark(models.Model):
+    """Highest source row id folded into the rollups, per source."""
+
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "security_rollup_watermark"
+        verbose_name = "Rollup Watermark"
+        verbose_name_plural = "Rollup Watermarks"
+
+    def __str__(self):
+        return f"{self.name}: {self.last_id}"
@@ -1,7 +1,11 @@
+from asgiref.sync import sync_to_async
 from django.db import models
+from django.utils import timezone
 
+from .user_agent_string import UserAgentModel
 
-class SecurityLog(models.Model):
+
+class SecurityLog(UserAgentModel):
     """Log of all security events for monitoring and audit."""
     
     ACTION_CHOICES = [
@@ -11,6 +15,7 @@ class SecurityLog(models.Model):
         ('EMAIL_BLOCK', 'Blocked by Email'),
         ('DOMAIN_BLOCK', 'Blocked by Domain'),
         ('USER_AGENT_BLOCK', 'Blocked by User Agent'),
+        ('ASN_BLOCK', 'Blocked by ASN'),
         ('RATE_LIMIT', 'Rate Limited'),
         ('AXES_LOCK', 'Login Locked (Axes)'),
         ('SUSPICIOUS_LOGIN', 'Suspicious Login Detected'),
@@ -30,11 +35,15 @@ class SecurityLog(models.Model):
     action = models.CharField(max_length=30, choices=ACTION_CHOICES, db_index=True)
     severity = models.CharField(max_length=10, choices=SEVERITY_CHOICES, default='medium')
     path = models.CharField(max_length=500)
+    route = models.CharField(
+        max_length=255, blank=True,
+        help_text="URL pattern or normalized path (NAI_SECURITY_PATH_NORMALIZATION)",
+    )
     method = models.CharField(max_length=10, blank=True)
-    user_agent = models.TextField(blank=True)
     details = models.TextField(blank=True)
     user_email = models.EmailField(blank=True, help_text="If login attempt, the email used")
-    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Not auto_now_add: events written later (buffered writer, event bus) keep the time they happened.
+    created_at = models.DateTimeField(default=timezone.now, editable=False, db_index=True)
 
     class Meta:
         db_table = "security_security_log"
@@ -46,35 +55,137 @@ class SecurityLog(models.Model):
             models.Index(fields=['ip_address', '-created_at']),
             models.Index(fields=['action', '-created_at']),
             models.Index(fields=['country_code', '-created_at']),
+            models.Index(fields=['route', '-created_at']),
         ]
 
     def __str__(self):
         return f"{self.action} - {self.ip_address} - {self.created_at}"
 
+    SEVERITY_MAP = {
+        'COUNTRY_BLOCK': 'medium',
+        'IP_BLOCK': 'high',
+        'EMAIL_BLOCK': 'medium',
+        'DOMAIN_BLOCK': 'low',
+        'USER_AGENT_BLOCK': 'low',
+        'ASN_BLOCK': 'medium',
+        'RATE_LIMIT': 'low',
+        'AXES_LOCK': 'high',
+        'SUSPICIOUS_LOGIN': 'high',
+        'AUTO_BLOCK_IP': 'high',
+        'AUTO_BLOCK_COUNTRY': 'critical',
+    }
+
     @classmethod
-    def log_event(cls, ip_address: str, action: str, path: str, **kwargs):
-        """Helper method to create a security log entry."""
-        severity_map = {
-            'COUNTRY_BLOCK': 'medium',
-            'IP_BLOCK': 'high',
-            'EMAIL_BLOCK': 'medium',
-            'DOMAIN_BLOCK': 'low',
-            'USER_AGENT_BLOCK': 'low',
-            'RATE_LIMIT': 'low',
-            'AXES_LOCK': 'high',
-            'SUSPICIOUS_LOGIN': 'high',
-            'AUTO_BLOCK_IP': 'high',
-            'AUTO_BLOCK_COUNTRY': 'critical',
-        }
-        
-        return cls.objects.create(
+    def _event_fields(cls, ip_address: str, action: str, path: str, **kwargs) -> dict:
+        from ..services.path_normalizer import normalize_path, path_max_length, path_normalization_enabled
+        route = kwargs.pop('route', None)
+        if route is None:
+            route = normalize_path(path) if path and path_normalization_enabled() else ''
+        return dict(
             ip_address=ip_address,
             action=action,
-            path=path[:500],
-            severity=kwargs.pop('severity', severity_map.get(action, 'medium')),
-            country_code=kwargs.pop('country_code', ''),
+            path=path[:path_max_length()],
+            route=route[:255],
+            severity=kwargs.pop('severity', cls.SEVERITY_MAP.get(action, 'medium')),
+            country_code=str(kwargs.pop('country_code', None) or ''),
             method=kwargs.pop('method', ''),
             user_agent=kwargs.pop('user_agent', '')[:1000] if kwargs.get('user_agent') else '',
             details=kwargs.pop('details', ''),
             user_email=kwargs.pop('user_email', ''),
         )
+
+    @classmethod
+    def log_event(cls, ip_address: str, action: str, path: str, **kwargs):
+        """
+        Helper method to create a security log entry. With
+        NAI_SECURITY_LOG_BACKENDS set, the (unsaved) entry goes to the log
+        writer and its backends instead; with NAI_SECURITY_EVENT_BUS it is
+        only published to the event bus (written as above if that fails).
+        """
+        from ..services.event_bus import event_bus_enabled, publish_events
+        from ..services.event_counters import record_security_event
+        from ..services.log_backends import log_backends_configured
+        fields = cls._event_fields(ip_address, action, path, **kwargs)
+        if event_bus_enabled():
+            event = cls(**fields)
+            if publish_events([event]):
+                return event
+        record_security_event(fields['ip_address'], fields['country_code'])
+        if log_backends_configured():
+            from ..services.log_writer import get_log_writer
+            event = cls(**fields)
+            get_log_writer().write(event)
+            return event
+        return cls.objects.create(**fields)
+
+    @classmethod
+    async def log_event_async(cls, ip_address: str, action: str, path: str, **kwargs):
+        """Async version of log_event()."""
+        from ..services.event_bus import event_bus_enabled, publish_events
+        from ..services.event_counters import record_security_event_async
+        from ..services.log_backends import log_backends_configured
+        fields = cls._event_fields(ip_address, action, path, **kwargs)
+        if event_bus_enabled():
+            event = cls(**fields)
+            if await sync_to_async(publish_events, thread_sensitive=False)([event]):
+                return event
+        await record_security_event_async(fields['ip_address'], fields['country_code'])
+        if log_backends_configured():
+            from ..services.log_writer import get_log_writer
+            event = cls(**fields)
+            await get_log_writer().write_async(event)
+            return event
+        return await cls.objects.acreate(**fields)
+
+    @classmethod
+    def log_events(cls, events, batch_size: int = 1000) -> list:
+        """
+        Bulk log_event(): events is an iterable of log_event() keyword dicts,
+        inserted in batches of batch_size. Meant for system entries such as
+        AUTO_BLOCK_*, so the entries are not fed to the event counters. With
+        NAI_SECURITY_LOG_BACKENDS set they go to the log writer instead, and
+        with NAI_SECURITY_EVENT_BUS to the event bus.
+        """
+        from ..services.event_bus import event_bus_enabled, publish_events
+        from ..services.log_backends import log_backends_configured
+        entries = [cls(**cls._event_fields(**event)) for event in events]
+        if event_bus_enabled() and publish_events(entries, system=True):
+            return entries
+        if log_backends_configured():
+            from ..services.log_writer import get_log_writer
+            writer = get_log_writer()
+            for entry in entries:
+                writer.write(entry)
+            return entries
+        from ..services.user_agents import resolve_user_agents
+        resolve_user_agents(entries)
+        return cls.objects.bulk_create(entries, batch_size=batch_size)
+
+    @classmethod
+    def record_event(cls, ip_address: str, action: str, path: str, **kwargs) -> None:
+        """
+        Like log_event(), but hands the entry to the configured log writer
+        (NAI_SECURITY_LOG_WRITER) instead of inserting it inline. Used on the
+        request path, where the row may be written after the response. With
+        NAI_SECURITY_EVENT_BUS the entry is only published to the bus.
+        """
+        from ..services.event_bus import event_bus_enabled, publish_events
+        from ..services.event_counters import record_security_event
+        from ..services.log_writer import get_log_writer
+        fields = cls._event_fields(ip_address, action, path, **kwargs)
+        if event_bus_enabled() and publish_events([cls(**fields)]):
+            return
+        record_security_event(fields['ip_address'], fields['country_code'])
+        get_log_writer().write(cls(**fields))
+
+    @classmethod
+    async def record_event_async(cls, ip_address: str, action: str, path: str, **kwargs) -> None:
+        """Async version of record_event()."""
+        from ..services.event_bus import event_bus_enabled, publish_events
+        from ..services.event_counters import record_security_event_async
+        from ..services.log_writer import get_log_writer
+        fields = cls._event_fields(ip_address, action, path, **kwargs)
+        if event_bus_enabled() and await sync_to_async(publish_events, thread_sensitive=False)([cls(**fields)]):
+            return
+        await record_security_event_async(fields['ip_address'], fields['country_code'])
+        await get_log_writer().write_async(cls(**fields))
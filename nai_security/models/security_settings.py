@@ -1,8 +1,46 @@
+from dataclasses import astuple, dataclass, fields
+
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.core.cache import cache
 from django.core.validators import MinValueValidator, MaxValueValidator
 
+from ..utils import bump_country_policy_version, bump_policy_generation
+
+SETTINGS_CACHE_KEY = 'security_settings'
+SETTINGS_RECORD_CACHE_KEY = 'sec_settings_record'
+
+
+@dataclass(frozen=True, slots=True)
+class SettingsRecord:
+    """
+    The SecuritySettings fields SecurityMiddleware reads on every request.
+
+    Cached as a plain (FORMAT, values) tuple rather than a pickled model
+    instance; bump FORMAT whenever the fields change so entries written by an
+    older release are ignored instead of misread.
+    """
+
+    FORMAT = 1
+
+    ip_blocking_enabled: bool
+    user_agent_blocking_enabled: bool
+    country_blocking_enabled: bool
+    country_whitelist_mode: bool
+
+    @classmethod
+    def from_model(cls, settings) -> 'SettingsRecord':
+        return cls(*(getattr(settings, f.name) for f in fields(cls)))
+
+    def to_cache(self) -> tuple:
+        return (self.FORMAT, astuple(self))
+
+    @classmethod
+    def from_cache(cls, value) -> 'SettingsRecord | None':
+        if not isinstance(value, tuple) or len(value) != 2 or value[0] != cls.FORMAT:
+            return None
+        return cls(*value[1])
+
 
 class SecuritySettings(models.Model):
     """
@@ -23,6 +61,21 @@ class SecuritySettings(models.Model):
         default=24,
         help_text="How long to auto-block an IP (hours). 0 = permanent"
     )
+    auto_block_subnet_threshold = models.PositiveIntegerField(
+        default=0,
+        help_text="Replace auto-blocked IPs with one network block once this many "
+                  "distinct addresses in the same subnet are auto-blocked. 0 = off"
+    )
+    auto_block_subnet_prefix_v4 = models.PositiveSmallIntegerField(
+        default=24,
+        validators=[MinValueValidator(8), MaxValueValidator(31)],
+        help_text="IPv4 subnet size (prefix length) for subnet aggregation"
+    )
+    auto_block_subnet_prefix_v6 = models.PositiveSmallIntegerField(
+        default=64,
+        validators=[MinValueValidator(16), MaxValueValidator(127)],
+        help_text="IPv6 subnet size (prefix length) for subnet aggregation"
+    )
     
     # Login attempt limits (django-axes)
     max_login_attempts = models.PositiveIntegerField(
@@ -53,6 +106,12 @@ class SecuritySettings(models.Model):
         help_text="Auto-block countries (requires manual review)"
     )
     
+    # Retention
+    security_log_retention_days = models.PositiveIntegerField(
+        default=0,
+        help_text="Delete security log entries older than this many days. 0 = keep forever"
+    )
+    
     # Login anomaly detection
     alert_on_new_country = models.BooleanField(
         default=True,
@@ -127,24 +186,78 @@ class SecuritySettings(models.Model):
         # Ensure only one instance exists (singleton)
         self.pk = 1
         super().save(*args, **kwargs)
-        cache.delete('security_settings')
+        cache.delete_many([SETTINGS_CACHE_KEY, SETTINGS_RECORD_CACHE_KEY])
+        bump_policy_generation()
+        bump_country_policy_version()
         try:
             from nai_security.handlers.axes_integration import refresh_axes_from_db
             refresh_axes_from_db()
         except ImportError:
             pass
 
+    @classmethod
+    def _to_cache(cls, settings) -> tuple:
+        names = tuple(f.attname for f in cls._meta.concrete_fields)
+        return (names, tuple(getattr(settings, name) for name in names))
+
+    @classmethod
+    def _from_cache(cls, value) -> 'SecuritySettings | None':
+        """
+        Instance rebuilt from a cached (field names, values) tuple, or None if
+        missing or written for a different set of fields (pickled instances
+        from older releases included).
+        """
+        names = tuple(f.attname for f in cls._meta.concrete_fields)
+        if not isinstance(value, tuple) or len(value) != 2 or value[0] != names:
+            return None
+        return cls.from_db(None, names, value[1])
+
     @classmethod
     def get_settings(cls) -> 'SecuritySettings':
-        """Get or create the singleton settings instance (cached)."""
-        cached = cache.get('security_settings')
-        if cached:
-            return cached
-        
+        """Get or create the singleton settings instance (cached as plain field values)."""
+        settings = cls._from_cache(cache.get(SETTINGS_CACHE_KEY))
+        if settings is not None:
+            return settings
+
         settings, _ = cls.objects.get_or_create(pk=1)
-        cache.set('security_settings', settings, 300)  # Cache 5 minutes
+        cache.set(SETTINGS_CACHE_KEY, cls._to_cache(settings), 300)  # Cache 5 minutes
         return settings
 
+    @classmethod
+    async def get_settings_async(cls) -> 'SecuritySettings':
+        """Async version of get_settings()."""
+        settings = cls._from_cache(await cache.aget(SETTINGS_CACHE_KEY))
+        if settings is not None:
+            return settings
+
+        settings, _ = await cls.objects.aget_or_create(pk=1)
+        await cache.aset(SETTINGS_CACHE_KEY, cls._to_cache(settings), 300)
+        return settings
+
+    @classmethod
+    def get_record(cls) -> SettingsRecord:
+        """Frozen SettingsRecord for the request path (cached as a small tuple)."""
+        record = SettingsRecord.from_cache(cache.get(SETTINGS_RECORD_CACHE_KEY))
+        if record is not None:
+            return record
+
+        settings, _ = cls.objects.get_or_create(pk=1)
+        record = SettingsRecord.from_model(settings)
+        cache.set(SETTINGS_RECORD_CACHE_KEY, record.to_cache(), 300)
+        return record
+
+    @classmethod
+    async def get_record_async(cls) -> SettingsRecord:
+        """Async version of get_record()."""
+        record = SettingsRecord.from_cache(await cache.aget(SETTINGS_RECORD_CACHE_KEY))
+        if record is not None:
+            return record
+
+        settings, _ = await cls.objects.aget_or_create(pk=1)
+        record = SettingsRecord.from_model(settings)
+        await cache.aset(SETTINGS_RECORD_CACHE_KEY, record.to_cache(), 300)
+        return record
+
     @classmethod
     def load(cls):
         """Alias for get_settings()."""
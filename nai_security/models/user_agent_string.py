@@ -0,0 +1,54 @@
+import hashlib
+
+from django.db import models
+
+
+class UserAgentString(models.Model):
+    """
+    One row per distinct user-agent string, keyed by its SHA-256. SecurityLog
+    and LoginHistory reference these instead of repeating the text per row.
+    """
+
+    hash = models.CharField(max_length=64, unique=True)
+    value = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "security_user_agent"
+        verbose_name = "User Agent String"
+        verbose_name_plural = "User Agent Strings"
+
+    def __str__(self):
+        return self.value[:80]
+
+    @staticmethod
+    def hash_value(value: str) -> str:
+        return hashlib.sha256(value.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+class UserAgentModel(models.Model):
+    """
+    Abstract base for rows with a deduplicated user agent. The text is still
+    written to `user_agent` during the transition; save() (or
+    services.user_agents.resolve_user_agents() before a bulk_create) also
+    points user_agent_string at its UserAgentString row. A later release
+    drops the text column.
+    """
+
+    user_agent = models.TextField(blank=True)
+    user_agent_string = models.ForeignKey(
+        UserAgentString,
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+        related_name='+',
+        db_index=False,
+    )
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        from ..services.user_agents import resolve_user_agents
+        resolve_user_agents([self])
+        super().save(*args, **kwargs)
@@ -1,14 +1,21 @@
 from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.db import models
 
+from ..utils import bump_policy_generation, normalize_network
+
 
 class WhitelistedIP(models.Model):
     """IP addresses that bypass all security checks."""
 
     ip_address = models.GenericIPAddressField(
-        unique=True,
         db_index=True,
-        help_text="IP address to whitelist (IPv4 or IPv6)"
+        help_text="IP address to whitelist (IPv4 or IPv6), or the network address when a prefix length is set"
+    )
+    prefix_length = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        help_text="Whitelist a whole network, e.g. 24 for 10.0.0.0/24. Leave empty for a single address"
     )
     description = models.CharField(
         max_length=255,
@@ -25,23 +32,49 @@ class WhitelistedIP(models.Model):
         verbose_name = "Whitelisted IP"
         verbose_name_plural = "Whitelisted IPs"
         ordering = ['-created_at']
+        constraints = [
+            # One row per network; single addresses (no prefix length) are
+            # unique on their own, since NULL prefix lengths never collide.
+            models.UniqueConstraint(fields=['ip_address', 'prefix_length'], name='security_whitelisted_ip_network'),
+            models.UniqueConstraint(
+                fields=['ip_address'], condition=models.Q(prefix_length__isnull=True), name='security_whitelisted_ip_address',
+            ),
+        ]
 
     def __str__(self):
-        return f"{self.ip_address} - {self.description or 'No description'}"
+        return f"{self.cidr} - {self.description or 'No description'}"
+
+    @property
+    def cidr(self) -> str:
+        if self.prefix_length is None:
+            return self.ip_address
+        return f"{self.ip_address}/{self.prefix_length}"
+
+    def clean(self):
+        try:
+            normalize_network(self.ip_address, self.prefix_length)
+        except ValueError as e:
+            raise ValidationError({'prefix_length': str(e)})
 
     def save(self, *args, **kwargs):
+        self.ip_address, self.prefix_length = normalize_network(self.ip_address, self.prefix_length)
         super().save(*args, **kwargs)
         cache.delete(f"sec_whitelist:{self.ip_address}")
+        bump_policy_generation()
 
     def delete(self, *args, **kwargs):
         ip = self.ip_address
         super().delete(*args, **kwargs)
         cache.delete(f"sec_whitelist:{ip}")
+        bump_policy_generation()
 
     @classmethod
     def is_whitelisted(cls, ip_address: str) -> bool:
-        """Check if IP is whitelisted."""
-        return cls.objects.filter(
+        """Check if IP is whitelisted, directly or through a whitelisted network."""
+        if cls.objects.filter(
             ip_address=ip_address,
             is_active=True
-        ).exists()
+        ).exists():
+            return True
+        from ..services.policy_snapshot import get_network_policy
+        return get_network_policy().is_ip_whitelisted(ip_address)
@@ -2,6 +2,8 @@ from django.core.cache import cache
 from django.db import models
 from django.conf import settings
 
+from ..utils import bump_policy_generation
+
 
 class WhitelistedUser(models.Model):
     """Users exempted from security checks."""
@@ -50,6 +52,7 @@ class WhitelistedUser(models.Model):
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
         cache.delete(f"sec_user_exempt:{self.user_id}")
+        bump_policy_generation()
         if self.is_active:
             self._reset_axes_lockout()
 
@@ -57,6 +60,7 @@ class WhitelistedUser(models.Model):
         user_id = self.user_id
         super().delete(*args, **kwargs)
         cache.delete(f"sec_user_exempt:{user_id}")
+        bump_policy_generation()
 
     def _reset_axes_lockout(self):
         """
@@ -102,4 +106,25 @@ class WhitelistedUser(models.Model):
                 return False
             return True
         except cls.DoesNotExist:
-            return False
\ No newline at end of file
+            return False
+
+    @classmethod
+    async def is_whitelisted_async(cls, user, check_type='all'):
+        """Async version of is_whitelisted()."""
+        if not user or not user.is_authenticated:
+            return False
+
+        from django.utils import timezone
+        now = timezone.now()
+
+        try:
+            whitelist = await cls.objects.aget(
+                user=user,
+                is_active=True,
+                exemption_type__in=[check_type, 'all']
+            )
+            if whitelist.expires_at and whitelist.expires_at < now:
+                return False
+            return True
+        except cls.DoesNotExist:
+            return False
@@ -1,17 +1,40 @@
+import ipaddress
 import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings as django_settings
+from django.core.cache import cache
+from django.db.models import Q
 from django.utils import timezone
 from datetime import timedelta
-from django.db.models import Count
 
 from ..models import (
     SecurityLog, SecuritySettings, BlockedIP, BlockedCountry
 )
+from ..utils import bulk_upsert, bump_country_policy_version, bump_policy_generation, publish_inline_block
+from .event_counters import COUNTRY, IP, counters_enabled, get_event_counters
+from .log_readers import get_log_reader
+from .ip_index import IPNetworkIndex
+from .policy_snapshot import PolicyGenerationCache, get_network_policy
 
 logger = logging.getLogger(__name__)
 
+# Rows per bulk INSERT / IN (...) list in the batch paths.
+BATCH_SIZE = 1000
+
+DEFAULT_EXPIRY_CHUNK_SIZE = 1000
+
 
 class AutoBlocker:
-    """Service for automatically blocking IPs and countries based on attack patterns."""
+    """
+    Service for automatically blocking IPs and countries based on attack patterns.
+
+    Events are counted through the log reader (services.log_readers:
+    SecurityLog, the hourly rollups or a Redis Stream), or, with
+    NAI_SECURITY_AUTO_BLOCK_COUNTERS = True, from the time-bucketed counters in
+    services.event_counters that SecurityLog.log_event / record_event keep.
+    With NAI_SECURITY_AUTO_BLOCK_INLINE = True an IP is blocked by
+    check_inline() as soon as the event that crosses its threshold is logged.
+    """
     
     @classmethod
     def check_and_block_ip(cls, ip_address: str) -> bool:
@@ -28,40 +51,107 @@ class AutoBlocker:
         if BlockedIP.objects.filter(ip_address=ip_address, is_active=True).exists():
             return False
         
-        # Count events in time window
-        window_start = timezone.now() - timedelta(hours=settings.auto_block_ip_window_hours)
-        event_count = SecurityLog.objects.filter(
-            ip_address=ip_address,
-            created_at__gte=window_start
-        ).count()
-        
+        event_count = cls._count_events(
+            IP, ip_address, settings.auto_block_ip_window_hours, ip_address=ip_address,
+        )
         if event_count >= settings.auto_block_ip_threshold:
-            # Auto-block this IP
-            expires_at = None
-            if settings.auto_block_ip_duration_hours > 0:
-                expires_at = timezone.now() + timedelta(hours=settings.auto_block_ip_duration_hours)
-            
-            BlockedIP.objects.create(
+            cls._block_ips({ip_address: event_count}, settings)
+            return True
+        
+        return False
+
+    @classmethod
+    def check_inline(cls, ip_address: str, counters) -> bool:
+        """
+        Inline mode: called right after an event for ip_address was counted.
+        Blocks the IP once its window count reaches the threshold. A short cache
+        claim per IP makes the events that follow skip straight out. Returns
+        True if IP was blocked.
+        """
+        threshold, window_hours = _inline_thresholds.get() or (0, 0)
+        if not threshold or ip_address == '0.0.0.0':  # system events
+            return False
+        event_count = counters.count(IP, ip_address, window_hours * 3600)
+        if event_count < threshold:
+            return False
+        return cls._block_inline(ip_address, counters, event_count)
+
+    @classmethod
+    async def check_inline_async(cls, ip_address: str, counters) -> bool:
+        """
+        Async version of check_inline(). The threshold check stays on the
+        event loop; only the block itself runs the ORM in a thread.
+        """
+        threshold, window_hours = await _inline_thresholds.get_async() or (0, 0)
+        if not threshold or ip_address == '0.0.0.0':  # system events
+            return False
+        event_count = await counters.count_async(IP, ip_address, window_hours * 3600)
+        if event_count < threshold:
+            return False
+        return await sync_to_async(cls._block_inline)(ip_address, counters, event_count)
+
+    @classmethod
+    def _block_inline(cls, ip_address: str, counters, event_count: int) -> bool:
+        if not cache.add(f"sec_autoblock_claim:{ip_address}", 1, counters.bucket_seconds):
+            return False
+        if get_network_policy().is_ip_blocked(ip_address):
+            return False
+        if BlockedIP.objects.filter(ip_address=ip_address, is_active=True).exists():
+            return False
+        cls._block_ips({ip_address: event_count}, SecuritySettings.get_settings(), inline=True)
+        # Straight into the middleware's per-IP cache: the next request from the
+        # IP is refused without a query (snapshot workers add the published
+        # block to their snapshot instead of rebuilding it).
+        cache.set(f"sec_blocked_ip:{ip_address}", True, 300)
+        return True
+
+    @classmethod
+    def _block_ips(cls, event_counts: dict[str, int], settings, inline: bool = False) -> int:
+        """
+        Block every IP in {ip: event count}: one upsert (an inactive row for
+        the address, expired or lifted by hand, is reactivated rather than
+        colliding with it), one AUTO_BLOCK_IP insert, one cache delete_many
+        and one generation bump, however many IPs there are. inline publishes
+        each block with its own generation (utils.publish_inline_block) so
+        workers apply it instead of rebuilding their policy copies.
+        """
+        if not event_counts:
+            return 0
+        expires_at = None
+        if settings.auto_block_ip_duration_hours > 0:
+            expires_at = timezone.now() + timedelta(hours=settings.auto_block_ip_duration_hours)
+        window_hours = settings.auto_block_ip_window_hours
+
+        _upsert_addresses([
+            BlockedIP(
                 ip_address=ip_address,
-                reason=f"Auto-blocked: {event_count} security events in {settings.auto_block_ip_window_hours}h",
+                reason=f"Auto-blocked: {event_count} security events in {window_hours}h",
                 is_active=True,
                 is_auto_blocked=True,
                 block_count=event_count,
                 expires_at=expires_at,
             )
-            
-            SecurityLog.log_event(
+            for ip_address, event_count in event_counts.items()
+        ], ['reason', 'is_active', 'is_auto_blocked', 'block_count', 'expires_at', 'updated_at'])
+        SecurityLog.log_events((
+            dict(
                 ip_address=ip_address,
                 action='AUTO_BLOCK_IP',
                 path='system',
                 details=f"Auto-blocked after {event_count} events",
                 severity='high',
             )
-            
-            logger.warning(f"AUTO_BLOCK_IP: {ip_address} after {event_count} events")
-            return True
-        
-        return False
+            for ip_address, event_count in event_counts.items()
+        ), batch_size=BATCH_SIZE)
+        cache.delete_many([f"sec_blocked_ip:{ip_address}" for ip_address in event_counts])
+        if inline:
+            for ip_address in event_counts:
+                publish_inline_block(ip_address, expires_at)
+        else:
+            bump_policy_generation()
+
+        logger.warning("AUTO_BLOCK_IP: %s", _summary(event_counts, 'events'))
+        return len(event_counts)
     
     @classmethod
     def check_and_flag_country(cls, country_code: str) -> bool:
@@ -78,25 +168,43 @@ class AutoBlocker:
         if BlockedCountry.objects.filter(code=country_code, is_active=True).exists():
             return False
         
-        # Count events in time window
-        window_start = timezone.now() - timedelta(hours=settings.auto_block_country_window_hours)
-        event_count = SecurityLog.objects.filter(
-            country_code=country_code,
-            created_at__gte=window_start
-        ).count()
-        
+        event_count = cls._count_events(
+            COUNTRY, country_code, settings.auto_block_country_window_hours, country_code=country_code,
+        )
         if event_count >= settings.auto_block_country_threshold:
-            if settings.auto_block_country_enabled:
-                # Auto-block country
-                BlockedCountry.objects.create(
+            cls._flag_countries({country_code: event_count}, settings)
+            return True
+        
+        return False
+
+    @classmethod
+    def _flag_countries(cls, event_counts: dict[str, int], settings) -> int:
+        """
+        Auto-block (auto_block_country_enabled) or flag for review every
+        country in {code: attack count}, in one upsert. Flagging only records
+        attack_count: an existing row keeps its is_active / reason, a new one
+        is created inactive.
+        """
+        if not event_counts:
+            return 0
+        names = dict(BlockedCountry.COUNTRY_CHOICES)
+        window_hours = settings.auto_block_country_window_hours
+
+        if settings.auto_block_country_enabled:
+            # Auto-block countries
+            bulk_upsert(BlockedCountry, [
+                BlockedCountry(
                     code=country_code,
-                    reason=f"Auto-blocked: {event_count} attacks in {settings.auto_block_country_window_hours}h",
+                    name=names.get(country_code, country_code),
+                    reason=f"Auto-blocked: {event_count} attacks in {window_hours}h",
                     is_active=True,
                     is_auto_blocked=True,
                     attack_count=event_count,
                 )
-                
-                SecurityLog.log_event(
+                for country_code, event_count in event_counts.items()
+            ], ['code'], ['reason', 'is_active', 'is_auto_blocked', 'attack_count', 'updated_at'])
+            SecurityLog.log_events((
+                dict(
                     ip_address='0.0.0.0',
                     action='AUTO_BLOCK_COUNTRY',
                     path='system',
@@ -104,77 +212,359 @@ class AutoBlocker:
                     details=f"Auto-blocked after {event_count} attacks",
                     severity='critical',
                 )
-                
-                logger.warning(f"AUTO_BLOCK_COUNTRY: {country_code} after {event_count} attacks")
-            else:
-                # Just update attack count for review
-                country, created = BlockedCountry.objects.get_or_create(
+                for country_code, event_count in event_counts.items()
+            ), batch_size=BATCH_SIZE)
+            logger.warning("AUTO_BLOCK_COUNTRY: %s", _summary(event_counts, 'attacks'))
+        else:
+            # Just update attack counts for review
+            bulk_upsert(BlockedCountry, [
+                BlockedCountry(
                     code=country_code,
-                    defaults={'is_active': False, 'attack_count': event_count}
+                    name=names.get(country_code, country_code),
+                    is_active=False,
+                    attack_count=event_count,
                 )
-                if not created:
-                    country.attack_count = event_count
-                    country.save(update_fields=['attack_count', 'updated_at'])
-                
-                logger.info(f"Country {country_code} flagged for review: {event_count} attacks")
-            
-            return True
-        
-        return False
+                for country_code, event_count in event_counts.items()
+            ], ['code'], ['attack_count', 'updated_at'])
+            logger.info("Countries flagged for review: %s", _summary(event_counts, 'attacks'))
+
+        cache.delete_many([f"sec_blocked_country:{country_code}" for country_code in event_counts])
+        bump_policy_generation()
+        if settings.auto_block_country_enabled:
+            bump_country_policy_version()
+        return len(event_counts)
+
+    @staticmethod
+    def _count_events(dimension: str, value: str, window_hours: int, **log_filter) -> int:
+        """Events for one IP / country in the window, from the counters or the log reader."""
+        if counters_enabled():
+            return get_event_counters().count(dimension, value, window_hours * 3600)
+        (field, value), = log_filter.items()
+        return get_log_reader().count(field, value, timezone.now() - timedelta(hours=window_hours))
     
+    @staticmethod
+    def _window_counts(dimension: str, field: str, values, window_hours: int) -> dict[str, int]:
+        """{value: events in the window} for several IPs / countries, in one read."""
+        if counters_enabled():
+            return get_event_counters().counts(dimension, values, window_hours * 3600)
+        return get_log_reader().counts(field, values, timezone.now() - timedelta(hours=window_hours))
+
+    @classmethod
+    def check_offenders(cls, ip_addresses, country_codes) -> dict:
+        """
+        check_and_block_ip() and check_and_flag_country() for a whole batch of
+        IPs / countries, for the event bus auto_blocker consumer: the active
+        blocks are dropped in batches of BATCH_SIZE, the window counts come
+        from one read per dimension and the offenders are handled by one
+        _block_ips() / _flag_countries() call. Returns summary of actions taken.
+        """
+        settings = SecuritySettings.get_settings()
+
+        ip_counts = {}
+        if settings.auto_block_ip_threshold and ip_addresses:
+            candidates = dict.fromkeys(ip_addresses, 0)
+            _drop_active(candidates, BlockedIP, 'ip_address')
+            ip_counts = {
+                ip_address: count for ip_address, count in cls._window_counts(
+                    IP, 'ip_address', candidates, settings.auto_block_ip_window_hours,
+                ).items() if count >= settings.auto_block_ip_threshold
+            }
+
+        country_counts = {}
+        if settings.auto_block_country_threshold and country_codes:
+            candidates = dict.fromkeys(country_codes, 0)
+            _drop_active(candidates, BlockedCountry, 'code')
+            country_counts = {
+                country_code: count for country_code, count in cls._window_counts(
+                    COUNTRY, 'country_code', candidates, settings.auto_block_country_window_hours,
+                ).items() if count >= settings.auto_block_country_threshold
+            }
+
+        return {
+            'blocked_ips': cls._block_ips(_drop_network_blocked(ip_counts), settings),
+            'flagged_countries': cls._flag_countries(country_counts, settings),
+        }
+
     @classmethod
     def process_recent_events(cls) -> dict:
         """
         Process recent security events and auto-block as needed.
         Called by Celery task.
+
+        Set-based: the IPs / countries over their thresholds and not already
+        actively blocked come from one aggregate query each (through the log
+        reader, or from the event counters), and are then
+        blocked in bulk by _block_ips() /
+        _flag_countries(). The number of queries does not grow with the
+        number of offenders, beyond the bulk batches.
         Returns summary of actions taken.
         """
         settings = SecuritySettings.get_settings()
-        window_start = timezone.now() - timedelta(hours=max(
-            settings.auto_block_ip_window_hours,
-            settings.auto_block_country_window_hours
-        ))
-        
-        # Get IPs with high event counts
-        ip_counts = SecurityLog.objects.filter(
-            created_at__gte=window_start
-        ).values('ip_address').annotate(
-            count=Count('id')
-        ).filter(count__gte=settings.auto_block_ip_threshold)
-        
-        blocked_ips = 0
-        for item in ip_counts:
-            if cls.check_and_block_ip(item['ip_address']):
-                blocked_ips += 1
-        
-        # Get countries with high event counts
-        country_counts = SecurityLog.objects.filter(
-            created_at__gte=window_start
-        ).exclude(country_code='').values('country_code').annotate(
-            count=Count('id')
-        ).filter(count__gte=settings.auto_block_country_threshold)
-        
-        flagged_countries = 0
-        for item in country_counts:
-            if cls.check_and_flag_country(item['country_code']):
-                flagged_countries += 1
-        
-        return {
-            'blocked_ips': blocked_ips,
-            'flagged_countries': flagged_countries,
+        if counters_enabled():
+            ip_counts, country_counts = cls._offenders_from_counters(settings)
+        else:
+            ip_counts, country_counts = cls._offenders_from_log(settings)
+
+        result = {
+            'blocked_ips': cls._block_ips(_drop_network_blocked(ip_counts), settings),
+            'flagged_countries': cls._flag_countries(country_counts, settings),
         }
-    
+        if settings.auto_block_subnet_threshold:
+            result['aggregated_networks'] = cls.aggregate_subnets(settings)
+        return result
+
+    @staticmethod
+    def _offenders_from_log(settings) -> tuple[dict, dict]:
+        """Totals over each window from the log reader, leaving out the active blocks."""
+        reader = get_log_reader()
+        reader.refresh()
+        now = timezone.now()
+
+        ip_counts = {}
+        if settings.auto_block_ip_threshold:
+            ip_counts = reader.totals(
+                'ip_address',
+                now - timedelta(hours=settings.auto_block_ip_window_hours),
+                settings.auto_block_ip_threshold,
+                exclude=BlockedIP.objects.filter(is_active=True).values_list('ip_address', flat=True),
+            )
+
+        country_counts = {}
+        if settings.auto_block_country_threshold:
+            country_counts = reader.totals(
+                'country_code',
+                now - timedelta(hours=settings.auto_block_country_window_hours),
+                settings.auto_block_country_threshold,
+                exclude=BlockedCountry.objects.filter(is_active=True).values_list('code', flat=True),
+            )
+
+        return ip_counts, country_counts
+
+    @staticmethod
+    def _offenders_from_counters(settings) -> tuple[dict, dict]:
+        """
+        The same from the event counters: only values over the threshold are
+        read back, and the active blocks among them are dropped in batches of
+        BATCH_SIZE. SecurityLog is not queried.
+        """
+        counters = get_event_counters()
+
+        ip_counts = {}
+        if settings.auto_block_ip_threshold:
+            ip_counts = counters.candidates(
+                IP, settings.auto_block_ip_window_hours * 3600, settings.auto_block_ip_threshold,
+            )
+            _drop_active(ip_counts, BlockedIP, 'ip_address')
+
+        country_counts = {}
+        if settings.auto_block_country_threshold:
+            country_counts = counters.candidates(
+                COUNTRY, settings.auto_block_country_window_hours * 3600, settings.auto_block_country_threshold,
+            )
+            _drop_active(country_counts, BlockedCountry, 'code')
+
+        return ip_counts, country_counts
+
     @classmethod
-    def cleanup_expired_blocks(cls) -> int:
-        """Remove expired IP blocks. Returns count of removed blocks."""
-        expired = BlockedIP.objects.filter(
-            expires_at__lt=timezone.now(),
-            is_active=True
+    def aggregate_subnets(cls, settings=None) -> int:
+        """
+        Collapse auto-blocked addresses into network blocks. Every /24 (IPv4)
+        or /64 (IPv6) subnet (auto_block_subnet_prefix_v4 / _v6) holding at
+        least auto_block_subnet_threshold active, auto-blocked single-address
+        rows gets one auto-blocked network row; the address rows are retired
+        (is_active=False). The network block lasts as long as the longest of
+        them and its block_count is their sum.
+
+        Subnets already inside an active network block only have their
+        address rows retired. A subnet with a manual row for the same network,
+        or an auto-blocked one deactivated before it expired (lifted by hand),
+        is left alone. Returns the number of network blocks written.
+        """
+        if settings is None:
+            settings = SecuritySettings.get_settings()
+        threshold = settings.auto_block_subnet_threshold
+        if not threshold:
+            return 0
+        prefixes = {4: settings.auto_block_subnet_prefix_v4, 6: settings.auto_block_subnet_prefix_v6}
+
+        subnets: dict[ipaddress.IPv4Network | ipaddress.IPv6Network, list[tuple]] = {}
+        for pk, ip_address, block_count, expires_at in BlockedIP.objects.filter(
+            is_active=True, is_auto_blocked=True, prefix_length__isnull=True,
+        ).values_list('pk', 'ip_address', 'block_count', 'expires_at').iterator(chunk_size=BATCH_SIZE):
+            try:
+                address = ipaddress.ip_address(ip_address)
+            except ValueError:
+                continue
+            network = ipaddress.ip_network(f"{address}/{prefixes[address.version]}", strict=False)
+            subnets.setdefault(network, []).append((pk, ip_address, block_count, expires_at))
+        subnets = {network: members for network, members in subnets.items() if len(members) >= threshold}
+        if not subnets:
+            return 0
+
+        # {network address: prefix length} of the active network blocks, and
+        # the candidate networks an admin owns or lifted.
+        covering = IPNetworkIndex(
+            (f"{ip_address}/{prefix_length}", prefix_length)
+            for ip_address, prefix_length in BlockedIP.objects.filter(
+                is_active=True, prefix_length__isnull=False,
+            ).values_list('ip_address', 'prefix_length')
         )
-        count = expired.count()
-        expired.update(is_active=False)
+        held = set()
+        lifted = Q(is_active=False) & (Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()))
+        addresses = [str(network.network_address) for network in subnets]
+        for i in range(0, len(addresses), BATCH_SIZE):
+            held.update(BlockedIP.objects.filter(
+                Q(is_auto_blocked=False) | lifted,
+                ip_address__in=addresses[i:i + BATCH_SIZE], prefix_length__isnull=False,
+            ).values_list('ip_address', 'prefix_length'))
+
+        networks, retired = [], []
+        for network, members in subnets.items():
+            network_address = str(network.network_address)
+            if any(length <= network.prefixlen for length in covering.iter_matches(network_address)):
+                retired.extend(members)
+                continue
+            if (network_address, network.prefixlen) in held:
+                continue
+            expiries = [expires_at for _, _, _, expires_at in members]
+            networks.append(BlockedIP(
+                ip_address=network_address,
+                prefix_length=network.prefixlen,
+                reason=f"Auto-blocked: {len(members)} auto-blocked addresses in {network}",
+                is_active=True,
+                is_auto_blocked=True,
+                block_count=sum(block_count for _, _, block_count, _ in members),
+                expires_at=None if None in expiries else max(expiries),
+            ))
+            retired.extend(members)
+        if not networks and not retired:
+            return 0
+
+        bulk_upsert(BlockedIP, networks, ['ip_address', 'prefix_length'], [
+            'reason', 'is_active', 'is_auto_blocked', 'block_count', 'expires_at', 'updated_at',
+        ])
+        retired_pks = [pk for pk, _, _, _ in retired]
+        now = timezone.now()
+        for i in range(0, len(retired_pks), BATCH_SIZE):
+            BlockedIP.objects.filter(pk__in=retired_pks[i:i + BATCH_SIZE]).update(is_active=False, updated_at=now)
+        SecurityLog.log_events((
+            dict(
+                ip_address=row.ip_address,
+                action='AUTO_BLOCK_IP',
+                path='system',
+                details=row.reason,
+                severity='high',
+            )
+            for row in networks
+        ), batch_size=BATCH_SIZE)
+        cache.delete_many([f"sec_blocked_ip:{ip_address}" for _, ip_address, _, _ in retired])
+        bump_policy_generation()
+
+        logger.warning(
+            "AUTO_BLOCK_IP: %d networks aggregated, %d address blocks retired", len(networks), len(retired),
+        )
+        return len(networks)
+
+    @classmethod
+    def cleanup_expired_blocks(cls, chunk_size: int | None = None, progress=None) -> int:
+        """
+        Deactivate expired IP blocks. Returns count of deactivated blocks.
+
+        Walks the expired rows in primary-key order, chunk_size at a time
+        (default NAI_SECURITY_EXPIRY_CHUNK_SIZE, 1000), so each UPDATE locks a
+        bounded set of rows. After each chunk the rows' sec_blocked_ip: cache
+        entries are deleted and the policy generation is bumped, and
+        progress(deactivated_so_far), if given, is called.
+        """
+        if chunk_size is None:
+            chunk_size = getattr(django_settings, 'NAI_SECURITY_EXPIRY_CHUNK_SIZE', DEFAULT_EXPIRY_CHUNK_SIZE)
+        now = timezone.now()
+        expired = BlockedIP.objects.filter(expires_at__lt=now, is_active=True)
+
+        count = 0
+        last_pk = 0
+        while True:
+            chunk = list(
+                expired.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'ip_address')[:chunk_size]
+            )
+            if not chunk:
+                break
+            last_pk = chunk[-1][0]
+            # Re-checks the expiry: a row re-blocked since the SELECT keeps its block.
+            count += expired.filter(pk__in=[pk for pk, _ in chunk]).update(is_active=False, updated_at=now)
+            cache.delete_many([f"sec_blocked_ip:{ip_address}" for _, ip_address in chunk])
+            bump_policy_generation()
+            if progress is not None:
+                progress(count)
         
         if count > 0:
             logger.info(f"Cleaned up {count} expired IP blocks")
         
         return count
+
+
+def _drop_active(event_counts: dict, model, field: str) -> None:
+    """Remove the values with an active `model` row from event_counts."""
+    values = list(event_counts)
+    for i in range(0, len(values), BATCH_SIZE):
+        for value in model.objects.filter(
+            is_active=True, **{f"{field}__in": values[i:i + BATCH_SIZE]},
+        ).values_list(field, flat=True):
+            event_counts.pop(value, None)
+
+
+def _drop_network_blocked(ip_counts: dict) -> dict:
+    """ip_counts without the IPs an active network block already covers."""
+    policy = get_network_policy()
+    if not policy.blocked:
+        return ip_counts
+    return {ip: count for ip, count in ip_counts.items() if not policy.is_ip_blocked(ip)}
+
+
+def _upsert_addresses(rows: list, update_fields: list[str]) -> None:
+    """
+    Upsert single-address BlockedIP rows. Their key is the partial unique
+    constraint on ip_address WHERE prefix_length IS NULL, which ON CONFLICT
+    cannot target, so the existing rows are looked up and bulk-updated and the
+    rest bulk-inserted (a row inserted concurrently by another worker wins).
+    """
+    existing = {}
+    addresses = [row.ip_address for row in rows]
+    for i in range(0, len(addresses), BATCH_SIZE):
+        existing.update(BlockedIP.objects.filter(
+            ip_address__in=addresses[i:i + BATCH_SIZE], prefix_length__isnull=True,
+        ).values_list('ip_address', 'pk'))
+    now = timezone.now()
+    for row in rows:
+        row.pk = existing.get(row.ip_address)
+        row.updated_at = now
+    BlockedIP.objects.bulk_update(
+        [row for row in rows if row.pk is not None], update_fields, batch_size=BATCH_SIZE,
+    )
+    BlockedIP.objects.bulk_create(
+        [row for row in rows if row.pk is None], batch_size=BATCH_SIZE, ignore_conflicts=True,
+    )
+
+
+def _summary(event_counts: dict, noun: str, limit: int = 10) -> str:
+    """'6.6.6.6 (15 events), ...' for the first `limit` entries."""
+    shown = ', '.join(f"{value} ({count} {noun})" for value, count in list(event_counts.items())[:limit])
+    if len(event_counts) > limit:
+        shown += f" and {len(event_counts) - limit} more"
+    return shown
+
+
+def _load_inline_thresholds(generation) -> tuple[int, int]:
+    settings, _ = SecuritySettings.objects.get_or_create(pk=1)
+    return settings.auto_block_ip_threshold, settings.auto_block_ip_window_hours
+
+
+# (auto_block_ip_threshold, auto_block_ip_window_hours), re-read when a
+# SecuritySettings save bumps the policy generation.
+_inline_thresholds = PolicyGenerationCache(
+    _load_inline_thresholds, 'auto-block thresholds', lambda value, generation, blocks: value,
+)
+
+
+def reset_inline_thresholds() -> None:
+    _inline_thresholds.reset()
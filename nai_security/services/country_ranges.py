@@ -0,0 +1,158 @@
+"""
+Country policy compiled into IP ranges.
+
+With NAI_SECURITY_COUNTRY_RANGES = True, SecurityMiddleware no longer asks
+"which country is this client in, and is that country blocked/allowed" on
+every request. Instead the active BlockedCountry / AllowedCountry policy is
+intersected once with the flattened GeoIP database (geoip_ranges) into a
+merged, sorted set of denied IP ranges, and the verdict is one binary search
+on the integer address.
+
+The set is a PolicyGenerationCache keyed on the country policy version
+(bumped only by BlockedCountry, AllowedCountry and SecuritySettings writes, not
+by the IP blocks that move the global policy generation), read at most every
+UNREAD_CHECK_INTERVAL seconds, and on the .mmdb file, checked at most every
+NAI_SECURITY_GEOIP_RELOAD_INTERVAL seconds. Nothing else triggers a rebuild:
+it walks the whole database, so one request per worker builds the new set
+while the others keep using the previous one.
+"""
+import ipaddress
+import socket
+import time
+from array import array
+from bisect import bisect_right
+
+from django.conf import settings as django_settings
+
+from ..utils import COUNTRY_POLICY_VERSION_CACHE_KEY, _geoip_file_identity, resolve_geoip_db_path
+from .geoip_ranges import get_country_range_table
+from .policy_snapshot import UNREAD_CHECK_INTERVAL, PolicyGenerationCache
+
+
+class CountryPolicyRanges:
+    """Immutable set of IP ranges the country policy denies, at one policy version."""
+
+    def __init__(self, version, action=None, table_file_id=None, denied_v4=(), denied_v6=()):
+        """
+        action: the SecurityLog action for a denied request ('COUNTRY_BLOCK' or
+        'COUNTRY_WHITELIST_BLOCK'), or None when country checks are off.
+        denied_v4 / denied_v6: sorted, non-overlapping (first, last) integer ranges.
+        """
+        self.version = version
+        self.action = action
+        self.table_file_id = table_file_id
+        self._v4 = (array('I', (r[0] for r in denied_v4)), array('I', (r[1] for r in denied_v4)))
+        self._v6 = ([r[0] for r in denied_v6], [r[1] for r in denied_v6])
+
+    @classmethod
+    def build(cls, version) -> 'CountryPolicyRanges':
+        from ..models import AllowedCountry, BlockedCountry, SecuritySettings
+        from ..models.security_settings import SettingsRecord
+
+        settings, _ = SecuritySettings.objects.get_or_create(pk=1)
+        return cls.compile(
+            version,
+            SettingsRecord.from_model(settings),
+            get_country_range_table(),
+            blocked=BlockedCountry.objects.filter(is_active=True).values_list('code', flat=True),
+            allowed=AllowedCountry.objects.filter(is_active=True).values_list('code', flat=True),
+        )
+
+    @classmethod
+    def compile(cls, version, settings, table, blocked=(), allowed=()) -> 'CountryPolicyRanges':
+        """
+        Intersect the policy with a CountryRangeTable. Same semantics as the
+        per-request checks: an address without a known country is never denied,
+        and allowlist mode with no AllowedCountry rows allows everything.
+        """
+        if table is None:
+            return cls(version)
+        allowlist = settings.country_whitelist_mode
+        if allowlist:
+            allowed = frozenset(allowed)
+            if not allowed:
+                return cls(version, table_file_id=table.file_id)
+            action = 'COUNTRY_WHITELIST_BLOCK'
+        elif settings.country_blocking_enabled:
+            blocked = frozenset(blocked)
+            action = 'COUNTRY_BLOCK'
+        else:
+            return cls(version, table_file_id=table.file_id)
+
+        ranges: dict[int, list[tuple[int, int]]] = {}
+        for family in (4, 6):
+            merged = ranges[family] = []
+            for first, last, code in table.iter_ranges(family):
+                if code is None or (code in allowed if allowlist else code not in blocked):
+                    continue
+                if merged and merged[-1][1] + 1 == first:
+                    merged[-1] = (merged[-1][0], last)
+                else:
+                    merged.append((first, last))
+        return cls(version, action, table.file_id, ranges[4], ranges[6])
+
+    def __len__(self) -> int:
+        return len(self._v4[0]) + len(self._v6[0])
+
+    def is_denied(self, ip_address: str) -> bool:
+        if self.action is None:
+            return False
+        try:
+            value = int.from_bytes(socket.inet_pton(socket.AF_INET, ip_address), 'big')
+            starts, ends = self._v4
+        except (OSError, TypeError):
+            try:
+                address = ipaddress.ip_address(ip_address)
+            except ValueError:
+                return False
+            if address.version == 6 and address.ipv4_mapped is not None:
+                address = address.ipv4_mapped
+            value = int(address)
+            starts, ends = self._v4 if address.version == 4 else self._v6
+        pos = bisect_right(starts, value) - 1
+        return pos >= 0 and value <= ends[pos]
+
+
+_file_checked_at = 0.0
+
+
+def _database_replaced(ranges: CountryPolicyRanges) -> bool:
+    """True if the .mmdb differs from the one ranges was compiled from (rate-limited)."""
+    global _file_checked_at
+    interval = getattr(django_settings, 'NAI_SECURITY_GEOIP_RELOAD_INTERVAL', 5)
+    now = time.monotonic()
+    if not interval or now - _file_checked_at < interval:
+        return False
+    _file_checked_at = now
+    path = resolve_geoip_db_path(getattr(django_settings, 'GEOIP_PATH', None))
+    try:
+        file_id = _geoip_file_identity(path) if path else None
+    except OSError:
+        file_id = None
+    return file_id != ranges.table_file_id
+
+
+def _build(version) -> CountryPolicyRanges:
+    return CountryPolicyRanges.build(version)
+
+
+_ranges_cache = PolicyGenerationCache(
+    _build, 'country ranges', check_interval=UNREAD_CHECK_INTERVAL,
+    key=COUNTRY_POLICY_VERSION_CACHE_KEY, expires=False, outdated=_database_replaced, wait=False,
+)
+
+
+def get_country_policy_ranges() -> CountryPolicyRanges | None:
+    """This worker's compiled country policy, or None if it could not be built."""
+    return _ranges_cache.get()
+
+
+async def get_country_policy_ranges_async() -> CountryPolicyRanges | None:
+    """Async version of get_country_policy_ranges(); only a rebuild leaves the event loop."""
+    return await _ranges_cache.get_async()
+
+
+def reset_country_policy_ranges() -> None:
+    global _file_checked_at
+    _ranges_cache.reset()
+    _file_checked_at = 0.0
@@ -0,0 +1,308 @@
+"""
+Redis Streams event bus for security events.
+
+With NAI_SECURITY_EVENT_BUS = True, SecurityLog.log_event / record_event /
+log_events publish each event to the stream NAI_SECURITY_EVENT_BUS_STREAM
+(default 'nai_security:bus', trimmed to about NAI_SECURITY_EVENT_BUS_MAXLEN
+entries) with one XADD and do nothing else: no SecurityLog INSERT, no counter
+update, no inline auto-block check. Events that cannot be published (Redis
+down) take the direct path instead, as without the bus. The work happens in `manage.py
+security_worker`, which runs one Redis consumer group per consumer:
+
+- log_writer: writes the events to the log backends
+  (NAI_SECURITY_LOG_BACKENDS, default the SecurityLog table).
+- auto_blocker: feeds the event counters and checks the IPs / countries seen
+  against the auto-block thresholds.
+- rollup: adds the events to the hourly SecurityEventRollup counts (use it
+  instead of the rollup_security_events task, not with it).
+- notifier: emails a digest of auto-blocks and suspicious logins to
+  SecuritySettings.notification_email.
+
+Each consumer reads batches with XREADGROUP and acknowledges a batch with one
+XACK once its handler returns. A batch whose handler raises stays pending;
+pending entries idle for NAI_SECURITY_EVENT_BUS_CLAIM_IDLE_MS (default 60 s),
+including those of a crashed worker, are taken over with XAUTOCLAIM. An
+entry delivered more than NAI_SECURITY_EVENT_BUS_MAX_DELIVERIES times (default
+5) is logged and dropped. Start as many workers as needed: processes in the
+same group share the stream. The Redis server is NAI_SECURITY_EVENT_BUS_URL,
+or NAI_SECURITY_REDIS_URL.
+"""
+import logging
+import os
+import socket
+from collections import Counter
+
+from django.conf import settings as django_settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections
+from django.utils.dateparse import parse_datetime
+
+from .log_backends import EVENT_FIELDS, event_record, redis_stream_client
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STREAM = 'nai_security:bus'
+DEFAULT_MAXLEN = 1000000
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_BLOCK_MS = 5000
+DEFAULT_CLAIM_IDLE_MS = 60000
+DEFAULT_MAX_DELIVERIES = 5
+
+NOTIFY_ACTIONS = ('AUTO_BLOCK_IP', 'AUTO_BLOCK_COUNTRY', 'SUSPICIOUS_LOGIN')
+
+_client = None
+
+
+def event_bus_enabled() -> bool:
+    return getattr(django_settings, 'NAI_SECURITY_EVENT_BUS', False)
+
+
+def bus_stream() -> str:
+    return getattr(django_settings, 'NAI_SECURITY_EVENT_BUS_STREAM', DEFAULT_STREAM)
+
+
+def get_bus_client():
+    """Redis client for the bus (NAI_SECURITY_EVENT_BUS_URL or NAI_SECURITY_REDIS_URL)."""
+    global _client
+    if _client is None:
+        try:
+            _client = redis_stream_client(getattr(django_settings, 'NAI_SECURITY_EVENT_BUS_URL', None))
+        except ImproperlyConfigured:
+            raise ImproperlyConfigured(
+                "NAI_SECURITY_EVENT_BUS needs NAI_SECURITY_EVENT_BUS_URL or NAI_SECURITY_REDIS_URL"
+            )
+    return _client
+
+
+def reset_bus_client() -> None:
+    global _client
+    _client = None
+
+
+def publish_events(events, system: bool = False) -> bool:
+    """
+    XADD unsaved SecurityLog instances to the bus, in one round-trip.
+    system marks AUTO_BLOCK_* style entries, which the auto_blocker consumer
+    does not count as attacks. Never raises: returns False if the events
+    could not be published, for the caller to write them directly instead.
+    """
+    maxlen = getattr(django_settings, 'NAI_SECURITY_EVENT_BUS_MAXLEN', DEFAULT_MAXLEN)
+    try:
+        client = get_bus_client()
+        pipe = client.pipeline(transaction=False)
+        for event in events:
+            record = event_record(event)
+            if system:
+                record['system'] = '1'
+            pipe.xadd(bus_stream(), record, maxlen=maxlen or None, approximate=True)
+        pipe.execute()
+    except Exception as e:
+        logger.error("Failed to publish %s security events, writing them directly: %s", len(events), e)
+        return False
+    return True
+
+
+def to_security_log(event: dict):
+    """A bus event back as an unsaved SecurityLog instance."""
+    from ..models import SecurityLog
+    return SecurityLog(
+        created_at=parse_datetime(event['created_at']),
+        **{field: event.get(field, '') for field in EVENT_FIELDS},
+    )
+
+
+class StreamConsumer:
+    """
+    One worker of a consumer group. run_once() processes one batch: entries
+    reclaimed from idle consumers first, otherwise new ones.
+    """
+
+    def __init__(self, client, stream, group, handler, consumer=None,
+                 batch_size=DEFAULT_BATCH_SIZE, block_ms=DEFAULT_BLOCK_MS,
+                 claim_idle_ms=DEFAULT_CLAIM_IDLE_MS, max_deliveries=DEFAULT_MAX_DELIVERIES):
+        self.client = client
+        self.stream = stream
+        self.group = group
+        self.handler = handler
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.max_deliveries = max_deliveries
+        self._claim_cursor = '0-0'
+        self._group_ready = False
+
+    def ensure_group(self) -> None:
+        """Create the group (and stream) if needed; a new group starts at the oldest entry."""
+        if self._group_ready:
+            return
+        try:
+            self.client.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+        except Exception as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self._group_ready = True
+
+    def run_once(self, block: bool = True) -> int:
+        """Process one batch; returns the number of entries acknowledged."""
+        self.ensure_group()
+        entries = self._claim()
+        if not entries:
+            response = self.client.xreadgroup(
+                self.group, self.consumer, {self.stream: '>'},
+                count=self.batch_size, block=self.block_ms if block else None,
+            )
+            entries = response[0][1] if response else []
+        if not entries:
+            return 0
+
+        ids = [entry_id for entry_id, _ in entries]
+        events = [{_text(k): _text(v) for k, v in fields.items()} for _, fields in entries]
+        close_old_connections()
+        try:
+            self.handler(events)
+        except Exception as e:
+            logger.error(
+                "Security event consumer %s failed on %s events, left pending: %s",
+                self.group, len(events), e,
+            )
+            return 0
+        self.client.xack(self.stream, self.group, *ids)
+        return len(ids)
+
+    def _claim(self) -> list:
+        """Take over entries idle longer than claim_idle_ms; drop those delivered too often."""
+        next_cursor, entries, *_ = self.client.xautoclaim(
+            self.stream, self.group, self.consumer, min_idle_time=self.claim_idle_ms,
+            start_id=self._claim_cursor, count=self.batch_size,
+        )
+        self._claim_cursor = _text(next_cursor)
+        entries = [entry for entry in entries if entry[1] is not None]
+        if not entries:
+            return []
+
+        pipe = self.client.pipeline(transaction=False)
+        for entry_id, _ in entries:
+            pipe.xpending_range(self.stream, self.group, min=entry_id, max=entry_id, count=1)
+        deliveries = {
+            _text(pending[0]['message_id']): pending[0]['times_delivered']
+            for pending in pipe.execute() if pending
+        }
+        poisoned = [entry_id for entry_id, _ in entries if deliveries.get(_text(entry_id), 0) > self.max_deliveries]
+        if poisoned:
+            self.client.xack(self.stream, self.group, *poisoned)
+            logger.error(
+                "Dropped %s security events after %s failed deliveries to %s",
+                len(poisoned), self.max_deliveries, self.group,
+            )
+        return [entry for entry in entries if entry[0] not in poisoned]
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+# Consumers
+
+
+_backends = None
+
+
+def write_logs(events) -> None:
+    """log_writer: hand the events to the configured log backends."""
+    global _backends
+    from .log_backends import build_log_backends
+    if _backends is None:
+        _backends = build_log_backends()
+    records = [to_security_log(event) for event in events]
+    for backend in _backends:
+        backend.emit(records)
+
+
+def block_offenders(events) -> None:
+    """
+    auto_blocker: count the attack events and check the IPs / countries seen,
+    all of them at once (AutoBlocker.check_offenders).
+    """
+    from .auto_blocker import AutoBlocker
+    from .event_counters import counters_enabled, get_event_counters
+
+    attacks = []
+    for event in events:
+        if event.get('system'):
+            continue
+        created_at = _event_time(event)
+        if created_at is None:
+            logger.warning("Skipped security event without a valid created_at: %r", event)
+            continue
+        attacks.append((event, created_at))
+    if counters_enabled():
+        counters = get_event_counters()
+        for event, created_at in attacks:
+            counters.record(event['ip_address'], event.get('country_code', ''), now=created_at.timestamp())
+    AutoBlocker.check_offenders(
+        {event['ip_address'] for event, _ in attacks if event.get('ip_address')},
+        {event['country_code'] for event, _ in attacks if event.get('country_code')},
+    )
+
+
+def _event_time(event: dict):
+    """The event's created_at, or None if it is missing or malformed."""
+    try:
+        return parse_datetime(event.get('created_at') or '')
+    except ValueError:
+        return None
+
+
+def roll_up(events) -> None:
+    """rollup: add the events to the hourly rollups."""
+    from .event_rollups import add_rollup_events
+    add_rollup_events([to_security_log(event) for event in events])
+
+
+def notify(events) -> None:
+    """notifier: one email per batch listing its auto-blocks and suspicious logins."""
+    from django.core.mail import send_mail
+    from ..models import SecuritySettings
+
+    settings = SecuritySettings.get_settings()
+    if not settings.notification_email:
+        return
+    actions = NOTIFY_ACTIONS if settings.notify_on_auto_block else ('SUSPICIOUS_LOGIN',)
+    notable = [event for event in events if event.get('action') in actions]
+    if not notable:
+        return
+    counts = Counter(event['action'] for event in notable)
+    send_mail(
+        subject="Security events: " + ", ".join(f"{count} {action}" for action, count in sorted(counts.items())),
+        message="\n".join(
+            f"{event['created_at']} {event['action']} {event['ip_address']} "
+            f"{event.get('country_code', '')} {event.get('details', '')}".rstrip()
+            for event in notable
+        ),
+        from_email=None,
+        recipient_list=[settings.notification_email],
+    )
+
+
+CONSUMERS = {
+    'log_writer': write_logs,
+    'auto_blocker': block_offenders,
+    'rollup': roll_up,
+    'notifier': notify,
+}
+
+
+def build_consumer(group: str, **options) -> StreamConsumer:
+    """A StreamConsumer for one of CONSUMERS, with defaults from the settings."""
+    if group not in CONSUMERS:
+        raise ValueError(f"Unknown security event consumer {group!r}; expected one of {', '.join(CONSUMERS)}")
+    defaults = {
+        'batch_size': getattr(django_settings, 'NAI_SECURITY_EVENT_BUS_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+        'claim_idle_ms': getattr(django_settings, 'NAI_SECURITY_EVENT_BUS_CLAIM_IDLE_MS', DEFAULT_CLAIM_IDLE_MS),
+        'max_deliveries': getattr(
+            django_settings, 'NAI_SECURITY_EVENT_BUS_MAX_DELIVERIES', DEFAULT_MAX_DELIVERIES,
+        ),
+    }
+    defaults.update({key: value for key, value in options.items() if value is not None})
+    return StreamConsumer(get_bus_client(), bus_stream(), group, CONSUMERS[group], **defaults)
@@ -0,0 +1,338 @@
+"""
+Time-bucketed security event counters for the AutoBlocker.
+
+With NAI_SECURITY_AUTO_BLOCK_COUNTERS = True, every SecurityLog event logged
+through SecurityLog.log_event / record_event also increments a per-IP and a
+per-country counter for the current bucket of
+NAI_SECURITY_AUTO_BLOCK_BUCKET_SECONDS (default 300). The number of events
+in a window is then the sum of the buckets it covers, read in one round-trip,
+and AutoBlocker.process_recent_events asks only for the IPs / countries over
+the threshold instead of scanning SecurityLog.
+
+NAI_SECURITY_AUTO_BLOCK_INLINE = True (which implies the counters) also reads
+the IP's window count back after each event and blocks the IP on the spot
+once it reaches auto_block_ip_threshold (AutoBlocker.check_inline).
+
+A window is rounded up to whole buckets, so a count may include up to one
+bucket of events older than the window. Buckets expire after
+NAI_SECURITY_AUTO_BLOCK_COUNTER_RETENTION_HOURS (default 48); windows longer
+than that only see the retained part. Counters live in the cache, so a cache
+flush resets them.
+
+With NAI_SECURITY_REDIS_URL set each bucket is a Redis sorted set
+(RedisEventCounters, one pipeline per event); otherwise the Django cache is
+used (CacheEventCounters), which needs a cache shared by all processes, such
+as Redis or Memcached, for the Celery worker to see the web workers' events.
+"""
+import logging
+import math
+import threading
+import time
+import uuid
+from typing import Iterable
+
+from asgiref.sync import sync_to_async
+from django.conf import settings as django_settings
+from django.core.cache import cache
+
+from ..utils import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKET_SECONDS = 300
+DEFAULT_RETENTION_HOURS = 48
+
+KEY_PREFIX = 'sec_ev'
+
+IP = 'ip'
+COUNTRY = 'cc'
+
+
+def inline_enabled() -> bool:
+    return getattr(django_settings, 'NAI_SECURITY_AUTO_BLOCK_INLINE', False)
+
+
+def counters_enabled() -> bool:
+    """
+    NAI_SECURITY_AUTO_BLOCK_COUNTERS, implied by NAI_SECURITY_AUTO_BLOCK_INLINE.
+
+    Cost per logged event: one Redis pipeline per dimension, or on the Django
+    cache an add (plus an incr once the key exists) per dimension. The first
+    event of an IP / country in a bucket also appends it to the bucket's index
+    for candidates(), for up to 5 cache round-trips on that event.
+    """
+    return getattr(django_settings, 'NAI_SECURITY_AUTO_BLOCK_COUNTERS', False) or inline_enabled()
+
+
+class EventCounters:
+    """
+    Base for the shared counters. Subclasses implement _incr(), _sum() and
+    _totals() over bucket indexes; dimension is IP or COUNTRY.
+    """
+
+    def __init__(self, bucket_seconds=DEFAULT_BUCKET_SECONDS, retention_hours=DEFAULT_RETENTION_HOURS):
+        self.bucket_seconds = max(1, int(bucket_seconds))
+        self.ttl = max(int(retention_hours * 3600), self.bucket_seconds) + self.bucket_seconds
+
+    def record(self, ip_address: str, country_code: str = '', amount: int = 1, now: float | None = None) -> None:
+        """Count `amount` events for an IP (and its country, if known)."""
+        index = self._index(now)
+        if ip_address:
+            self._incr(IP, ip_address, index, amount)
+        if country_code:
+            self._incr(COUNTRY, country_code, index, amount)
+
+    async def record_async(self, ip_address: str, country_code: str = '', amount: int = 1,
+                           now: float | None = None) -> None:
+        """Async version of record()."""
+        index = self._index(now)
+        if ip_address:
+            await self._incr_async(IP, ip_address, index, amount)
+        if country_code:
+            await self._incr_async(COUNTRY, country_code, index, amount)
+
+    def count(self, dimension: str, value: str, window_seconds: float, now: float | None = None) -> int:
+        """Events for one IP / country in the last window_seconds."""
+        return self.counts(dimension, [value], window_seconds, now).get(value, 0)
+
+    async def count_async(self, dimension: str, value: str, window_seconds: float, now: float | None = None) -> int:
+        """Async version of count()."""
+        totals = await self._sum_async(dimension, [value], self._indexes(window_seconds, now))
+        return totals.get(value, 0)
+
+    def counts(self, dimension: str, values: Iterable[str], window_seconds: float,
+               now: float | None = None) -> dict[str, int]:
+        """{value: events in the window} for each value."""
+        values = list(dict.fromkeys(values))
+        if not values:
+            return {}
+        return self._sum(dimension, values, self._indexes(window_seconds, now))
+
+    def candidates(self, dimension: str, window_seconds: float, threshold: int = 1,
+                   now: float | None = None) -> dict[str, int]:
+        """{value: events in the window} for every value with at least `threshold` events."""
+        return self._totals(dimension, self._indexes(window_seconds, now), max(1, threshold))
+
+    def _index(self, now=None) -> int:
+        return int((time.time() if now is None else now) // self.bucket_seconds)
+
+    def _indexes(self, window_seconds, now=None) -> range:
+        current = self._index(now)
+        buckets = max(1, math.ceil(window_seconds / self.bucket_seconds))
+        buckets = min(buckets, math.ceil(self.ttl / self.bucket_seconds))
+        return range(current - buckets + 1, current + 1)
+
+    def _incr(self, dimension, value, index, amount):
+        raise NotImplementedError
+
+    def _sum(self, dimension, values, indexes) -> dict[str, int]:
+        raise NotImplementedError
+
+    async def _incr_async(self, dimension, value, index, amount):
+        """_incr() in a pool thread, for counters without an async client."""
+        await sync_to_async(self._incr, thread_sensitive=False)(dimension, value, index, amount)
+
+    async def _sum_async(self, dimension, values, indexes) -> dict[str, int]:
+        return await sync_to_async(self._sum, thread_sensitive=False)(dimension, values, indexes)
+
+    def _totals(self, dimension, indexes, threshold) -> dict[str, int]:
+        raise NotImplementedError
+
+
+class CacheEventCounters(EventCounters):
+    """
+    Counters on the Django cache (add + incr), one key per value and bucket.
+    The values seen in a bucket are appended to an index (an incrementing slot
+    counter plus one key per slot) by whichever process counted the value's
+    first event there, so candidates() reads only the counters that exist.
+    """
+
+    @staticmethod
+    def _key(dimension, value, index) -> str:
+        return f"{KEY_PREFIX}:{dimension}:{value}:{index}"
+
+    def _incr(self, dimension, value, index, amount):
+        key = self._key(dimension, value, index)
+        if cache.add(key, amount, self.ttl):
+            total = amount
+        else:
+            try:
+                total = cache.incr(key, amount)
+            except ValueError:
+                cache.set(key, amount, self.ttl)
+                total = amount
+        if total == amount:
+            slot_key = f"{KEY_PREFIX}_n:{dimension}:{index}"
+            cache.add(slot_key, 0, self.ttl)
+            try:
+                slot = cache.incr(slot_key)
+            except ValueError:
+                cache.set(slot_key, 1, self.ttl)
+                slot = 1
+            cache.set(f"{KEY_PREFIX}_m:{dimension}:{index}:{slot}", value, self.ttl)
+
+    async def _incr_async(self, dimension, value, index, amount):
+        key = self._key(dimension, value, index)
+        if await cache.aadd(key, amount, self.ttl):
+            total = amount
+        else:
+            try:
+                total = await cache.aincr(key, amount)
+            except ValueError:
+                await cache.aset(key, amount, self.ttl)
+                total = amount
+        if total == amount:
+            slot_key = f"{KEY_PREFIX}_n:{dimension}:{index}"
+            await cache.aadd(slot_key, 0, self.ttl)
+            try:
+                slot = await cache.aincr(slot_key)
+            except ValueError:
+                await cache.aset(slot_key, 1, self.ttl)
+                slot = 1
+            await cache.aset(f"{KEY_PREFIX}_m:{dimension}:{index}:{slot}", value, self.ttl)
+
+    def _sum(self, dimension, values, indexes):
+        keys = {self._key(dimension, value, index): value for value in values for index in indexes}
+        return self._add_up(keys, dict.fromkeys(values, 0))
+
+    async def _sum_async(self, dimension, values, indexes):
+        keys = {self._key(dimension, value, index): value for value in values for index in indexes}
+        totals = dict.fromkeys(values, 0)
+        for key, count in (await cache.aget_many(list(keys))).items():
+            totals[keys[key]] += count or 0
+        return totals
+
+    def _totals(self, dimension, indexes, threshold):
+        slot_counts = cache.get_many([f"{KEY_PREFIX}_n:{dimension}:{index}" for index in indexes])
+        member_keys = {}
+        for key, count in slot_counts.items():
+            index = key.rsplit(':', 1)[1]
+            for slot in range(1, (count or 0) + 1):
+                member_keys[f"{KEY_PREFIX}_m:{dimension}:{index}:{slot}"] = index
+        keys = {
+            self._key(dimension, value, member_keys[member_key]): value
+            for member_key, value in cache.get_many(list(member_keys)).items()
+        } if member_keys else {}
+        totals = self._add_up(keys, {})
+        return {value: total for value, total in totals.items() if total >= threshold}
+
+    @staticmethod
+    def _add_up(keys: dict, totals: dict) -> dict:
+        for key, count in cache.get_many(list(keys)).items():
+            value = keys[key]
+            totals[value] = totals.get(value, 0) + (count or 0)
+        return totals
+
+
+class RedisEventCounters(EventCounters):
+    """
+    Counters in Redis: one sorted set per bucket, member = IP / country,
+    score = events (ZINCRBY, one pipeline per event). candidates() unions the
+    window's buckets server-side and returns only the members over the
+    threshold.
+    """
+
+    def __init__(self, client, **kwargs):
+        super().__init__(**kwargs)
+        self.client = client
+
+    @staticmethod
+    def _bucket_key(dimension, index) -> str:
+        return f"{KEY_PREFIX}:{dimension}:{index}"
+
+    def _incr(self, dimension, value, index, amount):
+        key = self._bucket_key(dimension, index)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.zincrby(key, amount, value)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def _sum(self, dimension, values, indexes):
+        pipe = self.client.pipeline(transaction=False)
+        for index in indexes:
+            pipe.zmscore(self._bucket_key(dimension, index), values)
+        totals = dict.fromkeys(values, 0)
+        for scores in pipe.execute():
+            for value, score in zip(values, scores):
+                totals[value] += int(score or 0)
+        return totals
+
+    def _totals(self, dimension, indexes, threshold):
+        union_key = f"{KEY_PREFIX}_u:{dimension}:{uuid.uuid4().hex}"
+        pipe = self.client.pipeline(transaction=False)
+        pipe.zunionstore(union_key, [self._bucket_key(dimension, index) for index in indexes])
+        pipe.zrangebyscore(union_key, threshold, '+inf', withscores=True)
+        pipe.delete(union_key)
+        _, members, _ = pipe.execute()
+        return {
+            (m.decode() if isinstance(m, bytes) else m): int(score)
+            for m, score in members
+        }
+
+
+_counters: EventCounters | None = None
+_counters_lock = threading.Lock()
+
+
+def get_event_counters() -> EventCounters:
+    """This process's counters: Redis when NAI_SECURITY_REDIS_URL is set, else the cache."""
+    global _counters
+    if _counters is None:
+        with _counters_lock:
+            if _counters is None:
+                options = dict(
+                    bucket_seconds=getattr(
+                        django_settings, 'NAI_SECURITY_AUTO_BLOCK_BUCKET_SECONDS', DEFAULT_BUCKET_SECONDS,
+                    ),
+                    retention_hours=getattr(
+                        django_settings, 'NAI_SECURITY_AUTO_BLOCK_COUNTER_RETENTION_HOURS',
+                        DEFAULT_RETENTION_HOURS,
+                    ),
+                )
+                client = get_redis_client()
+                if client is not None:
+                    _counters = RedisEventCounters(client, **options)
+                else:
+                    _counters = CacheEventCounters(**options)
+    return _counters
+
+
+def reset_event_counters() -> None:
+    global _counters
+    with _counters_lock:
+        _counters = None
+
+
+def record_security_event(ip_address: str, country_code: str = '') -> None:
+    """
+    Count one logged event, if counters are enabled, and in inline mode let
+    the AutoBlocker block the IP if this event took it over the threshold.
+    Never raises.
+    """
+    if not counters_enabled():
+        return
+    try:
+        counters = get_event_counters()
+        counters.record(ip_address, country_code)
+        if ip_address and inline_enabled():
+            from .auto_blocker import AutoBlocker
+            AutoBlocker.check_inline(ip_address, counters)
+    except Exception as e:
+        logger.error("Failed to count security event for %s: %s", ip_address, e)
+
+
+async def record_security_event_async(ip_address: str, country_code: str = '') -> None:
+    """
+    Async version of record_security_event(). The counters use the async
+    cache API; only an inline block that has to write leaves the event loop.
+    """
+    if not counters_enabled():
+        return
+    try:
+        counters = get_event_counters()
+        await counters.record_async(ip_address, country_code)
+        if ip_address and inline_enabled():
+            from .auto_blocker import AutoBlocker
+            await AutoBlocker.check_inline_async(ip_address, counters)
+    except Exception as e:
+        logger.error("Failed to count security event for %s: %s", ip_address, e)
@@ -0,0 +1,194 @@
+"""
+Hourly rollups of SecurityLog.
+
+rollup_security_events() (the rollup_security_events task, every few
+minutes) folds the SecurityLog rows past a watermark into
+SecurityEventRollup: one row per (hour, action, country_code, ip_address)
+with the number of events. Rows with a route (see path_normalizer) are also
+counted into SecurityRouteRollup, one row per (hour, route, action). Each run
+reads only the new log rows, in id batches of NAI_SECURITY_ROLLUP_BATCH_SIZE
+(default 10000), and advances the watermark in the same transaction as the
+counts.
+
+With NAI_SECURITY_EVENT_ROLLUPS = True, generate_security_report and
+AutoBlocker.process_recent_events (unless the event counters are on) read
+the rollups instead of scanning SecurityLog; process_recent_events catches
+the rollups up first. Windows are rounded out to whole hours.
+
+A batch ends before the first row younger than the log writer's flush
+interval plus NAI_SECURITY_ROLLUP_LAG_SECONDS (default 60), and the
+watermark stays there until that row is old enough: a buffered row carrying
+an earlier created_at, or a transaction that commits its row late, is still
+folded in as long as it lands within that lag. Rollups older than
+NAI_SECURITY_ROLLUP_RETENTION_DAYS (default 30) are deleted.
+"""
+import logging
+from collections import Counter
+from itertools import takewhile
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings as django_settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from ..models import RollupWatermark, SecurityEventRollup, SecurityLog, SecurityRouteRollup
+from ..utils import bulk_increment
+from .log_writer import DEFAULT_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 10000
+DEFAULT_LAG_SECONDS = 60
+DEFAULT_RETENTION_DAYS = 30
+
+WATERMARK = 'security_log'
+
+KEY_FIELDS = ('hour', 'action', 'country_code', 'ip_address')
+ROUTE_KEY_FIELDS = ('hour', 'route', 'action')
+
+
+def rollups_enabled() -> bool:
+    return getattr(django_settings, 'NAI_SECURITY_EVENT_ROLLUPS', False)
+
+
+def rollup_security_events(batch_size: int | None = None, lag_seconds: float | None = None) -> int:
+    """
+    Fold SecurityLog rows past the watermark into the hourly rollups, then
+    prune old rollups. Concurrent runs queue on the watermark row lock.
+    Returns the number of log rows folded in.
+    """
+    if batch_size is None:
+        batch_size = getattr(django_settings, 'NAI_SECURITY_ROLLUP_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    if lag_seconds is None:
+        lag_seconds = getattr(django_settings, 'NAI_SECURITY_ROLLUP_LAG_SECONDS', DEFAULT_LAG_SECONDS)
+    # Buffered rows reach the table up to one flush interval after their created_at.
+    flush_interval = getattr(django_settings, 'NAI_SECURITY_LOG_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+    horizon = timezone.now() - timedelta(seconds=flush_interval + lag_seconds)
+    RollupWatermark.objects.get_or_create(name=WATERMARK)
+
+    folded = 0
+    while True:
+        with transaction.atomic():
+            watermark = RollupWatermark.objects.select_for_update().get(name=WATERMARK)
+            ahead = SecurityLog.objects.filter(
+                pk__gt=watermark.last_id,
+            ).order_by('pk').values_list('pk', 'created_at')[:batch_size]
+            ids = [pk for pk, created_at in takewhile(lambda row: row[1] < horizon, ahead)]
+            if not ids:
+                break
+            rows = SecurityLog.objects.filter(
+                pk__gt=watermark.last_id, pk__lte=ids[-1], created_at__lt=horizon,
+            ).annotate(hour=TruncHour('created_at', tzinfo=dt_timezone.utc))
+            groups = rows.values(*KEY_FIELDS).annotate(events=Count('id'))
+            folded += _add_counts({tuple(g[f] for f in KEY_FIELDS): g['events'] for g in groups})
+            routes = rows.exclude(route='').values(*ROUTE_KEY_FIELDS).annotate(events=Count('id'))
+            _add_route_counts({tuple(g[f] for f in ROUTE_KEY_FIELDS): g['events'] for g in routes})
+            watermark.last_id = ids[-1]
+            watermark.save(update_fields=['last_id', 'updated_at'])
+
+    retention_days = getattr(django_settings, 'NAI_SECURITY_ROLLUP_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+    if retention_days:
+        cutoff = timezone.now() - timedelta(days=retention_days)
+        SecurityEventRollup.objects.filter(hour__lt=cutoff).delete()
+        SecurityRouteRollup.objects.filter(hour__lt=cutoff).delete()
+    if folded:
+        logger.info("Rolled up %s security events", folded)
+    return folded
+
+
+def _add_counts(counts: dict) -> int:
+    """
+    Add {(hour, action, country_code, ip_address): events} onto the stored
+    rollups, in the database. Returns the number of events added.
+    """
+    bulk_increment(SecurityEventRollup, counts, list(KEY_FIELDS), 'count')
+    return sum(counts.values())
+
+
+def _add_route_counts(counts: dict) -> None:
+    """Add {(hour, route, action): events} onto the stored route rollups."""
+    if counts:
+        bulk_increment(SecurityRouteRollup, counts, list(ROUTE_KEY_FIELDS), 'count')
+
+
+def add_rollup_events(events) -> int:
+    """
+    Add SecurityLog instances (saved or not) to the rollups directly, for the
+    event bus rollup consumer. The counts are added in the database in one
+    transaction, so consumers running side by side (or alongside
+    rollup_security_events) do not overwrite each other. Returns the number of
+    events added.
+    """
+    counts = Counter(
+        (_hour_floor(event.created_at), event.action, event.country_code or '', event.ip_address)
+        for event in events
+    )
+    if not counts:
+        return 0
+    with transaction.atomic():
+        _add_route_counts(dict(Counter(
+            (_hour_floor(event.created_at), event.route, event.action) for event in events if event.route
+        )))
+        return _add_counts(dict(counts))
+
+
+def _hour_floor(moment: datetime) -> datetime:
+    return moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def rollups_since(since: datetime):
+    """Rollup rows for the hours overlapping [since, now]."""
+    return SecurityEventRollup.objects.filter(hour__gte=_hour_floor(since))
+
+
+def rollup_totals(field: str, since: datetime, threshold: int = 1, exclude=None) -> dict:
+    """
+    {ip_address / country_code: events since `since`} for the values with at
+    least `threshold` events, leaving out `exclude` (values or a subquery).
+    """
+    rows = rollups_since(since)
+    if field == 'country_code':
+        rows = rows.exclude(country_code='')
+    if exclude is not None:
+        rows = rows.exclude(**{f"{field}__in": exclude})
+    return dict(rows.values(field).annotate(
+        total=Sum('count'),
+    ).filter(total__gte=threshold).values_list(field, 'total'))
+
+
+def rollup_top_routes(since: datetime, limit: int = 10) -> list:
+    """[{'route', 'count'}] for the most targeted routes since `since`."""
+    return list(
+        SecurityRouteRollup.objects.filter(hour__gte=_hour_floor(since))
+        .values('route').annotate(count=Sum('count')).order_by('-count')[:limit]
+    )
+
+
+def rollup_count(field: str, value: str, since: datetime) -> int:
+    """Events for one IP / country since `since`."""
+    return rollups_since(since).filter(**{field: value}).aggregate(total=Sum('count'))['total'] or 0
+
+
+def rollup_counts(field: str, values, since: datetime) -> dict:
+    """{ip_address / country_code: events since `since`} for each of `values` with events."""
+    return dict(rollups_since(since).filter(**{f"{field}__in": list(values)}).values(field).annotate(
+        total=Sum('count'),
+    ).values_list(field, 'total'))
+
+
+def rollup_report(since: datetime) -> dict:
+    """The SecurityLog part of generate_security_report, from the rollups."""
+    rows = rollups_since(since)
+    return {
+        'total_blocks': rows.aggregate(total=Sum('count'))['total'] or 0,
+        'blocks_by_action': dict(rows.values_list('action').annotate(count=Sum('count'))),
+        'top_blocked_ips': list(
+            rows.values('ip_address').annotate(count=Sum('count')).order_by('-count')[:10]
+        ),
+        'top_blocked_countries': list(
+            rows.exclude(country_code='').values('country_code').annotate(count=Sum('count')).order_by('-count')[:10]
+        ),
+        'top_targeted_routes': rollup_top_routes(since),
+    }
@@ -0,0 +1,244 @@
+"""
+Flattened GeoIP country database for bulk lookups.
+
+CountryRangeTable walks the GeoLite2 Country tree once and keeps, per address
+family, a sorted array of range starts plus a parallel array of country
+indexes (adjacent networks of the same country merged, gaps mapped to None).
+Resolving an address is then one binary search on its integer value, with no
+reader call or cache traffic, which is what reports, backfills and replays
+over millions of addresses need.
+
+get_countries_for_ips() resolves a batch with it. With NumPy installed, IPv4
+batches of BULK_NUMPY_THRESHOLD addresses or more go through one vectorized
+searchsorted; otherwise (and for IPv6, whose 128-bit values NumPy cannot hold)
+each address is a bisect on the arrays.
+
+The table is rebuilt when the .mmdb file changes (same inode/mtime/size check
+as the request-path reader).
+"""
+import ipaddress
+import logging
+import socket
+import threading
+from array import array
+from bisect import bisect_right
+from typing import Iterable, Iterator
+
+from django.conf import settings as django_settings
+
+from ..utils import _geoip_file_identity, _geoip_open_mode, resolve_geoip_db_path
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+BULK_NUMPY_THRESHOLD = 1024
+
+
+class _FamilyRanges:
+    """Sorted range starts and country indexes for one address family."""
+
+    __slots__ = ('starts', 'codes', '_np_starts')
+
+    def __init__(self, starts, codes):
+        self.starts = starts
+        self.codes = codes
+        self._np_starts = None
+
+    def index_of(self, value: int) -> int:
+        """Country index for an integer address (0 = unknown)."""
+        pos = bisect_right(self.starts, value) - 1
+        return self.codes[pos] if pos >= 0 else 0
+
+    def np_starts(self):
+        if self._np_starts is None:
+            self._np_starts = numpy.frombuffer(self.starts, dtype=numpy.uint32)
+        return self._np_starts
+
+
+class CountryRangeTable:
+    """Immutable country-per-range view of one GeoIP Country database file."""
+
+    def __init__(self, ranges: Iterable[tuple[int, int, int, str | None]], file_id=None):
+        """
+        ranges: (version, first, last, country_code) for each network, sorted by
+        (version, first) and non-overlapping, as produced by iterating a MaxMind
+        DB reader.
+        """
+        self.file_id = file_id
+        self.country_codes: list[str | None] = [None]
+        code_index: dict[str | None, int] = {None: 0}
+        built = {4: (array('I'), array('H')), 6: ([], array('H'))}
+        ends = {4: -1, 6: -1}
+        for version, first, last, country_code in ranges:
+            starts, codes = built[version]
+            idx = code_index.get(country_code)
+            if idx is None:
+                idx = code_index[country_code] = len(self.country_codes)
+                self.country_codes.append(country_code)
+            if first > ends[version] + 1:
+                # Gap since the previous network: no country.
+                starts.append(ends[version] + 1)
+                codes.append(0)
+            if not codes or codes[-1] != idx:
+                starts.append(first)
+                codes.append(idx)
+            ends[version] = last
+        for version, (starts, codes) in built.items():
+            max_value = (1 << 32) - 1 if version == 4 else (1 << 128) - 1
+            if ends[version] < max_value:
+                starts.append(ends[version] + 1)
+                codes.append(0)
+        self._v4 = _FamilyRanges(*built[4])
+        self._v6 = _FamilyRanges(*built[6])
+
+    @classmethod
+    def from_reader(cls, reader, file_id=None) -> 'CountryRangeTable':
+        """Build from a maxminddb reader (anything iterating (network, record))."""
+        def ranges():
+            for network, record in reader:
+                country = (record or {}).get('country') or {}
+                yield (
+                    network.version,
+                    int(network.network_address),
+                    int(network.broadcast_address),
+                    country.get('iso_code'),
+                )
+        return cls(ranges(), file_id=file_id)
+
+    @classmethod
+    def from_file(cls, path: str) -> 'CountryRangeTable':
+        import maxminddb
+
+        file_id = _geoip_file_identity(path)
+        reader = maxminddb.open_database(path, _geoip_open_mode())
+        try:
+            return cls.from_reader(reader, file_id=file_id)
+        finally:
+            reader.close()
+
+    def __len__(self) -> int:
+        return len(self._v4.starts) + len(self._v6.starts)
+
+    def lookup(self, ip_address: str) -> str | None:
+        """Country code for one address, or None (unknown or invalid)."""
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return None
+        return self._lookup_address(address)
+
+    def _lookup_address(self, address) -> str | None:
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        family = self._v4 if address.version == 4 else self._v6
+        return self.country_codes[family.index_of(int(address))]
+
+    def lookup_many(self, ip_addresses: Iterable[str]) -> dict[str, str | None]:
+        """{ip: country code or None} for each distinct address."""
+        result: dict[str, str | None] = {}
+        v4_ips, v4_values = [], []
+        inet_pton, AF_INET = socket.inet_pton, socket.AF_INET
+        for ip in ip_addresses:
+            if ip in result:
+                continue
+            try:
+                # Fast path for dotted-quad IPv4, the bulk of any log.
+                v4_values.append(int.from_bytes(inet_pton(AF_INET, ip), 'big'))
+            except (OSError, TypeError):
+                pass
+            else:
+                result[ip] = None  # placeholder keeps first-seen order
+                v4_ips.append(ip)
+                continue
+            try:
+                address = ipaddress.ip_address(ip)
+            except ValueError:
+                result[ip] = None
+                continue
+            if address.version == 6 and address.ipv4_mapped is not None:
+                address = address.ipv4_mapped
+            if address.version == 4:
+                result[ip] = None  # placeholder keeps first-seen order
+                v4_ips.append(ip)
+                v4_values.append(int(address))
+            else:
+                result[ip] = self.country_codes[self._v6.index_of(int(address))]
+
+        codes = self.country_codes
+        if numpy is not None and len(v4_values) >= BULK_NUMPY_THRESHOLD:
+            values = numpy.fromiter(v4_values, dtype=numpy.uint32, count=len(v4_values))
+            positions = numpy.searchsorted(self._v4.np_starts(), values, side='right') - 1
+            indexes = numpy.frombuffer(self._v4.codes, dtype=numpy.uint16)[positions]
+            for ip, idx in zip(v4_ips, indexes.tolist()):
+                result[ip] = codes[idx]
+        else:
+            index_of = self._v4.index_of
+            for ip, value in zip(v4_ips, v4_values):
+                result[ip] = codes[index_of(value)]
+        return result
+
+    def iter_ranges(self, version: int) -> Iterator[tuple[int, int, str | None]]:
+        """(first, last, country_code) for every range of one family, in order."""
+        family = self._v4 if version == 4 else self._v6
+        max_value = (1 << 32) - 1 if version == 4 else (1 << 128) - 1
+        starts, codes = family.starts, family.codes
+        for i, first in enumerate(starts):
+            last = starts[i + 1] - 1 if i + 1 < len(starts) else max_value
+            yield first, last, self.country_codes[codes[i]]
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def get_country_range_table() -> CountryRangeTable | None:
+    """
+    This process's table for GEOIP_PATH, built on first use and rebuilt when the
+    file changes. None if the database is missing or cannot be read.
+    """
+    global _table
+    path = resolve_geoip_db_path(getattr(django_settings, 'GEOIP_PATH', None))
+    if not path:
+        return None
+    try:
+        file_id = _geoip_file_identity(path)
+    except OSError:
+        logger.error(f"GeoIP database not found at {path}")
+        return None
+
+    table = _table
+    if table is not None and table.file_id == file_id:
+        return table
+    with _table_lock:
+        if _table is not None and _table.file_id == file_id:
+            return _table
+        try:
+            _table = CountryRangeTable.from_file(path)
+        except Exception as e:
+            logger.error(f"Failed to build GeoIP range table: {e}")
+            return _table
+        logger.info(f"GeoIP range table built from {path}: {len(_table)} ranges")
+        return _table
+
+
+def reset_country_range_table() -> None:
+    global _table
+    with _table_lock:
+        _table = None
+
+
+def get_countries_for_ips(ip_addresses: Iterable[str]) -> dict[str, str | None]:
+    """
+    Resolve many addresses at once: {ip: country code or None} per distinct ip.
+
+    Uses the flattened range table; without a readable database every address
+    maps to None.
+    """
+    table = get_country_range_table()
+    if table is None:
+        return dict.fromkeys(ip_addresses)
+    return table.lookup_many(ip_addresses)
@@ -0,0 +1,80 @@
+"""
+Longest-prefix-match index for IPv4/IPv6 networks.
+
+Each network is stored once, in a hash table for its prefix length. A lookup
+masks the address once per prefix length present in the index, longest first,
+so it is bounded by the address width (32/128) and in practice by the handful
+of distinct lengths in use (/32, /24, /64 ...). A single address is simply a
+/32 or /128 entry.
+"""
+import ipaddress
+from typing import Any, Iterable, Iterator
+
+_MISSING = object()
+
+
+def parse_ip(ip_address) -> ipaddress.IPv4Address | ipaddress.IPv6Address | None:
+    """Parse an address, unwrapping IPv4-mapped IPv6. Returns None if invalid."""
+    try:
+        ip = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return None
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        return ip.ipv4_mapped
+    return ip
+
+
+class IPNetworkIndex:
+    """Immutable prefix index mapping networks to arbitrary values."""
+
+    __slots__ = ('_tables', '_size')
+
+    def __init__(self, entries: Iterable[tuple[Any, Any]] = ()):
+        """entries: (network, value) pairs; network is a CIDR string, address or ip_network."""
+        tables: dict[int, dict[int, dict[int, Any]]] = {4: {}, 6: {}}
+        size = 0
+        for network, value in entries:
+            try:
+                net = ipaddress.ip_network(network, strict=False)
+            except ValueError:
+                continue
+            by_length = tables[net.version].setdefault(net.prefixlen, {})
+            key = int(net.network_address) >> (net.max_prefixlen - net.prefixlen)
+            if key not in by_length:
+                size += 1
+            by_length[key] = value
+        self._tables = {
+            version: tuple(sorted(by_length.items(), reverse=True))
+            for version, by_length in tables.items()
+        }
+        self._size = size
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __bool__(self) -> bool:
+        return self._size > 0
+
+    def __contains__(self, ip_address) -> bool:
+        return next(self.iter_matches(ip_address), _MISSING) is not _MISSING
+
+    def iter_matches(self, ip_address) -> Iterator[Any]:
+        """Yield values of every network containing ip_address, longest prefix first."""
+        if not self._size:
+            return
+        ip = ip_address if isinstance(ip_address, (ipaddress.IPv4Address, ipaddress.IPv6Address)) \
+            else parse_ip(ip_address)
+        if ip is None:
+            return
+        if ip.version == 6 and ip.ipv4_mapped is not None:
+            ip = ip.ipv4_mapped
+        value = int(ip)
+        width = ip.max_prefixlen
+        for prefix_length, by_network in self._tables[ip.version]:
+            key = value >> (width - prefix_length)
+            if key in by_network:
+                yield by_network[key]
+
+    def lookup(self, ip_address, default=None):
+        """Value of the longest matching network, or default."""
+        return next(self.iter_matches(ip_address), default)
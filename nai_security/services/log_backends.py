@@ -0,0 +1,254 @@
+"""
+Sinks for security events.
+
+NAI_SECURITY_LOG_BACKENDS lists where SecurityLog events are sent. Each entry
+is a backend name, a dotted class path, or a dict
+{'BACKEND': name_or_path, 'OPTIONS': {...}} whose options are passed to the
+class:
+
+- 'database': bulk_create into SecurityLog (the default when the setting is
+  unset).
+- 'jsonl': one JSON object per line in a size-rotated file; one write and one
+  fsync per batch. Options: path (required), max_bytes (default 100 MB),
+  backup_count (default 5), fsync (default True). Several processes may share
+  one path (see JSONLFileBackend).
+- 'syslog': one JSON message per event via logging's SysLogHandler. Options:
+  address (default '/dev/log'; a (host, port) tuple for UDP), facility
+  (default 'local0'), tag (default 'nai_security').
+- 'redis': XADD to a Redis Stream trimmed with MAXLEN. Options: stream
+  (default 'nai_security:events'), maxlen (default 100000), approximate
+  (default True, MAXLEN ~), url (default NAI_SECURITY_REDIS_URL).
+
+With the setting present, the log writer fans every batch out to all of the
+backends from its background thread (see log_writer.BufferedLogWriter), so
+the request never waits for any of them. Without 'database' in the list no
+SecurityLog rows are written; point NAI_SECURITY_LOG_READER at a backend that
+can be read back (see log_readers).
+
+A backend is any object with emit(events) and close(); events is a list of
+unsaved SecurityLog instances.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+
+from django.conf import settings as django_settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+EVENT_FIELDS = (
+    'ip_address', 'country_code', 'action', 'severity', 'path', 'route',
+    'method', 'user_agent', 'details', 'user_email',
+)
+
+SYSLOG_LEVELS = {
+    'low': logging.INFO,
+    'medium': logging.WARNING,
+    'high': logging.ERROR,
+    'critical': logging.CRITICAL,
+}
+
+DEFAULT_STREAM = 'nai_security:events'
+DEFAULT_STREAM_MAXLEN = 100000
+
+
+def event_record(event) -> dict:
+    """A SecurityLog instance as a flat dict of strings, for the non-database sinks."""
+    record = {field: getattr(event, field) or '' for field in EVENT_FIELDS}
+    record['created_at'] = (event.created_at or timezone.now()).isoformat()
+    return record
+
+
+class DatabaseBackend:
+    """bulk_create into SecurityLog."""
+
+    name = 'database'
+
+    def __init__(self, batch_size=500):
+        self.batch_size = batch_size
+
+    def emit(self, events) -> None:
+        from ..models import SecurityLog
+        from .user_agents import resolve_user_agents
+        resolve_user_agents(events)
+        SecurityLog.objects.bulk_create(events, batch_size=self.batch_size)
+
+    def close(self) -> None:
+        pass
+
+
+class JSONLFileBackend:
+    """
+    Appends events as JSON lines. The file is rotated to path.1 ... path.N
+    once it grows past max_bytes; each batch is one write() and, with fsync,
+    one os.fsync().
+
+    Each batch opens path, takes an exclusive flock on it and checks that path
+    still names the file it opened, so the web workers of several processes
+    can share one path: a batch never lands in a file another process has just
+    rotated away, and only one process rotates. Without fcntl (Windows) give
+    each process its own path.
+    """
+
+    name = 'jsonl'
+
+    def __init__(self, path=None, max_bytes=100 * 1024 * 1024, backup_count=5, fsync=True):
+        if not path:
+            raise ImproperlyConfigured("The 'jsonl' log backend needs a 'path' option")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.fsync = fsync
+        self._lock = threading.Lock()
+
+    def emit(self, events) -> None:
+        data = ''.join(json.dumps(event_record(event)) + '\n' for event in events).encode()
+        with self._lock:
+            while not self._append(data):
+                pass
+
+    def _append(self, data: bytes) -> bool:
+        """Write data to the current file; False if it must be reopened first."""
+        with open(self.path, 'ab') as file:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            opened = os.fstat(file.fileno())
+            try:
+                current = os.stat(self.path)
+            except FileNotFoundError:
+                return False
+            if (current.st_dev, current.st_ino) != (opened.st_dev, opened.st_ino):
+                return False  # rotated by another process since the open
+            if self.max_bytes and opened.st_size and opened.st_size + len(data) > self.max_bytes:
+                self._rotate()
+                return False
+            file.write(data)
+            file.flush()
+            if self.fsync:
+                os.fsync(file.fileno())
+        return True
+
+    def _rotate(self) -> None:
+        """Shift path.1 ... path.N along and move path to path.1. Call with path locked."""
+        if self.backup_count:
+            for i in range(self.backup_count - 1, 0, -1):
+                source = f"{self.path}.{i}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def close(self) -> None:
+        pass
+
+
+class SyslogBackend:
+    """One syslog message per event, at a level following its severity."""
+
+    name = 'syslog'
+
+    def __init__(self, address='/dev/log', facility='local0', tag='nai_security'):
+        if isinstance(address, list):
+            address = tuple(address)
+        self.tag = tag
+        self._handler = logging.handlers.SysLogHandler(
+            address=address,
+            facility=logging.handlers.SysLogHandler.facility_names[facility],
+        )
+
+    def emit(self, events) -> None:
+        for event in events:
+            self._handler.handle(logging.makeLogRecord({
+                'name': self.tag,
+                'levelno': SYSLOG_LEVELS.get(event.severity, logging.WARNING),
+                'levelname': logging.getLevelName(SYSLOG_LEVELS.get(event.severity, logging.WARNING)),
+                'msg': f"{self.tag}: {json.dumps(event_record(event))}",
+            }))
+
+    def close(self) -> None:
+        self._handler.close()
+
+
+class RedisStreamBackend:
+    """XADD per event in one pipeline, trimming the stream to maxlen entries."""
+
+    name = 'redis'
+
+    def __init__(self, stream=DEFAULT_STREAM, maxlen=DEFAULT_STREAM_MAXLEN, approximate=True,
+                 url=None, client=None):
+        self.stream = stream
+        self.maxlen = maxlen
+        self.approximate = approximate
+        self.client = client or redis_stream_client(url)
+
+    def emit(self, events) -> None:
+        pipe = self.client.pipeline(transaction=False)
+        for event in events:
+            pipe.xadd(self.stream, event_record(event), maxlen=self.maxlen or None,
+                      approximate=self.approximate)
+        pipe.execute()
+
+    def close(self) -> None:
+        pass
+
+
+def redis_stream_client(url=None):
+    """Client for url, or the shared NAI_SECURITY_REDIS_URL client."""
+    if url:
+        import redis
+        return redis.Redis.from_url(url)
+    from ..utils import get_redis_client
+    client = get_redis_client()
+    if client is None:
+        raise ImproperlyConfigured(
+            "The 'redis' log backend needs a 'url' option or NAI_SECURITY_REDIS_URL"
+        )
+    return client
+
+
+BACKENDS = {
+    'database': DatabaseBackend,
+    'jsonl': JSONLFileBackend,
+    'syslog': SyslogBackend,
+    'redis': RedisStreamBackend,
+}
+
+
+def log_backends_configured() -> bool:
+    return getattr(django_settings, 'NAI_SECURITY_LOG_BACKENDS', None) is not None
+
+
+def backend_options(name: str) -> dict:
+    """OPTIONS of the first NAI_SECURITY_LOG_BACKENDS entry for backend `name`."""
+    for entry in getattr(django_settings, 'NAI_SECURITY_LOG_BACKENDS', None) or ():
+        if isinstance(entry, dict) and entry.get('BACKEND') == name:
+            return dict(entry.get('OPTIONS') or {})
+    return {}
+
+
+def build_log_backends(config=None) -> list:
+    """Instantiate NAI_SECURITY_LOG_BACKENDS (or `config`); ['database'] when unset."""
+    if config is None:
+        config = getattr(django_settings, 'NAI_SECURITY_LOG_BACKENDS', None)
+    if config is None:
+        config = ['database']
+    backends = []
+    for entry in config:
+        if isinstance(entry, dict):
+            name, options = entry['BACKEND'], entry.get('OPTIONS') or {}
+        else:
+            name, options = entry, {}
+        backend_class = BACKENDS.get(name) or import_string(name)
+        backends.append(backend_class(**options))
+    return backends
@@ -0,0 +1,195 @@
+"""
+Read access to security events, independent of where they are stored.
+
+AutoBlocker and generate_security_report ask get_log_reader() for event counts
+instead of querying SecurityLog. NAI_SECURITY_LOG_READER selects:
+
+- 'database': SecurityLog (the default).
+- 'rollups': the hourly SecurityEventRollup counts (the default when
+  NAI_SECURITY_EVENT_ROLLUPS is on); windows are rounded out to whole hours.
+- 'redis': the Redis Stream written by the 'redis' log backend, for
+  deployments that do not write SecurityLog. Each read scans the stream
+  entries in the window, so keep the stream bounded with MAXLEN.
+- a dotted class path, or {'READER': name_or_path, 'OPTIONS': {...}}.
+
+A reader implements:
+    refresh()                                  bring derived data up to date
+    count(field, value, since) -> int          events for one IP / country
+    counts(field, values, since) -> dict       {value: events} for several
+    totals(field, since, threshold, exclude)   {value: events} over threshold
+    report(since) -> dict                      the report's event statistics
+field is 'ip_address' or 'country_code'; exclude is an iterable (or a
+values_list() queryset) of values to leave out.
+"""
+from collections import Counter
+from datetime import datetime
+
+from django.conf import settings as django_settings
+from django.db.models import Count
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+
+from ..models import SecurityLog
+from . import event_rollups
+from .log_backends import DEFAULT_STREAM, backend_options, redis_stream_client
+
+TOP_N = 10
+
+
+class DatabaseLogReader:
+    """Aggregate queries over SecurityLog."""
+
+    def refresh(self) -> None:
+        pass
+
+    def count(self, field: str, value: str, since: datetime) -> int:
+        return SecurityLog.objects.filter(created_at__gte=since, **{field: value}).count()
+
+    def counts(self, field: str, values, since: datetime) -> dict:
+        return dict(SecurityLog.objects.filter(
+            created_at__gte=since, **{f"{field}__in": list(values)},
+        ).values(field).annotate(count=Count('id')).values_list(field, 'count'))
+
+    def totals(self, field: str, since: datetime, threshold: int = 1, exclude=None) -> dict:
+        rows = SecurityLog.objects.filter(created_at__gte=since)
+        if field == 'country_code':
+            rows = rows.exclude(country_code='')
+        if exclude is not None:
+            rows = rows.exclude(**{f"{field}__in": exclude})
+        return dict(rows.values(field).annotate(
+            count=Count('id'),
+        ).filter(count__gte=threshold).values_list(field, 'count'))
+
+    def report(self, since: datetime) -> dict:
+        rows = SecurityLog.objects.filter(created_at__gte=since)
+        return {
+            'total_blocks': rows.count(),
+            'blocks_by_action': dict(rows.values_list('action').annotate(count=Count('id'))),
+            'top_blocked_ips': list(
+                rows.values('ip_address').annotate(count=Count('id')).order_by('-count')[:TOP_N]
+            ),
+            'top_blocked_countries': list(
+                rows.exclude(country_code='').values('country_code')
+                .annotate(count=Count('id')).order_by('-count')[:TOP_N]
+            ),
+            'top_targeted_routes': list(
+                rows.exclude(route='').values('route')
+                .annotate(count=Count('id')).order_by('-count')[:TOP_N]
+            ),
+        }
+
+
+class RollupLogReader:
+    """The hourly rollups; refresh() folds in the log rows written since the last run."""
+
+    def refresh(self) -> None:
+        event_rollups.rollup_security_events()
+
+    def count(self, field: str, value: str, since: datetime) -> int:
+        return event_rollups.rollup_count(field, value, since)
+
+    def counts(self, field: str, values, since: datetime) -> dict:
+        return event_rollups.rollup_counts(field, values, since)
+
+    def totals(self, field: str, since: datetime, threshold: int = 1, exclude=None) -> dict:
+        return event_rollups.rollup_totals(field, since, threshold, exclude=exclude)
+
+    def report(self, since: datetime) -> dict:
+        return event_rollups.rollup_report(since)
+
+
+class RedisStreamLogReader:
+    """
+    Scans the entries of the 'redis' backend's stream that were added since
+    the start of the window (stream ids are millisecond timestamps), in
+    XRANGE pages of `page_size`. Options default to that backend's.
+    """
+
+    def __init__(self, stream=None, url=None, client=None, page_size=1000):
+        options = backend_options('redis')
+        self.stream = stream or options.get('stream', DEFAULT_STREAM)
+        self.client = client or redis_stream_client(url or options.get('url'))
+        self.page_size = page_size
+
+    def refresh(self) -> None:
+        pass
+
+    def _events(self, since: datetime):
+        start = f"{int(since.timestamp() * 1000)}-0"
+        while True:
+            page = self.client.xrange(self.stream, min=start, max='+', count=self.page_size)
+            for entry_id, fields in page:
+                event = {_text(k): _text(v) for k, v in fields.items()}
+                created_at = parse_datetime(event.get('created_at', ''))
+                if created_at is None or created_at >= since:
+                    yield event
+            if len(page) < self.page_size:
+                return
+            start = f"({_text(page[-1][0])}"
+
+    def _counter(self, field: str, since: datetime) -> Counter:
+        return Counter(event.get(field, '') for event in self._events(since))
+
+    def count(self, field: str, value: str, since: datetime) -> int:
+        return sum(1 for event in self._events(since) if event.get(field) == value)
+
+    def counts(self, field: str, values, since: datetime) -> dict:
+        wanted = set(values)
+        return {value: count for value, count in self._counter(field, since).items() if value in wanted}
+
+    def totals(self, field: str, since: datetime, threshold: int = 1, exclude=None) -> dict:
+        excluded = set(exclude) if exclude is not None else set()
+        return {
+            value: count for value, count in self._counter(field, since).items()
+            if value and count >= threshold and value not in excluded
+        }
+
+    def report(self, since: datetime) -> dict:
+        ips: Counter[str] = Counter()
+        countries: Counter[str] = Counter()
+        actions: Counter[str] = Counter()
+        routes: Counter[str] = Counter()
+        for event in self._events(since):
+            ips[event.get('ip_address', '')] += 1
+            actions[event.get('action', '')] += 1
+            if event.get('country_code'):
+                countries[event['country_code']] += 1
+            if event.get('route'):
+                routes[event['route']] += 1
+        return {
+            'total_blocks': sum(actions.values()),
+            'blocks_by_action': dict(actions),
+            'top_blocked_ips': [
+                {'ip_address': ip, 'count': count} for ip, count in ips.most_common(TOP_N)
+            ],
+            'top_blocked_countries': [
+                {'country_code': code, 'count': count} for code, count in countries.most_common(TOP_N)
+            ],
+            'top_targeted_routes': [
+                {'route': route, 'count': count} for route, count in routes.most_common(TOP_N)
+            ],
+        }
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+READERS = {
+    'database': DatabaseLogReader,
+    'rollups': RollupLogReader,
+    'redis': RedisStreamLogReader,
+}
+
+
+def get_log_reader():
+    """The reader selected by NAI_SECURITY_LOG_READER (see the module docstring)."""
+    config = getattr(django_settings, 'NAI_SECURITY_LOG_READER', None)
+    if config is None:
+        config = 'rollups' if event_rollups.rollups_enabled() else 'database'
+    if isinstance(config, dict):
+        name, options = config['READER'], config.get('OPTIONS') or {}
+    else:
+        name, options = config, {}
+    reader_class = READERS.get(name) or import_string(name)
+    return reader_class(**options)
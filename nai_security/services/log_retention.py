@@ -0,0 +1,320 @@
+"""
+SecurityLog retention.
+
+SecuritySettings.security_log_retention_days (0 = keep forever) sets how long
+SecurityLog rows are kept. purge_security_logs() (the purge_security_logs
+task and management command) deletes older rows in primary-key batches of
+NAI_SECURITY_LOG_PURGE_BATCH_SIZE (default 5000). Each batch is its own short
+DELETE, so no statement locks more than one batch of rows. The
+UserAgentString rows (see services.user_agents) left without a log or login
+row are deleted afterwards, in batches of the same size.
+
+On PostgreSQL the table can also be range-partitioned on created_at, one
+partition per day or week (NAI_SECURITY_LOG_PARTITIONING = 'day' / 'week').
+The partition_security_log command converts the existing table once. After
+that, ensure_log_partitions() keeps NAI_SECURITY_LOG_PARTITIONS_AHEAD
+(default 7) partitions ready in advance, and the purge drops every partition
+that lies wholly before the cutoff with DROP TABLE. Only the rows of the
+partition straddling the cutoff go through the batched DELETE.
+
+Partitions are named <table>_d<YYYYMMDD> / <table>_w<YYYYMMDD> after their
+first day (UTC), plus <table>_default for rows outside every range.
+"""
+import logging
+import re
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings as django_settings
+from django.db import connections, models, router, transaction
+from django.utils import timezone
+
+from ..models import SecurityLog, SecuritySettings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PURGE_BATCH_SIZE = 5000
+DEFAULT_PARTITIONS_AHEAD = 7
+
+INTERVALS = {'day': ('d', 1), 'week': ('w', 7)}
+
+_PARTITION_SUFFIX = re.compile(r'_([dw])(\d{8})')
+
+
+def purge_security_logs(retention_days: int | None = None, batch_size: int | None = None,
+                        progress=None) -> dict:
+    """
+    Delete SecurityLog rows older than retention_days (default: the
+    SecuritySettings value; 0 = keep everything). Drops whole partitions
+    first when the table is partitioned. progress(deleted_so_far), if given,
+    is called after every batch.
+    Returns {'partitions_dropped': n, 'deleted': rows deleted by DELETE,
+    'user_agents_deleted': orphaned UserAgentString rows deleted}.
+    """
+    from .user_agents import purge_orphan_user_agents
+
+    if retention_days is None:
+        retention_days = SecuritySettings.get_settings().security_log_retention_days
+    if not retention_days:
+        return {'partitions_dropped': 0, 'deleted': 0, 'user_agents_deleted': 0}
+    if batch_size is None:
+        batch_size = getattr(django_settings, 'NAI_SECURITY_LOG_PURGE_BATCH_SIZE', DEFAULT_PURGE_BATCH_SIZE)
+    cutoff = timezone.now() - timedelta(days=retention_days)
+
+    partitions_dropped = drop_expired_partitions(cutoff)
+
+    old = SecurityLog.objects.filter(created_at__lt=cutoff)
+    deleted = 0
+    while True:
+        pks = list(old.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+        # created_at stays in the DELETE so PostgreSQL prunes partitions.
+        deleted += old.filter(pk__in=pks).delete()[0]
+        if progress is not None:
+            progress(deleted)
+    user_agents_deleted = purge_orphan_user_agents(cutoff, batch_size)
+
+    if partitions_dropped or deleted or user_agents_deleted:
+        logger.info(
+            "Purged SecurityLog older than %s days: %s partitions dropped, %s rows deleted, "
+            "%s unused user agents deleted",
+            retention_days, partitions_dropped, deleted, user_agents_deleted,
+        )
+    return {'partitions_dropped': partitions_dropped, 'deleted': deleted, 'user_agents_deleted': user_agents_deleted}
+
+
+# ------------------------------------------------------------------
+# PostgreSQL partitioning
+# ------------------------------------------------------------------
+
+def _connection():
+    return connections[router.db_for_write(SecurityLog)]
+
+
+def partitioning_interval() -> str | None:
+    """NAI_SECURITY_LOG_PARTITIONING: 'day', 'week' or None."""
+    interval = getattr(django_settings, 'NAI_SECURITY_LOG_PARTITIONING', None)
+    if interval is not None and interval not in INTERVALS:
+        raise ValueError(f"NAI_SECURITY_LOG_PARTITIONING must be one of {sorted(INTERVALS)} or None")
+    return interval
+
+
+def is_partitioned() -> bool:
+    """True if SecurityLog's table is a PostgreSQL partitioned table."""
+    connection = _connection()
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = %s AND c.relnamespace = to_regnamespace(current_schema())",
+            [SecurityLog._meta.db_table],
+        )
+        return cursor.fetchone() is not None
+
+
+def period_start(day: date, interval: str) -> date:
+    """First day of the day / week (Monday) containing day."""
+    return day - timedelta(days=day.weekday()) if interval == 'week' else day
+
+
+def partition_name(table: str, interval: str, start: date) -> str:
+    return f"{table}_{INTERVALS[interval][0]}{start:%Y%m%d}"
+
+
+def parse_partition_name(table: str, name: str) -> tuple[date, date] | None:
+    """(first day, day after the last) of a partition named by partition_name(), else None."""
+    if not name.startswith(table):
+        return None
+    match = _PARTITION_SUFFIX.fullmatch(name[len(table):])
+    if match is None:
+        return None
+    interval = 'day' if match.group(1) == 'd' else 'week'
+    start = datetime.strptime(match.group(2), '%Y%m%d').date()
+    return start, period_start(start, interval) + timedelta(days=INTERVALS[interval][1])
+
+
+def plan_partitions(interval: str, first: date, until: date) -> list[tuple[date, date]]:
+    """
+    (start, end) day ranges that cover [first, until] in `interval` steps.
+    The first range is shortened to the next period boundary when first is
+    not on one (e.g. after the interval changed from day to week).
+    """
+    ranges = []
+    start = first
+    step = timedelta(days=INTERVALS[interval][1])
+    while start <= until:
+        end = period_start(start, interval) + step
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def _bound(day: date) -> str:
+    return datetime(day.year, day.month, day.day, tzinfo=dt_timezone.utc).isoformat()
+
+
+def _partitions(cursor, table: str) -> dict[str, tuple[date, date]]:
+    """{name: (start, end)} of the existing range partitions."""
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = %s AND p.relnamespace = to_regnamespace(current_schema())",
+        [table],
+    )
+    partitions = {}
+    for (name,) in cursor.fetchall():
+        bounds = parse_partition_name(table, name)
+        if bounds is not None:
+            partitions[name] = bounds
+    return partitions
+
+
+def _create_partitions(cursor, table: str, interval: str, ranges, parent: str | None = None) -> int:
+    """Partitions of parent (default: table) for ranges, named after table."""
+    quote = _connection().ops.quote_name
+    for start, end in ranges:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {quote(partition_name(table, interval, start))} "
+            f"PARTITION OF {quote(parent or table)} FOR VALUES FROM (%s) TO (%s)",
+            [_bound(start), _bound(end)],
+        )
+    return len(ranges)
+
+
+def ensure_log_partitions(ahead: int | None = None) -> int:
+    """
+    Create the partitions for today and the next `ahead` periods
+    (NAI_SECURITY_LOG_PARTITIONS_AHEAD). No-op unless the table is
+    partitioned. Returns the number of partitions created.
+    """
+    interval = partitioning_interval()
+    if interval is None or not is_partitioned():
+        return 0
+    if ahead is None:
+        ahead = getattr(django_settings, 'NAI_SECURITY_LOG_PARTITIONS_AHEAD', DEFAULT_PARTITIONS_AHEAD)
+    table = SecurityLog._meta.db_table
+    today = timezone.now().astimezone(dt_timezone.utc).date()
+    until = today + timedelta(days=INTERVALS[interval][1] * ahead)
+    with transaction.atomic(using=_connection().alias), _connection().cursor() as cursor:
+        ends = [end for _, end in _partitions(cursor, table).values()]
+        # Never backfill past periods: their rows are already in the default
+        # partition, which a new partition for the same range would conflict with.
+        first = max([period_start(today, interval), *ends])
+        return _create_partitions(cursor, table, interval, plan_partitions(interval, first, until))
+
+
+def drop_expired_partitions(cutoff: datetime) -> int:
+    """DROP every partition whose range ends at or before cutoff. Returns how many."""
+    if not is_partitioned():
+        return 0
+    table = SecurityLog._meta.db_table
+    quote = _connection().ops.quote_name
+    cutoff_day = cutoff.astimezone(dt_timezone.utc).date()
+    with _connection().cursor() as cursor:
+        partitions = sorted(_partitions(cursor, table).items(), key=lambda item: item[1])
+    dropped = 0
+    for name, (_, end) in partitions:
+        if end > cutoff_day:
+            continue
+        # One short transaction per DROP, each on its own cursor.
+        with transaction.atomic(using=_connection().alias), _connection().cursor() as cursor:
+            cursor.execute(f"DROP TABLE {quote(name)}")
+        dropped += 1
+    return dropped
+
+
+def model_indexes(model, connection) -> list[models.Index]:
+    """
+    Every index the model's table has after a migrate: one per db_index
+    field (plus its pattern_ops twin for LIKE on PostgreSQL text columns),
+    then Meta.indexes.
+    """
+    table = model._meta.db_table
+    indexes = []
+    for field in model._meta.local_fields:
+        if not field.db_index or field.unique:
+            continue
+        indexes.append(models.Index(fields=[field.name], name=f"{table}_{field.column}_idx"))
+        db_type = field.db_type(connection) or ''
+        if connection.vendor == 'postgresql' and db_type.startswith(('varchar', 'text')):
+            indexes.append(models.Index(
+                fields=[field.name], name=f"{table}_{field.column}_like",
+                opclasses=['varchar_pattern_ops' if db_type.startswith('varchar') else 'text_pattern_ops'],
+            ))
+    return indexes + list(model._meta.indexes)
+
+
+def convert_to_partitioned(interval: str, ahead: int | None = None) -> int:
+    """
+    Rebuild SecurityLog's table as a table range-partitioned by `interval`
+    on created_at, copying every row, in one transaction (the table is
+    locked for the copy). The primary key becomes (id, created_at), as
+    PostgreSQL requires the partition key in it. Returns the number of
+    partitions created.
+    """
+    connection = _connection()
+    if connection.vendor != 'postgresql':
+        raise RuntimeError("SecurityLog partitioning needs PostgreSQL")
+    if interval not in INTERVALS:
+        raise ValueError(f"interval must be one of {sorted(INTERVALS)}")
+    if is_partitioned():
+        raise RuntimeError("SecurityLog is already partitioned")
+    if ahead is None:
+        ahead = getattr(django_settings, 'NAI_SECURITY_LOG_PARTITIONS_AHEAD', DEFAULT_PARTITIONS_AHEAD)
+
+    table = SecurityLog._meta.db_table
+    new_table = f"{table}_new"
+    quote = connection.ops.quote_name
+    today = timezone.now().astimezone(dt_timezone.utc).date()
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {quote(table)} IN EXCLUSIVE MODE")
+        cursor.execute(f"SELECT MIN(created_at) FROM {quote(table)}")  # noqa: S608 - quoted identifier
+        oldest = cursor.fetchone()[0]
+        first = oldest.astimezone(dt_timezone.utc).date() if oldest else today
+
+        cursor.execute(
+            f"CREATE TABLE {quote(new_table)} (LIKE {quote(table)} INCLUDING DEFAULTS INCLUDING IDENTITY) "
+            f"PARTITION BY RANGE (created_at)"
+        )
+        cursor.execute(f"ALTER TABLE {quote(new_table)} ADD PRIMARY KEY (id, created_at)")
+        # Tables created before Django 4.1 use a serial id: the copied default
+        # still points at the old table's sequence, which must move over.
+        cursor.execute(
+            "SELECT attidentity FROM pg_attribute WHERE attrelid = %s::regclass AND attname = 'id'", [table],
+        )
+        if not cursor.fetchone()[0]:
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+            sequence = cursor.fetchone()[0]
+            if sequence:
+                # Let PostgreSQL quote both names: regclass renders the
+                # sequence schema-qualified and quoted, %I the table.
+                cursor.execute(
+                    "SELECT format('ALTER SEQUENCE %%s OWNED BY %%I.id', %s::regclass, %s)", [sequence, new_table],
+                )
+                cursor.execute(cursor.fetchone()[0])
+        cursor.execute(f"CREATE TABLE {quote(table + '_default')} PARTITION OF {quote(new_table)} DEFAULT")
+        ranges = plan_partitions(
+            interval, period_start(first, interval), today + timedelta(days=INTERVALS[interval][1] * ahead),
+        )
+        _create_partitions(cursor, table, interval, ranges, parent=new_table)
+        cursor.execute(f"INSERT INTO {quote(new_table)} SELECT * FROM {quote(table)}")  # noqa: S608 - quoted names
+        cursor.execute(
+            "SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(MAX(id), 0) + 1, false) "  # noqa: S608
+            f"FROM {quote(new_table)}",  # quoted name
+            [new_table],
+        )
+        cursor.execute(f"DROP TABLE {quote(table)}")
+        cursor.execute(f"ALTER TABLE {quote(new_table)} RENAME TO {quote(table)}")
+        cursor.execute(f"ALTER TABLE {quote(table)} RENAME CONSTRAINT {quote(new_table + '_pkey')} "
+                       f"TO {quote(table + '_pkey')}")
+
+        # The model's indexes, now that the old table and its indexes are
+        # gone. Partitions inherit them.
+        with connection.schema_editor(atomic=False) as editor:
+            for index in model_indexes(SecurityLog, connection):
+                editor.execute(index.create_sql(SecurityLog, editor))
+
+    logger.info("SecurityLog partitioned by %s: %s partitions", interval, len(ranges))
+    return len(ranges)
@@ -0,0 +1,246 @@
+"""
+Pluggable SecurityLog writers for the request path.
+
+SecurityMiddleware and RateLimitLoggingMiddleware hand every blocked-request
+event to get_log_writer(). Two writers ship with the package:
+
+- DatabaseLogWriter (default): one INSERT per event inside the request, the
+  historical behaviour.
+- BufferedLogWriter: events go into a bounded in-process queue and a daemon
+  thread writes them with bulk_create once NAI_SECURITY_LOG_BATCH_SIZE events
+  are waiting or NAI_SECURITY_LOG_FLUSH_INTERVAL seconds have passed. The
+  request returns its 403 without waiting for the database. When the queue is
+  full the event is dropped and counted (see stats()); the queue is flushed on
+  interpreter shutdown.
+
+NAI_SECURITY_LOG_WRITER selects 'database', 'buffered' or the dotted path of a
+class implementing write(event) / write_async(event). With
+NAI_SECURITY_LOG_BACKENDS set, 'database' and 'buffered' both give a
+BufferedLogWriter that hands each batch to every configured backend (see
+log_backends).
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings as django_settings
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+
+from .log_backends import DatabaseBackend, build_log_backends, log_backends_configured
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+
+class DatabaseLogWriter:
+    """Saves each event immediately (one INSERT per event)."""
+
+    def write(self, event) -> None:
+        event.save()
+
+    async def write_async(self, event) -> None:
+        await event.asave()
+
+    def flush(self) -> int:
+        return 0
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+
+class BufferedLogWriter:
+    """
+    Queues unsaved SecurityLog instances and hands them in batches to its
+    backends (default: a DatabaseBackend, i.e. bulk_create) from a background
+    thread. A backend that fails does not stop the others; its events are
+    counted as failed.
+
+    queue_timeout > 0 makes a full queue block the caller for up to that many
+    seconds (backpressure) before the event is dropped; the default 0 drops
+    immediately so a flood never slows the request path.
+    """
+
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, queue_timeout=0, autostart=True, backends=None):
+        self.batch_size = max(1, batch_size)
+        self.backends = backends if backends is not None else [DatabaseBackend(self.batch_size)]
+        self.flush_interval = flush_interval
+        self.queue_timeout = queue_timeout
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'queued': 0, 'written': 0, 'dropped': 0, 'failed': 0}
+        self._thread = None
+        if autostart:
+            self.start()
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='nai-security-log-writer', daemon=True,
+        )
+        self._thread.start()
+
+    def write(self, event) -> None:
+        try:
+            if self.queue_timeout > 0:
+                self._queue.put(event, timeout=self.queue_timeout)
+            else:
+                self._queue.put_nowait(event)
+        except queue.Full:
+            dropped = self._count('dropped')
+            if dropped == 1 or dropped % 1000 == 0:
+                logger.warning("SecurityLog queue full, %s events dropped so far", dropped)
+            return
+        self._count('queued')
+        if self._queue.qsize() >= self.batch_size:
+            self._wake.set()
+
+    async def write_async(self, event) -> None:
+        if self.queue_timeout > 0:
+            # A blocking put would stall the event loop.
+            await sync_to_async(self.write, thread_sensitive=False)(event)
+        else:
+            self.write(event)
+
+    def flush(self) -> int:
+        """
+        Write everything queued so far in the calling thread. Returns the
+        events accepted by at least one backend.
+        """
+        written = 0
+        with self._flush_lock:
+            while True:
+                batch = self._drain()
+                if not batch:
+                    return written
+                delivered = False
+                for backend in self.backends:
+                    try:
+                        backend.emit(batch)
+                    except Exception as e:
+                        self._count('failed', len(batch))
+                        logger.error(
+                            "Failed to write %s security log events to %s: %s",
+                            len(batch), getattr(backend, 'name', type(backend).__name__), e,
+                        )
+                    else:
+                        delivered = True
+                if delivered:
+                    self._count('written', len(batch))
+                    written += len(batch)
+
+    def close(self, timeout=5.0) -> None:
+        """Stop the background thread and flush what is left."""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self.flush()
+        for backend in self.backends:
+            try:
+                backend.close()
+            except Exception as e:
+                logger.error("Failed to close security log backend: %s", e)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize()
+        return stats
+
+    def _drain(self) -> list:
+        batch: list = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _count(self, key, n=1) -> int:
+        with self._stats_lock:
+            self._stats[key] += n
+            return self._stats[key]
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._queue.empty():
+                continue
+            close_old_connections()
+            started = time.monotonic()
+            written = self.flush()
+            logger.debug(
+                "Flushed %s security log events in %.1f ms",
+                written, (time.monotonic() - started) * 1000,
+            )
+        close_old_connections()
+
+
+WRITERS = {
+    'database': DatabaseLogWriter,
+    'buffered': BufferedLogWriter,
+}
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _build_writer():
+    name = getattr(django_settings, 'NAI_SECURITY_LOG_WRITER', 'database')
+    writer_class = WRITERS.get(name) or import_string(name)
+    if writer_class is BufferedLogWriter or (writer_class is DatabaseLogWriter and log_backends_configured()):
+        return BufferedLogWriter(
+            backends=build_log_backends() if log_backends_configured() else None,
+            queue_size=getattr(django_settings, 'NAI_SECURITY_LOG_QUEUE_SIZE', DEFAULT_QUEUE_SIZE),
+            batch_size=getattr(django_settings, 'NAI_SECURITY_LOG_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+            flush_interval=getattr(
+                django_settings, 'NAI_SECURITY_LOG_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL,
+            ),
+            queue_timeout=getattr(django_settings, 'NAI_SECURITY_LOG_QUEUE_TIMEOUT', 0),
+        )
+    return writer_class()
+
+
+def get_log_writer():
+    """Return this process's log writer, creating it from settings on first use."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = _build_writer()
+    return _writer
+
+
+def reset_log_writer() -> None:
+    """Close the current writer (flushing it); the next call builds a new one."""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
+
+
+@atexit.register
+def _flush_on_exit():
+    if _writer is not None:
+        try:
+            _writer.close()
+        except Exception as e:
+            logger.error("Failed to flush security log on shutdown: %s", e)
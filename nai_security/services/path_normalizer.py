@@ -0,0 +1,76 @@
+"""
+Route templates for SecurityLog.
+
+With NAI_SECURITY_PATH_NORMALIZATION = True every logged event also gets a
+`route`: the URL pattern the path resolves to ('/api/items/<int:pk>/', from
+request.resolver_match or, before the view runs, from resolve()), or, for
+paths no pattern matches (scanners), the path with numeric, UUID and long
+hex segments collapsed to {int}, {uuid} and {hex} and the query string
+dropped. Routes have bounded cardinality, so they can be grouped on (see the
+route rollups and the report's top_targeted_routes) where raw paths cannot.
+
+The raw path is still stored, cut to NAI_SECURITY_LOG_PATH_MAX_LENGTH
+characters (default and maximum 500).
+"""
+import re
+from functools import lru_cache
+
+from django.conf import settings as django_settings
+from django.http import Http404
+from django.urls import resolve
+
+MAX_PATH_LENGTH = 500
+MAX_ROUTE_LENGTH = 255
+RESOLVE_CACHE_SIZE = 4096
+
+NUMERIC_SEGMENT = re.compile(r'^\d+$')
+UUID_SEGMENT = re.compile(r'^[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}$')
+HEX_SEGMENT = re.compile(r'^[0-9a-fA-F]{16,}$')
+
+
+def path_normalization_enabled() -> bool:
+    return getattr(django_settings, 'NAI_SECURITY_PATH_NORMALIZATION', False)
+
+
+def path_max_length() -> int:
+    return min(getattr(django_settings, 'NAI_SECURITY_LOG_PATH_MAX_LENGTH', MAX_PATH_LENGTH), MAX_PATH_LENGTH)
+
+
+def normalize_path(path: str) -> str:
+    """'/orders/42/items/9f1c...?x=1' -> '/orders/{int}/items/{uuid}'."""
+    segments = []
+    for segment in path.split('?', 1)[0].split('/'):
+        if NUMERIC_SEGMENT.match(segment):
+            segment = '{int}'
+        elif UUID_SEGMENT.match(segment):
+            segment = '{uuid}'
+        elif HEX_SEGMENT.match(segment):
+            segment = '{hex}'
+        segments.append(segment)
+    return '/'.join(segments)[:MAX_ROUTE_LENGTH]
+
+
+@lru_cache(maxsize=RESOLVE_CACHE_SIZE)
+def _resolved_route(path_info: str, urlconf: str) -> str | None:
+    try:
+        match = resolve(path_info, urlconf)
+    except Http404:
+        return None
+    return match.route
+
+
+def request_route(request) -> str:
+    """The route for a request, or '' with normalization off."""
+    if not path_normalization_enabled():
+        return ''
+    match = getattr(request, 'resolver_match', None)
+    if match is not None:
+        route = match.route
+    else:
+        urlconf = getattr(request, 'urlconf', None) or django_settings.ROOT_URLCONF
+        route = _resolved_route(request.path_info, urlconf)
+    if route is None:
+        # path_info, like the resolver: the same prefix-free key whatever
+        # SCRIPT_NAME the app is mounted under.
+        return normalize_path(request.path_info)
+    return ('/' + route.lstrip('^/'))[:MAX_ROUTE_LENGTH]
@@ -0,0 +1,436 @@
+"""
+In-process, versioned copies of the request-path security policy.
+
+With NAI_SECURITY_POLICY_SNAPSHOT = True, each worker holds one immutable
+PolicySnapshot of the active BlockedIP, WhitelistedIP, BlockedCountry,
+AllowedCountry and WhitelistedUser rows plus SecuritySettings. Every save or
+delete on those models bumps a single shared counter
+(utils.POLICY_GENERATION_CACHE_KEY); a worker rebuilds its snapshot only when
+that counter changes, so a typical request costs one cache read followed by
+plain dict/set lookups instead of a cache round-trip per check.
+
+Network (CIDR) entries are always served from memory, snapshot mode or not:
+NetworkPolicy holds just the BlockedIP / WhitelistedIP rows that carry a
+prefix_length, plus the active BlockedASN rules, in the same generation-bound
+way. An ASN rule therefore costs one local GeoLite2-ASN lookup per request,
+and only while at least one rule is active.
+
+An inline auto-block (AutoBlocker.check_inline) also moves the generation,
+but publishes the blocked address with it: a worker that is only behind by
+such blocks adds the addresses to its copies instead of rebuilding them.
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from collections.abc import Callable, Mapping
+from datetime import datetime
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any
+
+from asgiref.sync import sync_to_async
+from django.conf import settings as django_settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from ..utils import (
+    INLINE_BLOCK_CACHE_PREFIX, POLICY_GENERATION_CACHE_KEY, get_asn_from_ip, local_bump_count, seed_counter,
+    seed_counter_async,
+)
+from .ip_index import IPNetworkIndex
+
+if TYPE_CHECKING:
+    from ..models.security_settings import SettingsRecord
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_AGE = 300
+# Further behind than this many generations, a worker rebuilds even if they
+# were all inline blocks.
+MAX_INLINE_BLOCKS = 64
+# Seconds between generation reads for the caches consulted without snapshot
+# mode (network and rate-limit policy), where the middleware does not read it.
+UNREAD_CHECK_INTERVAL = 1
+
+# Passed as `generation` when the caller has not read the counter itself.
+UNREAD = object()
+
+
+def read_policy_generation():
+    """
+    Read the shared generation once, for a request to hand to every
+    per-process cache it consults instead of each one reading it again.
+    Returns UNREAD when NAI_SECURITY_POLICY_SNAPSHOT_CHECK_INTERVAL is set:
+    the caches then skip most reads on their own.
+    """
+    if getattr(django_settings, 'NAI_SECURITY_POLICY_SNAPSHOT_CHECK_INTERVAL', 0):
+        return UNREAD
+    return cache.get(POLICY_GENERATION_CACHE_KEY)
+
+
+async def read_policy_generation_async():
+    """Async version of read_policy_generation()."""
+    if getattr(django_settings, 'NAI_SECURITY_POLICY_SNAPSHOT_CHECK_INTERVAL', 0):
+        return UNREAD
+    return await cache.aget(POLICY_GENERATION_CACHE_KEY)
+
+
+class PolicyGenerationCache:
+    """
+    A per-process value rebuilt whenever the shared policy generation moves or
+    the value is older than NAI_SECURITY_POLICY_SNAPSHOT_MAX_AGE seconds.
+
+    NAI_SECURITY_POLICY_SNAPSHOT_CHECK_INTERVAL (default 0, or check_interval
+    when the caller passes no generation) skips the generation read entirely
+    for that many seconds after the last check, unless this process bumped
+    the generation since. A failed rebuild keeps serving the previous value
+    (None if there is none) and is retried on the next call. get() takes the generation when the caller
+    already read it (see read_policy_generation()).
+
+    A missing counter is re-seeded with cache.add. If the cache does not keep
+    it (DummyCache, cache down), the value is only rebuilt at the max age.
+
+    advance(value, generation, blocks), if given, returns the value carried
+    forward to generation when every generation since the current one was an
+    inline block; blocks are their (ip_address, expires_at) pairs. The max age
+    still counts from the last full build.
+
+    For a value bound to another counter, key names it. expires=False drops
+    the max-age rebuild (the counter read at each check is then the only
+    trigger), outdated(value) returning True forces a rebuild, and wait=False
+    lets other threads keep the previous value while one rebuilds.
+    """
+
+    def __init__(self, builder: Callable[[int], object], name: str,
+                 advance: Callable[[Any, int, list], Any] | None = None, check_interval: float = 0,
+                 key: str = POLICY_GENERATION_CACHE_KEY, expires: bool = True,
+                 outdated: Callable[[Any], bool] | None = None, wait: bool = True):
+        self.builder = builder
+        self.name = name
+        self.advance = advance
+        self.check_interval = check_interval
+        self.key = key
+        self.expires = expires
+        self.outdated = outdated
+        self.wait = wait
+        self._value = None
+        self._generation = None
+        self._built_at = 0.0
+        self._last_checked = 0.0
+        self._bumps_seen = 0
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, generation, now, max_age) -> bool:
+        return (
+            self._value is not None
+            and generation == self._generation
+            and (not self.expires or now - self._built_at < max_age)
+        )
+
+    def _is_outdated(self) -> bool:
+        return self.outdated is not None and self._value is not None and self.outdated(self._value)
+
+    def _skips_read(self, generation, now) -> bool:
+        """True if the value may be served without reading the generation."""
+        check_interval = getattr(django_settings, 'NAI_SECURITY_POLICY_SNAPSHOT_CHECK_INTERVAL', 0)
+        if not check_interval and generation is UNREAD:
+            check_interval = self.check_interval
+        return (
+            self._value is not None
+            and bool(check_interval)
+            and now - self._last_checked < check_interval
+            and self._bumps_seen == local_bump_count(self.key)
+        )
+
+    def get(self, generation=UNREAD):
+        now = time.monotonic()
+        max_age = getattr(django_settings, 'NAI_SECURITY_POLICY_SNAPSHOT_MAX_AGE', DEFAULT_MAX_AGE)
+        seen = self._value
+        outdated = self._is_outdated()
+        if not outdated and self._skips_read(generation, now):
+            return seen
+
+        self._bumps_seen = local_bump_count(self.key)
+        if generation is UNREAD:
+            generation = cache.get(self.key)
+        if generation is None:
+            generation = seed_counter(self.key)
+        self._last_checked = now
+        if not outdated and self._is_fresh(generation, now, max_age):
+            return seen
+        return self._rebuild(generation, now, max_age, seen)
+
+    async def get_async(self, generation=UNREAD):
+        """
+        Async twin of get(). The generation check uses cache.aget, so the hot
+        path stays on the event loop; only an actual rebuild (a rare event)
+        hops to a thread to run the ORM queries.
+        """
+        now = time.monotonic()
+        max_age = getattr(django_settings, 'NAI_SECURITY_POLICY_SNAPSHOT_MAX_AGE', DEFAULT_MAX_AGE)
+        seen = self._value
+        outdated = self._is_outdated()
+        if not outdated and self._skips_read(generation, now):
+            return seen
+
+        self._bumps_seen = local_bump_count(self.key)
+        if generation is UNREAD:
+            generation = await cache.aget(self.key)
+        if generation is None:
+            generation = await seed_counter_async(self.key)
+        self._last_checked = now
+        if not outdated and self._is_fresh(generation, now, max_age):
+            return seen
+        return await sync_to_async(self._rebuild)(generation, now, max_age, seen)
+
+    def _rebuild(self, generation, now, max_age, seen):
+        """
+        Replace seen, the value found stale. Another thread may have done it
+        while this one waited for the lock.
+        """
+        if not self._lock.acquire(blocking=self.wait or seen is None):
+            return seen
+        try:
+            if self._value is not seen and self._is_fresh(generation, now, max_age):
+                return self._value
+            value = self._advance(generation, now, max_age)
+            if value is None:
+                try:
+                    value = self.builder(generation)
+                except Exception as e:
+                    logger.error("Failed to build security %s: %s", self.name, e)
+                    self._last_checked = 0.0
+                    return self._value
+                self._built_at = time.monotonic()
+            self._value = value
+            self._generation = generation
+            return value
+        finally:
+            self._lock.release()
+
+    def _advance(self, generation, now, max_age):
+        """The current value carried forward to generation, or None to rebuild."""
+        if self.advance is None or self._value is None or self._generation is None or generation is None:
+            return None
+        if now - self._built_at >= max_age or not 0 < generation - self._generation <= MAX_INLINE_BLOCKS:
+            return None
+        keys = [f"{INLINE_BLOCK_CACHE_PREFIX}:{g}" for g in range(self._generation + 1, generation + 1)]
+        blocks = cache.get_many(keys)
+        if len(blocks) != len(keys):
+            return None
+        return self.advance(self._value, generation, [blocks[key] for key in keys])
+
+    def reset(self) -> None:
+        """Drop this worker's copy; the next call rebuilds it."""
+        with self._lock:
+            self._value = None
+            self._generation = None
+            self._last_checked = 0.0
+
+
+@dataclass(frozen=True)
+class PolicySnapshot:
+    """Immutable view of the active security policy at one generation."""
+
+    generation: int | None
+    settings: 'SettingsRecord'
+    whitelisted_ips: IPNetworkIndex
+    blocked_ips: IPNetworkIndex
+    blocked_countries: frozenset
+    allowed_countries: frozenset
+    user_exemptions: Mapping[int, tuple[str, datetime | None]]
+    blocked_asns: Mapping[int, int]
+    # {ip_address: expires_at} of the inline blocks applied since the build.
+    inline_blocked: Mapping[str, datetime | None] = field(default_factory=lambda: MappingProxyType({}))
+
+    @classmethod
+    def build(cls, generation: int | None) -> 'PolicySnapshot':
+        """Load the active policy rows from the database."""
+        from ..models import (
+            AllowedCountry, BlockedASN, BlockedCountry, BlockedIP, SecuritySettings,
+            WhitelistedIP, WhitelistedUser,
+        )
+
+        from ..models.security_settings import SettingsRecord
+
+        settings, _ = SecuritySettings.objects.get_or_create(pk=1)
+        return cls(
+            generation=generation,
+            settings=SettingsRecord.from_model(settings),
+            whitelisted_ips=IPNetworkIndex(
+                (_cidr(ip, prefix), True)
+                for ip, prefix in WhitelistedIP.objects.filter(
+                    is_active=True,
+                ).values_list('ip_address', 'prefix_length')
+            ),
+            blocked_ips=IPNetworkIndex(
+                (_cidr(ip, prefix), expires_at)
+                for ip, prefix, expires_at in BlockedIP.objects.filter(
+                    is_active=True,
+                ).values_list('ip_address', 'prefix_length', 'expires_at')
+            ),
+            blocked_countries=frozenset(
+                BlockedCountry.objects.filter(is_active=True).values_list('code', flat=True)
+            ),
+            allowed_countries=frozenset(
+                AllowedCountry.objects.filter(is_active=True).values_list('code', flat=True)
+            ),
+            user_exemptions=MappingProxyType({
+                user_id: (exemption_type, expires_at)
+                for user_id, exemption_type, expires_at in WhitelistedUser.objects.filter(
+                    is_active=True,
+                ).values_list('user_id', 'exemption_type', 'expires_at')
+            }),
+            blocked_asns=_blocked_asns(BlockedASN),
+        )
+
+    def is_ip_whitelisted(self, ip_address: str) -> bool:
+        return ip_address in self.whitelisted_ips
+
+    def with_inline_blocks(self, generation: int, blocks: list) -> 'PolicySnapshot':
+        return replace(
+            self, generation=generation, inline_blocked=MappingProxyType({**self.inline_blocked, **dict(blocks)}),
+        )
+
+    def is_ip_blocked(self, ip_address: str) -> bool:
+        if ip_address in self.inline_blocked:
+            expires_at = self.inline_blocked[ip_address]
+            if expires_at is None or timezone.now() <= expires_at:
+                return True
+        return _any_unexpired(self.blocked_ips, ip_address)
+
+    def is_country_blocked(self, country_code: str) -> bool:
+        return country_code in self.blocked_countries
+
+    def is_country_allowed(self, country_code: str) -> bool:
+        """Same semantics as AllowedCountry.is_country_allowed: no rows = all allowed."""
+        if not self.allowed_countries:
+            return True
+        return country_code in self.allowed_countries
+
+    def get_user_exemption(self, user_id) -> str | None:
+        entry = self.user_exemptions.get(user_id)
+        if entry is None:
+            return None
+        exemption_type, expires_at = entry
+        if expires_at and expires_at < timezone.now():
+            return None
+        return exemption_type
+
+    def get_blocked_asn(self, ip_address: str) -> int | None:
+        return _match_asn(self.blocked_asns, ip_address)
+
+
+@dataclass(frozen=True)
+class NetworkPolicy:
+    """
+    Active network-level (prefix_length set) BlockedIP / WhitelistedIP rows and
+    BlockedASN rules.
+    """
+
+    generation: int | None
+    whitelisted: IPNetworkIndex
+    blocked: IPNetworkIndex
+    blocked_asns: Mapping[int, int]
+
+    @classmethod
+    def build(cls, generation: int | None) -> 'NetworkPolicy':
+        from ..models import BlockedASN, BlockedIP, WhitelistedIP
+
+        return cls(
+            generation=generation,
+            whitelisted=IPNetworkIndex(
+                (_cidr(ip, prefix), True)
+                for ip, prefix in WhitelistedIP.objects.filter(
+                    is_active=True, prefix_length__isnull=False,
+                ).values_list('ip_address', 'prefix_length')
+            ),
+            blocked=IPNetworkIndex(
+                (_cidr(ip, prefix), expires_at)
+                for ip, prefix, expires_at in BlockedIP.objects.filter(
+                    is_active=True, prefix_length__isnull=False,
+                ).values_list('ip_address', 'prefix_length', 'expires_at')
+            ),
+            blocked_asns=_blocked_asns(BlockedASN),
+        )
+
+    def is_ip_whitelisted(self, ip_address: str) -> bool:
+        return ip_address in self.whitelisted
+
+    def is_ip_blocked(self, ip_address: str) -> bool:
+        return _any_unexpired(self.blocked, ip_address)
+
+    def get_blocked_asn(self, ip_address: str) -> int | None:
+        return _match_asn(self.blocked_asns, ip_address)
+
+
+_EMPTY_NETWORK_POLICY = NetworkPolicy(None, IPNetworkIndex(), IPNetworkIndex(), MappingProxyType({}))
+
+
+def _cidr(ip_address: str, prefix_length: int | None) -> str:
+    return ip_address if prefix_length is None else f"{ip_address}/{prefix_length}"
+
+
+def _blocked_asns(model) -> Mapping[int, int]:
+    """{asn: BlockedASN pk} of the active rules."""
+    return MappingProxyType(dict(model.objects.filter(is_active=True).values_list('asn', 'pk')))
+
+
+def _match_asn(blocked_asns: Mapping[int, int], ip_address: str) -> int | None:
+    """pk of the BlockedASN rule covering ip_address. No rules, no GeoIP lookup."""
+    if not blocked_asns:
+        return None
+    asn = get_asn_from_ip(ip_address)
+    return blocked_asns.get(asn) if asn is not None else None
+
+
+def _any_unexpired(index: IPNetworkIndex, ip_address: str) -> bool:
+    """True if any network containing ip_address has no expiry or has not expired."""
+    now = None
+    for expires_at in index.iter_matches(ip_address):
+        if expires_at is None:
+            return True
+        if now is None:
+            now = timezone.now()
+        if now <= expires_at:
+            return True
+    return False
+
+
+def keep_for_generation(value, generation, blocks):
+    """advance for a policy an address block does not change: only its generation moves."""
+    return replace(value, generation=generation)
+
+
+_snapshot_cache = PolicyGenerationCache(
+    PolicySnapshot.build, 'policy snapshot', PolicySnapshot.with_inline_blocks,
+)
+_network_cache = PolicyGenerationCache(
+    NetworkPolicy.build, 'network policy', keep_for_generation, check_interval=UNREAD_CHECK_INTERVAL,
+)
+
+
+def get_policy_snapshot(generation=UNREAD) -> PolicySnapshot | None:
+    """Return this worker's PolicySnapshot, or None if it could not be built."""
+    return _snapshot_cache.get(generation)
+
+
+async def get_policy_snapshot_async(generation=UNREAD) -> PolicySnapshot | None:
+    """Async version of get_policy_snapshot()."""
+    return await _snapshot_cache.get_async(generation)
+
+
+def get_network_policy(generation=UNREAD) -> NetworkPolicy:
+    """Return this worker's NetworkPolicy (empty if it could not be built)."""
+    return _network_cache.get(generation) or _EMPTY_NETWORK_POLICY
+
+
+async def get_network_policy_async(generation=UNREAD) -> NetworkPolicy:
+    """Async version of get_network_policy()."""
+    return await _network_cache.get_async(generation) or _EMPTY_NETWORK_POLICY
+
+
+def reset_policy_snapshot() -> None:
+    """Drop this worker's in-process policy copies."""
+    _snapshot_cache.reset()
+    _network_cache.reset()
@@ -0,0 +1,336 @@
+"""
+Enforcement of admin-managed RateLimitRule rows.
+
+RateLimitPolicy compiles the active rules into a prefix matcher, rebuilt per
+policy generation like the PolicySnapshot (RateLimitRule.save/delete bump the
+generation). A rule's path_pattern is a path prefix; the longest matching
+prefix wins, and a method-specific rule beats an ALL rule of the same prefix.
+
+Counting uses a sliding window approximated from two fixed windows: the
+current window's count plus the previous window's count weighted by how much
+of it still overlaps the sliding window. With NAI_SECURITY_REDIS_URL set this
+is one MULTI/EXEC pipeline round-trip per request (RedisSlidingWindow);
+otherwise the Django cache is used (CacheSlidingWindow).
+
+NAI_SECURITY_RATE_LIMIT_MODE = 'approximate' puts a LocalTokenLimiter in front
+of either, so most requests are decided in-process and the shared counter is
+reconciled in batches.
+"""
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
+
+from django.conf import settings as django_settings
+from django.core.cache import cache
+
+from ..utils import get_redis_client
+from .policy_snapshot import UNREAD, UNREAD_CHECK_INTERVAL, PolicyGenerationCache, keep_for_generation
+
+logger = logging.getLogger(__name__)
+
+RATE_PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+KEY_PREFIX = 'sec_rl'
+
+
+def parse_rate(rate: str) -> tuple[int, int]:
+    """'10/m' -> (10, 60). Raises ValueError for malformed rates."""
+    count, _, period = rate.partition('/')
+    if not period or period[-1] not in RATE_PERIODS:
+        raise ValueError(f"Invalid rate: {rate!r}")
+    multiplier = int(period[:-1]) if period[:-1] else 1
+    limit = int(count)
+    if limit <= 0 or multiplier <= 0:
+        raise ValueError(f"Invalid rate: {rate!r}")
+    return limit, multiplier * RATE_PERIODS[period[-1]]
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledRule:
+    pk: int
+    path_pattern: str
+    method: str
+    limit: int
+    window: int
+
+
+@dataclass(frozen=True)
+class RateLimitPolicy:
+    """Active rules indexed by method, then by path prefix."""
+
+    generation: int | None
+    rules: Mapping[str, Mapping[str, CompiledRule]]
+    prefix_lengths: tuple[int, ...]
+
+    @classmethod
+    def build(cls, generation: int | None) -> 'RateLimitPolicy':
+        from ..models import RateLimitRule
+
+        rows = RateLimitRule.objects.filter(is_active=True).values_list(
+            'pk', 'path_pattern', 'method', 'rate',
+        )
+        return cls.from_rules(generation, rows)
+
+    @classmethod
+    def from_rules(cls, generation, rows) -> 'RateLimitPolicy':
+        """rows: (pk, path_pattern, method, rate) tuples."""
+        rules: dict[str, dict[str, CompiledRule]] = {}
+        for pk, path_pattern, method, rate in rows:
+            try:
+                limit, window = parse_rate(rate)
+            except ValueError:
+                logger.warning("Skipping rate limit rule %s with invalid rate %r", pk, rate)
+                continue
+            method = (method or 'ALL').upper()
+            rules.setdefault(method, {})[path_pattern] = CompiledRule(
+                pk, path_pattern, method, limit, window,
+            )
+        lengths = {len(prefix) for by_prefix in rules.values() for prefix in by_prefix}
+        return cls(
+            generation=generation,
+            rules=MappingProxyType({m: MappingProxyType(p) for m, p in rules.items()}),
+            prefix_lengths=tuple(sorted(lengths, reverse=True)),
+        )
+
+    def match(self, path: str, method: str) -> CompiledRule | None:
+        """The rule for the longest matching prefix, or None."""
+        if not self.prefix_lengths:
+            return None
+        specific = self.rules.get(method.upper(), {})
+        catch_all = self.rules.get('ALL', {})
+        for length in self.prefix_lengths:
+            if length > len(path):
+                continue
+            prefix = path[:length]
+            rule = specific.get(prefix) or catch_all.get(prefix)
+            if rule is not None:
+                return rule
+        return None
+
+
+_EMPTY_POLICY = RateLimitPolicy(None, MappingProxyType({}), ())
+_policy_cache = PolicyGenerationCache(
+    RateLimitPolicy.build, 'rate limit policy', keep_for_generation, check_interval=UNREAD_CHECK_INTERVAL,
+)
+
+
+def get_rate_limit_policy(generation=UNREAD) -> RateLimitPolicy:
+    """Return this worker's compiled rules (empty if they could not be loaded)."""
+    return _policy_cache.get(generation) or _EMPTY_POLICY
+
+
+async def get_rate_limit_policy_async(generation=UNREAD) -> RateLimitPolicy:
+    """Async version of get_rate_limit_policy()."""
+    return await _policy_cache.get_async(generation) or _EMPTY_POLICY
+
+
+def reset_rate_limit_policy() -> None:
+    _policy_cache.reset()
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    estimate: float
+    retry_after: int
+
+
+def evaluate(current: int, previous: int, limit: int, window: int, elapsed: float) -> RateLimitResult:
+    """
+    Decide on a request that brought the current window to `current` hits.
+
+    The sliding-window estimate is previous * (1 - elapsed / window) + current.
+    retry_after is the number of seconds until one more request would fit.
+    """
+    weight = (window - elapsed) / window
+    estimate = previous * weight + current
+    if estimate <= limit:
+        return RateLimitResult(True, estimate, 0)
+
+    if current < limit and previous:
+        # Fits later in this window, once enough of the previous one slides out.
+        wait = window - elapsed - (limit - current - 1) * window / previous
+    else:
+        # Only after this window rolls over and its weight decays.
+        wait = (window - elapsed) + window * max(0.0, 1 - (limit - 1) / current)
+    return RateLimitResult(False, estimate, max(1, math.ceil(wait)))
+
+
+class SlidingWindowCounter:
+    """
+    Base for shared counters. Subclasses implement consume(): add `amount` hits
+    to window `index` and return (that window's count, previous window's count).
+    """
+
+    def consume(self, rule: CompiledRule, identity: str, index: int, amount: int) -> tuple[int, int]:
+        raise NotImplementedError
+
+    def hit(self, rule: CompiledRule, identity: str) -> RateLimitResult:
+        index, elapsed = divmod(time.time(), rule.window)
+        current, previous = self.consume(rule, identity, int(index), 1)
+        return evaluate(current, previous, rule.limit, rule.window, elapsed)
+
+    @staticmethod
+    def _key(rule: CompiledRule, identity: str, index: int) -> str:
+        return f"{KEY_PREFIX}:{rule.pk}:{identity}:{index}"
+
+
+class CacheSlidingWindow(SlidingWindowCounter):
+    """Sliding-window counter on the Django cache (add + incr + get)."""
+
+    def consume(self, rule, identity, index, amount):
+        current_key = self._key(rule, identity, index)
+        cache.add(current_key, 0, rule.window * 2)
+        try:
+            current = cache.incr(current_key, amount)
+        except ValueError:
+            cache.set(current_key, amount, rule.window * 2)
+            current = amount
+        previous = cache.get(self._key(rule, identity, index - 1)) or 0
+        return current, previous
+
+
+class RedisSlidingWindow(SlidingWindowCounter):
+    """Sliding-window counter in Redis: INCRBY, EXPIRE and GET in one MULTI/EXEC round-trip."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def consume(self, rule, identity, index, amount):
+        current_key = self._key(rule, identity, index)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.incrby(current_key, amount)
+        pipe.expire(current_key, rule.window * 2)
+        pipe.get(self._key(rule, identity, index - 1))
+        current, _, previous = pipe.execute()
+        return int(current), int(previous or 0)
+
+
+class _LocalWindow:
+    __slots__ = ('rule', 'index', 'current', 'previous', 'pending', 'synced_at')
+
+    def __init__(self, rule, index):
+        self.rule = rule
+        self.index = index
+        self.current = 0
+        self.previous = 0
+        self.pending = 0
+        self.synced_at = None
+
+
+class LocalTokenLimiter:
+    """
+    Approximate mode: decide from a per-worker copy of the shared counters and
+    push the hits counted locally in batches.
+
+    Each (rule, client) keeps the last shared counts seen plus the hits this
+    worker has admitted since. It reconciles (one shared consume() call that
+    adds the pending hits and reads back the global counts) when:
+      - the window rolls over or the client is new,
+      - sync_tokens hits are pending,
+      - sync_interval seconds have passed since the last reconciliation, or
+      - fewer than sync_tokens requests remain under the limit, so close to
+        the limit every request is decided on fresh global counts.
+    A client already over the limit is refused locally until the next
+    interval-driven reconciliation.
+
+    While a client is more than sync_tokens below the limit each worker can
+    admit at most sync_tokens hits the others have not seen yet, so a global
+    limit is exceeded by at most (workers - 1) * sync_tokens per window.
+    """
+
+    def __init__(self, shared: SlidingWindowCounter, sync_tokens=10, sync_interval=0.1,
+                 max_entries=10000):
+        self.shared = shared
+        self.sync_tokens = max(1, sync_tokens)
+        self.sync_interval = sync_interval
+        self.max_entries = max_entries
+        self._windows: OrderedDict[tuple[int, str], _LocalWindow] = OrderedDict()
+        self._lock = threading.Lock()
+        self.local_decisions = 0
+        self.syncs = 0
+
+    def hit(self, rule: CompiledRule, identity: str) -> RateLimitResult:
+        now = time.time()
+        index, elapsed = divmod(now, rule.window)
+        index = int(index)
+        key = (rule.pk, identity)
+        stale = evicted = None
+
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or window.index != index:
+                stale = window
+                window = _LocalWindow(rule, index)
+                self._windows[key] = window
+                if len(self._windows) > self.max_entries:
+                    evicted = self._windows.popitem(last=False)
+            else:
+                self._windows.move_to_end(key)
+            window.pending += 1
+            local = evaluate(
+                window.current + window.pending, window.previous, rule.limit, rule.window, elapsed,
+            )
+            since_sync = now - window.synced_at if window.synced_at is not None else None
+            due = since_sync is None or since_sync >= self.sync_interval
+            if not local.allowed:
+                need_sync = due
+            else:
+                need_sync = (
+                    due
+                    or window.pending >= self.sync_tokens
+                    or rule.limit - local.estimate < self.sync_tokens
+                )
+            if not need_sync:
+                self.local_decisions += 1
+                return local
+            amount, window.pending = window.pending, 0
+
+        try:
+            self._flush(identity, stale)
+            if evicted is not None:
+                self._flush(evicted[0][1], evicted[1])
+            current, previous = self.shared.consume(rule, identity, index, amount)
+        except Exception:
+            # Keep the hits for the next reconciliation rather than dropping them.
+            with self._lock:
+                window.pending += amount
+            raise
+        self.syncs += 1
+        with self._lock:
+            window.current = current
+            window.previous = previous
+            window.synced_at = now
+        return evaluate(current, previous, rule.limit, rule.window, elapsed)
+
+    def _flush(self, identity, window):
+        """Push hits still pending on a rolled-over or evicted window."""
+        if window is not None and window.pending:
+            with self._lock:
+                pending, window.pending = window.pending, 0
+            try:
+                self.shared.consume(window.rule, identity, window.index, pending)
+            except Exception:
+                with self._lock:
+                    window.pending += pending
+                raise
+
+
+def get_rate_limiter():
+    """
+    Redis-backed counter when NAI_SECURITY_REDIS_URL is set, else the cache one;
+    wrapped in a LocalTokenLimiter when NAI_SECURITY_RATE_LIMIT_MODE = 'approximate'.
+    """
+    client = get_redis_client()
+    shared = RedisSlidingWindow(client) if client is not None else CacheSlidingWindow()
+    if getattr(django_settings, 'NAI_SECURITY_RATE_LIMIT_MODE', 'strict') == 'approximate':
+        return LocalTokenLimiter(
+            shared,
+            sync_tokens=getattr(django_settings, 'NAI_SECURITY_RATE_LIMIT_SYNC_TOKENS', 10),
+            sync_interval=getattr(django_settings, 'NAI_SECURITY_RATE_LIMIT_SYNC_INTERVAL_MS', 100) / 1000,
+        )
+    return shared
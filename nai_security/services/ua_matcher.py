@@ -0,0 +1,394 @@
+"""
+Compiled matcher for the active BlockedUserAgent patterns.
+
+The pattern set is compiled once per version instead of being walked pattern by
+pattern on every request:
+
+- exact patterns: one dict lookup on the lowercased user agent
+- contains patterns: one Aho-Corasick pass over the lowercased user agent
+- regex patterns: one alternation searched over the lowercased user agent;
+  patterns that need IGNORECASE proper (uppercase literals) or define their
+  own groups (merging would renumber backreferences) are compiled on their own
+
+A user agent several patterns match is attributed to the first of them in
+pattern order (BlockedUserAgent's ordering), as when the rows were tried one
+by one, so block counts and logs name the same pattern they always did.
+
+UA_PATTERN_CACHE_KEY holds (PATTERN_CACHE_FORMAT, version, rows) with rows as
+plain (pk, pattern, block_type) tuples, not pickled model instances. The
+version lives under UA_PATTERN_VERSION_KEY; BlockedUserAgent.save/delete
+clear it together with UA_PATTERN_CACHE_KEY, and each worker recompiles the
+next time it sees a version it has not compiled.
+
+Each compiled matcher also memoizes verdicts per user-agent string in a
+VerdictCache, so the recompile doubles as its invalidation.
+"""
+import logging
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Iterable
+
+from asgiref.sync import sync_to_async
+from django.conf import settings as django_settings
+from django.core.cache import cache
+
+from ..models.blocked_user_agent import UA_PATTERN_CACHE_KEY, UA_PATTERN_VERSION_KEY
+
+logger = logging.getLogger(__name__)
+
+
+class AhoCorasick:
+    """Multi-pattern substring automaton. Values are reported for each keyword found."""
+
+    __slots__ = ('_goto', '_fail', '_out', '_least')
+
+    def __init__(self, keywords: Iterable[tuple[str, object]]):
+        goto: list[dict[str, int]] = [{}]
+        out: list[Any] = [None]
+        for keyword, value in keywords:
+            if not keyword:
+                continue
+            state = 0
+            for ch in keyword:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append(None)
+                state = nxt
+            if out[state] is None:
+                out[state] = value
+
+        # Breadth-first failure links; a state inherits the output of its
+        # failure state so a match is reported as soon as any keyword ends.
+        fail = [0] * len(goto)
+        least = list(out)
+        queue = list(goto[0].values())
+        for state in queue:
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                inherited = least[fail[nxt]]
+                if inherited is not None and (least[nxt] is None or inherited < least[nxt]):
+                    least[nxt] = inherited
+                if out[nxt] is None:
+                    out[nxt] = out[fail[nxt]]
+
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+        self._least = least
+
+    def search(self, text: str):
+        """Value of the first keyword to end in text, or None."""
+        goto, fail, out = self._goto, self._fail, self._out
+        if len(goto) == 1:
+            return None
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state] is not None:
+                return out[state]
+        return None
+
+    def least(self, text: str):
+        """Smallest value among the keywords found anywhere in text, or None."""
+        goto, fail, least = self._goto, self._fail, self._least
+        if len(goto) == 1:
+            return None
+        best = None
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            found = least[state]
+            if found is not None and (best is None or found < best):
+                best = found
+        return best
+
+
+_MISS = object()
+
+PATTERN_CACHE_FORMAT = 2
+
+
+class UAPattern:
+    """The parts of a BlockedUserAgent row the matcher and middleware use."""
+
+    __slots__ = ('pk', 'pattern', 'block_type')
+
+    def __init__(self, pk, pattern, block_type):
+        self.pk = pk
+        self.pattern = pattern
+        self.block_type = block_type
+
+    def __repr__(self):
+        return f"UAPattern({self.pk!r}, {self.pattern!r}, {self.block_type!r})"
+
+DEFAULT_VERDICT_CACHE_SIZE = 4096
+DEFAULT_VERDICT_MAX_LENGTH = 512
+
+
+class VerdictCache:
+    """
+    Bounded segmented LRU of user-agent string -> matched pattern (or None).
+
+    New entries land in a small probation segment and are promoted to the
+    protected segment on their second hit, so a stream of one-off user agents
+    only churns probation and cannot evict the hot ones. Strings longer than
+    max_length are never cached.
+    """
+
+    def __init__(self, maxsize=DEFAULT_VERDICT_CACHE_SIZE, max_length=DEFAULT_VERDICT_MAX_LENGTH):
+        self.maxsize = maxsize
+        self.max_length = max_length
+        self._probation_size = max(1, maxsize // 5)
+        self._protected_size = max(0, maxsize - self._probation_size)
+        self._probation = OrderedDict()
+        self._protected = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+
+    def get(self, user_agent: str):
+        """Cached verdict, or _MISS."""
+        if len(user_agent) > self.max_length:
+            self.skipped += 1
+            return _MISS
+        with self._lock:
+            value = self._protected.get(user_agent, _MISS)
+            if value is not _MISS:
+                self._protected.move_to_end(user_agent)
+                self.hits += 1
+                return value
+            value = self._probation.pop(user_agent, _MISS)
+            if value is _MISS:
+                self.misses += 1
+                return _MISS
+            self.hits += 1
+            if self._protected_size:
+                self._protected[user_agent] = value
+                if len(self._protected) > self._protected_size:
+                    # Demote rather than drop: it was hot once.
+                    demoted, demoted_value = self._protected.popitem(last=False)
+                    self._add_probation(demoted, demoted_value)
+            else:
+                self._add_probation(user_agent, value)
+            return value
+
+    def put(self, user_agent: str, value) -> None:
+        if len(user_agent) > self.max_length:
+            return
+        with self._lock:
+            if user_agent not in self._protected:
+                self._add_probation(user_agent, value)
+
+    def _add_probation(self, user_agent, value):
+        self._probation[user_agent] = value
+        self._probation.move_to_end(user_agent)
+        if len(self._probation) > self._probation_size:
+            self._probation.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._probation) + len(self._protected)
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'skipped': self.skipped,
+        }
+
+
+_ESCAPE = re.compile(r'\\.', re.DOTALL)
+
+
+def _is_case_folded(regex: str) -> bool:
+    """
+    True if searching the lowercased user agent without IGNORECASE gives the
+    same result as IGNORECASE on the original: no uppercase characters outside
+    escape sequences, and no escapes that spell a character by code point.
+    """
+    if re.search(r'\\[xuUN0-7]', regex):
+        return False
+    return not any(ch.isupper() for ch in _ESCAPE.sub('', regex))
+
+
+class UserAgentMatcher:
+    """Immutable compiled form of a list of BlockedUserAgent-like patterns."""
+
+    def __init__(self, patterns: Iterable, version=None, verdict_cache_size=0,
+                 verdict_max_length=DEFAULT_VERDICT_MAX_LENGTH):
+        """
+        patterns: objects with pattern and block_type attributes, in precedence order.
+        verdict_cache_size > 0 memoizes match() per user-agent string.
+        """
+        self.version = version
+        self.verdicts = (
+            VerdictCache(verdict_cache_size, verdict_max_length) if verdict_cache_size > 0 else None
+        )
+        # Every table holds (position, pattern) so hits from different tables
+        # can be ranked by pattern order.
+        exact: dict[str, tuple[int, object]] = {}
+        contains = []
+        folded = []
+        separate = []
+        for position, pattern in enumerate(patterns):
+            text = pattern.pattern
+            if pattern.block_type == 'exact':
+                exact.setdefault(text.lower(), (position, pattern))
+            elif pattern.block_type == 'contains':
+                contains.append((text.lower(), (position, pattern)))
+            elif pattern.block_type == 'regex':
+                try:
+                    compiled = re.compile(text, re.IGNORECASE)
+                except re.error:
+                    logger.warning("Skipping invalid user agent regex: %r", text)
+                    continue
+                if not compiled.groups and _is_case_folded(text):
+                    folded.append((position, re.compile(text), pattern))
+                else:
+                    separate.append((position, compiled, pattern))
+
+        self._exact = exact
+        self._contains = AhoCorasick(contains)
+        # One non-capturing alternation over the lowercased user agent answers
+        # "does any folded regex match" in a single pass; the (rare) hit is then
+        # attributed by trying the folded regexes one by one. Named capture
+        # groups or IGNORECASE would each disable sre's alternation fast paths.
+        self._folded = tuple(folded)
+        self._folded_any = None
+        if folded:
+            try:
+                self._folded_any = re.compile('|'.join(f'(?:{c.pattern})' for _, c, _ in folded))
+            except re.error:
+                # e.g. a global inline flag that is only legal at the very start
+                separate.extend((i, re.compile(c.pattern, re.IGNORECASE), p) for i, c, p in folded)
+                separate.sort(key=lambda entry: entry[0])
+                self._folded = ()
+        self._separate = tuple(separate)
+        self.size = len(exact) + len(contains) + len(self._folded) + len(self._separate)
+
+    def match(self, user_agent: str):
+        """Return the first matching pattern object, or None."""
+        if not user_agent:
+            return None
+        if self.verdicts is None:
+            return self._match(user_agent)
+        found = self.verdicts.get(user_agent)
+        if found is _MISS:
+            found = self._match(user_agent)
+            self.verdicts.put(user_agent, found)
+        return found
+
+    def _match(self, user_agent: str):
+        ua_lower = user_agent.lower()
+        best = self._exact.get(ua_lower)
+        found = self._contains.least(ua_lower)
+        if found is not None and (best is None or found[0] < best[0]):
+            best = found
+        # The regex tables are in pattern order, so each scan stops at the
+        # first hit or at the position already beaten.
+        limit = best[0] if best is not None else math.inf
+        if self._folded_any is not None and self._folded[0][0] < limit and self._folded_any.search(ua_lower):
+            for position, compiled, pattern in self._folded:
+                if position >= limit:
+                    break
+                if compiled.search(ua_lower):
+                    best, limit = (position, pattern), position
+                    break
+        for position, compiled, pattern in self._separate:
+            if position >= limit:
+                break
+            if compiled.search(user_agent):
+                best = (position, pattern)
+                break
+        return best[1] if best is not None else None
+
+
+_matcher = UserAgentMatcher(())
+_lock = threading.Lock()
+
+
+def _load_patterns() -> tuple:
+    from ..models import BlockedUserAgent
+    return tuple(
+        BlockedUserAgent.objects.filter(is_active=True).values_list('pk', 'pattern', 'block_type')
+    )
+
+
+def _unpack(cached):
+    """(version, rows) from a cached entry, or None if missing or in an older format."""
+    if not isinstance(cached, tuple) or len(cached) != 3 or cached[0] != PATTERN_CACHE_FORMAT:
+        return None
+    return cached[1], cached[2]
+
+
+def _compile(version, cached):
+    """Build the matcher for version from the cached pattern entry or the DB."""
+    global _matcher
+    with _lock:
+        if version is not None and _matcher.version == version:
+            return _matcher
+        entry = _unpack(cached)
+        if entry is None or (version is not None and entry[0] != version):
+            entry = (time.time_ns(), _load_patterns())
+            cache.set(UA_PATTERN_CACHE_KEY, (PATTERN_CACHE_FORMAT, *entry), 300)
+            cache.set(UA_PATTERN_VERSION_KEY, entry[0], 300)
+        elif version is None:
+            cache.set(UA_PATTERN_VERSION_KEY, entry[0], 300)
+        _matcher = UserAgentMatcher(
+            [UAPattern(*row) for row in entry[1]],
+            version=entry[0],
+            verdict_cache_size=getattr(
+                django_settings, 'NAI_SECURITY_UA_VERDICT_CACHE_SIZE', DEFAULT_VERDICT_CACHE_SIZE,
+            ),
+            verdict_max_length=getattr(
+                django_settings, 'NAI_SECURITY_UA_VERDICT_MAX_LENGTH', DEFAULT_VERDICT_MAX_LENGTH,
+            ),
+        )
+        return _matcher
+
+
+def get_ua_matcher() -> UserAgentMatcher:
+    """Return this worker's matcher, recompiling if the pattern version moved."""
+    version = cache.get(UA_PATTERN_VERSION_KEY)
+    matcher = _matcher
+    if version is not None and matcher.version == version:
+        return matcher
+    return _compile(version, cache.get(UA_PATTERN_CACHE_KEY))
+
+
+async def get_ua_matcher_async() -> UserAgentMatcher:
+    """Async version of get_ua_matcher(); only a recompile leaves the event loop."""
+    version = await cache.aget(UA_PATTERN_VERSION_KEY)
+    matcher = _matcher
+    if version is not None and matcher.version == version:
+        return matcher
+    return await sync_to_async(_compile)(version, await cache.aget(UA_PATTERN_CACHE_KEY))
+
+
+def reset_ua_matcher() -> None:
+    """Drop this worker's compiled matcher."""
+    global _matcher
+    with _lock:
+        _matcher = UserAgentMatcher(())
+
+
+def ua_verdict_stats() -> dict:
+    """Hit/miss counters of the current matcher's verdict cache (empty if disabled)."""
+    verdicts = _matcher.verdicts
+    return verdicts.stats() if verdicts is not None else {}
@@ -0,0 +1,142 @@
+"""
+UserAgentString lookups for SecurityLog and LoginHistory.
+
+Each distinct user-agent string is stored once, keyed by its SHA-256; log
+rows reference it by id (and, until the text column is dropped, still carry
+the text). user_agent_ids() maps strings to ids with a bulk
+get-or-create (one SELECT for the unknown hashes, one INSERT ... ON CONFLICT
+DO NOTHING for the new ones, one SELECT for their ids) and keeps a
+process-local LRU of hash -> id of NAI_SECURITY_UA_ID_CACHE_SIZE entries
+(default 4096), so steady traffic resolves its few hundred agents without a
+query. Ids enter the cache only once the surrounding transaction commits: a
+rolled-back insert never leaves a dangling id behind.
+
+The rows are protected from deletion while referenced (on_delete=PROTECT),
+so purging old log rows leaves strings nobody uses any more;
+purge_orphan_user_agents() (run by purge_security_logs) deletes them and
+bumps PURGE_VERSION_CACHE_KEY, on which every process drops its cached ids
+(read at most every PURGE_CHECK_INTERVAL seconds).
+"""
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterable
+from datetime import datetime
+
+from django.conf import settings as django_settings
+from django.core.cache import cache
+from django.db import router, transaction
+from django.db.models import Exists, OuterRef
+
+from ..models import LoginHistory, SecurityLog, UserAgentString
+
+DEFAULT_CACHE_SIZE = 4096
+QUERY_CHUNK = 500
+
+PURGE_VERSION_CACHE_KEY = 'sec_user_agent_purge'
+PURGE_CHECK_INTERVAL = 1
+
+_ids: OrderedDict[str, int] = OrderedDict()
+_lock = threading.Lock()
+_purge_version = None
+_purge_checked_at = 0.0
+
+
+def user_agent_ids(values: Iterable[str]) -> dict[str, int]:
+    """{user agent: UserAgentString id} for the non-empty values, creating missing rows."""
+    hashes = {value: UserAgentString.hash_value(value) for value in set(values) if value}
+    if hashes:
+        _forget_purged()
+    ids, missing = {}, {}
+    with _lock:
+        for value, digest in hashes.items():
+            if digest in _ids:
+                _ids.move_to_end(digest)
+                ids[value] = _ids[digest]
+            else:
+                missing[digest] = value
+    if not missing:
+        return ids
+
+    found = _lookup(list(missing))
+    new = [UserAgentString(hash=digest, value=value) for digest, value in missing.items() if digest not in found]
+    if new:
+        UserAgentString.objects.bulk_create(new, batch_size=QUERY_CHUNK, ignore_conflicts=True)
+        found.update(_lookup([row.hash for row in new]))
+    for digest, value in missing.items():
+        ids[value] = found[digest]
+    transaction.on_commit(lambda: _remember(found), using=router.db_for_write(UserAgentString))
+    return ids
+
+
+def _lookup(digests: list) -> dict[str, int]:
+    found = {}
+    for i in range(0, len(digests), QUERY_CHUNK):
+        found.update(UserAgentString.objects.filter(
+            hash__in=digests[i:i + QUERY_CHUNK],
+        ).values_list('hash', 'id'))
+    return found
+
+
+def _remember(found: dict) -> None:
+    size = getattr(django_settings, 'NAI_SECURITY_UA_ID_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+    if size <= 0:
+        return
+    with _lock:
+        _ids.update(found)
+        while len(_ids) > size:
+            _ids.popitem(last=False)
+
+
+def resolve_user_agents(instances) -> None:
+    """Point the instances' user_agent_string at the rows for their user_agent text."""
+    instances = list(instances)
+    ids = user_agent_ids(instance.user_agent for instance in instances)
+    for instance in instances:
+        instance.user_agent_string_id = ids.get(instance.user_agent)
+
+
+def _forget_purged() -> None:
+    """
+    Drop the cached ids if orphaned strings were purged since they were
+    cached. Reads the purge version at most every PURGE_CHECK_INTERVAL seconds.
+    """
+    global _purge_version, _purge_checked_at
+    now = time.monotonic()
+    if now - _purge_checked_at < PURGE_CHECK_INTERVAL:
+        return
+    _purge_checked_at = now
+    version = cache.get(PURGE_VERSION_CACHE_KEY)
+    if version != _purge_version:
+        clear_user_agent_cache()
+        _purge_version = version
+
+
+def purge_orphan_user_agents(before: datetime, batch_size: int = QUERY_CHUNK) -> int:
+    """
+    Delete the UserAgentString rows created before `before` that no
+    SecurityLog or LoginHistory row references, batch_size at a time. Newer
+    rows are kept: their log rows may not have committed yet. Returns the
+    number deleted.
+    """
+    orphans = UserAgentString.objects.filter(created_at__lt=before).filter(
+        ~Exists(SecurityLog.objects.filter(user_agent_string=OuterRef('pk'))),
+        ~Exists(LoginHistory.objects.filter(user_agent_string=OuterRef('pk'))),
+    )
+    deleted = 0
+    while True:
+        pks = list(orphans.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+        if not deleted:
+            cache.set(PURGE_VERSION_CACHE_KEY, datetime.now().timestamp(), None)
+            clear_user_agent_cache()
+        deleted += orphans.filter(pk__in=pks).delete()[0]
+    return deleted
+
+
+def clear_user_agent_cache() -> None:
+    global _purge_checked_at
+    with _lock:
+        _ids.clear()
+    _purge_checked_at = 0.0
@@ -45,6 +45,39 @@ def cleanup_expired_blocks():
         return {'error': str(e)}
 
 
+@shared_task(name='security.purge_security_logs')
+def purge_security_logs():
+    """
+    Create upcoming SecurityLog partitions (if partitioned) and delete
+    entries older than security_log_retention_days.
+    Run daily.
+    """
+    from .services.log_retention import ensure_log_partitions, purge_security_logs as purge
+    
+    try:
+        result = purge()
+        result['partitions_created'] = ensure_log_partitions()
+        return result
+    except Exception as e:
+        logger.error(f"Security log purge failed: {e}")
+        return {'error': str(e)}
+
+
+@shared_task(name='security.rollup_security_events')
+def rollup_security_events():
+    """
+    Fold new SecurityLog rows into the hourly SecurityEventRollup counts.
+    Run every 1-5 minutes.
+    """
+    from .services.event_rollups import rollup_security_events as rollup
+    
+    try:
+        return {'rolled_up': rollup()}
+    except Exception as e:
+        logger.error(f"Security event rollup failed: {e}")
+        return {'error': str(e)}
+
+
 @shared_task(name='security.sync_security_lists')
 def sync_security_lists():
     """
@@ -69,35 +102,16 @@ def generate_security_report():
     """
     from django.utils import timezone
     from datetime import timedelta
-    from django.db.models import Count
-    from .models import SecurityLog, BlockedIP, LoginHistory
+    from .models import BlockedIP, LoginHistory
+    from .services.log_readers import get_log_reader
     
     try:
         yesterday = timezone.now() - timedelta(days=1)
         
         # Get stats
-        total_blocks = SecurityLog.objects.filter(created_at__gte=yesterday).count()
-        
-        blocks_by_action = dict(
-            SecurityLog.objects.filter(created_at__gte=yesterday)
-            .values_list('action')
-            .annotate(count=Count('id'))
-        )
-        
-        top_blocked_ips = list(
-            SecurityLog.objects.filter(created_at__gte=yesterday)
-            .values('ip_address')
-            .annotate(count=Count('id'))
-            .order_by('-count')[:10]
-        )
-        
-        top_blocked_countries = list(
-            SecurityLog.objects.filter(created_at__gte=yesterday)
-            .exclude(country_code='')
-            .values('country_code')
-            .annotate(count=Count('id'))
-            .order_by('-count')[:10]
-        )
+        reader = get_log_reader()
+        reader.refresh()
+        log_stats = reader.report(yesterday)
         
         new_auto_blocks = BlockedIP.objects.filter(
             is_auto_blocked=True,
@@ -111,10 +125,7 @@ def generate_security_report():
         
         report = {
             'period': 'last_24h',
-            'total_blocks': total_blocks,
-            'blocks_by_action': blocks_by_action,
-            'top_blocked_ips': top_blocked_ips,
-            'top_blocked_countries': top_blocked_countries,
+            **log_stats,
             'new_auto_blocks': new_auto_blocks,
             'suspicious_logins': suspicious_logins,
         }
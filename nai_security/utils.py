@@ -1,72 +1,363 @@
+import ipaddress
 import logging
+import math
 import os
+import threading
+import time
+from collections import OrderedDict
 from django.conf import settings
 from django.core.cache import cache
 
 logger = logging.getLogger(__name__)
 
-# GeoIP reader instance (lazy loaded)
-_geoip_reader = None
+_geoip_shared_stats = {'hits': 0, 'misses': 0}
 
+DEFAULT_GEOIP_CACHE_SIZE = 65536
+_GEOIP_MISS = object()
 
-def get_geoip_reader():
-    """Get or create GeoIP2 reader instance."""
-    global _geoip_reader
-    
-    if _geoip_reader is not None:
-        return _geoip_reader
-    
+GEOIP_EDITION_FILENAMES = {
+    'country': 'GeoLite2-Country.mmdb',
+    'asn': 'GeoLite2-ASN.mmdb',
+}
+
+# Redis client for NAI_SECURITY_REDIS_URL (lazy loaded)
+_redis_client = None
+
+# Shared counter bumped on every write to a policy model (blocked/whitelisted
+# IPs, countries, user exemptions, settings). Workers compare it against the
+# generation of their in-process PolicySnapshot to decide when to rebuild.
+POLICY_GENERATION_CACHE_KEY = 'sec_policy_generation'
+
+# An inline auto-block advances the generation like any other policy write,
+# but also leaves (ip_address, expires_at) under this prefix and the new
+# generation, so workers add the address to their copies instead of
+# rebuilding them (see PolicyGenerationCache).
+INLINE_BLOCK_CACHE_PREFIX = 'sec_inline_block'
+INLINE_BLOCK_TTL = 600
+
+# Bumped only by writes that change the country policy (BlockedCountry,
+# AllowedCountry, SecuritySettings), so the compiled country ranges are not
+# rebuilt every time an IP is blocked.
+COUNTRY_POLICY_VERSION_CACHE_KEY = 'sec_country_policy_version'
+
+
+class GeoIPResultCache:
+    """Bounded LRU of IP address -> country code or ASN (None cached too), with hit/miss counters."""
+
+    def __init__(self, maxsize=DEFAULT_GEOIP_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, ip_address: str):
+        """Cached country code or ASN (or None), or _GEOIP_MISS."""
+        with self._lock:
+            value = self._data.get(ip_address, _GEOIP_MISS)
+            if value is _GEOIP_MISS:
+                self.misses += 1
+            else:
+                self._data.move_to_end(ip_address)
+                self.hits += 1
+            return value
+
+    def put(self, ip_address: str, value: str | int | None) -> None:
+        with self._lock:
+            self._data[ip_address] = value
+            self._data.move_to_end(ip_address)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {'size': len(self), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+class GeoIPDatabase:
+    """
+    One memory-mapped .mmdb file (the Country or ASN edition) shared by the
+    process, plus a per-process LRU of lookup results.
+
+    At most every NAI_SECURITY_GEOIP_RELOAD_INTERVAL seconds (default 5; 0
+    disables reloading) the file is stat'ed, and if its inode, mtime or size
+    changed a new reader is opened and swapped in and the result cache is
+    dropped. Lookups still running on the old reader finish on it; it is closed
+    once no longer referenced.
+    """
+
+    def __init__(self, edition: str, path_getter):
+        self.edition = edition
+        self.path_getter = path_getter
+        self._reader = None
+        self._file_id = None
+        self._checked_at = None
+        self._results: GeoIPResultCache | None = None
+        self._lock = threading.Lock()
+
+    def get_reader(self):
+        interval = getattr(settings, 'NAI_SECURITY_GEOIP_RELOAD_INTERVAL', 5)
+        now = time.monotonic()
+        if not self._check_due(now, interval):
+            return self._reader
+        with self._lock:
+            if not self._check_due(now, interval):
+                return self._reader
+            try:
+                return self._open()
+            finally:
+                # Only stamped once the check is complete, so concurrent callers
+                # that skip the lock never see "checked" while the first reader
+                # is opening.
+                self._checked_at = now
+
+    def results(self) -> GeoIPResultCache:
+        """This reader's result cache (replaced whenever the reader is)."""
+        results = self._results
+        if results is None:
+            with self._lock:
+                if self._results is None:
+                    self._results = GeoIPResultCache(
+                        getattr(settings, 'NAI_SECURITY_GEOIP_CACHE_SIZE', DEFAULT_GEOIP_CACHE_SIZE),
+                    )
+                results = self._results
+        return results
+
+    def reset(self) -> None:
+        """Drop the reader and results; the next lookup opens the database again."""
+        with self._lock:
+            self._reader = self._file_id = self._checked_at = self._results = None
+
+    def _check_due(self, now: float, interval: float) -> bool:
+        if self._checked_at is None:
+            return True
+        if not interval:
+            return self._reader is None
+        return now - self._checked_at >= interval
+
+    def _open(self):
+        """(Re)open the reader if the database file changed. Call with _lock held."""
+        path = self.path_getter()
+        if not path:
+            return self._reader
+
+        try:
+            file_id = _geoip_file_identity(path)
+        except OSError:
+            if self._reader is None:
+                logger.error(f"GeoIP database not found at {path}")
+            return self._reader
+
+        if self._reader is not None and file_id == self._file_id:
+            return self._reader
+
+        try:
+            import geoip2.database
+            reader = geoip2.database.Reader(path, mode=_geoip_open_mode())
+        except Exception as e:
+            # Keep serving the previous database, if any; retried next interval.
+            logger.error(f"Failed to load GeoIP database: {e}")
+            return self._reader
+
+        action = "reloaded" if self._reader is not None else "loaded"
+        self._reader, self._file_id, self._results = reader, file_id, None
+        logger.info(f"GeoIP database {action} from {path}")
+        return reader
+
+
+def _geoip_open_mode() -> int:
+    """MODE_MMAP_EXT when the maxminddb C extension is available, else MODE_MMAP."""
+    import maxminddb
     try:
-        import geoip2.database
-        geoip_path = resolve_geoip_db_path(getattr(settings, 'GEOIP_PATH', None))
-        
-        if not geoip_path:
-            logger.warning("GEOIP_PATH not configured in settings")
-            return None
-        
-        _geoip_reader = geoip2.database.Reader(geoip_path)
-        logger.info(f"GeoIP database loaded from {geoip_path}")
-        return _geoip_reader
-        
-    except FileNotFoundError:
-        logger.error(f"GeoIP database not found at {geoip_path}")
+        from maxminddb import extension
+    except ImportError:
+        return maxminddb.MODE_MMAP
+    if hasattr(extension, 'Reader'):
+        return maxminddb.MODE_MMAP_EXT
+    return maxminddb.MODE_MMAP
+
+
+def _geoip_file_identity(path: str) -> tuple:
+    """What identifies one version of a database file: a replacement changes it."""
+    stat = os.stat(path)
+    return (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def get_geoip_path() -> str | None:
+    """The Country database: GEOIP_PATH (a file, or a directory holding GeoLite2-Country.mmdb)."""
+    path = resolve_geoip_db_path(getattr(settings, 'GEOIP_PATH', None))
+    if not path:
+        logger.warning("GEOIP_PATH not configured in settings")
+    return path
+
+
+def get_geoip_asn_path() -> str | None:
+    """
+    The ASN database: NAI_SECURITY_GEOIP_ASN_PATH if set, else GeoLite2-ASN.mmdb
+    next to the Country database resolved from GEOIP_PATH.
+    """
+    path = getattr(settings, 'NAI_SECURITY_GEOIP_ASN_PATH', None)
+    if path:
+        return resolve_geoip_db_path(path, 'asn')
+    country_path = getattr(settings, 'GEOIP_PATH', None)
+    if not country_path:
         return None
+    if os.path.isdir(country_path):
+        return resolve_geoip_db_path(country_path, 'asn')
+    return os.path.join(os.path.dirname(country_path), GEOIP_EDITION_FILENAMES['asn'])
+
+
+_country_db = GeoIPDatabase('country', get_geoip_path)
+_asn_db = GeoIPDatabase('asn', get_geoip_asn_path)
+
+
+def get_geoip_reader():
+    """Get the process-wide GeoIP2 Country reader (memory-mapped, hot-reloaded)."""
+    return _country_db.get_reader()
+
+
+def get_geoip_asn_reader():
+    """Get the process-wide GeoIP2 ASN reader (memory-mapped, hot-reloaded)."""
+    return _asn_db.get_reader()
+
+
+def reset_geoip_reader() -> None:
+    """Drop this process's readers; the next lookup opens the databases again."""
+    _country_db.reset()
+    _asn_db.reset()
+
+
+def _geoip_cache_mode() -> str:
+    """NAI_SECURITY_GEOIP_CACHE: 'local' (default), 'shared' or 'none'."""
+    return getattr(settings, 'NAI_SECURITY_GEOIP_CACHE', 'local')
+
+
+def geoip_cache_stats() -> dict:
+    """Hit/miss counters of the active GeoIP cache mode."""
+    mode = _geoip_cache_mode()
+    if mode == 'local':
+        return {'mode': mode, **_country_db.results().stats()}
+    if mode == 'shared':
+        return {'mode': mode, **_geoip_shared_stats}
+    return {'mode': mode}
+
+
+def _lookup_country(reader, ip_address: str) -> str | None:
+    try:
+        return reader.country(ip_address).country.iso_code
     except Exception as e:
-        logger.error(f"Failed to load GeoIP database: {e}")
+        logger.debug(f"Could not determine country for IP {ip_address}: {e}")
         return None
 
 
 def get_country_from_ip(ip_address: str) -> str | None:
-    """Get country code from IP address."""
+    """
+    Get country code from IP address.
+
+    Results are cached per NAI_SECURITY_GEOIP_CACHE: 'local' (default) keeps a
+    bounded per-process LRU, cleared when the database is reloaded; 'shared'
+    uses the Django cache for an hour (one round-trip per lookup); 'none'
+    always asks the memory-mapped reader.
+    """
     if not ip_address or ip_address in ('127.0.0.1', 'localhost', '::1'):
         return None
-    
+
+    mode = _geoip_cache_mode()
+    if mode == 'shared':
+        cache_key = f"geoip_country:{ip_address}"
+        cached = cache.get(cache_key)
+        if cached is not None:
+            _geoip_shared_stats['hits'] += 1
+            return cached if cached != '__NONE__' else None
+        _geoip_shared_stats['misses'] += 1
+        reader = get_geoip_reader()
+        if reader is None:
+            return None
+        country_code = _lookup_country(reader, ip_address)
+        cache.set(cache_key, country_code or '__NONE__', 3600)
+        return country_code
+
+    reader = get_geoip_reader()
+    if reader is None:
+        return None
+    if mode == 'none':
+        return _lookup_country(reader, ip_address)
+
+    results = _country_db.results()
+    country_code = results.get(ip_address)
+    if country_code is _GEOIP_MISS:
+        country_code = _lookup_country(reader, ip_address)
+        results.put(ip_address, country_code)
+    return country_code
+
+
+async def get_country_from_ip_async(ip_address: str) -> str | None:
+    """Async version of get_country_from_ip(). Only 'shared' mode awaits the cache."""
+    if not ip_address or ip_address in ('127.0.0.1', 'localhost', '::1'):
+        return None
+
+    if _geoip_cache_mode() != 'shared':
+        return get_country_from_ip(ip_address)
+
     cache_key = f"geoip_country:{ip_address}"
-    cached = cache.get(cache_key)
+    cached = await cache.aget(cache_key)
     if cached is not None:
+        _geoip_shared_stats['hits'] += 1
         return cached if cached != '__NONE__' else None
-    
+    _geoip_shared_stats['misses'] += 1
     reader = get_geoip_reader()
     if reader is None:
         return None
-    
+    country_code = _lookup_country(reader, ip_address)
+    await cache.aset(cache_key, country_code or '__NONE__', 3600)
+    return country_code
+
+
+def get_asn_from_ip(ip_address: str) -> int | None:
+    """
+    Get the autonomous system number of an IP address from the ASN database,
+    or None (no database, unknown or private address).
+
+    Cached in a per-process LRU next to the reader unless
+    NAI_SECURITY_GEOIP_CACHE is 'none'. The lookup never touches the shared
+    cache, so it is safe to call from async code.
+    """
+    if not ip_address or ip_address in ('127.0.0.1', 'localhost', '::1'):
+        return None
+
+    reader = get_geoip_asn_reader()
+    if reader is None:
+        return None
+    if _geoip_cache_mode() == 'none':
+        return _lookup_asn(reader, ip_address)
+
+    results = _asn_db.results()
+    asn = results.get(ip_address)
+    if asn is _GEOIP_MISS:
+        asn = _lookup_asn(reader, ip_address)
+        results.put(ip_address, asn)
+    return asn
+
+
+def _lookup_asn(reader, ip_address: str) -> int | None:
     try:
-        response = reader.country(ip_address)
-        country_code = response.country.iso_code
-        cache.set(cache_key, country_code or '__NONE__', 3600)
-        return country_code
+        return reader.asn(ip_address).autonomous_system_number
     except Exception as e:
-        logger.debug(f"Could not determine country for IP {ip_address}: {e}")
-        cache.set(cache_key, '__NONE__', 3600)
+        logger.debug(f"Could not determine ASN for IP {ip_address}: {e}")
         return None
 
 
-def resolve_geoip_db_path(path: str | None) -> str | None:
-    """Return the .mmdb file path. Django's GEOIP_PATH may be a directory."""
+def resolve_geoip_db_path(path: str | None, edition: str = 'country') -> str | None:
+    """
+    Return the .mmdb file path for an edition ('country' or 'asn'). Django's
+    GEOIP_PATH may be a directory, holding GeoLite2-Country.mmdb / GeoLite2-ASN.mmdb.
+    """
     if not path:
         return None
     if os.path.isdir(path):
-        return os.path.join(path, 'GeoLite2-Country.mmdb')
+        return os.path.join(path, GEOIP_EDITION_FILENAMES[edition])
     return path
 
 
@@ -87,6 +378,40 @@ def get_client_ip(request) -> str:
     return request.META.get('HTTP_X_REAL_IP') or remote
 
 
+def normalize_network(ip_address: str, prefix_length: int | None = None) -> tuple[str, int | None]:
+    """
+    Canonicalize an address or network to (network_address, prefix_length).
+
+    Accepts either a CIDR string ("203.0.113.0/24") or an address plus a separate
+    prefix length. Host bits are masked off, and a full-length prefix (/32, /128)
+    collapses to (address, None) so single addresses keep their existing form.
+    Raises ValueError for invalid input.
+    """
+    ip_address = str(ip_address).strip()
+    if '/' in ip_address:
+        ip_address, _, prefix = ip_address.partition('/')
+        prefix_length = int(prefix)
+    if prefix_length is None:
+        ipaddress.ip_address(ip_address)
+        return ip_address, None
+    network = ipaddress.ip_network(f"{ip_address}/{prefix_length}", strict=False)
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address), None
+    return str(network.network_address), network.prefixlen
+
+
+def block_cache_timeout(expires_at, timeout: int = 300) -> int:
+    """
+    Timeout for a cached "blocked" verdict: `timeout`, cut short so that the
+    entry is gone no later than the block's expires_at.
+    """
+    if expires_at is None:
+        return timeout
+    from django.utils import timezone
+    remaining = math.ceil((expires_at - timezone.now()).total_seconds())
+    return max(1, min(timeout, remaining))
+
+
 def parse_user_agent(user_agent: str) -> dict:
     """Parse user agent string to extract device info."""
     result = {
@@ -136,8 +461,175 @@ def parse_user_agent(user_agent: str) -> dict:
     return result
 
 
+def get_policy_generation() -> int | None:
+    """Return the shared policy generation, or None if the counter is missing."""
+    return cache.get(POLICY_GENERATION_CACHE_KEY)
+
+
+def bump_policy_generation() -> int:
+    """
+    Advance the shared policy generation so every worker rebuilds its snapshot.
+
+    A missing counter (first write, cache flush, eviction) is re-seeded from the
+    wall clock rather than 1, so a generation number a worker saw before the
+    flush is never handed out again.
+    """
+    return _bump_counter(POLICY_GENERATION_CACHE_KEY)
+
+
+def publish_inline_block(ip_address: str, expires_at) -> int:
+    """Advance the generation for one inline auto-block of ip_address; returns the new generation."""
+    generation = bump_policy_generation()
+    cache.set(f"{INLINE_BLOCK_CACHE_PREFIX}:{generation}", (ip_address, expires_at), INLINE_BLOCK_TTL)
+    return generation
+
+
+def bump_country_policy_version() -> int:
+    """Advance the country policy version (see COUNTRY_POLICY_VERSION_CACHE_KEY)."""
+    return _bump_counter(COUNTRY_POLICY_VERSION_CACHE_KEY)
+
+
+def seed_counter(key: str) -> int | None:
+    """
+    Re-create a missing counter (generation or version) without advancing it
+    if another worker got there first (cache.add, wall-clock seeded). None when
+    the cache does not keep it (DummyCache, cache down).
+    """
+    cache.add(key, time.time_ns() // 1000, None)
+    return cache.get(key)
+
+
+async def seed_counter_async(key: str) -> int | None:
+    """Async version of seed_counter()."""
+    await cache.aadd(key, time.time_ns() // 1000, None)
+    return await cache.aget(key)
+
+
+def local_bump_count(key: str) -> int:
+    """How many times this process has advanced the counter under key."""
+    return _local_bumps.get(key, 0)
+
+
+# Counter bumps made by this process, so caches that skip the shared read for
+# a while still see this process's own writes at once.
+_local_bumps: dict[str, int] = {}
+
+
+def _bump_counter(key: str) -> int:
+    _local_bumps[key] = _local_bumps.get(key, 0) + 1
+    try:
+        return cache.incr(key)
+    except ValueError:
+        value = time.time_ns() // 1000
+        cache.set(key, value, None)
+        return value
+
+
+def get_redis_client():
+    """
+    Redis client for NAI_SECURITY_REDIS_URL, or None when the setting is unset
+    or the client cannot be created. Used by features that need atomic
+    multi-key operations the Django cache API does not offer.
+    """
+    global _redis_client
+
+    if _redis_client is not None:
+        return _redis_client
+
+    url = getattr(settings, 'NAI_SECURITY_REDIS_URL', None)
+    if not url:
+        return None
+
+    try:
+        import redis
+        _redis_client = redis.Redis.from_url(url)
+        return _redis_client
+    except Exception as e:
+        logger.error(f"Failed to create Redis client: {e}")
+        return None
+
+
+def increment_batched(model, pk, cache_key: str, field: str = 'block_count', flush_threshold: int = 100):
+    """
+    Count a hit in the cache and add it to model.field in one UPDATE every
+    flush_threshold hits, instead of writing the row on every hit.
+    """
+    from django.db.models import F
+
+    try:
+        count = cache.incr(cache_key)
+    except ValueError:
+        cache.set(cache_key, 1, 3600)
+        return
+
+    if count >= flush_threshold:
+        model.objects.filter(pk=pk).update(**{field: F(field) + count})
+        cache.delete(cache_key)
+
+
+async def increment_batched_async(model, pk, cache_key: str, field: str = 'block_count',
+                                  flush_threshold: int = 100):
+    """Async version of increment_batched()."""
+    from django.db.models import F
+
+    try:
+        count = await cache.aincr(cache_key)
+    except ValueError:
+        await cache.aset(cache_key, 1, 3600)
+        return
+
+    if count >= flush_threshold:
+        await model.objects.filter(pk=pk).aupdate(**{field: F(field) + count})
+        await cache.adelete(cache_key)
+
+
+def bulk_upsert(model, rows: list, unique_fields: list[str], update_fields: list[str],
+                batch_size: int = 1000) -> None:
+    """bulk_create() that updates update_fields of the rows whose unique_fields already exist."""
+    from django.db import connections, router
+
+    features = connections[router.db_for_write(model)].features
+    model.objects.bulk_create(
+        rows,
+        batch_size=batch_size,
+        update_conflicts=True,
+        # MySQL takes no conflict target: any unique key conflicts.
+        unique_fields=unique_fields if features.supports_update_conflicts_with_target else None,
+        update_fields=update_fields,
+    )
+
+
+def bulk_increment(model, counts: dict, key_fields: list[str], field: str, batch_size: int = 200) -> None:
+    """
+    Add {key tuple: amount} onto `field` of the rows keyed by key_fields with
+    UPDATE ... SET field = field + amount, so concurrent writers never lose
+    each other's increments. Missing rows are inserted first with field 0
+    (ignore_conflicts); then there is one UPDATE per distinct amount and
+    batch_size keys. Call inside transaction.atomic() to apply all or nothing.
+    """
+    import operator
+    from functools import reduce
+    from django.db.models import F, Q
+
+    model.objects.bulk_create(
+        [model(**dict(zip(key_fields, key)), **{field: 0}) for key in counts],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    by_amount: dict[int, list] = {}
+    for key, amount in counts.items():
+        by_amount.setdefault(amount, []).append(key)
+    for amount, keys in by_amount.items():
+        for i in range(0, len(keys), batch_size):
+            model.objects.filter(reduce(operator.or_, (
+                Q(**dict(zip(key_fields, key))) for key in keys[i:i + batch_size]
+            ))).update(**{field: F(field) + amount})
+
+
 def clear_security_cache():
     """Clear all security-related cache entries."""
-    cache.delete('security_settings')
+    cache.delete_many(['security_settings', 'sec_settings_record'])
+    bump_policy_generation()
+    bump_country_policy_version()
     # Note: For full cache clear, consider cache.clear() but be careful
     logger.info("Security cache cleared")
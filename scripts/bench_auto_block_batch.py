@@ -0,0 +1,133 @@
+"""
+AutoBlocker batch run: per-IP loop vs the set-based process_recent_events().
+
+Fills SecurityLog with `threshold` events for each of N offending IPs and
+blocks them all:
+  per-ip     -> the old shape: GROUP BY, then check_and_block_ip() per
+                offender (exists(), recount, upsert, AUTO_BLOCK_IP insert,
+                cache delete and generation bump for every IP). Run over the
+                first `per_ip_sample` offenders only and extrapolated, as a
+                full run at 100k IPs takes minutes.
+  set-based  -> process_recent_events(): one aggregate query anti-joined
+                against the active blocks, bulk upsert, bulk AUTO_BLOCK_IP
+                insert, one delete_many and one generation bump.
+
+Run from repo root:
+    python scripts/bench_auto_block_batch.py [offending_ips] [per_ip_sample]
+"""
+import os
+import sys
+import time
+
+import django
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+django.setup()
+
+import logging
+logging.getLogger('nai_security').setLevel(logging.ERROR)
+
+from django.core.management import call_command
+call_command('migrate', verbosity=0, run_syncdb=True)
+
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from django.test import override_settings
+from django.utils import timezone
+
+from nai_security.models import BlockedIP, SecurityLog, SecuritySettings
+from nai_security.services.auto_blocker import AutoBlocker
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bench-auto-block-batch',
+        'OPTIONS': {'MAX_ENTRIES': 1000000},
+    },
+}
+
+THRESHOLD = 2
+
+
+def _ip(i):
+    return f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+
+
+def _per_ip(limit):
+    """The pre-batch process_recent_events() loop, over the first `limit` offenders."""
+    settings = SecuritySettings.get_settings()
+    window_start = timezone.now() - timedelta(hours=settings.auto_block_ip_window_hours)
+    ip_counts = SecurityLog.objects.filter(
+        created_at__gte=window_start
+    ).values('ip_address').annotate(
+        count=Count('id')
+    ).filter(count__gte=settings.auto_block_ip_threshold)
+    blocked = 0
+    for item in ip_counts[:limit]:
+        if AutoBlocker.check_and_block_ip(item['ip_address']):
+            blocked += 1
+    return blocked
+
+
+class QueryCounter:
+    """connection.execute_wrapper() that counts queries (the debug query log stops at 9000)."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def main():
+    n_ips = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    sample = min(n_ips, int(sys.argv[2]) if len(sys.argv) > 2 else 5000)
+
+    SecuritySettings.objects.update_or_create(pk=1, defaults={
+        'auto_block_ip_threshold': THRESHOLD,
+        'auto_block_ip_window_hours': 1,
+        'auto_block_country_threshold': 0,
+    })
+
+    with override_settings(CACHES=LOCMEM_CACHES):
+        cache.clear()
+        SecurityLog.objects.bulk_create(
+            [SecurityLog(ip_address=_ip(i), action='IP_BLOCK', path='/')
+             for i in range(n_ips) for _ in range(THRESHOLD)],
+            batch_size=5000,
+        )
+        print(f"{n_ips} offending IPs, {n_ips * THRESHOLD} events")
+
+        def reset():
+            BlockedIP.objects.all().delete()
+            SecurityLog.objects.filter(action='AUTO_BLOCK_IP').delete()
+            cache.delete_many(['security_settings', 'sec_settings_record'])
+
+        reset()
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            started = time.perf_counter()
+            blocked = _per_ip(sample)
+            elapsed = time.perf_counter() - started
+        print(f"per-ip    {elapsed * 1000:10.1f} ms  {blocked} blocked, {queries.count} queries"
+              f"  (~{elapsed * n_ips / sample:.1f} s for all {n_ips})")
+
+        reset()
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            started = time.perf_counter()
+            result = AutoBlocker.process_recent_events()
+            elapsed = time.perf_counter() - started
+        print(f"set-based {elapsed * 1000:10.1f} ms  {result['blocked_ips']} blocked, {queries.count} queries")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+AutoBlocker.process_recent_events: SecurityLog scan vs streaming counters.
+
+Fills SecurityLog with events from many distinct IPs (a few of them over the
+threshold) and times one process_recent_events() run:
+  scan      -> GROUP BY over the log window, then a COUNT per candidate
+  counters  -> NAI_SECURITY_AUTO_BLOCK_COUNTERS = True: bucketed counters in
+               the Django cache (LocMemCache), fed when the events were logged
+  redis     -> the same with the Redis sorted-set counters, over fakeredis
+
+An in-memory SQLite table of this size is the scan's best case; on a large
+Postgres table the scan grows with the rows in the window, while the counter
+run grows only with the distinct IPs seen (per bucket, for the cache backend)
+and never touches the log table.
+
+Run from repo root:
+    python scripts/bench_auto_blocker.py [events] [distinct_ips]
+"""
+import os
+import sys
+import time
+
+import django
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+django.setup()
+
+import logging
+logging.getLogger('nai_security').setLevel(logging.ERROR)
+
+from django.core.management import call_command
+call_command('migrate', verbosity=0, run_syncdb=True)
+
+from unittest.mock import patch
+
+import fakeredis
+from django.core.cache import cache
+from django.test import override_settings
+
+from nai_security.models import BlockedIP, SecurityLog, SecuritySettings
+from nai_security.services.auto_blocker import AutoBlocker
+from nai_security.services.event_counters import get_event_counters, reset_event_counters
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bench-auto-blocker',
+        'OPTIONS': {'MAX_ENTRIES': 1000000},
+    },
+}
+
+
+def _events(n_events, n_ips):
+    """(ip, country) per event; the first ten IPs get a tenth of all events."""
+    hot = n_events // 10
+    for i in range(n_events):
+        ip_index = i % 10 if i < hot else 10 + i % (n_ips - 10)
+        yield f"10.{ip_index // 65536 % 256}.{ip_index // 256 % 256}.{ip_index % 256}", 'US'
+
+
+def main():
+    n_events = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    n_ips = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+    SecuritySettings.objects.update_or_create(pk=1, defaults={
+        'auto_block_ip_threshold': max(10, n_events // 200),
+        'auto_block_ip_window_hours': 1,
+        'auto_block_country_threshold': 0,
+    })
+
+    redis_client = fakeredis.FakeRedis()
+    with override_settings(CACHES=LOCMEM_CACHES):
+        cache.clear()
+        events = list(_events(n_events, n_ips))
+        SecurityLog.objects.bulk_create(
+            [SecurityLog(ip_address=ip, action='IP_BLOCK', path='/', country_code=cc) for ip, cc in events],
+            batch_size=5000,
+        )
+        for client in (None, redis_client):
+            reset_event_counters()
+            with patch('nai_security.services.event_counters.get_redis_client', return_value=client):
+                counters = get_event_counters()
+            for ip, country in events:
+                counters.record(ip, country)
+        print(f"{n_events} events from {n_ips} IPs")
+
+        for label, enabled, client in (('scan', False, None), ('counters', True, None), ('redis', True, redis_client)):
+            BlockedIP.objects.all().delete()
+            cache.delete_many(['security_settings', 'sec_settings_record'])
+            reset_event_counters()
+            with override_settings(NAI_SECURITY_AUTO_BLOCK_COUNTERS=enabled), \
+                    patch('nai_security.services.event_counters.get_redis_client', return_value=client):
+                started = time.perf_counter()
+                result = AutoBlocker.process_recent_events()
+                elapsed = time.perf_counter() - started
+            print(f"{label:9s} {elapsed * 1000:9.1f} ms  {result}")
+
+
+if __name__ == '__main__':
+    main()
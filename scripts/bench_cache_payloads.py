@@ -0,0 +1,65 @@
+"""
+Size and per-request deserialization cost of the hot-path cache entries.
+
+Compares what used to be cached (pickled model instances) with the compact
+values cached now:
+  sec_ua_patterns       list of BlockedUserAgent  vs  (format, version, row tuples)
+  security settings     SecuritySettings instance vs  (field names, values) / SettingsRecord
+
+Run from repo root:
+    python scripts/bench_cache_payloads.py [patterns] [iterations]
+"""
+import os
+import pickle
+import sys
+import time
+
+import django
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+django.setup()
+
+from django.core.management import call_command
+call_command('migrate', verbosity=0, run_syncdb=True)
+
+from nai_security.models import BlockedUserAgent, SecuritySettings
+from nai_security.models.security_settings import SettingsRecord
+from nai_security.services.ua_matcher import PATTERN_CACHE_FORMAT, _load_patterns
+
+
+def measure(label, value, iterations):
+    data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        pickle.loads(data)  # noqa: S301 - round-trips the bytes dumped just above
+    per_load = (time.perf_counter() - start) / iterations * 1e6
+    print(f"  {label:<34} {len(data):>9,} bytes   {per_load:>9.1f} us/load")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    BlockedUserAgent.objects.all().delete()
+    BlockedUserAgent.objects.bulk_create(
+        BlockedUserAgent(pattern=f'bot{i:04d}crawler', description=f'Synced bot {i}', is_auto_synced=True)
+        for i in range(n)
+    )
+    settings, _ = SecuritySettings.objects.get_or_create(pk=1)
+
+    print(f"\nUser-agent patterns ({n} rows)")
+    measure('model instances (before)', list(BlockedUserAgent.objects.filter(is_active=True)), iterations)
+    measure('row tuples (after)', (PATTERN_CACHE_FORMAT, time.time_ns(), _load_patterns()), iterations)
+
+    print("\nSecurity settings")
+    measure('model instance (before)', settings, iterations * 10)
+    measure('field values tuple (after)', SecuritySettings._to_cache(settings), iterations * 10)
+    measure('SettingsRecord tuple (after)', SettingsRecord.from_model(settings).to_cache(), iterations * 10)
+
+
+if __name__ == '__main__':
+    main()
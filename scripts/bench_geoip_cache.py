@@ -0,0 +1,105 @@
+"""
+Cost of get_country_from_ip per NAI_SECURITY_GEOIP_CACHE mode.
+
+Generates a small country database (tests/mmdb.py) and looks up a working set
+of client IPs repeatedly in each mode:
+  none    -> every call asks the memory-mapped reader
+  local   -> per-process LRU in front of the reader (default)
+  shared  -> Django cache in front of the reader, measured with LocMemCache
+             and with the Redis backend over fakeredis (no network; a real
+             Redis adds one round-trip per lookup on top of this)
+
+Run from repo root:
+    python scripts/bench_geoip_cache.py [lookups] [distinct_ips]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import django
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+django.setup()
+
+import logging
+logging.getLogger('nai_security').setLevel(logging.ERROR)
+
+from django.core.management import call_command
+call_command('migrate', verbosity=0, run_syncdb=True)
+
+from django.test import override_settings
+
+from nai_security import utils
+from nai_security.utils import geoip_cache_stats, get_country_from_ip, reset_geoip_reader
+from tests.mmdb import write_country_mmdb
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bench-geoip',
+        'OPTIONS': {'MAX_ENTRIES': 1000000},
+    },
+}
+
+REDIS_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/0',
+        'OPTIONS': {'connection_class': None},
+    },
+}
+
+
+def _report(label, n, elapsed, stats):
+    lookups = stats.get('hits', 0) + stats.get('misses', 0)
+    ratio = f"hit ratio {stats['hits'] / lookups:.1%}" if lookups else ''
+    print(f"  {label:<26} {elapsed / n * 1e6:>8.2f} us/lookup   {ratio}")
+
+
+def run(label, n, ips, **overrides):
+    with override_settings(**overrides):
+        from django.core.cache import cache
+        cache.clear()
+        reset_geoip_reader()
+        utils._geoip_shared_stats.update(hits=0, misses=0)
+        for ip in ips:
+            get_country_from_ip(ip)
+        start = time.perf_counter()
+        for i in range(n):
+            get_country_from_ip(ips[i % len(ips)])
+        elapsed = time.perf_counter() - start
+        _report(label, n, elapsed, geoip_cache_stats())
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    distinct = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+    networks = {f'{a}.{b}.0.0/16': ('US', 'DE', 'FR', 'JP', 'BR')[(a + b) % 5]
+                for a in range(1, 224, 7) for b in range(0, 256, 5)}
+    ips = [f'{1 + 7 * (i % 32)}.{5 * (i % 51)}.{i % 256}.{i % 250 + 1}' for i in range(distinct)]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = write_country_mmdb(os.path.join(tmpdir, 'GeoLite2-Country.mmdb'), networks)
+        print(f"{n} lookups over {distinct} distinct IPs, {len(networks)} networks")
+        run('none (mmdb reader)', n, ips, GEOIP_PATH=path, NAI_SECURITY_GEOIP_CACHE='none')
+        run('local LRU', n, ips, GEOIP_PATH=path, NAI_SECURITY_GEOIP_CACHE='local')
+        run('shared (LocMemCache)', n, ips, GEOIP_PATH=path,
+            NAI_SECURITY_GEOIP_CACHE='shared', CACHES=LOCMEM_CACHES)
+        try:
+            import fakeredis
+        except ImportError:
+            print("  shared (redis)             skipped: fakeredis not installed")
+        else:
+            REDIS_CACHES['default']['OPTIONS']['connection_class'] = fakeredis.FakeConnection
+            run('shared (Redis, fakeredis)', n, ips, GEOIP_PATH=path,
+                NAI_SECURITY_GEOIP_CACHE='shared', CACHES=REDIS_CACHES)
+
+
+if __name__ == '__main__':
+    main()
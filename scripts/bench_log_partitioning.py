@@ -0,0 +1,112 @@
+"""
+SecurityLog on PostgreSQL: plain table vs daily range partitions.
+
+For each layout, fills security_security_log to `rows` entries spread over the
+last 30 days (server-side INSERT ... SELECT generate_series, in ten steps).
+After each step it times one ORM bulk_create of `sample` new entries, the
+shape of the buffered log writer's flush, and reports rows/s. At the end it
+times purge_security_logs(retention_days=23), which removes about a week of
+entries: batched DELETEs on the plain table, and mostly DROP TABLE of whole
+partitions on the partitioned one.
+
+Needs a scratch PostgreSQL database (its nai_security tables are dropped and
+recreated) and psycopg, configured through the usual libpq variables:
+    PGDATABASE=bench PGHOST=localhost PGUSER=postgres PGPASSWORD=... \\
+        python scripts/bench_log_partitioning.py [rows] [sample]
+"""
+import os
+import sys
+import time
+
+import django
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+if not os.environ.get('PGDATABASE'):
+    sys.exit("Set PGDATABASE (and PGHOST / PGPORT / PGUSER / PGPASSWORD) to a scratch PostgreSQL database")
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+import tests.settings as bench_settings
+
+bench_settings.DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ['PGDATABASE'],
+        'HOST': os.environ.get('PGHOST', ''),
+        'PORT': os.environ.get('PGPORT', ''),
+        'USER': os.environ.get('PGUSER', ''),
+        'PASSWORD': os.environ.get('PGPASSWORD', ''),
+    },
+}
+django.setup()
+
+import logging
+logging.getLogger('nai_security').setLevel(logging.ERROR)
+
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+
+from nai_security.models import SecurityLog
+from nai_security.services import log_retention
+
+TABLE = SecurityLog._meta.db_table
+DAYS = 30
+
+# TABLE and DAYS are constants of this script, not input.
+FILL_SQL = f"""
+INSERT INTO {TABLE} (ip_address, country_code, action, severity, path, route, method,
+                     user_agent, details, user_email, created_at)
+SELECT ('10.' || (g % 256) || '.' || (g / 256 % 256) || '.' || (g / 65536 % 256))::inet,
+       'US', 'IP_BLOCK', 'high', '/', '', 'GET', '', '', '',
+       now() - random() * interval '{DAYS} days'
+FROM generate_series(1, %s) g
+"""  # noqa: S608
+
+
+def _reset(partitioned):
+    call_command('migrate', 'nai_security', 'zero', verbosity=0)
+    call_command('migrate', 'nai_security', verbosity=0)
+    if partitioned:
+        log_retention.convert_to_partitioned('day', ahead=1)
+        today = timezone.now().date()
+        with connection.cursor() as cursor:
+            log_retention._create_partitions(
+                cursor, TABLE, 'day', log_retention.plan_partitions('day', today - timedelta(days=DAYS + 1), today),
+            )
+
+
+def _insert_rate(sample):
+    rows = [SecurityLog(ip_address='192.0.2.1', action='RATE_LIMIT', path='/api/') for _ in range(sample)]
+    started = time.perf_counter()
+    SecurityLog.objects.bulk_create(rows, batch_size=500)
+    return sample / (time.perf_counter() - started)
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+    sample = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    step = total // 10
+
+    for label, partitioned in (('plain', False), ('partitioned', True)):
+        _reset(partitioned)
+        print(f"{label}:")
+        filled = 0
+        while filled < total:
+            with connection.cursor() as cursor:
+                cursor.execute(FILL_SQL, [step])
+                cursor.execute(f"ANALYZE {TABLE}")
+            filled += step
+            print(f"  {filled:>11,} rows  insert {_insert_rate(sample):>9,.0f} rows/s")
+
+        started = time.perf_counter()
+        result = log_retention.purge_security_logs(retention_days=DAYS - 7)
+        print(f"  purge 7 days  {time.perf_counter() - started:8.1f} s  {result}")
+
+
+if __name__ == '__main__':
+    main()
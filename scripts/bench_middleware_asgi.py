@@ -0,0 +1,127 @@
+"""
+Per-request overhead of SecurityMiddleware under ASGI.
+
+Compares three ways of running the same allowed request through the middleware:
+  sync      -> plain WSGI-style call (baseline)
+  adapted   -> sync middleware wrapped in sync_to_async, which is what Django did
+               for this middleware under ASGI before it was async capable
+  native    -> the async path (__acall__) awaited directly on the event loop
+
+Both the default per-key cache mode and NAI_SECURITY_POLICY_SNAPSHOT mode are
+measured. Note that Django's bundled cache backends and the async ORM implement
+their a* methods with sync_to_async, so the native path only avoids thread
+switches where the cache backend is natively async (or the snapshot is fresh).
+
+Each mode is run sequentially and as concurrent batches (asyncio.gather) with a
+warm cache, so the numbers reflect the steady-state hot path.
+
+Run from repo root:
+    python scripts/bench_middleware_asgi.py [requests] [concurrency]
+"""
+import asyncio
+import os
+import sys
+import time
+
+import django
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+django.setup()
+
+import logging
+logging.getLogger('nai_security').setLevel(logging.ERROR)
+
+from django.core.management import call_command
+call_command('migrate', verbosity=0, run_syncdb=True)
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from nai_security.middleware import SecurityMiddleware
+from nai_security.models import BlockedIP, SecuritySettings
+
+factory = RequestFactory()
+ANONYMOUS = AnonymousUser()
+
+
+async def _auser():
+    return ANONYMOUS
+
+
+def _make_request(i):
+    r = factory.get('/bench/')
+    r.META['REMOTE_ADDR'] = f'198.51.100.{i % 200 + 1}'
+    r.META['HTTP_USER_AGENT'] = 'Mozilla/5.0 (bench)'
+    r.user = ANONYMOUS
+    r.auser = _auser
+    return r
+
+
+def _sync_ok(request):
+    return HttpResponse('OK')
+
+
+async def _async_ok(request):
+    return HttpResponse('OK')
+
+
+def _report(label, n, elapsed):
+    print(f"  {label:<28} {n / elapsed:>10,.0f} req/s   {elapsed / n * 1e6:>8.1f} us/req")
+
+
+def run_sync(n):
+    sync_mw = SecurityMiddleware(_sync_ok)
+
+    # Warm caches for every client IP used below.
+    for i in range(200):
+        sync_mw(_make_request(i))
+
+    start = time.perf_counter()
+    for i in range(n):
+        sync_mw(_make_request(i))
+    _report('sync (WSGI)', n, time.perf_counter() - start)
+
+
+async def run_async(n, concurrency):
+    adapted_mw = sync_to_async(SecurityMiddleware(_sync_ok))
+    native_mw = SecurityMiddleware(_async_ok)
+
+    for label, mw in (('adapted (sync_to_async)', adapted_mw), ('native async', native_mw)):
+        start = time.perf_counter()
+        for i in range(n):
+            await mw(_make_request(i))
+        _report(f'{label} sequential', n, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for offset in range(0, n, concurrency):
+            await asyncio.gather(*(mw(_make_request(offset + j)) for j in range(concurrency)))
+        _report(f'{label} gather', n, time.perf_counter() - start)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    SecuritySettings.get_settings()
+    BlockedIP.objects.get_or_create(ip_address='203.0.113.66')
+
+    for snapshot_mode in (False, True):
+        settings.NAI_SECURITY_POLICY_SNAPSHOT = snapshot_mode
+        print(f"\n{n} requests, concurrency {concurrency}, "
+              f"cache={settings.CACHES['default']['BACKEND'].rsplit('.', 1)[-1]}, "
+              f"snapshot={snapshot_mode}")
+        run_sync(n)
+        # async_to_sync keeps thread-sensitive ORM calls on this thread, which the
+        # in-memory test database requires.
+        async_to_sync(run_async)(n, concurrency)
+
+
+if __name__ == '__main__':
+    main()
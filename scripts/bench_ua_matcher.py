@@ -0,0 +1,88 @@
+"""
+User-agent check cost: linear BlockedUserAgent.matches() walk vs the compiled
+UserAgentMatcher (exact dict + Aho-Corasick + merged regex).
+
+Builds N synthetic bot patterns (80% contains, 10% exact, 10% regex) and times
+both approaches over a mix of browser and bot user agents.
+
+Run from repo root:
+    python scripts/bench_ua_matcher.py [patterns] [iterations]
+"""
+import os
+import random
+import sys
+import time
+
+import django
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+django.setup()
+
+from nai_security.models import BlockedUserAgent
+from nai_security.services.ua_matcher import UserAgentMatcher
+
+USER_AGENTS = [
+    (
+        'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+        'Chrome/124.0.0.0 Safari/537.36'
+    ),
+    (
+        'Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 '
+        '(KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1'
+    ),
+    'Mozilla/5.0 (X11; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0',
+    'Mozilla/5.0 (compatible; bot0042crawler/2.1; +http://example.com/bot)',
+]
+
+
+def build_patterns(n, rng):
+    patterns = []
+    for i in range(n):
+        roll = rng.random()
+        if roll < 0.8:
+            patterns.append(BlockedUserAgent(pk=i, pattern=f'bot{i:04d}crawler', block_type='contains'))
+        elif roll < 0.9:
+            patterns.append(BlockedUserAgent(pk=i, pattern=f'exactbot/{i}', block_type='exact'))
+        else:
+            patterns.append(BlockedUserAgent(pk=i, pattern=rf'scan{i}er/\d+', block_type='regex'))
+    return patterns
+
+
+def linear(patterns, user_agent):
+    for pattern in patterns:
+        if pattern.matches(user_agent):
+            return pattern
+    return None
+
+
+def time_it(func, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        func(USER_AGENTS[i % len(USER_AGENTS)])
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    patterns = build_patterns(n, random.Random(1))
+
+    start = time.perf_counter()
+    matcher = UserAgentMatcher(patterns)
+    compile_ms = (time.perf_counter() - start) * 1000
+
+    for ua in USER_AGENTS:
+        expected, got = linear(patterns, ua), matcher.match(ua)
+        assert (expected is None) == (got is None), ua
+
+    print(f"\n{n} patterns, {iterations} checks (compile: {compile_ms:.1f} ms)")
+    print(f"  linear matches()   {time_it(lambda ua: linear(patterns, ua), iterations):>8.1f} us/check")
+    print(f"  compiled matcher   {time_it(matcher.match, iterations):>8.1f} us/check")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+SecurityLog storage and insert throughput: inline user-agent text vs the
+deduplicated UserAgentString reference.
+
+Writes `rows` log entries whose user agents are drawn from a pool of
+`distinct` realistic strings, in bulk_create batches of 500 (the buffered log
+writer's flush):
+  inline  -> a copy of the pre-dedupe table, user_agent TextField per row.
+  deduped -> SecurityLog as it will be once the text column is dropped: bulk
+             get-or-create of the batch's strings (served from the
+             process-local id cache once seen), then the rows with only the
+             reference (the text column left empty).
+Reports rows/s and the size of each table plus its indexes (SQLite dbstat).
+
+Run from repo root:
+    python scripts/bench_user_agent_dedupe.py [rows] [distinct]
+"""
+import os
+import random
+import sys
+import time
+
+import django
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+django.setup()
+
+import logging
+logging.getLogger('nai_security').setLevel(logging.ERROR)
+
+from django.core.management import call_command
+call_command('migrate', verbosity=0, run_syncdb=True)
+
+from django.db import connection, models
+
+from nai_security.models import SecurityLog, UserAgentString
+from nai_security.services.user_agents import resolve_user_agents
+
+BATCH = 500
+
+
+class InlineLog(models.Model):
+    """SecurityLog as it was before the dedupe, user agent inline."""
+
+    ip_address = models.GenericIPAddressField(db_index=True)
+    country_code = models.CharField(max_length=2, blank=True, db_index=True)
+    action = models.CharField(max_length=30, db_index=True)
+    severity = models.CharField(max_length=10, default='medium')
+    path = models.CharField(max_length=500)
+    method = models.CharField(max_length=10, blank=True)
+    user_agent = models.TextField(blank=True)
+    details = models.TextField(blank=True)
+    user_email = models.EmailField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        app_label = 'nai_security'
+        db_table = 'bench_inline_log'
+        indexes = [
+            models.Index(fields=['-created_at']),
+            models.Index(fields=['ip_address', '-created_at']),
+            models.Index(fields=['action', '-created_at']),
+            models.Index(fields=['country_code', '-created_at']),
+        ]
+
+
+def _user_agents(count):
+    rng = random.Random(7)
+    browsers = ['Chrome', 'Firefox', 'Safari', 'Edg', 'OPR']
+    systems = [
+        'Windows NT 10.0; Win64; x64', 'Macintosh; Intel Mac OS X 10_15_7',
+        'X11; Linux x86_64', 'iPhone; CPU iPhone OS 17_1 like Mac OS X',
+        'Linux; Android 14; Pixel 8',
+    ]
+    return [
+        f"Mozilla/5.0 ({rng.choice(systems)}) AppleWebKit/537.36 (KHTML, like Gecko) "
+        f"{rng.choice(browsers)}/{rng.randint(90, 125)}.0.{rng.randint(1000, 6999)}.{i} Safari/537.36"
+        for i in range(count)
+    ]
+
+
+def _fields(i, user_agent):
+    return dict(
+        ip_address=f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}",
+        country_code='US', action='IP_BLOCK', severity='high', path='/login/',
+        method='POST', user_agent=user_agent,
+    )
+
+
+def _table_bytes(table):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT SUM(pgsize) FROM dbstat WHERE name IN "
+            "(SELECT name FROM sqlite_master WHERE tbl_name = %s)",
+            [table],
+        )
+        return cursor.fetchone()[0] or 0
+
+
+def _write_deduped(rows):
+    logs = [SecurityLog(**r) for r in rows]
+    resolve_user_agents(logs)
+    for log in logs:
+        log.user_agent = ''
+    SecurityLog.objects.bulk_create(logs, batch_size=BATCH)
+
+
+def _run(n_rows, pool, write):
+    rng = random.Random(11)
+    started = time.perf_counter()
+    for start in range(0, n_rows, BATCH):
+        write([_fields(i, rng.choice(pool)) for i in range(start, min(start + BATCH, n_rows))])
+    return time.perf_counter() - started
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    distinct = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    pool = _user_agents(distinct)
+
+    with connection.schema_editor() as editor:
+        editor.create_model(InlineLog)
+
+    runs = {
+        'inline': (
+            lambda rows: InlineLog.objects.bulk_create([InlineLog(**r) for r in rows], batch_size=BATCH),
+            [InlineLog._meta.db_table],
+        ),
+        'deduped': (
+            _write_deduped,
+            [SecurityLog._meta.db_table, UserAgentString._meta.db_table],
+        ),
+    }
+    print(f"{n_rows} rows, {distinct} distinct user agents")
+    for label, (write, tables) in runs.items():
+        elapsed = _run(n_rows, pool, write)
+        size = sum(_table_bytes(table) for table in tables)
+        print(f"{label:8} {n_rows / elapsed:10,.0f} rows/s  {size / 1024 / 1024:8.1f} MiB  "
+              f"({size / n_rows:.0f} B/row incl. indexes)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Minimal MaxMind DB writer for tests and benchmarks.
+
+Writes GeoLite2-Country-shaped ({"country": {"iso_code": ...}}) and
+GeoLite2-ASN-shaped databases from a mapping of network -> ISO code or ASN, so
+GeoIP code paths can run against a real reader without shipping a downloaded
+database. IPv4 networks are stored
+in the ::/96 subtree of an IPv6 tree, as in the MaxMind databases.
+"""
+import ipaddress
+import struct
+import time
+
+METADATA_MARKER = b'\xab\xcd\xefMaxMind.com'
+
+_TYPE_STRING, _TYPE_MAP = 2, 7
+_TYPE_UINT16, _TYPE_UINT32, _TYPE_UINT64, _TYPE_ARRAY = 5, 6, 9, 11
+
+
+def _control(type_, size):
+    if size < 29:
+        head, extra = size, b''
+    elif size < 285:
+        head, extra = 29, bytes([size - 29])
+    elif size < 65821:
+        head, extra = 30, (size - 285).to_bytes(2, 'big')
+    else:
+        head, extra = 31, (size - 65821).to_bytes(3, 'big')
+    if type_ <= 7:
+        return bytes([(type_ << 5) | head]) + extra
+    return bytes([head, type_ - 7]) + extra
+
+
+class _UInt(int):
+    """An unsigned integer with an explicit MMDB type (libmaxminddb checks metadata types)."""
+
+    def __new__(cls, value, type_):
+        obj = super().__new__(cls, value)
+        obj.type_ = type_
+        return obj
+
+
+def _encode(value):
+    if isinstance(value, _UInt):
+        raw = value.to_bytes((value.bit_length() + 7) // 8, 'big') if value else b''
+        return _control(value.type_, len(raw)) + raw
+    if isinstance(value, str):
+        raw = value.encode()
+        return _control(_TYPE_STRING, len(raw)) + raw
+    if isinstance(value, dict):
+        out = _control(_TYPE_MAP, len(value))
+        for key, item in value.items():
+            out += _encode(key) + _encode(item)
+        return out
+    if isinstance(value, list):
+        return _control(_TYPE_ARRAY, len(value)) + b''.join(_encode(v) for v in value)
+    raise TypeError(f"Unsupported MMDB value: {value!r}")
+
+
+def _bits(network):
+    if network.version == 4:
+        network = ipaddress.IPv6Network((int(network.network_address), network.prefixlen + 96))
+    value = int(network.network_address)
+    return [(value >> (127 - i)) & 1 for i in range(network.prefixlen)]
+
+
+def write_country_mmdb(path, networks, database_type='GeoLite2-Country'):
+    """
+    networks: {'192.0.2.0/24': 'US', '2001:db8::/32': 'DE', ...}. More specific
+    networks may be nested in broader ones; None leaves a network without data.
+    """
+    return write_mmdb(path, {
+        cidr: None if code is None else {'country': {'iso_code': code, 'names': {'en': code}}}
+        for cidr, code in networks.items()
+    }, database_type)
+
+
+def write_asn_mmdb(path, networks, database_type='GeoLite2-ASN'):
+    """networks: {'192.0.2.0/24': (64496, 'Example Hosting'), ...}; None for no data."""
+    return write_mmdb(path, {
+        cidr: None if entry is None else {
+            'autonomous_system_number': _UInt(entry[0], _TYPE_UINT32),
+            'autonomous_system_organization': entry[1],
+        }
+        for cidr, entry in networks.items()
+    }, database_type)
+
+
+def write_mmdb(path, networks, database_type):
+    """networks: {cidr: record dict or None}, as for write_country_mmdb()."""
+    data = b''
+    offsets = {}
+    root = [None, None]
+    for cidr, value in sorted(networks.items(), key=lambda item: ipaddress.ip_network(item[0]).prefixlen):
+        network = ipaddress.ip_network(cidr)
+        if value is None:
+            leaf = None
+        else:
+            encoded = _encode(value)
+            if encoded not in offsets:
+                offsets[encoded] = len(data)
+                data += encoded
+            leaf = ('data', offsets[encoded])
+        bits = _bits(network)
+        node = root
+        for bit in bits[:-1]:
+            child = node[bit]
+            if not isinstance(child, list):
+                # Split an inherited leaf so the broader network keeps its data.
+                child = node[bit] = [child, child]
+            node = child
+        node[bits[-1]] = leaf
+
+    nodes = []
+    queue = [root]
+    index = {id(root): 0}
+    for node in queue:
+        nodes.append(node)
+        for child in node:
+            if isinstance(child, list):
+                index[id(child)] = len(index)
+                queue.append(child)
+    node_count = len(nodes)
+
+    def record(child):
+        if isinstance(child, list):
+            return index[id(child)]
+        if child is None:
+            return node_count
+        return node_count + 16 + child[1]
+
+    tree = b''.join(
+        struct.pack('>I', record(left))[1:] + struct.pack('>I', record(right))[1:]
+        for left, right in nodes
+    )
+    metadata = _encode({
+        'binary_format_major_version': _UInt(2, _TYPE_UINT16),
+        'binary_format_minor_version': _UInt(0, _TYPE_UINT16),
+        'build_epoch': _UInt(int(time.time()), _TYPE_UINT64),
+        'database_type': database_type,
+        'description': {'en': 'nai_security test database'},
+        'ip_version': _UInt(6, _TYPE_UINT16),
+        'languages': ['en'],
+        'node_count': _UInt(node_count, _TYPE_UINT32),
+        'record_size': _UInt(24, _TYPE_UINT16),
+    })
+    with open(path, 'wb') as f:
+        f.write(tree + b'\x00' * 16 + data + METADATA_MARKER + metadata)
+    return path
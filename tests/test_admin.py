@@ -1,6 +1,6 @@
 ﻿from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
-from nai_security.models import SecuritySettings
+from nai_security.models import LoginHistory, SecurityLog, SecuritySettings
 
 User = get_user_model()
 
@@ -36,6 +36,17 @@ class AdminAccessTest(TestCase):
         response = self.client.get('/admin/nai_security/securitylog/add/')
         self.assertEqual(response.status_code, 403)
 
+    def test_search_by_user_agent(self):
+        user = User.objects.create_user('u', 'u@test.com', 'password')
+        for ip, agent in (('10.1.1.1', 'curl/8.4.0'), ('10.2.2.2', 'Mozilla/5.0')):
+            SecurityLog.log_event(ip, 'IP_BLOCK', '/', user_agent=agent)
+            LoginHistory.objects.create(user=user, ip_address=ip, user_agent=agent)
+        for changelist in ('securitylog', 'loginhistory'):
+            with self.subTest(changelist=changelist):
+                response = self.client.get(f'/admin/nai_security/{changelist}/', {'q': 'curl'})
+                self.assertContains(response, '10.1.1.1')
+                self.assertNotContains(response, '10.2.2.2')
+
     def test_login_history_readonly(self):
         response = self.client.get('/admin/nai_security/loginhistory/add/')
         self.assertEqual(response.status_code, 403)
@@ -77,3 +88,10 @@ class BadgeRenderingTest(TestCase):
                     self.fail(f"{model_admin.__class__.__name__}.{name} raised {broken!r}")
                 except Exception:
                     pass
+
+    def test_every_log_action_has_a_color(self):
+        from nai_security.admin import SecurityLogAdmin
+        from nai_security.models import SecurityLog
+
+        actions = {value for value, _ in SecurityLog.ACTION_CHOICES}
+        self.assertEqual(actions - set(SecurityLogAdmin.ACTION_COLORS), set())
@@ -0,0 +1,171 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+
+from nai_security.middleware import SecurityMiddleware
+from nai_security.models import BlockedASN, SecurityLog, SecuritySettings, WhitelistedUser
+from nai_security.services.policy_snapshot import get_network_policy, reset_policy_snapshot
+from nai_security.utils import get_asn_from_ip, get_geoip_asn_path, reset_geoip_reader
+from tests.mmdb import write_asn_mmdb, write_country_mmdb
+
+ASN_NETWORKS = {
+    '10.0.0.0/8': (64496, 'Example Hosting'),
+    '10.1.0.0/16': (64497, 'Other Cloud'),
+    '2001:db8::/32': (64496, 'Example Hosting'),
+}
+
+
+class ASNTestMixin:
+
+    def setUp(self):
+        cache.clear()
+        reset_geoip_reader()
+        reset_policy_snapshot()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.country_path = write_country_mmdb(
+            os.path.join(self.tmpdir.name, 'GeoLite2-Country.mmdb'), {'10.0.0.0/8': 'US'},
+        )
+        self.asn_path = write_asn_mmdb(os.path.join(self.tmpdir.name, 'GeoLite2-ASN.mmdb'), ASN_NETWORKS)
+        self.addCleanup(self.tmpdir.cleanup)
+        self.addCleanup(reset_geoip_reader)
+        self.addCleanup(reset_policy_snapshot)
+
+
+class GetASNFromIPTest(ASNTestMixin, TestCase):
+
+    def test_lookup_from_directory(self):
+        with override_settings(GEOIP_PATH=self.tmpdir.name):
+            self.assertEqual(get_asn_from_ip('10.2.3.4'), 64496)
+            self.assertEqual(get_asn_from_ip('10.1.3.4'), 64497)
+            self.assertEqual(get_asn_from_ip('2001:db8::1'), 64496)
+            self.assertIsNone(get_asn_from_ip('8.8.8.8'))
+            self.assertIsNone(get_asn_from_ip('127.0.0.1'))
+
+    def test_asn_file_next_to_country_file(self):
+        with override_settings(GEOIP_PATH=self.country_path):
+            self.assertEqual(get_geoip_asn_path(), self.asn_path)
+            self.assertEqual(get_asn_from_ip('10.2.3.4'), 64496)
+
+    def test_explicit_asn_path(self):
+        other = shutil.copy(self.asn_path, os.path.join(self.tmpdir.name, 'asn.mmdb'))
+        with override_settings(GEOIP_PATH=None, NAI_SECURITY_GEOIP_ASN_PATH=other):
+            self.assertEqual(get_geoip_asn_path(), other)
+            self.assertEqual(get_asn_from_ip('10.2.3.4'), 64496)
+
+    def test_missing_database(self):
+        os.remove(self.asn_path)
+        with override_settings(GEOIP_PATH=self.country_path):
+            self.assertIsNone(get_asn_from_ip('10.2.3.4'))
+
+    def test_results_cached_per_process(self):
+        with override_settings(GEOIP_PATH=self.tmpdir.name):
+            get_asn_from_ip('10.2.3.4')
+            with patch('nai_security.utils._lookup_asn') as mock_lookup:
+                self.assertEqual(get_asn_from_ip('10.2.3.4'), 64496)
+            mock_lookup.assert_not_called()
+
+
+class BlockedASNPolicyTest(ASNTestMixin, TestCase):
+
+    def test_network_policy_rebuilt_on_save(self):
+        with override_settings(GEOIP_PATH=self.tmpdir.name):
+            self.assertIsNone(get_network_policy().get_blocked_asn('10.2.3.4'))
+            rule = BlockedASN.objects.create(asn=64496, organization='Example Hosting')
+            self.assertEqual(get_network_policy().get_blocked_asn('10.2.3.4'), rule.pk)
+            self.assertIsNone(get_network_policy().get_blocked_asn('10.1.3.4'))
+            rule.is_active = False
+            rule.save()
+            self.assertIsNone(get_network_policy().get_blocked_asn('10.2.3.4'))
+
+    def test_no_rules_skips_lookup(self):
+        with override_settings(GEOIP_PATH=self.tmpdir.name), \
+                patch('nai_security.services.policy_snapshot.get_asn_from_ip') as mock_asn:
+            self.assertIsNone(get_network_policy().get_blocked_asn('10.2.3.4'))
+        mock_asn.assert_not_called()
+
+    def test_str(self):
+        self.assertEqual(str(BlockedASN(asn=64496, organization='Example Hosting')), 'AS64496 (Example Hosting)')
+        self.assertEqual(str(BlockedASN(asn=64496)), 'AS64496')
+
+
+class ASNMiddlewareTest(ASNTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        SecuritySettings.get_settings()
+        self.rule = BlockedASN.objects.create(asn=64496, organization='Example Hosting')
+        self.factory = RequestFactory()
+        self.middleware = SecurityMiddleware(lambda request: HttpResponse('OK'))
+
+    def _make_request(self, ip, user=None):
+        request = self.factory.get('/')
+        request.META['REMOTE_ADDR'] = ip
+        request.user = user or AnonymousUser()
+        return request
+
+    def test_blocks_whole_provider(self):
+        with override_settings(GEOIP_PATH=self.tmpdir.name):
+            for ip in ('10.2.3.4', '10.200.0.1', '2001:db8::7'):
+                self.assertEqual(self.middleware(self._make_request(ip)).status_code, 403, ip)
+            self.assertEqual(self.middleware(self._make_request('10.1.0.1')).status_code, 200)
+        self.assertEqual(SecurityLog.objects.filter(action='ASN_BLOCK').count(), 3)
+        self.assertEqual(cache.get(f"sec_asn_count:{self.rule.pk}"), 3)
+
+    @override_settings(NAI_SECURITY_POLICY_SNAPSHOT=True)
+    def test_snapshot_mode(self):
+        with override_settings(GEOIP_PATH=self.tmpdir.name):
+            self.assertEqual(self.middleware(self._make_request('10.2.3.4')).status_code, 403)
+
+    def test_ip_blocking_disabled(self):
+        settings = SecuritySettings.get_settings()
+        settings.ip_blocking_enabled = False
+        settings.save()
+        with override_settings(GEOIP_PATH=self.tmpdir.name):
+            self.assertEqual(self.middleware(self._make_request('10.2.3.4')).status_code, 200)
+
+    def test_ip_block_exemption_bypasses(self):
+        user = get_user_model().objects.create_user('asn-exempt', password='x')
+        WhitelistedUser.objects.create(user=user, exemption_type='ip_block')
+        with override_settings(GEOIP_PATH=self.tmpdir.name):
+            self.assertEqual(self.middleware(self._make_request('10.2.3.4', user)).status_code, 200)
+
+    async def test_async_blocks(self):
+        async def view(request):
+            return HttpResponse('OK')
+
+        request = self._make_request('10.2.3.4')
+
+        async def auser():
+            return AnonymousUser()
+        request.auser = auser
+        with override_settings(GEOIP_PATH=self.tmpdir.name):
+            response = await SecurityMiddleware(view)(request)
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(await SecurityLog.objects.filter(action='ASN_BLOCK').aexists())
+
+
+class DownloadGeoIPEditionTest(ASNTestMixin, TestCase):
+
+    def test_asn_edition_written_next_to_country_database(self):
+        source = write_asn_mmdb(os.path.join(self.tmpdir.name, 'source.mmdb'), {'8.8.8.0/24': (15169, 'Google')})
+        os.remove(self.asn_path)
+
+        def fake_download(url, path):
+            shutil.copy(source, path)
+
+        out = StringIO()
+        with override_settings(GEOIP_PATH=self.country_path), \
+                patch('urllib.request.urlretrieve', side_effect=fake_download) as mock_download:
+            call_command('download_geoip', '--edition', 'asn', stdout=out)
+        self.assertIn('GeoLite2-ASN.mmdb', mock_download.call_args[0][0])
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir.name, 'GeoLite2-ASN.mmdb')))
+        self.assertIn('Verified: 8.8.8.8 -> AS15169', out.getvalue())
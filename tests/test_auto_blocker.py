@@ -1,11 +1,24 @@
+import time
 from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
 
+import fakeredis
 from django.core.cache import cache
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from nai_security.models import BlockedIP, BlockedCountry, SecurityLog, SecuritySettings
-from nai_security.services.auto_blocker import AutoBlocker
+from nai_security.services.auto_blocker import AutoBlocker, reset_inline_thresholds
+from nai_security.services.event_counters import (
+    COUNTRY, IP, CacheEventCounters, RedisEventCounters, get_event_counters, record_security_event_async,
+    reset_event_counters,
+)
+from nai_security.services.policy_snapshot import get_network_policy, get_policy_snapshot, reset_policy_snapshot
+from nai_security.utils import block_cache_timeout, get_policy_generation
 
 
 class AutoBlockerBaseTest(TestCase):
@@ -169,6 +182,193 @@ class ProcessRecentEventsTest(AutoBlockerBaseTest):
         self.assertEqual(result['blocked_ips'], 0)
         self.assertEqual(result['flagged_countries'], 0)
 
+    def _bulk_events(self, ips, count, country_code=''):
+        SecurityLog.objects.bulk_create([
+            SecurityLog(ip_address=ip, action='IP_BLOCK', path='/test/', country_code=country_code)
+            for ip in ips for _ in range(count)
+        ])
+
+    def _process_counting_queries(self, n_ips):
+        self._bulk_events([f"6.6.{n_ips}.{i}" for i in range(n_ips)], 10)
+        SecuritySettings.get_settings()
+        with CaptureQueriesContext(connection) as queries:
+            result = AutoBlocker.process_recent_events()
+        self.assertEqual(result['blocked_ips'], n_ips)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_offenders(self):
+        self.assertEqual(self._process_counting_queries(3), self._process_counting_queries(60))
+
+    def test_bulk_blocks_logs_and_invalidates(self):
+        ips = [f"6.6.6.{i}" for i in range(20)]
+        self._bulk_events(ips, 12)
+        cache.set_many({f"sec_blocked_ip:{ip}": False for ip in ips})
+        self.assertEqual(AutoBlocker.process_recent_events()['blocked_ips'], 20)
+        self.assertEqual(BlockedIP.objects.filter(is_active=True, is_auto_blocked=True, block_count=12).count(), 20)
+        self.assertEqual(SecurityLog.objects.filter(action='AUTO_BLOCK_IP', severity='high').count(), 20)
+        self.assertEqual(cache.get_many([f"sec_blocked_ip:{ip}" for ip in ips]), {})
+
+    def test_skips_active_and_reactivates_inactive_blocks(self):
+        BlockedIP.objects.create(ip_address='5.5.5.5', is_active=True, reason='manual')
+        BlockedIP.objects.create(ip_address='6.6.6.6', is_active=False, reason='lifted')
+        self._bulk_events(['5.5.5.5', '6.6.6.6'], 15)
+        self.assertEqual(AutoBlocker.process_recent_events()['blocked_ips'], 1)
+        self.assertEqual(BlockedIP.objects.get(ip_address='5.5.5.5').reason, 'manual')
+        reactivated = BlockedIP.objects.get(ip_address='6.6.6.6')
+        self.assertTrue(reactivated.is_active)
+        self.assertTrue(reactivated.is_auto_blocked)
+        self.assertEqual(reactivated.block_count, 15)
+        self.assertEqual(SecurityLog.objects.filter(action='AUTO_BLOCK_IP').count(), 1)
+
+    def test_address_block_leaves_network_row_alone(self):
+        BlockedIP.objects.create(ip_address='6.6.6.0/24', is_active=False, reason='lifted')
+        self._bulk_events(['6.6.6.0'], 15)
+        self.assertEqual(AutoBlocker.process_recent_events()['blocked_ips'], 1)
+        self.assertEqual(BlockedIP.objects.get(prefix_length=24).reason, 'lifted')
+        self.assertTrue(BlockedIP.objects.get(ip_address='6.6.6.0', prefix_length=None).is_active)
+
+    def test_flagging_updates_attack_count_only(self):
+        BlockedCountry.objects.create(code='CN', is_active=False, reason='reviewed', attack_count=100)
+        self._bulk_events(['1.1.1.1'], 150, country_code='CN')
+        self._bulk_events(['2.2.2.2'], 100, country_code='RU')
+        self.assertEqual(AutoBlocker.process_recent_events()['flagged_countries'], 2)
+        cn = BlockedCountry.objects.get(code='CN')
+        self.assertEqual((cn.is_active, cn.reason, cn.attack_count), (False, 'reviewed', 150))
+        ru = BlockedCountry.objects.get(code='RU')
+        self.assertEqual((ru.is_active, ru.attack_count, ru.name), (False, 100, 'Russia'))
+
+    def test_auto_blocks_countries_in_bulk(self):
+        settings = SecuritySettings.get_settings()
+        settings.auto_block_country_enabled = True
+        settings.save()
+        BlockedCountry.objects.create(code='CN', is_active=False, reason='reviewed')
+        self._bulk_events(['1.1.1.1'], 150, country_code='CN')
+        self._bulk_events(['2.2.2.2'], 100, country_code='RU')
+        self.assertEqual(AutoBlocker.process_recent_events()['flagged_countries'], 2)
+        self.assertEqual(BlockedCountry.objects.filter(is_active=True, is_auto_blocked=True).count(), 2)
+        self.assertEqual(
+            set(SecurityLog.objects.filter(action='AUTO_BLOCK_COUNTRY').values_list('country_code', flat=True)),
+            {'CN', 'RU'},
+        )
+
+
+# ------------------------------------------------------------------
+# Subnet aggregation
+# ------------------------------------------------------------------
+
+class SubnetAggregationTest(AutoBlockerBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        reset_policy_snapshot()
+        self.addCleanup(reset_policy_snapshot)
+        settings = SecuritySettings.get_settings()
+        settings.auto_block_subnet_threshold = 3
+        settings.save()
+
+    def _auto_blocks(self, ips, hours=24, **kwargs):
+        expires_at = timezone.now() + timedelta(hours=hours) if hours else None
+        for ip in ips:
+            BlockedIP.objects.create(
+                ip_address=ip, is_auto_blocked=True, block_count=10, expires_at=expires_at, **kwargs,
+            )
+
+    def test_collapses_subnet_into_network_block(self):
+        self._auto_blocks(['203.0.113.5', '203.0.113.9'])
+        self._auto_blocks(['203.0.113.77'], hours=48)
+        self._auto_blocks(['198.51.100.1', '198.51.100.2'])
+        self.assertEqual(AutoBlocker.aggregate_subnets(), 1)
+
+        network = BlockedIP.objects.get(ip_address='203.0.113.0')
+        self.assertEqual(network.prefix_length, 24)
+        self.assertTrue(network.is_active and network.is_auto_blocked)
+        self.assertEqual(network.block_count, 30)
+        self.assertEqual(network.expires_at, BlockedIP.objects.get(ip_address='203.0.113.77').expires_at)
+        self.assertFalse(BlockedIP.objects.filter(ip_address__startswith='203.0.113.', prefix_length=None,
+                                                  is_active=True).exists())
+        self.assertEqual(BlockedIP.objects.filter(ip_address__startswith='198.51.100.', is_active=True).count(), 2)
+        self.assertTrue(get_network_policy().is_ip_blocked('203.0.113.200'))
+        self.assertEqual(SecurityLog.objects.filter(action='AUTO_BLOCK_IP', ip_address='203.0.113.0').count(), 1)
+
+    def test_permanent_member_makes_network_permanent(self):
+        self._auto_blocks(['203.0.113.5', '203.0.113.9'])
+        self._auto_blocks(['203.0.113.10'], hours=0)
+        AutoBlocker.aggregate_subnets()
+        self.assertIsNone(BlockedIP.objects.get(ip_address='203.0.113.0').expires_at)
+
+    def test_ipv6_uses_64(self):
+        self._auto_blocks(['2001:db8:0:1::1', '2001:db8:0:1::2', '2001:db8:0:1:ffff::3', '2001:db8:0:2::1'])
+        self.assertEqual(AutoBlocker.aggregate_subnets(), 1)
+        network = BlockedIP.objects.get(prefix_length=64)
+        self.assertEqual(network.ip_address, '2001:db8:0:1::')
+        self.assertTrue(BlockedIP.objects.get(ip_address='2001:db8:0:2::1').is_active)
+
+    def test_row_on_network_address_is_retired_next_to_network_block(self):
+        self._auto_blocks(['203.0.113.0', '203.0.113.1', '203.0.113.2'])
+        AutoBlocker.aggregate_subnets()
+        network = BlockedIP.objects.get(ip_address='203.0.113.0', prefix_length=24)
+        self.assertTrue(network.is_active)
+        self.assertFalse(BlockedIP.objects.get(ip_address='203.0.113.0', prefix_length=None).is_active)
+        self.assertEqual(BlockedIP.objects.filter(is_active=True).count(), 1)
+
+    def test_manual_blocks_neither_counted_nor_overwritten(self):
+        self._auto_blocks(['203.0.113.5', '203.0.113.9'])
+        BlockedIP.objects.create(ip_address='203.0.113.6', reason='manual')
+        self.assertEqual(AutoBlocker.aggregate_subnets(), 0)
+        self._auto_blocks(['203.0.113.7'])
+        BlockedIP.objects.create(ip_address='203.0.113.0', prefix_length=24, reason='manual', is_active=False)
+        self.assertEqual(AutoBlocker.aggregate_subnets(), 0)
+        self.assertEqual(BlockedIP.objects.get(ip_address='203.0.113.0').reason, 'manual')
+
+    def test_lifted_network_block_not_reactivated(self):
+        self._auto_blocks(['203.0.113.5', '203.0.113.9', '203.0.113.10'])
+        AutoBlocker.aggregate_subnets()
+        BlockedIP.objects.filter(ip_address='203.0.113.0', prefix_length=24).update(is_active=False)
+        self._auto_blocks(['203.0.113.20', '203.0.113.21', '203.0.113.22'])
+        self.assertEqual(AutoBlocker.aggregate_subnets(), 0)
+        self.assertFalse(BlockedIP.objects.get(ip_address='203.0.113.0', prefix_length=24).is_active)
+
+    def test_expired_network_block_aggregated_again(self):
+        self._auto_blocks(['203.0.113.5', '203.0.113.9', '203.0.113.10'])
+        AutoBlocker.aggregate_subnets()
+        BlockedIP.objects.filter(ip_address='203.0.113.0', prefix_length=24).update(
+            is_active=False, expires_at=timezone.now() - timedelta(hours=1),
+        )
+        self._auto_blocks(['203.0.113.20', '203.0.113.21', '203.0.113.22'])
+        self.assertEqual(AutoBlocker.aggregate_subnets(), 1)
+        self.assertTrue(BlockedIP.objects.get(ip_address='203.0.113.0', prefix_length=24).is_active)
+
+    def test_manual_row_on_network_address_does_not_stop_aggregation(self):
+        BlockedIP.objects.create(ip_address='203.0.113.0', reason='manual')
+        self._auto_blocks(['203.0.113.5', '203.0.113.9', '203.0.113.10'])
+        self.assertEqual(AutoBlocker.aggregate_subnets(), 1)
+        self.assertEqual(BlockedIP.objects.get(ip_address='203.0.113.0', prefix_length=None).reason, 'manual')
+
+    def test_already_covered_subnet_only_retires_addresses(self):
+        BlockedIP.objects.create(ip_address='203.0.0.0', prefix_length=16, reason='manual')
+        self._auto_blocks(['203.0.113.5', '203.0.113.9', '203.0.113.10'])
+        self.assertEqual(AutoBlocker.aggregate_subnets(), 0)
+        self.assertFalse(BlockedIP.objects.filter(prefix_length=None, is_active=True).exists())
+        self.assertFalse(BlockedIP.objects.filter(prefix_length=24).exists())
+
+    def test_disabled_by_default(self):
+        settings = SecuritySettings.get_settings()
+        settings.auto_block_subnet_threshold = 0
+        settings.save()
+        self._auto_blocks(['203.0.113.5', '203.0.113.9', '203.0.113.10'])
+        self.assertEqual(AutoBlocker.aggregate_subnets(), 0)
+        self.assertNotIn('aggregated_networks', AutoBlocker.process_recent_events())
+
+    def test_process_recent_events_aggregates_and_skips_covered_ips(self):
+        self._create_events('203.0.113.5', 10)
+        self._create_events('203.0.113.9', 10)
+        self._create_events('203.0.113.10', 10)
+        self.assertEqual(AutoBlocker.process_recent_events()['aggregated_networks'], 1)
+        self._create_events('203.0.113.11', 10)
+        result = AutoBlocker.process_recent_events()
+        self.assertEqual((result['blocked_ips'], result['aggregated_networks']), (0, 0))
+        self.assertFalse(BlockedIP.objects.filter(ip_address='203.0.113.11').exists())
+
 
 # ------------------------------------------------------------------
 # cleanup_expired_blocks
@@ -205,3 +405,260 @@ class CleanupExpiredBlocksTest(AutoBlockerBaseTest):
     def test_returns_zero_when_nothing_expired(self):
         count = AutoBlocker.cleanup_expired_blocks()
         self.assertEqual(count, 0)
+
+    def _expired_blocks(self, n):
+        past = timezone.now() - timedelta(hours=1)
+        BlockedIP.objects.bulk_create([
+            BlockedIP(ip_address=f"9.9.9.{i}", is_active=True, expires_at=past) for i in range(n)
+        ])
+        return [f"9.9.9.{i}" for i in range(n)]
+
+    def test_sweeps_in_chunks_with_progress(self):
+        self._expired_blocks(7)
+        seen = []
+        with CaptureQueriesContext(connection) as queries:
+            count = AutoBlocker.cleanup_expired_blocks(chunk_size=3, progress=seen.append)
+        self.assertEqual(count, 7)
+        self.assertEqual(seen, [3, 6, 7])
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 3)
+        self.assertFalse(BlockedIP.objects.filter(is_active=True).exists())
+
+    def test_invalidates_cache_and_bumps_generation(self):
+        ips = self._expired_blocks(4)
+        cache.set_many({f"sec_blocked_ip:{ip}": True for ip in ips})
+        generation = get_policy_generation()
+        AutoBlocker.cleanup_expired_blocks(chunk_size=2)
+        self.assertEqual(cache.get_many([f"sec_blocked_ip:{ip}" for ip in ips]), {})
+        self.assertNotEqual(get_policy_generation(), generation)
+
+    def test_command_reports_progress(self):
+        self._expired_blocks(3)
+        out = StringIO()
+        call_command('cleanup_expired_blocks', '--chunk-size', '2', stdout=out)
+        self.assertIn('2 deactivated', out.getvalue())
+        self.assertIn('Deactivated 3 expired IP blocks', out.getvalue())
+
+    def test_positive_cache_entry_ends_with_block(self):
+        from nai_security.middleware import SecurityMiddleware
+        BlockedIP.objects.create(
+            ip_address='4.4.4.4', is_active=True, expires_at=timezone.now() + timedelta(seconds=30),
+        )
+        middleware = SecurityMiddleware(lambda request: None)
+        with patch.object(cache, 'set', wraps=cache.set) as mock_set:
+            self.assertTrue(middleware._is_ip_blocked('4.4.4.4'))
+        key, value, timeout = mock_set.call_args[0]
+        self.assertEqual((key, value), ('sec_blocked_ip:4.4.4.4', True))
+        self.assertLessEqual(timeout, 30)
+
+
+class BlockCacheTimeoutTest(TestCase):
+
+    def test_timeouts(self):
+        now = timezone.now()
+        self.assertEqual(block_cache_timeout(None), 300)
+        self.assertEqual(block_cache_timeout(now + timedelta(hours=1)), 300)
+        self.assertEqual(block_cache_timeout(now + timedelta(seconds=42.5)), 43)
+        self.assertEqual(block_cache_timeout(now - timedelta(seconds=5)), 1)
+
+
+# ------------------------------------------------------------------
+# Streaming event counters
+# ------------------------------------------------------------------
+
+class EventCountersMixin:
+
+    def _counters(self):
+        raise NotImplementedError
+
+    def test_counts_within_window(self):
+        counters = self._counters()
+        now = 1_000_000.0
+        counters.record('6.6.6.6', 'CN', now=now - 7200)
+        for _ in range(3):
+            counters.record('6.6.6.6', 'CN', now=now - 600)
+        counters.record('6.6.6.6', '', now=now)
+        self.assertEqual(counters.count(IP, '6.6.6.6', 3600, now=now), 4)
+        self.assertEqual(counters.count(IP, '6.6.6.6', 3 * 3600, now=now), 5)
+        self.assertEqual(counters.count(COUNTRY, 'CN', 3600, now=now), 3)
+        self.assertEqual(counters.count(IP, '7.7.7.7', 3600, now=now), 0)
+
+    def test_candidates_over_threshold(self):
+        counters = self._counters()
+        now = 1_000_000.0
+        for _ in range(5):
+            counters.record('6.6.6.6', 'CN', now=now - 300)
+        counters.record('7.7.7.7', 'CN', now=now)
+        counters.record('8.8.8.8', 'US', now=now - 7200)
+        self.assertEqual(counters.candidates(IP, 3600, 2, now=now), {'6.6.6.6': 5})
+        self.assertEqual(counters.candidates(IP, 3600, now=now), {'6.6.6.6': 5, '7.7.7.7': 1})
+        self.assertEqual(counters.candidates(COUNTRY, 3600, 6, now=now), {'CN': 6})
+
+
+class CacheEventCountersTest(EventCountersMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def _counters(self):
+        return CacheEventCounters(bucket_seconds=300, retention_hours=24)
+
+
+class RedisEventCountersTest(EventCountersMixin, TestCase):
+
+    def _counters(self):
+        return RedisEventCounters(fakeredis.FakeRedis(), bucket_seconds=300, retention_hours=24)
+
+
+@override_settings(NAI_SECURITY_AUTO_BLOCK_COUNTERS=True)
+class CounterModeAutoBlockerTest(AutoBlockerBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        reset_event_counters()
+        self.addCleanup(reset_event_counters)
+
+    def _log_events(self, ip, count, country_code=''):
+        for _ in range(count):
+            SecurityLog.log_event(ip_address=ip, action='IP_BLOCK', path='/test/', country_code=country_code)
+
+    def test_logged_events_are_counted(self):
+        self._log_events('6.6.6.6', 2, 'CN')
+        SecurityLog.record_event(ip_address='6.6.6.6', action='RATE_LIMIT', path='/test/')
+        self.assertEqual(get_event_counters().count(IP, '6.6.6.6', 3600), 3)
+        self.assertEqual(get_event_counters().count(COUNTRY, 'CN', 3600), 2)
+
+    def test_check_and_block_ip_reads_counters(self):
+        self._log_events('6.6.6.6', 10)
+        SecurityLog.objects.all().delete()
+        self.assertTrue(AutoBlocker.check_and_block_ip('6.6.6.6'))
+
+    def test_process_recent_events_without_log_scan(self):
+        self._log_events('6.6.6.6', 15, 'CN')
+        self._log_events('7.7.7.7', 3, 'CN')
+        BlockedIP.objects.create(ip_address='5.5.5.5', is_active=True)
+        self._log_events('5.5.5.5', 90, 'CN')
+        with patch.object(SecurityLog.objects, 'filter', side_effect=AssertionError('scanned SecurityLog')):
+            result = AutoBlocker.process_recent_events()
+        self.assertEqual(result, {'blocked_ips': 1, 'flagged_countries': 1})
+        self.assertTrue(BlockedIP.objects.filter(ip_address='6.6.6.6', block_count=15).exists())
+        self.assertFalse(BlockedIP.objects.filter(ip_address='7.7.7.7').exists())
+        self.assertEqual(BlockedCountry.objects.get(code='CN').attack_count, 108)
+
+    def test_old_events_fall_out_of_window(self):
+        past = time.time() - 2 * 3600
+        counters = get_event_counters()
+        for _ in range(20):
+            counters.record('6.6.6.6', now=past)
+        self.assertEqual(AutoBlocker.process_recent_events()['blocked_ips'], 0)
+
+    @override_settings(NAI_SECURITY_AUTO_BLOCK_COUNTERS=False)
+    def test_disabled_records_nothing(self):
+        self._log_events('6.6.6.6', 3)
+        self.assertEqual(get_event_counters().count(IP, '6.6.6.6', 3600), 0)
+
+
+@override_settings(NAI_SECURITY_AUTO_BLOCK_INLINE=True)
+class InlineAutoBlockTest(AutoBlockerBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        reset_event_counters()
+        reset_inline_thresholds()
+        self.addCleanup(reset_event_counters)
+        self.addCleanup(reset_inline_thresholds)
+
+    def _log_events(self, ip, count):
+        for _ in range(count):
+            SecurityLog.log_event(ip_address=ip, action='IP_BLOCK', path='/test/')
+
+    def test_blocks_when_threshold_crossed(self):
+        self._log_events('6.6.6.6', 9)
+        self.assertFalse(BlockedIP.objects.filter(ip_address='6.6.6.6').exists())
+        self._log_events('6.6.6.6', 1)
+        blocked = BlockedIP.objects.get(ip_address='6.6.6.6')
+        self.assertTrue(blocked.is_auto_blocked)
+        self.assertEqual(blocked.block_count, 10)
+        self.assertEqual(SecurityLog.objects.filter(action='AUTO_BLOCK_IP').count(), 1)
+        self.assertIs(cache.get('sec_blocked_ip:6.6.6.6'), True)
+
+    def test_further_events_do_not_block_again(self):
+        self._log_events('6.6.6.6', 10)
+        with patch.object(AutoBlocker, '_block_ips') as mock_block:
+            self._log_events('6.6.6.6', 5)
+        mock_block.assert_not_called()
+        self.assertEqual(SecurityLog.objects.filter(action='AUTO_BLOCK_IP').count(), 1)
+
+    def test_reactivates_inactive_row(self):
+        BlockedIP.objects.create(ip_address='6.6.6.6', is_active=False, reason='lifted')
+        self._log_events('6.6.6.6', 10)
+        blocked = BlockedIP.objects.get(ip_address='6.6.6.6')
+        self.assertTrue(blocked.is_active)
+        self.assertTrue(blocked.is_auto_blocked)
+
+    def test_threshold_change_picked_up(self):
+        settings = SecuritySettings.get_settings()
+        settings.auto_block_ip_threshold = 3
+        settings.save()
+        self._log_events('6.6.6.6', 3)
+        self.assertTrue(BlockedIP.objects.filter(ip_address='6.6.6.6', is_active=True).exists())
+
+    def test_middleware_rejects_next_request(self):
+        from django.contrib.auth.models import AnonymousUser
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from nai_security.middleware import SecurityMiddleware
+
+        self._log_events('6.6.6.6', 10)
+        request = RequestFactory().get('/')
+        request.META['REMOTE_ADDR'] = '6.6.6.6'
+        request.user = AnonymousUser()
+        response = SecurityMiddleware(lambda r: HttpResponse('OK'))(request)
+        self.assertEqual(response.status_code, 403)
+
+    def test_snapshot_takes_block_without_rebuild(self):
+        reset_policy_snapshot()
+        self.addCleanup(reset_policy_snapshot)
+        before = get_policy_snapshot()
+        self._log_events('6.6.6.6', 10)
+        with self.assertNumQueries(0):
+            snapshot = get_policy_snapshot()
+            self.assertTrue(snapshot.is_ip_blocked('6.6.6.6'))
+        self.assertEqual(snapshot.generation, get_policy_generation())
+        self.assertIs(snapshot.blocked_ips, before.blocked_ips)
+
+    def test_other_policy_write_still_rebuilds(self):
+        reset_policy_snapshot()
+        self.addCleanup(reset_policy_snapshot)
+        get_policy_snapshot()
+        self._log_events('6.6.6.6', 10)
+        BlockedIP.objects.create(ip_address='7.7.7.7')
+        snapshot = get_policy_snapshot()
+        self.assertEqual(set(snapshot.inline_blocked), set())
+        self.assertTrue(snapshot.is_ip_blocked('6.6.6.6'))
+        self.assertTrue(snapshot.is_ip_blocked('7.7.7.7'))
+
+    async def test_async_record_blocks_over_threshold(self):
+        await SecuritySettings.get_settings_async()
+        with patch.object(AutoBlocker, '_block_inline', wraps=AutoBlocker._block_inline) as block:
+            for _ in range(9):
+                await record_security_event_async('6.6.6.6')
+            block.assert_not_called()
+            await record_security_event_async('6.6.6.6')
+        block.assert_called_once()
+        self.assertTrue(await BlockedIP.objects.filter(ip_address='6.6.6.6', is_active=True).aexists())
+
+    async def test_async_record_under_threshold_stays_on_the_event_loop(self):
+        await SecuritySettings.get_settings_async()
+        await record_security_event_async('6.6.6.6')
+        with patch('nai_security.services.auto_blocker.sync_to_async') as hop, \
+                patch('nai_security.services.event_counters.sync_to_async') as counters_hop:
+            await record_security_event_async('6.6.6.6')
+        hop.assert_not_called()
+        counters_hop.assert_not_called()
+        self.assertEqual(get_event_counters().count(IP, '6.6.6.6', 3600), 2)
+
+    @override_settings(NAI_SECURITY_AUTO_BLOCK_INLINE=False)
+    def test_off_by_default(self):
+        self._log_events('6.6.6.6', 10)
+        self.assertFalse(BlockedIP.objects.filter(ip_address='6.6.6.6').exists())
@@ -359,6 +359,15 @@ class UnifiedWhitelistBypassTest(TestCase):
             )
         self.assertFalse(result, "Whitelisted IP must bypass axes for unknown users too")
 
+    def test_whitelisted_network_not_locked(self):
+        """A WhitelistedIP network entry covers every address inside it."""
+        from nai_security.models import WhitelistedIP
+        WhitelistedIP.objects.create(ip_address='203.0.113.0', prefix_length=24, is_active=True)
+
+        with patch.object(AxesDatabaseHandler, 'is_locked', return_value=True):
+            result = self.handler.is_locked(self._request(), credentials=None)
+        self.assertFalse(result, "Address inside a whitelisted network must bypass axes")
+
     # ---- B2: any exemption_type bypasses axes ----
 
     def test_whitelisted_user_with_ip_block_exemption_not_locked_by_axes(self):
@@ -0,0 +1,243 @@
+import os
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+
+from nai_security.middleware import SecurityMiddleware
+from nai_security.models import AllowedCountry, BlockedCountry, BlockedIP, SecurityLog, SecuritySettings
+from nai_security.models.security_settings import SettingsRecord
+from nai_security.services.country_ranges import (
+    CountryPolicyRanges, get_country_policy_ranges, reset_country_policy_ranges,
+)
+from nai_security.services.geoip_ranges import CountryRangeTable, reset_country_range_table
+from nai_security.utils import COUNTRY_POLICY_VERSION_CACHE_KEY, reset_geoip_reader
+from tests.mmdb import write_country_mmdb
+
+NETWORKS = {
+    '10.0.0.0/8': 'US',
+    '10.1.0.0/16': 'CN',
+    '10.2.0.0/16': 'CN',
+    '11.0.0.0/8': 'RU',
+    '192.0.2.0/24': 'FR',
+    '2001:db8::/32': 'CN',
+}
+
+
+def _record(blocking=True, allowlist=False):
+    return SettingsRecord(
+        ip_blocking_enabled=True,
+        user_agent_blocking_enabled=True,
+        country_blocking_enabled=blocking,
+        country_whitelist_mode=allowlist,
+    )
+
+
+class CountryRangesTestMixin:
+
+    def setUp(self):
+        cache.clear()
+        reset_country_policy_ranges()
+        reset_country_range_table()
+        reset_geoip_reader()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = write_country_mmdb(os.path.join(self.tmpdir.name, 'GeoLite2-Country.mmdb'), NETWORKS)
+        self.addCleanup(self.tmpdir.cleanup)
+        self.addCleanup(reset_country_policy_ranges)
+        self.addCleanup(reset_country_range_table)
+        self.addCleanup(reset_geoip_reader)
+
+
+class CountryPolicyRangesCompileTest(CountryRangesTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.table = CountryRangeTable.from_file(self.path)
+
+    def test_blocklist(self):
+        ranges = CountryPolicyRanges.compile(1, _record(), self.table, blocked=['CN'])
+        self.assertEqual(ranges.action, 'COUNTRY_BLOCK')
+        self.assertTrue(ranges.is_denied('10.1.5.5'))
+        self.assertTrue(ranges.is_denied('10.2.255.255'))
+        self.assertTrue(ranges.is_denied('2001:db8::1'))
+        self.assertTrue(ranges.is_denied('::ffff:10.1.0.1'))
+        self.assertFalse(ranges.is_denied('10.3.0.0'))
+        self.assertFalse(ranges.is_denied('8.8.8.8'))
+        self.assertFalse(ranges.is_denied('not-an-ip'))
+
+    def test_adjacent_denied_networks_merged(self):
+        ranges = CountryPolicyRanges.compile(1, _record(), self.table, blocked=['CN'])
+        # 10.1/16 + 10.2/16 and the IPv6 /32.
+        self.assertEqual(len(ranges), 2)
+
+    def test_allowlist(self):
+        ranges = CountryPolicyRanges.compile(1, _record(allowlist=True), self.table, allowed=['US', 'FR'])
+        self.assertEqual(ranges.action, 'COUNTRY_WHITELIST_BLOCK')
+        self.assertFalse(ranges.is_denied('10.9.0.1'))
+        self.assertFalse(ranges.is_denied('192.0.2.1'))
+        self.assertTrue(ranges.is_denied('11.0.0.1'))
+        self.assertTrue(ranges.is_denied('10.1.0.1'))
+        # No known country: never denied, as with the per-request check.
+        self.assertFalse(ranges.is_denied('8.8.8.8'))
+
+    def test_allowlist_without_rows_allows_all(self):
+        ranges = CountryPolicyRanges.compile(1, _record(allowlist=True), self.table, allowed=[])
+        self.assertFalse(ranges.is_denied('11.0.0.1'))
+
+    def test_country_checks_off(self):
+        ranges = CountryPolicyRanges.compile(1, _record(blocking=False), self.table, blocked=['CN'])
+        self.assertIsNone(ranges.action)
+        self.assertFalse(ranges.is_denied('10.1.0.1'))
+
+    def test_without_database(self):
+        ranges = CountryPolicyRanges.compile(1, _record(), None, blocked=['CN'])
+        self.assertFalse(ranges.is_denied('10.1.0.1'))
+
+
+class CountryPolicyRangesRebuildTest(CountryRangesTestMixin, TestCase):
+
+    def test_rebuilt_when_policy_changes(self):
+        with override_settings(GEOIP_PATH=self.path):
+            self.assertFalse(get_country_policy_ranges().is_denied('11.0.0.1'))
+            BlockedCountry.objects.create(code='RU', name='Russia')
+            self.assertTrue(get_country_policy_ranges().is_denied('11.0.0.1'))
+
+    def test_not_rebuilt_for_other_policy_writes(self):
+        SecuritySettings.get_settings()
+        BlockedCountry.objects.create(code='RU', name='Russia')
+        with override_settings(GEOIP_PATH=self.path):
+            ranges = get_country_policy_ranges()
+            BlockedIP.objects.create(ip_address='11.0.0.1')
+            with self.assertNumQueries(0):
+                self.assertIs(get_country_policy_ranges(), ranges)
+
+    def test_version_read_once_per_check_interval(self):
+        SecuritySettings.get_settings()
+        with override_settings(GEOIP_PATH=self.path):
+            ranges = get_country_policy_ranges()
+            with patch.object(cache, 'get', wraps=cache.get) as get:
+                for _ in range(3):
+                    self.assertIs(get_country_policy_ranges(), ranges)
+            self.assertNotIn(COUNTRY_POLICY_VERSION_CACHE_KEY, [c.args[0] for c in get.call_args_list])
+
+    @override_settings(NAI_SECURITY_POLICY_SNAPSHOT_MAX_AGE=1)
+    def test_not_recompiled_at_max_age_while_version_unchanged(self):
+        SecuritySettings.get_settings()
+        with override_settings(GEOIP_PATH=self.path):
+            ranges = get_country_policy_ranges()
+            with patch('nai_security.services.policy_snapshot.time.monotonic', return_value=time.monotonic() + 10), \
+                    patch.object(CountryPolicyRanges, 'compile') as compile_ranges:
+                self.assertIs(get_country_policy_ranges(), ranges)
+            compile_ranges.assert_not_called()
+
+    def test_rebuilt_when_settings_change(self):
+        AllowedCountry.objects.create(code='US', name='United States')
+        with override_settings(GEOIP_PATH=self.path):
+            self.assertFalse(get_country_policy_ranges().is_denied('11.0.0.1'))
+            settings = SecuritySettings.get_settings()
+            settings.country_whitelist_mode = True
+            settings.save()
+            self.assertTrue(get_country_policy_ranges().is_denied('11.0.0.1'))
+
+    def test_previous_set_served_while_rebuilding(self):
+        with override_settings(GEOIP_PATH=self.path):
+            previous = get_country_policy_ranges()
+            BlockedCountry.objects.create(code='RU', name='Russia')
+            started, release = threading.Event(), threading.Event()
+            build = CountryPolicyRanges.build
+
+            def slow_build(version):
+                started.set()
+                release.wait(5)
+                return build(version)
+
+            with patch.object(CountryPolicyRanges, 'build', side_effect=slow_build):
+                builder = threading.Thread(target=get_country_policy_ranges)
+                builder.start()
+                self.assertTrue(started.wait(5))
+                self.assertIs(get_country_policy_ranges(), previous)
+                release.set()
+                builder.join()
+            self.assertTrue(get_country_policy_ranges().is_denied('11.0.0.1'))
+
+    def test_rebuilt_when_database_replaced(self):
+        BlockedCountry.objects.create(code='CN', name='China')
+        with override_settings(GEOIP_PATH=self.path, NAI_SECURITY_GEOIP_RELOAD_INTERVAL=0.001):
+            self.assertFalse(get_country_policy_ranges().is_denied('192.0.2.1'))
+            tmp = write_country_mmdb(self.path + '.tmp', {'192.0.2.0/24': 'CN'})
+            os.replace(tmp, self.path)
+            time.sleep(0.01)
+            self.assertTrue(get_country_policy_ranges().is_denied('192.0.2.1'))
+
+
+@override_settings(NAI_SECURITY_COUNTRY_RANGES=True)
+class CountryRangesMiddlewareTest(CountryRangesTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        SecuritySettings.get_settings()
+        BlockedCountry.objects.create(code='CN', name='China')
+        self.factory = RequestFactory()
+        self.seen = []
+
+        def view(request):
+            self.seen.append(request)
+            return HttpResponse('OK')
+        self.view = view
+
+    def _make_request(self, ip):
+        request = self.factory.get('/')
+        request.META['REMOTE_ADDR'] = ip
+        request.user = AnonymousUser()
+        return request
+
+    def test_blocked_range_logged_with_country(self):
+        with override_settings(GEOIP_PATH=self.path):
+            response = SecurityMiddleware(self.view)(self._make_request('10.1.2.3'))
+        self.assertEqual(response.status_code, 403)
+        log = SecurityLog.objects.get(action='COUNTRY_BLOCK')
+        self.assertEqual(log.country_code, 'CN')
+
+    def test_allowed_request_checked_without_country_cache_keys(self):
+        with override_settings(GEOIP_PATH=self.path), \
+                patch('nai_security.middleware.security.SecurityMiddleware._is_country_blocked') as blocked:
+            response = SecurityMiddleware(self.view)(self._make_request('10.9.9.9'))
+        self.assertEqual(response.status_code, 200)
+        blocked.assert_not_called()
+
+    def test_country_code_is_a_plain_string(self):
+        with override_settings(GEOIP_PATH=self.path):
+            SecurityMiddleware(self.view)(self._make_request('192.0.2.5'))
+            SecurityMiddleware(self.view)(self._make_request('8.8.8.8'))
+        self.assertEqual([request.country_code for request in self.seen], ['FR', ''])
+        self.assertIs(type(self.seen[0].country_code), str)
+
+    def test_allowlist_mode(self):
+        settings = SecuritySettings.get_settings()
+        settings.country_whitelist_mode = True
+        settings.save()
+        AllowedCountry.objects.create(code='US', name='United States')
+        with override_settings(GEOIP_PATH=self.path):
+            middleware = SecurityMiddleware(self.view)
+            self.assertEqual(middleware(self._make_request('10.9.9.9')).status_code, 200)
+            self.assertEqual(middleware(self._make_request('11.1.1.1')).status_code, 403)
+        self.assertTrue(SecurityLog.objects.filter(action='COUNTRY_WHITELIST_BLOCK').exists())
+
+    async def test_async_blocked_range(self):
+        async def view(request):
+            return HttpResponse('OK')
+
+        request = self._make_request('10.2.0.1')
+
+        async def auser():
+            return AnonymousUser()
+        request.auser = auser
+        with override_settings(GEOIP_PATH=self.path):
+            response = await SecurityMiddleware(view)(request)
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(await SecurityLog.objects.filter(action='COUNTRY_BLOCK', country_code='CN').aexists())
@@ -0,0 +1,255 @@
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+import fakeredis
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from nai_security.models import BlockedIP, SecurityEventRollup, SecurityLog, SecuritySettings
+from nai_security.services import event_bus
+from nai_security.services.event_bus import StreamConsumer, build_consumer
+
+STREAM = 'nai_security:bus'
+
+
+@override_settings(NAI_SECURITY_EVENT_BUS=True)
+class EventBusTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.redis = fakeredis.FakeRedis()
+        event_bus._client = self.redis
+        event_bus._backends = None
+
+    def tearDown(self):
+        event_bus.reset_bus_client()
+        event_bus._backends = None
+
+    def _publish(self, count, ip='1.1.1.1', action='IP_BLOCK', **kwargs):
+        for _ in range(count):
+            SecurityLog.log_event(ip, action, '/', **kwargs)
+
+
+class PublishTest(EventBusTestCase):
+
+    def test_log_event_only_publishes(self):
+        with self.assertNumQueries(0):
+            SecurityLog.log_event('1.1.1.1', 'IP_BLOCK', '/x', country_code='US')
+            SecurityLog.record_event('2.2.2.2', 'RATE_LIMIT', '/y')
+        entries = self.redis.xrange(STREAM)
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0][1][b'country_code'], b'US')
+        self.assertEqual(entries[1][1][b'action'], b'RATE_LIMIT')
+
+    def test_system_entries_are_marked(self):
+        SecurityLog.log_events([{'ip_address': '1.1.1.1', 'action': 'AUTO_BLOCK_IP', 'path': ''}])
+        self.assertEqual(self.redis.xrange(STREAM)[0][1][b'system'], b'1')
+
+    def test_publish_failure_is_logged_not_raised(self):
+        with patch.object(self.redis, 'pipeline', side_effect=ConnectionError('down')):
+            SecurityLog.log_event('1.1.1.1', 'IP_BLOCK', '/')
+
+    def test_publish_failure_falls_back_to_the_direct_write(self):
+        with patch.object(self.redis, 'pipeline', side_effect=ConnectionError('down')):
+            SecurityLog.log_event('1.1.1.1', 'IP_BLOCK', '/')
+            SecurityLog.log_events([{'ip_address': '1.1.1.1', 'action': 'AUTO_BLOCK_IP', 'path': ''}])
+        self.assertEqual(
+            sorted(SecurityLog.objects.values_list('action', flat=True)), ['AUTO_BLOCK_IP', 'IP_BLOCK'],
+        )
+
+
+class StreamConsumerTest(EventBusTestCase):
+
+    def _consumer(self, handler, name='c1', **kwargs):
+        return StreamConsumer(self.redis, STREAM, 'g', handler, consumer=name, block_ms=None, **kwargs)
+
+    def test_acks_each_batch(self):
+        self._publish(5)
+        seen = []
+        consumer = self._consumer(seen.append, batch_size=3)
+        self.assertEqual(consumer.run_once(block=False), 3)
+        self.assertEqual(consumer.run_once(block=False), 2)
+        self.assertEqual(consumer.run_once(block=False), 0)
+        self.assertEqual([len(batch) for batch in seen], [3, 2])
+        self.assertEqual(self.redis.xpending(STREAM, 'g')['pending'], 0)
+
+    def test_failed_batch_stays_pending_and_is_claimed(self):
+        self._publish(2)
+        failing = self._consumer(lambda events: 1 / 0)
+        self.assertEqual(failing.run_once(block=False), 0)
+        self.assertEqual(self.redis.xpending(STREAM, 'g')['pending'], 2)
+
+        seen = []
+        rescuer = self._consumer(seen.append, name='c2', claim_idle_ms=0)
+        self.assertEqual(rescuer.run_once(block=False), 2)
+        self.assertEqual(len(seen[0]), 2)
+        self.assertEqual(self.redis.xpending(STREAM, 'g')['pending'], 0)
+
+    def test_poison_entries_are_dropped(self):
+        self._publish(1)
+        consumer = self._consumer(lambda events: 1 / 0, claim_idle_ms=0, max_deliveries=2)
+        for _ in range(4):
+            consumer.run_once(block=False)
+        self.assertEqual(self.redis.xpending(STREAM, 'g')['pending'], 0)
+
+    def test_poison_entries_found_among_other_pending_entries(self):
+        self._publish(5)
+        self._consumer(lambda events: 1 / 0).run_once(block=False)
+        time.sleep(0.05)
+        # The middle entries were just taken over by another consumer, so
+        # only the first and last are idle enough to claim.
+        middle = [entry_id for entry_id, _ in self.redis.xrange(STREAM)[1:4]]
+        self.redis.xclaim(STREAM, 'g', 'c2', min_idle_time=0, message_ids=middle, justid=True)
+        seen = []
+        self._consumer(seen.extend, name='c3', claim_idle_ms=30, max_deliveries=1).run_once(block=False)
+        self.assertEqual(seen, [])
+        self.assertEqual(self.redis.xpending(STREAM, 'g')['pending'], 3)
+
+    def test_workers_in_a_group_share_the_stream(self):
+        self._publish(4)
+        first, second = [], []
+        self._consumer(first.extend, batch_size=2).run_once(block=False)
+        self._consumer(second.extend, name='c2', batch_size=2).run_once(block=False)
+        self.assertEqual(len(first) + len(second), 4)
+
+    def test_groups_each_see_every_event(self):
+        self._publish(3)
+        one, two = [], []
+        StreamConsumer(self.redis, STREAM, 'a', one.extend, consumer='c').run_once(block=False)
+        StreamConsumer(self.redis, STREAM, 'b', two.extend, consumer='c').run_once(block=False)
+        self.assertEqual((len(one), len(two)), (3, 3))
+
+
+class ConsumersTest(EventBusTestCase):
+
+    def setUp(self):
+        super().setUp()
+        SecuritySettings.objects.update_or_create(pk=1, defaults={
+            'auto_block_ip_threshold': 3,
+            'auto_block_ip_window_hours': 1,
+            'auto_block_country_threshold': 0,
+            'notification_email': 'ops@example.com',
+            'notify_on_auto_block': True,
+        })
+
+    def _drain(self, group):
+        consumer = build_consumer(group, consumer='test', block_ms=None)
+        while consumer.run_once(block=False):
+            pass
+
+    def test_log_writer_keeps_event_time(self):
+        logged_at = timezone.now() - timedelta(minutes=10)
+        event_bus.publish_events([
+            SecurityLog(ip_address='1.1.1.1', action='IP_BLOCK', path='/', created_at=logged_at)
+            for _ in range(2)
+        ])
+        self._drain('log_writer')
+        self.assertEqual(SecurityLog.objects.count(), 2)
+        self.assertEqual(SecurityLog.objects.first().created_at, logged_at)
+
+    def test_auto_blocker_blocks_over_threshold(self):
+        self._publish(3)
+        self._drain('log_writer')
+        self._drain('auto_blocker')
+        self.assertTrue(BlockedIP.objects.filter(ip_address='1.1.1.1', is_active=True).exists())
+
+    def test_auto_blocker_queries_do_not_grow_with_the_offenders(self):
+        from nai_security.services.policy_snapshot import get_network_policy
+        SecuritySettings.get_settings()
+        get_network_policy()
+
+        def blocking_queries(ips):
+            for ip in ips:
+                self._publish(3, ip=ip)
+            self._drain('log_writer')
+            with CaptureQueriesContext(connection) as queries:
+                self._drain('auto_blocker')
+            self.assertEqual(BlockedIP.objects.filter(ip_address__in=ips, is_active=True).count(), len(ips))
+            return len(queries)
+
+        self.assertEqual(
+            blocking_queries(['1.1.1.1', '1.1.1.2']),
+            blocking_queries([f'2.2.2.{i}' for i in range(20)]),
+        )
+
+    @override_settings(NAI_SECURITY_AUTO_BLOCK_COUNTERS=True)
+    def test_auto_blocker_counts_attacks_not_system_entries(self):
+        from nai_security.services.event_counters import reset_event_counters
+        reset_event_counters()
+        self._publish(2)
+        SecurityLog.log_events([{'ip_address': '1.1.1.1', 'action': 'AUTO_BLOCK_IP', 'path': ''}])
+        self._drain('auto_blocker')
+        self.assertFalse(BlockedIP.objects.exists())
+        self._publish(1)
+        self._drain('auto_blocker')
+        self.assertTrue(BlockedIP.objects.filter(ip_address='1.1.1.1').exists())
+        reset_event_counters()
+
+    @override_settings(NAI_SECURITY_AUTO_BLOCK_COUNTERS=True)
+    def test_auto_blocker_skips_malformed_events(self):
+        from nai_security.services.event_counters import reset_event_counters
+        reset_event_counters()
+        self.addCleanup(reset_event_counters)
+        self._publish(3)
+        self.redis.xadd(STREAM, {'ip_address': '1.1.1.1', 'action': 'IP_BLOCK', 'created_at': 'yesterday'})
+        self.redis.xadd(STREAM, {'ip_address': '1.1.1.1', 'action': 'IP_BLOCK'})
+        with self.assertLogs('nai_security.services.event_bus', 'WARNING'):
+            self._drain('auto_blocker')
+        self.assertEqual(self.redis.xpending(STREAM, 'auto_blocker')['pending'], 0)
+        self.assertTrue(BlockedIP.objects.filter(ip_address='1.1.1.1').exists())
+
+    def test_rollup(self):
+        self._publish(3, country_code='US')
+        self._drain('rollup')
+        row = SecurityEventRollup.objects.get()
+        self.assertEqual((row.ip_address, row.country_code, row.count), ('1.1.1.1', 'US', 3))
+
+    def test_overlapping_rollup_batches_add_up(self):
+        # Worker b's whole batch lands between worker a's first and second
+        # rollup queries, as when two workers run side by side.
+        self._publish(3, country_code='US')
+        worker_a = build_consumer('rollup', consumer='a', block_ms=None)
+        worker_b = build_consumer('rollup', consumer='b', block_ms=None)
+        interleaved = []
+
+        def run_worker_b(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if not interleaved and 'security_event_rollup' in sql:
+                interleaved.append(sql)
+                self._publish(2, country_code='US')
+                self.assertEqual(worker_b.run_once(block=False), 2)
+            return result
+
+        with connection.execute_wrapper(run_worker_b):
+            self.assertEqual(worker_a.run_once(block=False), 3)
+        self.assertTrue(interleaved)
+        self.assertEqual(SecurityEventRollup.objects.get().count, 5)
+
+    def test_notifier_sends_one_digest_per_batch(self):
+        self._publish(2)
+        SecurityLog.log_events([
+            {'ip_address': '1.1.1.1', 'action': 'AUTO_BLOCK_IP', 'path': ''},
+            {'ip_address': '2.2.2.2', 'action': 'AUTO_BLOCK_IP', 'path': ''},
+        ])
+        self._drain('notifier')
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['ops@example.com'])
+        self.assertIn('2 AUTO_BLOCK_IP', mail.outbox[0].subject)
+
+    def test_command_once(self):
+        self._publish(2)
+        out = StringIO()
+        call_command('security_worker', '--once', '--consumer', 'log_writer', '--name', 'w1', stdout=out)
+        self.assertIn('log_writer: 2 events', out.getvalue())
+        self.assertEqual(SecurityLog.objects.count(), 2)
+
+    def test_command_rejects_unknown_consumer(self):
+        with self.assertRaises(CommandError):
+            call_command('security_worker', '--once', '--consumer', 'nope', stdout=StringIO())
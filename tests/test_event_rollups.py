@@ -0,0 +1,145 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from nai_security.models import BlockedIP, RollupWatermark, SecurityEventRollup, SecurityLog, SecuritySettings
+from nai_security.services.auto_blocker import AutoBlocker
+from nai_security.services.event_rollups import (
+    rollup_count, rollup_report, rollup_security_events, rollup_totals,
+)
+from nai_security.tasks import generate_security_report
+
+
+def _logs(count, ip='1.2.3.4', action='IP_BLOCK', country_code='', seconds_ago=3600):
+    SecurityLog.objects.bulk_create([
+        SecurityLog(ip_address=ip, action=action, country_code=country_code, path='/') for _ in range(count)
+    ])
+    ids = SecurityLog.objects.order_by('-pk').values_list('pk', flat=True)[:count]
+    SecurityLog.objects.filter(pk__in=list(ids)).update(
+        created_at=timezone.now() - timedelta(seconds=seconds_ago),
+    )
+
+
+class RollupSecurityEventsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_folds_log_into_hourly_rows(self):
+        _logs(3, ip='1.1.1.1', country_code='US')
+        _logs(2, ip='2.2.2.2', action='RATE_LIMIT')
+        self.assertEqual(rollup_security_events(), 5)
+        self.assertEqual(SecurityEventRollup.objects.count(), 2)
+        row = SecurityEventRollup.objects.get(ip_address='1.1.1.1')
+        self.assertEqual((row.action, row.country_code, row.count), ('IP_BLOCK', 'US', 3))
+        self.assertEqual((row.hour.minute, row.hour.second), (0, 0))
+
+    def test_only_new_rows_are_read(self):
+        _logs(3)
+        rollup_security_events()
+        self.assertEqual(rollup_security_events(), 0)
+        _logs(2)
+        self.assertEqual(rollup_security_events(), 2)
+        self.assertEqual(SecurityEventRollup.objects.get().count, 5)
+        self.assertEqual(
+            RollupWatermark.objects.get().last_id,
+            SecurityLog.objects.order_by('-pk').values_list('pk', flat=True)[0],
+        )
+
+    def test_recent_rows_wait_for_the_lag(self):
+        _logs(2, seconds_ago=5)
+        self.assertEqual(rollup_security_events(lag_seconds=60), 0)
+        self.assertEqual(rollup_security_events(lag_seconds=0), 2)
+
+    def test_late_row_behind_a_recent_one_is_not_skipped(self):
+        now = timezone.now()
+        recent = SecurityLog.objects.create(ip_address='1.1.1.1', action='IP_BLOCK', path='/')
+        # recent.pk + 1 belongs to a write that has not committed yet.
+        SecurityLog.objects.create(
+            pk=recent.pk + 2, ip_address='1.1.1.1', action='IP_BLOCK', path='/', created_at=now - timedelta(hours=1),
+        )
+        self.assertEqual(rollup_security_events(), 0)
+        self.assertEqual(RollupWatermark.objects.get().last_id, 0)
+
+        SecurityLog.objects.create(
+            pk=recent.pk + 1, ip_address='1.1.1.1', action='IP_BLOCK', path='/', created_at=now - timedelta(seconds=30),
+        )
+        SecurityLog.objects.filter(pk=recent.pk).update(created_at=now - timedelta(hours=1))
+        self.assertEqual(rollup_security_events(lag_seconds=0), 3)
+        self.assertEqual(SecurityEventRollup.objects.aggregate(total=Sum('count'))['total'], 3)
+
+    def test_batches(self):
+        _logs(7)
+        self.assertEqual(rollup_security_events(batch_size=3), 7)
+        self.assertEqual(SecurityEventRollup.objects.get().count, 7)
+
+    def test_prunes_old_rollups(self):
+        _logs(2, seconds_ago=40 * 86400)
+        _logs(1)
+        rollup_security_events()
+        self.assertEqual(SecurityEventRollup.objects.count(), 1)
+
+    def test_totals_and_count(self):
+        _logs(3, ip='1.1.1.1', country_code='US')
+        _logs(1, ip='2.2.2.2', country_code='US')
+        _logs(1, ip='3.3.3.3', seconds_ago=3 * 3600)
+        rollup_security_events()
+        since = timezone.now() - timedelta(hours=2)
+        self.assertEqual(rollup_totals('ip_address', since), {'1.1.1.1': 3, '2.2.2.2': 1})
+        self.assertEqual(rollup_totals('ip_address', since, threshold=2), {'1.1.1.1': 3})
+        self.assertEqual(rollup_totals('ip_address', since, exclude=['1.1.1.1']), {'2.2.2.2': 1})
+        self.assertEqual(rollup_totals('country_code', since), {'US': 4})
+        self.assertEqual(rollup_count('ip_address', '1.1.1.1', since), 3)
+        self.assertEqual(rollup_count('ip_address', '9.9.9.9', since), 0)
+
+    def test_report(self):
+        _logs(3, ip='1.1.1.1', country_code='US')
+        _logs(1, ip='2.2.2.2', action='RATE_LIMIT')
+        rollup_security_events()
+        report = rollup_report(timezone.now() - timedelta(days=1))
+        self.assertEqual(report['total_blocks'], 4)
+        self.assertEqual(report['blocks_by_action'], {'IP_BLOCK': 3, 'RATE_LIMIT': 1})
+        self.assertEqual(report['top_blocked_ips'][0], {'ip_address': '1.1.1.1', 'count': 3})
+        self.assertEqual(report['top_blocked_countries'], [{'country_code': 'US', 'count': 3}])
+
+
+@override_settings(NAI_SECURITY_EVENT_ROLLUPS=True)
+class RollupConsumersTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        SecuritySettings.objects.update_or_create(pk=1, defaults={
+            'auto_block_ip_threshold': 3,
+            'auto_block_ip_window_hours': 2,
+            'auto_block_country_threshold': 0,
+        })
+
+    def test_report_task_matches_log_scan(self):
+        _logs(3, ip='1.1.1.1', country_code='US')
+        _logs(1, ip='2.2.2.2', action='RATE_LIMIT')
+        from_rollups = generate_security_report()
+        with override_settings(NAI_SECURITY_EVENT_ROLLUPS=False):
+            from_log = generate_security_report()
+        self.assertEqual(from_rollups, from_log)
+
+    def test_process_recent_events_reads_rollups(self):
+        _logs(3, ip='1.1.1.1')
+        _logs(2, ip='2.2.2.2')
+        result = AutoBlocker.process_recent_events()
+        self.assertEqual(result['blocked_ips'], 1)
+        self.assertTrue(BlockedIP.objects.filter(ip_address='1.1.1.1', is_active=True).exists())
+        self.assertFalse(BlockedIP.objects.filter(ip_address='2.2.2.2').exists())
+
+    def test_already_blocked_ips_are_skipped(self):
+        BlockedIP.objects.create(ip_address='1.1.1.1', is_active=True)
+        _logs(3, ip='1.1.1.1')
+        self.assertEqual(AutoBlocker.process_recent_events()['blocked_ips'], 0)
+
+    def test_count_events_uses_rollups(self):
+        _logs(4, ip='1.1.1.1')
+        rollup_security_events()
+        SecurityLog.objects.all().delete()
+        self.assertTrue(AutoBlocker.check_and_block_ip('1.1.1.1'))
@@ -0,0 +1,154 @@
+import os
+import random
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+
+from nai_security.models import LoginHistory, SecurityLog
+from nai_security.services import geoip_ranges
+from nai_security.services.geoip_ranges import (
+    CountryRangeTable, get_countries_for_ips, get_country_range_table, reset_country_range_table,
+)
+from tests.mmdb import write_country_mmdb
+
+NETWORKS = {
+    '10.0.0.0/8': 'US',
+    '10.1.0.0/16': 'DE',
+    '11.0.0.0/8': 'US',
+    '192.0.2.0/24': 'FR',
+    '198.51.100.0/25': 'JP',
+    '2001:db8::/32': 'NL',
+    '2001:db8:1::/48': 'BE',
+}
+
+
+class GeoIPRangesTestMixin:
+
+    def setUp(self):
+        reset_country_range_table()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = write_country_mmdb(os.path.join(self.tmpdir.name, 'GeoLite2-Country.mmdb'), NETWORKS)
+        self.addCleanup(self.tmpdir.cleanup)
+        self.addCleanup(reset_country_range_table)
+
+
+class CountryRangeTableTest(GeoIPRangesTestMixin, TestCase):
+
+    def test_adjacent_networks_merged(self):
+        table = CountryRangeTable.from_file(self.path)
+        v4 = [(first, last, code) for first, last, code in table.iter_ranges(4) if code]
+        # 10/8 (split around 10.1/16) and 11/8 collapse into US, DE, US.
+        self.assertEqual([code for _, _, code in v4], ['US', 'DE', 'US', 'FR', 'JP'])
+
+    def test_matches_reader_on_random_addresses(self):
+        import geoip2.database
+        from geoip2.errors import AddressNotFoundError
+
+        table = CountryRangeTable.from_file(self.path)
+        reader = geoip2.database.Reader(self.path)
+        self.addCleanup(reader.close)
+        rng = random.Random(1234)
+        ips = [f'{rng.choice([10, 11, 12, 192, 198])}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}'
+               for _ in range(2000)]
+        ips += ['192.0.2.1', '198.51.100.1', '198.51.100.200', '2001:db8::1', '2001:db8:1::5', '2001:db9::1']
+        for ip in ips:
+            try:
+                expected = reader.country(ip).country.iso_code
+            except AddressNotFoundError:
+                expected = None
+            self.assertEqual(table.lookup(ip), expected, ip)
+
+    def test_lookup_many(self):
+        table = CountryRangeTable.from_file(self.path)
+        result = table.lookup_many(
+            ['10.1.2.3', '10.1.2.3', '::ffff:192.0.2.9', '2001:db8:1::1', '8.8.8.8', 'not-an-ip'],
+        )
+        self.assertEqual(result, {
+            '10.1.2.3': 'DE',
+            '::ffff:192.0.2.9': 'FR',
+            '2001:db8:1::1': 'BE',
+            '8.8.8.8': None,
+            'not-an-ip': None,
+        })
+
+    def test_bounds(self):
+        table = CountryRangeTable.from_file(self.path)
+        self.assertIsNone(table.lookup('0.0.0.0'))
+        self.assertIsNone(table.lookup('255.255.255.255'))
+        self.assertEqual(table.lookup('11.255.255.255'), 'US')
+        self.assertIsNone(table.lookup('ffff::1'))
+
+
+class GetCountriesForIPsTest(GeoIPRangesTestMixin, TestCase):
+
+    def test_resolves_batch(self):
+        with override_settings(GEOIP_PATH=self.path):
+            self.assertEqual(
+                get_countries_for_ips(['10.9.9.9', '198.51.100.7']),
+                {'10.9.9.9': 'US', '198.51.100.7': 'JP'},
+            )
+
+    def test_table_built_once_and_rebuilt_on_file_change(self):
+        with override_settings(GEOIP_PATH=self.path):
+            first = get_country_range_table()
+            self.assertIs(get_country_range_table(), first)
+            tmp = write_country_mmdb(self.path + '.tmp', {'10.0.0.0/8': 'CA'})
+            os.replace(tmp, self.path)
+            self.assertIsNot(get_country_range_table(), first)
+            self.assertEqual(get_countries_for_ips(['10.1.0.1']), {'10.1.0.1': 'CA'})
+
+    def test_missing_database_maps_to_none(self):
+        with override_settings(GEOIP_PATH=os.path.join(self.tmpdir.name, 'missing.mmdb')):
+            self.assertEqual(get_countries_for_ips(['10.0.0.1']), {'10.0.0.1': None})
+
+    def test_large_batch_without_numpy(self):
+        ips = [f'10.{i % 4}.{i % 256}.{i % 200 + 1}' for i in range(geoip_ranges.BULK_NUMPY_THRESHOLD * 2)]
+        with override_settings(GEOIP_PATH=self.path), patch.object(geoip_ranges, 'numpy', None):
+            result = get_countries_for_ips(ips)
+        self.assertEqual(len(result), len(set(ips)))
+        for ip, country_code in result.items():
+            self.assertEqual(country_code, 'DE' if ip.startswith('10.1.') else 'US', ip)
+
+
+class BackfillCountriesCommandTest(GeoIPRangesTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user('backfill', password='x')
+
+    def test_fills_empty_country_codes(self):
+        SecurityLog.objects.create(ip_address='10.1.0.1', action='IP_BLOCK', path='/')
+        SecurityLog.objects.create(ip_address='10.1.0.1', action='IP_BLOCK', path='/')
+        SecurityLog.objects.create(ip_address='192.0.2.4', action='IP_BLOCK', path='/')
+        SecurityLog.objects.create(ip_address='8.8.8.8', action='IP_BLOCK', path='/')
+        SecurityLog.objects.create(ip_address='11.0.0.1', action='IP_BLOCK', path='/', country_code='ZZ')
+        LoginHistory.objects.create(user=self.user, ip_address='2001:db8::9')
+
+        out = StringIO()
+        with override_settings(GEOIP_PATH=self.path):
+            call_command('backfill_countries', '--batch-size', '2', stdout=out)
+
+        self.assertEqual(
+            sorted(SecurityLog.objects.values_list('ip_address', 'country_code')),
+            [('10.1.0.1', 'DE'), ('10.1.0.1', 'DE'), ('11.0.0.1', 'ZZ'), ('192.0.2.4', 'FR'), ('8.8.8.8', '')],
+        )
+        self.assertEqual(LoginHistory.objects.get().country_code, 'NL')
+        self.assertIn('security_log: Updated 3 rows', out.getvalue())
+
+    def test_dry_run_changes_nothing(self):
+        SecurityLog.objects.create(ip_address='10.1.0.1', action='IP_BLOCK', path='/')
+        out = StringIO()
+        with override_settings(GEOIP_PATH=self.path):
+            call_command('backfill_countries', '--dry-run', '--model', 'security_log', stdout=out)
+        self.assertEqual(SecurityLog.objects.get().country_code, '')
+        self.assertIn('Would update 1 rows', out.getvalue())
+
+    def test_missing_database_is_an_error(self):
+        with override_settings(GEOIP_PATH=os.path.join(self.tmpdir.name, 'missing.mmdb')):
+            with self.assertRaises(CommandError):
+                call_command('backfill_countries', stdout=StringIO())
@@ -0,0 +1,228 @@
+import json
+import os
+import socket
+import tempfile
+from datetime import timedelta
+from unittest.mock import patch
+
+import fakeredis
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from nai_security.models import SecurityLog, SecuritySettings
+from nai_security.services.auto_blocker import AutoBlocker
+from nai_security.services.log_backends import (
+    DatabaseBackend, JSONLFileBackend, RedisStreamBackend, SyslogBackend, build_log_backends,
+)
+from nai_security.services.log_readers import (
+    DatabaseLogReader, RedisStreamLogReader, RollupLogReader, get_log_reader,
+)
+from nai_security.services.log_writer import BufferedLogWriter, get_log_writer, reset_log_writer
+
+
+def _event(ip='6.6.6.6', action='IP_BLOCK', country_code=''):
+    return SecurityLog(**SecurityLog._event_fields(ip, action, '/', country_code=country_code))
+
+
+class JSONLFileBackendTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'security.jsonl')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _lines(self, path=None):
+        with open(path or self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_writes_one_line_per_event_with_one_fsync(self):
+        backend = JSONLFileBackend(path=self.path)
+        with patch('nai_security.services.log_backends.os.fsync') as fsync:
+            backend.emit([_event('1.1.1.1'), _event('2.2.2.2', country_code='US')])
+        backend.close()
+        self.assertEqual(fsync.call_count, 1)
+        lines = self._lines()
+        self.assertEqual([line['ip_address'] for line in lines], ['1.1.1.1', '2.2.2.2'])
+        self.assertEqual(lines[1]['country_code'], 'US')
+        self.assertEqual(lines[0]['severity'], 'high')
+        self.assertIn('created_at', lines[0])
+
+    def test_rotates_past_max_bytes(self):
+        backend = JSONLFileBackend(path=self.path, max_bytes=300, backup_count=2, fsync=False)
+        for i in range(6):
+            backend.emit([_event(f'10.0.0.{i}')])
+        backend.close()
+        self.assertTrue(os.path.exists(f'{self.path}.1'))
+        self.assertTrue(os.path.exists(f'{self.path}.2'))
+        self.assertFalse(os.path.exists(f'{self.path}.3'))
+        self.assertEqual(self._lines()[-1]['ip_address'], '10.0.0.5')
+
+    def test_processes_sharing_a_path_follow_rotation(self):
+        # Two instances stand in for two worker processes appending to one path.
+        first = JSONLFileBackend(path=self.path, max_bytes=300, backup_count=10, fsync=False)
+        second = JSONLFileBackend(path=self.path, max_bytes=300, backup_count=10, fsync=False)
+        for i in range(6):
+            (first if i % 2 else second).emit([_event(f'10.0.0.{i}')])
+        first.close()
+        second.close()
+        backups = [f'{self.path}.{i}' for i in range(10, 0, -1) if os.path.exists(f'{self.path}.{i}')]
+        self.assertGreater(len(backups), 1)
+        rotated = [line for path in [*backups, self.path] for line in self._lines(path)]
+        self.assertEqual([line['ip_address'] for line in rotated], [f'10.0.0.{i}' for i in range(6)])
+
+    def test_reopens_a_file_rotated_by_another_process(self):
+        backend = JSONLFileBackend(path=self.path, fsync=False)
+        backend.emit([_event('1.1.1.1')])
+        os.replace(self.path, f'{self.path}.1')
+        backend.emit([_event('2.2.2.2')])
+        self.assertEqual([line['ip_address'] for line in self._lines()], ['2.2.2.2'])
+        self.assertEqual([line['ip_address'] for line in self._lines(f'{self.path}.1')], ['1.1.1.1'])
+
+    def test_path_required(self):
+        with self.assertRaises(ImproperlyConfigured):
+            JSONLFileBackend()
+
+
+class SyslogBackendTest(TestCase):
+
+    def test_sends_one_datagram_per_event(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(2)
+        backend = SyslogBackend(address=server.getsockname(), tag='sec')
+        try:
+            backend.emit([_event('1.1.1.1'), _event('2.2.2.2', action='RATE_LIMIT')])
+            first, second = server.recv(4096).decode(), server.recv(4096).decode()
+        finally:
+            backend.close()
+            server.close()
+        # local0 (16) * 8 + error (3) for a 'high' event, warning (4) for 'low' -> info (6).
+        self.assertTrue(first.startswith('<131>sec: '))
+        self.assertEqual(json.loads(first.split('sec: ', 1)[1].rstrip('\x00'))['ip_address'], '1.1.1.1')
+        self.assertTrue(second.startswith('<134>'))
+
+
+class RedisStreamBackendTest(TestCase):
+
+    def test_xadd_with_maxlen(self):
+        client = fakeredis.FakeRedis()
+        backend = RedisStreamBackend(stream='events', maxlen=3, approximate=False, client=client)
+        backend.emit([_event(f'10.0.0.{i}') for i in range(5)])
+        entries = client.xrange('events')
+        self.assertEqual(len(entries), 3)
+        self.assertEqual(entries[-1][1][b'ip_address'], b'10.0.0.4')
+
+    @override_settings(NAI_SECURITY_REDIS_URL=None)
+    def test_needs_a_client(self):
+        with self.assertRaises(ImproperlyConfigured):
+            RedisStreamBackend()
+
+
+class FanOutTest(TestCase):
+
+    def tearDown(self):
+        reset_log_writer()
+
+    def test_failing_backend_does_not_stop_the_others(self):
+        client = fakeredis.FakeRedis()
+        broken = DatabaseBackend()
+        writer = BufferedLogWriter(autostart=False, backends=[
+            broken, RedisStreamBackend(stream='events', client=client),
+        ])
+        writer.write(_event())
+        with patch.object(SecurityLog.objects, 'bulk_create', side_effect=Exception('db down')):
+            self.assertEqual(writer.flush(), 1)
+        self.assertEqual(client.xlen('events'), 1)
+        stats = writer.stats()
+        self.assertEqual((stats['written'], stats['failed']), (1, 1))
+
+    def test_build_from_settings(self):
+        backends = build_log_backends([
+            'database', {'BACKEND': 'redis', 'OPTIONS': {'stream': 's', 'client': fakeredis.FakeRedis()}},
+        ])
+        self.assertIsInstance(backends[0], DatabaseBackend)
+        self.assertEqual(backends[1].stream, 's')
+
+    @override_settings(NAI_SECURITY_LOG_BACKENDS=['database'])
+    def test_backends_setting_makes_logging_non_blocking(self):
+        reset_log_writer()
+        with patch.object(BufferedLogWriter, 'start'):
+            writer = get_log_writer()
+        self.assertIsInstance(writer, BufferedLogWriter)
+        SecurityLog.log_event('1.1.1.1', 'IP_BLOCK', '/')
+        SecurityLog.log_events([{'ip_address': '2.2.2.2', 'action': 'AUTO_BLOCK_IP', 'path': ''}])
+        writer.close()
+        self.assertEqual(
+            set(SecurityLog.objects.values_list('ip_address', flat=True)), {'1.1.1.1', '2.2.2.2'},
+        )
+
+    @override_settings(NAI_SECURITY_LOG_BACKENDS=[])
+    def test_without_database_no_rows_are_written(self):
+        reset_log_writer()
+        with patch.object(BufferedLogWriter, 'start'):
+            SecurityLog.log_event('1.1.1.1', 'IP_BLOCK', '/')
+        get_log_writer().close()
+        self.assertEqual(SecurityLog.objects.count(), 0)
+
+
+class LogReaderTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = fakeredis.FakeRedis()
+        events = [_event('1.1.1.1', country_code='US') for _ in range(3)]
+        events += [_event('2.2.2.2', action='RATE_LIMIT'), _event('3.3.3.3', country_code='DE')]
+        logged_at = timezone.now() - timedelta(minutes=5)
+        for event in events:
+            event.created_at = logged_at
+        SecurityLog.objects.bulk_create(events)
+        SecurityLog.objects.update(created_at=logged_at)
+        RedisStreamBackend(stream='events', client=self.client).emit(events)
+        self.since = timezone.now() - timedelta(hours=1)
+
+    def _readers(self):
+        return [DatabaseLogReader(), RollupLogReader(), RedisStreamLogReader(stream='events', client=self.client)]
+
+    def test_readers_agree(self):
+        for reader in self._readers():
+            with self.subTest(reader=type(reader).__name__):
+                reader.refresh()
+                self.assertEqual(reader.count('ip_address', '1.1.1.1', self.since), 3)
+                self.assertEqual(reader.totals('ip_address', self.since, 2), {'1.1.1.1': 3})
+                self.assertEqual(
+                    reader.totals('country_code', self.since, exclude=['DE']), {'US': 3},
+                )
+                report = reader.report(self.since)
+                self.assertEqual(report['total_blocks'], 5)
+                self.assertEqual(report['blocks_by_action'], {'IP_BLOCK': 4, 'RATE_LIMIT': 1})
+                self.assertEqual(report['top_blocked_ips'][0], {'ip_address': '1.1.1.1', 'count': 3})
+                self.assertEqual(len(report['top_blocked_countries']), 2)
+
+    def test_redis_reader_pages_and_window(self):
+        reader = RedisStreamLogReader(stream='events', client=self.client, page_size=2)
+        self.assertEqual(reader.report(self.since)['total_blocks'], 5)
+        self.assertEqual(reader.report(timezone.now() + timedelta(minutes=1))['total_blocks'], 0)
+
+    def test_selection(self):
+        self.assertIsInstance(get_log_reader(), DatabaseLogReader)
+        with override_settings(NAI_SECURITY_EVENT_ROLLUPS=True):
+            self.assertIsInstance(get_log_reader(), RollupLogReader)
+        with override_settings(NAI_SECURITY_LOG_READER={
+            'READER': 'redis', 'OPTIONS': {'stream': 'events', 'client': self.client},
+        }):
+            self.assertIsInstance(get_log_reader(), RedisStreamLogReader)
+
+    @patch('nai_security.services.log_readers.redis_stream_client')
+    def test_auto_blocker_reads_through_reader(self, stream_client):
+        stream_client.return_value = self.client
+        SecuritySettings.objects.update_or_create(pk=1, defaults={
+            'auto_block_ip_threshold': 3, 'auto_block_ip_window_hours': 1,
+            'auto_block_country_threshold': 0,
+        })
+        SecurityLog.objects.all().delete()
+        with override_settings(NAI_SECURITY_LOG_READER={'READER': 'redis', 'OPTIONS': {'stream': 'events'}}):
+            self.assertEqual(AutoBlocker.process_recent_events()['blocked_ips'], 1)
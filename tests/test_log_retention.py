@@ -0,0 +1,146 @@
+from datetime import date, timedelta
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from nai_security.models import SecurityLog, SecuritySettings, UserAgentString
+from nai_security.services.log_retention import (
+    drop_expired_partitions, ensure_log_partitions, is_partitioned, model_indexes, parse_partition_name,
+    partition_name, partitioning_interval, period_start, plan_partitions, purge_security_logs,
+)
+from nai_security.tasks import purge_security_logs as purge_task
+
+TABLE = 'security_security_log'
+
+
+class PurgeSecurityLogsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        SecuritySettings.objects.update_or_create(pk=1, defaults={'security_log_retention_days': 30})
+
+    def _logs(self, count, days_ago):
+        SecurityLog.objects.bulk_create([
+            SecurityLog(ip_address='1.2.3.4', action='IP_BLOCK', path='/') for _ in range(count)
+        ])
+        ids = SecurityLog.objects.order_by('-pk').values_list('pk', flat=True)[:count]
+        SecurityLog.objects.filter(pk__in=list(ids)).update(created_at=timezone.now() - timedelta(days=days_ago))
+
+    def test_deletes_only_expired_rows(self):
+        self._logs(5, days_ago=40)
+        self._logs(3, days_ago=10)
+        result = purge_security_logs()
+        self.assertEqual(result, {'partitions_dropped': 0, 'deleted': 5, 'user_agents_deleted': 0})
+        self.assertEqual(SecurityLog.objects.count(), 3)
+
+    def test_deletes_in_batches_with_progress(self):
+        self._logs(7, days_ago=40)
+        seen = []
+        self.assertEqual(purge_security_logs(batch_size=3, progress=seen.append)['deleted'], 7)
+        self.assertEqual(seen, [3, 6, 7])
+
+    def test_explicit_days_override_settings(self):
+        self._logs(2, days_ago=10)
+        self.assertEqual(purge_security_logs(retention_days=5)['deleted'], 2)
+
+    def test_zero_keeps_everything(self):
+        SecuritySettings.objects.filter(pk=1).update(security_log_retention_days=0)
+        cache.clear()
+        self._logs(2, days_ago=4000)
+        self.assertEqual(purge_security_logs()['deleted'], 0)
+        self.assertEqual(SecurityLog.objects.count(), 2)
+
+    def test_deletes_user_agents_left_unused(self):
+        old, kept = (
+            SecurityLog.log_event('1.2.3.4', 'IP_BLOCK', '/', user_agent=agent) for agent in ('old/1.0', 'kept/1.0')
+        )
+        SecurityLog.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=40))
+        UserAgentString.objects.update(created_at=timezone.now() - timedelta(days=40))
+        result = purge_security_logs()
+        self.assertEqual((result['deleted'], result['user_agents_deleted']), (1, 1))
+        self.assertEqual(list(UserAgentString.objects.values_list('value', flat=True)), ['kept/1.0'])
+        self.assertEqual(SecurityLog.objects.get(pk=kept.pk).user_agent, 'kept/1.0')
+
+    def test_keeps_recent_unused_user_agents(self):
+        # Created inside the retention window: its log row may still be on the way.
+        UserAgentString.objects.create(hash=UserAgentString.hash_value('new/1.0'), value='new/1.0')
+        self.assertEqual(purge_security_logs()['user_agents_deleted'], 0)
+        self.assertTrue(UserAgentString.objects.exists())
+
+    def test_task(self):
+        self._logs(2, days_ago=40)
+        self.assertEqual(purge_task(), {
+            'partitions_dropped': 0, 'deleted': 2, 'user_agents_deleted': 0, 'partitions_created': 0,
+        })
+
+    def test_command(self):
+        self._logs(3, days_ago=40)
+        out = StringIO()
+        call_command('purge_security_logs', '--batch-size', '2', stdout=out)
+        self.assertIn('2 deleted', out.getvalue())
+        self.assertIn('Dropped 0 partitions, deleted 3 rows', out.getvalue())
+
+
+class PartitionPlanTest(TestCase):
+
+    def test_period_start(self):
+        self.assertEqual(period_start(date(2026, 10, 17), 'day'), date(2026, 10, 17))
+        self.assertEqual(period_start(date(2026, 10, 17), 'week'), date(2026, 10, 12))
+
+    def test_plan_days(self):
+        self.assertEqual(plan_partitions('day', date(2026, 10, 17), date(2026, 10, 19)), [
+            (date(2026, 10, 17), date(2026, 10, 18)),
+            (date(2026, 10, 18), date(2026, 10, 19)),
+            (date(2026, 10, 19), date(2026, 10, 20)),
+        ])
+
+    def test_plan_weeks_from_mid_week(self):
+        self.assertEqual(plan_partitions('week', date(2026, 10, 15), date(2026, 10, 20)), [
+            (date(2026, 10, 15), date(2026, 10, 19)),
+            (date(2026, 10, 19), date(2026, 10, 26)),
+        ])
+
+    def test_names_round_trip(self):
+        name = partition_name(TABLE, 'week', date(2026, 10, 15))
+        self.assertEqual(name, 'security_security_log_w20261015')
+        self.assertEqual(parse_partition_name(TABLE, name), (date(2026, 10, 15), date(2026, 10, 19)))
+        self.assertEqual(
+            parse_partition_name(TABLE, partition_name(TABLE, 'day', date(2026, 10, 17))),
+            (date(2026, 10, 17), date(2026, 10, 18)),
+        )
+        self.assertIsNone(parse_partition_name(TABLE, f"{TABLE}_default"))
+        self.assertIsNone(parse_partition_name(TABLE, 'other_table_d20261017'))
+
+    def test_interval_setting_validated(self):
+        with override_settings(NAI_SECURITY_LOG_PARTITIONING='month'):
+            with self.assertRaises(ValueError):
+                partitioning_interval()
+
+
+@override_settings(NAI_SECURITY_LOG_PARTITIONING='day')
+class PartitioningWithoutPostgresTest(TestCase):
+
+    def test_no_op(self):
+        self.assertFalse(is_partitioned())
+        self.assertEqual(ensure_log_partitions(), 0)
+        self.assertEqual(drop_expired_partitions(timezone.now()), 0)
+
+    def test_command_refuses(self):
+        with self.assertRaisesMessage(CommandError, 'PostgreSQL'):
+            call_command('partition_security_log', stdout=StringIO())
+
+    def test_model_indexes_match_the_table(self):
+        indexes = model_indexes(SecurityLog, connection)
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, TABLE)
+        self.assertEqual(
+            sorted(
+                tuple(SecurityLog._meta.get_field(name.lstrip('-')).column for name in index.fields)
+                for index in indexes
+            ),
+            sorted(tuple(info['columns']) for info in constraints.values() if info['index'] and not info['unique']),
+        )
@@ -0,0 +1,107 @@
+from unittest.mock import patch
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+
+from nai_security.middleware import SecurityMiddleware
+from nai_security.models import BlockedIP, SecurityLog, SecuritySettings
+from nai_security.services.log_writer import (
+    BufferedLogWriter, DatabaseLogWriter, get_log_writer, reset_log_writer,
+)
+
+
+def _event(ip='6.6.6.6'):
+    return SecurityLog(**SecurityLog._event_fields(ip, 'IP_BLOCK', '/'))
+
+
+class BufferedLogWriterTest(TestCase):
+
+    def test_nothing_written_until_flush(self):
+        writer = BufferedLogWriter(autostart=False)
+        writer.write(_event())
+        writer.write(_event('7.7.7.7'))
+        self.assertEqual(SecurityLog.objects.count(), 0)
+        self.assertEqual(writer.flush(), 2)
+        self.assertEqual(SecurityLog.objects.count(), 2)
+        self.assertEqual(writer.stats(), {
+            'queued': 2, 'written': 2, 'dropped': 0, 'failed': 0, 'pending': 0,
+        })
+
+    def test_flush_uses_batched_inserts(self):
+        writer = BufferedLogWriter(batch_size=10, autostart=False)
+        for i in range(25):
+            writer.write(_event(f'10.0.0.{i}'))
+        with self.assertNumQueries(3):
+            writer.flush()
+        self.assertEqual(SecurityLog.objects.count(), 25)
+
+    def test_full_queue_drops_and_counts(self):
+        writer = BufferedLogWriter(queue_size=3, autostart=False)
+        for _ in range(5):
+            writer.write(_event())
+        stats = writer.stats()
+        self.assertEqual(stats['queued'], 3)
+        self.assertEqual(stats['dropped'], 2)
+        self.assertEqual(writer.flush(), 3)
+
+    def test_failed_batch_is_counted_not_raised(self):
+        writer = BufferedLogWriter(autostart=False)
+        writer.write(_event())
+        with patch.object(SecurityLog.objects, 'bulk_create', side_effect=Exception('db down')):
+            self.assertEqual(writer.flush(), 0)
+        stats = writer.stats()
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(stats['pending'], 0)
+
+    def test_close_flushes_remaining_events(self):
+        writer = BufferedLogWriter(autostart=False)
+        writer.write(_event())
+        writer.close()
+        self.assertEqual(SecurityLog.objects.count(), 1)
+
+
+class LogWriterSelectionTest(TestCase):
+
+    def tearDown(self):
+        reset_log_writer()
+
+    def test_default_is_database_writer(self):
+        reset_log_writer()
+        self.assertIsInstance(get_log_writer(), DatabaseLogWriter)
+
+    @override_settings(NAI_SECURITY_LOG_WRITER='buffered', NAI_SECURITY_LOG_BATCH_SIZE=50)
+    def test_buffered_from_settings(self):
+        reset_log_writer()
+        writer = get_log_writer()
+        self.assertIsInstance(writer, BufferedLogWriter)
+        self.assertEqual(writer.batch_size, 50)
+
+    @override_settings(NAI_SECURITY_LOG_WRITER='nai_security.services.log_writer.DatabaseLogWriter')
+    def test_dotted_path(self):
+        reset_log_writer()
+        self.assertIsInstance(get_log_writer(), DatabaseLogWriter)
+
+
+@override_settings(NAI_SECURITY_LOG_WRITER='buffered', NAI_SECURITY_LOG_FLUSH_INTERVAL=3600)
+class BufferedMiddlewareTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        reset_log_writer()
+        SecuritySettings.get_settings()
+        self.middleware = SecurityMiddleware(lambda req: HttpResponse('OK'))
+
+    def tearDown(self):
+        reset_log_writer()
+
+    def test_block_returns_before_log_is_written(self):
+        BlockedIP.objects.create(ip_address='6.6.6.6')
+        request = RequestFactory().get('/')
+        request.META['REMOTE_ADDR'] = '6.6.6.6'
+        request.user = AnonymousUser()
+        self.assertEqual(self.middleware(request).status_code, 403)
+        self.assertFalse(SecurityLog.objects.exists())
+        get_log_writer().flush()
+        self.assertTrue(SecurityLog.objects.filter(action='IP_BLOCK', ip_address='6.6.6.6').exists())
@@ -109,7 +109,7 @@ class ExemptPathTest(SecurityMiddlewareBaseTest):
     def test_an_exempt_path_answers_when_the_database_is_unavailable(self):
         cache.clear()
         with patch.object(
-            SecuritySettings, 'get_settings', side_effect=AssertionError('db touched')
+            SecuritySettings, 'get_record', side_effect=AssertionError('db touched')
         ):
             response = self.middleware(self._make_request(path='/health/'))
         self.assertEqual(response.status_code, 200)
@@ -510,3 +510,119 @@ class RateLimitLoggingMiddlewareTest(TestCase):
         request = self._make_request(limited=True)
         self.middleware(request)
         self.assertTrue(SecurityLog.objects.filter(action='RATE_LIMIT').exists())
+
+
+# ------------------------------------------------------------------
+# Async (ASGI) path
+# ------------------------------------------------------------------
+
+async def _async_ok(request):
+    return HttpResponse('OK')
+
+
+class AsyncSecurityMiddlewareTest(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = SecurityMiddleware(_async_ok)
+        SecuritySettings.get_settings()
+        cache.clear()
+
+    def _make_request(self, ip='8.8.8.8', user_agent='Mozilla/5.0', user=None):
+        request = self.factory.get('/')
+        request.META['REMOTE_ADDR'] = ip
+        request.META['HTTP_USER_AGENT'] = user_agent
+        user = user or AnonymousUser()
+
+        async def auser():
+            return user
+        request.auser = auser
+        return request
+
+    def test_async_mode_detected(self):
+        self.assertTrue(self.middleware.async_mode)
+        self.assertFalse(SecurityMiddleware(lambda req: HttpResponse('OK')).async_mode)
+
+    async def test_allowed_request(self):
+        response = await self.middleware(self._make_request())
+        self.assertEqual(response.status_code, 200)
+
+    async def test_blocked_ip(self):
+        await BlockedIP.objects.acreate(ip_address='6.6.6.6')
+        response = await self.middleware(self._make_request(ip='6.6.6.6'))
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(await SecurityLog.objects.filter(action='IP_BLOCK').aexists())
+
+    async def test_blocked_network(self):
+        await BlockedIP.objects.acreate(ip_address='203.0.113.0', prefix_length=24)
+        response = await self.middleware(self._make_request(ip='203.0.113.7'))
+        self.assertEqual(response.status_code, 403)
+
+    async def test_whitelisted_ip_overrides_block(self):
+        await BlockedIP.objects.acreate(ip_address='6.6.6.6')
+        await WhitelistedIP.objects.acreate(ip_address='6.6.6.6')
+        response = await self.middleware(self._make_request(ip='6.6.6.6'))
+        self.assertEqual(response.status_code, 200)
+
+    async def test_ip_block_exemption(self):
+        user = await User.objects.acreate_user(username='asyncexempt', password='pass')
+        await WhitelistedUser.objects.acreate(user=user, exemption_type='ip_block')
+        await BlockedIP.objects.acreate(ip_address='6.6.6.6')
+        response = await self.middleware(self._make_request(ip='6.6.6.6', user=user))
+        self.assertEqual(response.status_code, 200)
+
+    async def test_blocked_user_agent(self):
+        await BlockedUserAgent.objects.acreate(pattern='sqlmap', block_type='contains')
+        response = await self.middleware(self._make_request(user_agent='sqlmap/1.0'))
+        self.assertEqual(response.status_code, 403)
+
+    @patch('nai_security.middleware.security.get_country_from_ip_async')
+    async def test_blocked_country(self, mock_geo):
+        mock_geo.return_value = 'CN'
+        await BlockedCountry.objects.acreate(code='CN')
+        response = await self.middleware(self._make_request())
+        self.assertEqual(response.status_code, 403)
+
+    @patch('nai_security.middleware.security.get_country_from_ip_async')
+    async def test_country_whitelist_mode(self, mock_geo):
+        mock_geo.return_value = 'RU'
+        settings = await SecuritySettings.get_settings_async()
+        settings.country_whitelist_mode = True
+        await settings.asave()
+        await AllowedCountry.objects.acreate(code='US')
+        response = await self.middleware(self._make_request())
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(NAI_SECURITY_POLICY_SNAPSHOT=True)
+    async def test_snapshot_mode(self):
+        from nai_security.services.policy_snapshot import reset_policy_snapshot
+        reset_policy_snapshot()
+        middleware = SecurityMiddleware(_async_ok)
+        await BlockedIP.objects.acreate(ip_address='6.6.6.6')
+        self.assertEqual((await middleware(self._make_request(ip='6.6.6.6'))).status_code, 403)
+        self.assertEqual((await middleware(self._make_request())).status_code, 200)
+
+
+class AsyncRateLimitLoggingMiddlewareTest(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = RateLimitLoggingMiddleware(_async_ok)
+        cache.clear()
+
+    def _make_request(self, user=None):
+        request = self.factory.get('/')
+        request.META['REMOTE_ADDR'] = '8.8.8.8'
+        request.limited = True
+        request.user = user or AnonymousUser()
+        return request
+
+    async def test_limited_request_logs_event(self):
+        await self.middleware(self._make_request())
+        self.assertTrue(await SecurityLog.objects.filter(action='RATE_LIMIT').aexists())
+
+    async def test_rate_limit_exemption_bypasses_logging(self):
+        user = await User.objects.acreate_user(username='asyncrl', password='pass')
+        await WhitelistedUser.objects.acreate(user=user, exemption_type='rate_limit')
+        await self.middleware(self._make_request(user=user))
+        self.assertFalse(await SecurityLog.objects.filter(action='RATE_LIMIT').aexists())
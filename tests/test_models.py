@@ -28,6 +28,33 @@ class BlockedIPTest(TestCase):
         self.assertIn('AUTO', str(ip))
 
 
+    def test_cidr_input_is_split_and_normalized(self):
+        ip = BlockedIP.objects.create(ip_address='203.0.113.77/24')
+        self.assertEqual(ip.ip_address, '203.0.113.0')
+        self.assertEqual(ip.prefix_length, 24)
+        self.assertEqual(ip.cidr, '203.0.113.0/24')
+
+    def test_host_prefix_collapses_to_single_address(self):
+        ip = BlockedIP.objects.create(ip_address='2001:db8::1', prefix_length=128)
+        self.assertIsNone(ip.prefix_length)
+
+    def test_clean_rejects_prefix_out_of_range(self):
+        from django.core.exceptions import ValidationError
+        ip = BlockedIP(ip_address='203.0.113.0', prefix_length=33)
+        with self.assertRaises(ValidationError):
+            ip.clean()
+
+    def test_host_and_networks_on_one_address(self):
+        from django.db import IntegrityError, transaction
+        BlockedIP.objects.create(ip_address='10.0.0.0')
+        BlockedIP.objects.create(ip_address='10.0.0.0/8')
+        BlockedIP.objects.create(ip_address='10.0.0.0/16')
+        self.assertEqual(BlockedIP.objects.filter(ip_address='10.0.0.0').count(), 3)
+        for duplicate in ('10.0.0.0', '10.0.0.0/16'):
+            with self.subTest(duplicate), self.assertRaises(IntegrityError), transaction.atomic():
+                BlockedIP.objects.create(ip_address=duplicate)
+
+
 class BlockedEmailTest(TestCase):
     def test_is_blocked(self):
         BlockedEmail.objects.create(email='bad@test.com')
@@ -107,6 +134,18 @@ class WhitelistedIPTest(TestCase):
         self.assertTrue(WhitelistedIP.is_whitelisted('10.0.0.1'))
         self.assertFalse(WhitelistedIP.is_whitelisted('10.0.0.2'))
 
+    def test_is_whitelisted_by_network(self):
+        WhitelistedIP.objects.create(ip_address='2001:db8::', prefix_length=48)
+        self.assertTrue(WhitelistedIP.is_whitelisted('2001:db8:0:1::5'))
+        self.assertFalse(WhitelistedIP.is_whitelisted('2001:db9::5'))
+
+    def test_host_and_network_on_one_address(self):
+        from django.db import IntegrityError, transaction
+        WhitelistedIP.objects.create(ip_address='203.0.113.0')
+        WhitelistedIP.objects.create(ip_address='203.0.113.0/24')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            WhitelistedIP.objects.create(ip_address='203.0.113.0')
+
 
 class WhitelistedUserTest(TestCase):
     def setUp(self):
@@ -164,6 +203,54 @@ class SecuritySettingsTest(TestCase):
         s.axes_cooloff_minutes = 30
         s.full_clean()  # Should not raise
 
+    def test_record_is_cached_as_plain_tuple(self):
+        from django.core.cache import cache
+        from nai_security.models.security_settings import SETTINGS_RECORD_CACHE_KEY, SettingsRecord
+        cache.clear()
+        record = SecuritySettings.get_record()
+        self.assertIsInstance(record, SettingsRecord)
+        self.assertTrue(record.ip_blocking_enabled)
+        self.assertEqual(cache.get(SETTINGS_RECORD_CACHE_KEY), (SettingsRecord.FORMAT, (True, True, True, False)))
+        with self.assertNumQueries(0):
+            self.assertEqual(SecuritySettings.get_record(), record)
+
+    def test_settings_cached_as_plain_values(self):
+        from datetime import datetime
+        from django.core.cache import cache
+        from nai_security.models.security_settings import SETTINGS_CACHE_KEY
+        cache.clear()
+        SecuritySettings.get_settings()
+        names, values = cache.get(SETTINGS_CACHE_KEY)
+        self.assertIn('max_login_attempts', names)
+        self.assertTrue(all(v is None or isinstance(v, (bool, int, str, datetime)) for v in values))
+        with self.assertNumQueries(0):
+            s = SecuritySettings.get_settings()
+        self.assertEqual((s.pk, s.max_login_attempts, s._state.adding), (1, 5, False))
+        s.max_login_attempts = 7
+        s.save()
+        self.assertEqual(SecuritySettings.get_settings().max_login_attempts, 7)
+
+    def test_pickled_settings_entry_is_ignored(self):
+        from django.core.cache import cache
+        from nai_security.models.security_settings import SETTINGS_CACHE_KEY
+        stale = SecuritySettings.get_settings()
+        stale.max_login_attempts = 99
+        cache.set(SETTINGS_CACHE_KEY, stale)
+        self.assertEqual(SecuritySettings.get_settings().max_login_attempts, 5)
+
+    def test_record_refreshes_on_save(self):
+        SecuritySettings.get_record()
+        s = SecuritySettings.get_settings()
+        s.ip_blocking_enabled = False
+        s.save()
+        self.assertFalse(SecuritySettings.get_record().ip_blocking_enabled)
+
+    def test_record_in_older_format_is_ignored(self):
+        from django.core.cache import cache
+        from nai_security.models.security_settings import SETTINGS_RECORD_CACHE_KEY
+        cache.set(SETTINGS_RECORD_CACHE_KEY, (0, (False,)))
+        self.assertTrue(SecuritySettings.get_record().ip_blocking_enabled)
+
 
 class SecurityLogTest(TestCase):
     def test_log_event(self):
@@ -176,6 +263,10 @@ class SecurityLogTest(TestCase):
         self.assertEqual(log.severity, 'high')
         self.assertEqual(log.action, 'IP_BLOCK')
 
+    def test_unknown_country_stored_empty(self):
+        log = SecurityLog.log_event('1.2.3.4', 'AXES_LOCK', '/login/', country_code=None)
+        self.assertEqual(SecurityLog.objects.get(pk=log.pk).country_code, '')
+
 
 class LoginHistoryTest(TestCase):
     def setUp(self):
@@ -0,0 +1,130 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import path, re_path
+from django.utils import timezone
+
+from nai_security.middleware import SecurityMiddleware
+from nai_security.models import BlockedIP, SecurityLog, SecurityRouteRollup, SecuritySettings
+from nai_security.services.event_rollups import add_rollup_events, rollup_security_events
+from nai_security.services.log_readers import DatabaseLogReader, RollupLogReader
+from nai_security.services.path_normalizer import _resolved_route, normalize_path, request_route
+
+urlpatterns = [
+    path('orders/<int:pk>/', lambda request, pk: HttpResponse()),
+    re_path(r'^files/(?P<name>\w+)$', lambda request, name: HttpResponse()),
+]
+
+UUID = '3f2b8c1e-9a4d-4e6f-8b2a-1c3d5e7f9a0b'
+
+
+class NormalizePathTest(TestCase):
+
+    def test_collapses_ids(self):
+        self.assertEqual(normalize_path('/orders/42/items/7'), '/orders/{int}/items/{int}')
+        self.assertEqual(normalize_path(f'/u/{UUID}/'), '/u/{uuid}/')
+        self.assertEqual(normalize_path('/t/' + 'ab12' * 5), '/t/{hex}')
+
+    def test_keeps_words_and_drops_query(self):
+        self.assertEqual(normalize_path('/wp-login.php?redirect=1'), '/wp-login.php')
+        self.assertEqual(normalize_path('/api/v2/cafe'), '/api/v2/cafe')
+
+    def test_route_is_bounded(self):
+        self.assertEqual(len(normalize_path('/x' * 400)), 255)
+
+
+@override_settings(ROOT_URLCONF='tests.test_path_normalizer', NAI_SECURITY_PATH_NORMALIZATION=True)
+class RequestRouteTest(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        _resolved_route.cache_clear()
+
+    def test_resolved_pattern(self):
+        self.assertEqual(request_route(self.factory.get('/orders/42/')), '/orders/<int:pk>/')
+        self.assertEqual(request_route(self.factory.get('/files/abc')), '/files/(?P<name>\\w+)$')
+
+    def test_unresolved_path_is_normalized(self):
+        self.assertEqual(request_route(self.factory.get('/backup/2024/db.sql')), '/backup/{int}/db.sql')
+
+    def test_unresolved_path_drops_the_script_prefix(self):
+        request = self.factory.get('/backup/2024/db.sql', SCRIPT_NAME='/app')
+        self.assertEqual(request.path, '/app/backup/2024/db.sql')
+        self.assertEqual(request_route(request), '/backup/{int}/db.sql')
+
+    def test_resolver_match_is_used_when_present(self):
+        request = self.factory.get('/orders/42/')
+        request.resolver_match = type('Match', (), {'route': 'orders/<int:pk>/'})()
+        with self.assertNumQueries(0):
+            self.assertEqual(request_route(request), '/orders/<int:pk>/')
+        self.assertEqual(_resolved_route.cache_info().currsize, 0)
+
+    @override_settings(NAI_SECURITY_PATH_NORMALIZATION=False)
+    def test_disabled(self):
+        self.assertEqual(request_route(self.factory.get('/orders/42/')), '')
+
+
+@override_settings(ROOT_URLCONF='tests.test_path_normalizer', NAI_SECURITY_PATH_NORMALIZATION=True)
+class RouteLoggingTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        _resolved_route.cache_clear()
+        SecuritySettings.get_settings()
+
+    def test_middleware_logs_route(self):
+        BlockedIP.objects.create(ip_address='6.6.6.6')
+        middleware = SecurityMiddleware(lambda request: HttpResponse('OK'))
+        request = RequestFactory().get('/orders/42/?page=2', REMOTE_ADDR='6.6.6.6')
+        request.user = AnonymousUser()
+        middleware(request)
+        log = SecurityLog.objects.get(action='IP_BLOCK')
+        self.assertEqual((log.path, log.route), ('/orders/42/', '/orders/<int:pk>/'))
+
+    def test_log_event_normalizes_without_request(self):
+        log = SecurityLog.log_event('1.1.1.1', 'IP_BLOCK', '/orders/9/')
+        self.assertEqual(log.route, '/orders/{int}/')
+
+    @override_settings(NAI_SECURITY_LOG_PATH_MAX_LENGTH=20)
+    def test_raw_path_is_capped(self):
+        log = SecurityLog.log_event('1.1.1.1', 'IP_BLOCK', '/' + 'a' * 100)
+        self.assertEqual(len(log.path), 20)
+
+    @override_settings(NAI_SECURITY_PATH_NORMALIZATION=False)
+    def test_no_route_when_disabled(self):
+        self.assertEqual(SecurityLog.log_event('1.1.1.1', 'IP_BLOCK', '/orders/9/').route, '')
+
+
+@override_settings(NAI_SECURITY_PATH_NORMALIZATION=True)
+class TopRoutesTest(TestCase):
+
+    def setUp(self):
+        logged_at = timezone.now() - timedelta(minutes=5)
+        for i in range(5):
+            SecurityLog.log_event(f'10.0.0.{i}', 'IP_BLOCK', f'/orders/{i}/')
+        for i in range(2):
+            SecurityLog.log_event('10.0.1.1', 'RATE_LIMIT', f'/wp-admin/{i}')
+        SecurityLog.log_event('10.0.1.2', 'IP_BLOCK', '/', route='')
+        SecurityLog.objects.update(created_at=logged_at)
+        self.since = timezone.now() - timedelta(hours=1)
+
+    def test_rollup_counts_routes(self):
+        rollup_security_events()
+        self.assertEqual(
+            dict(SecurityRouteRollup.objects.values_list('route', 'count')),
+            {'/orders/{int}/': 5, '/wp-admin/{int}': 2},
+        )
+
+    def test_readers_agree(self):
+        rollup_security_events()
+        expected = [{'route': '/orders/{int}/', 'count': 5}, {'route': '/wp-admin/{int}', 'count': 2}]
+        self.assertEqual(DatabaseLogReader().report(self.since)['top_targeted_routes'], expected)
+        self.assertEqual(RollupLogReader().report(self.since)['top_targeted_routes'], expected)
+
+    def test_add_rollup_events(self):
+        add_rollup_events(list(SecurityLog.objects.all()))
+        add_rollup_events(list(SecurityLog.objects.filter(action='RATE_LIMIT')))
+        self.assertEqual(SecurityRouteRollup.objects.get(route='/wp-admin/{int}').count, 4)
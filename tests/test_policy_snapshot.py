@@ -0,0 +1,281 @@
+import time
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+from django.utils import timezone
+
+from nai_security.middleware import RateLimitMiddleware, SecurityMiddleware
+from nai_security.models import (
+    BlockedIP, BlockedCountry, AllowedCountry, WhitelistedIP, WhitelistedUser,
+    SecuritySettings,
+)
+from nai_security.services.ip_index import IPNetworkIndex
+from nai_security.services.policy_snapshot import get_policy_snapshot, reset_policy_snapshot
+from nai_security.utils import POLICY_GENERATION_CACHE_KEY, get_policy_generation
+
+User = get_user_model()
+
+
+class PolicyGenerationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_model_save_bumps_generation(self):
+        self.assertIsNone(get_policy_generation())
+        BlockedIP.objects.create(ip_address='6.6.6.6')
+        first = get_policy_generation()
+        self.assertIsNotNone(first)
+        WhitelistedIP.objects.create(ip_address='10.0.0.1')
+        self.assertGreater(get_policy_generation(), first)
+
+    def test_model_delete_bumps_generation(self):
+        obj = BlockedCountry.objects.create(code='CN')
+        before = get_policy_generation()
+        obj.delete()
+        self.assertGreater(get_policy_generation(), before)
+
+
+class PolicySnapshotTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        reset_policy_snapshot()
+        SecuritySettings.get_settings()
+
+    def test_lookups(self):
+        BlockedIP.objects.create(ip_address='6.6.6.6')
+        BlockedIP.objects.create(ip_address='7.7.7.7', expires_at=timezone.now() - timedelta(hours=1))
+        BlockedIP.objects.create(ip_address='8.8.8.8', is_active=False)
+        WhitelistedIP.objects.create(ip_address='10.0.0.1')
+        BlockedCountry.objects.create(code='CN')
+
+        snapshot = get_policy_snapshot()
+        self.assertTrue(snapshot.is_ip_blocked('6.6.6.6'))
+        self.assertFalse(snapshot.is_ip_blocked('7.7.7.7'))
+        self.assertFalse(snapshot.is_ip_blocked('8.8.8.8'))
+        self.assertTrue(snapshot.is_ip_whitelisted('10.0.0.1'))
+        self.assertTrue(snapshot.is_country_blocked('CN'))
+        self.assertTrue(snapshot.is_country_allowed('RU'))
+
+    def test_allowed_countries(self):
+        AllowedCountry.objects.create(code='US')
+        snapshot = get_policy_snapshot()
+        self.assertTrue(snapshot.is_country_allowed('US'))
+        self.assertFalse(snapshot.is_country_allowed('RU'))
+
+    def test_user_exemption_respects_expiry(self):
+        active = User.objects.create_user(username='active', password='pass')
+        expired = User.objects.create_user(username='expired', password='pass')
+        WhitelistedUser.objects.create(user=active, exemption_type='ip_block')
+        WhitelistedUser.objects.create(
+            user=expired, exemption_type='all', expires_at=timezone.now() - timedelta(hours=1),
+        )
+        snapshot = get_policy_snapshot()
+        self.assertEqual(snapshot.get_user_exemption(active.pk), 'ip_block')
+        self.assertIsNone(snapshot.get_user_exemption(expired.pk))
+
+    def test_reused_until_generation_changes(self):
+        first = get_policy_snapshot()
+        with self.assertNumQueries(0):
+            self.assertIs(get_policy_snapshot(), first)
+        BlockedIP.objects.create(ip_address='6.6.6.6')
+        second = get_policy_snapshot()
+        self.assertIsNot(second, first)
+        self.assertTrue(second.is_ip_blocked('6.6.6.6'))
+
+    def test_rebuilds_after_generation_counter_lost(self):
+        first = get_policy_snapshot()
+        cache.delete(POLICY_GENERATION_CACHE_KEY)
+        self.assertIsNot(get_policy_snapshot(), first)
+        self.assertIsNotNone(get_policy_generation())
+
+    @override_settings(NAI_SECURITY_POLICY_SNAPSHOT_MAX_AGE=0)
+    def test_rebuilds_when_older_than_max_age(self):
+        first = get_policy_snapshot()
+        self.assertIsNot(get_policy_snapshot(), first)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_no_rebuild_per_call_without_a_cache(self):
+        first = get_policy_snapshot()
+        with self.assertNumQueries(0):
+            self.assertIs(get_policy_snapshot(), first)
+        self.assertIsNone(get_policy_generation())
+
+    def test_lost_counter_is_seeded_not_bumped(self):
+        get_policy_snapshot()
+        cache.delete(POLICY_GENERATION_CACHE_KEY)
+        cache.add(POLICY_GENERATION_CACHE_KEY, 42, None)  # another worker re-seeded it first
+        snapshot = get_policy_snapshot()
+        self.assertEqual((snapshot.generation, get_policy_generation()), (42, 42))
+
+    def test_failed_rebuild_keeps_previous_snapshot(self):
+        first = get_policy_snapshot()
+        BlockedIP.objects.create(ip_address='6.6.6.6')
+        with patch(
+            'nai_security.services.policy_snapshot._snapshot_cache.builder',
+            side_effect=Exception('db down'),
+        ):
+            self.assertIs(get_policy_snapshot(), first)
+
+
+@override_settings(NAI_SECURITY_POLICY_SNAPSHOT=True)
+class SnapshotMiddlewareTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        reset_policy_snapshot()
+        self.factory = RequestFactory()
+        self.middleware = SecurityMiddleware(lambda req: HttpResponse('OK'))
+        SecuritySettings.get_settings()
+
+    def _make_request(self, ip='8.8.8.8', user=None):
+        request = self.factory.get('/')
+        request.META['REMOTE_ADDR'] = ip
+        request.META['HTTP_USER_AGENT'] = 'Mozilla/5.0'
+        request.user = user or AnonymousUser()
+        return request
+
+    def test_blocked_ip(self):
+        BlockedIP.objects.create(ip_address='6.6.6.6')
+        self.assertEqual(self.middleware(self._make_request(ip='6.6.6.6')).status_code, 403)
+
+    def test_whitelisted_ip_overrides_block(self):
+        BlockedIP.objects.create(ip_address='6.6.6.6')
+        WhitelistedIP.objects.create(ip_address='6.6.6.6')
+        self.assertEqual(self.middleware(self._make_request(ip='6.6.6.6')).status_code, 200)
+
+    def test_ip_block_exemption(self):
+        user = User.objects.create_user(username='exempt', password='pass')
+        WhitelistedUser.objects.create(user=user, exemption_type='ip_block')
+        BlockedIP.objects.create(ip_address='6.6.6.6')
+        request = self._make_request(ip='6.6.6.6', user=user)
+        self.assertEqual(self.middleware(request).status_code, 200)
+
+    @patch('nai_security.middleware.security.get_country_from_ip', return_value='CN')
+    def test_blocked_country(self, mock_geo):
+        BlockedCountry.objects.create(code='CN')
+        self.assertEqual(self.middleware(self._make_request()).status_code, 403)
+
+    def test_allowed_request_touches_no_database_once_built(self):
+        self.middleware(self._make_request())
+        with self.assertNumQueries(0):
+            response = self.middleware(self._make_request())
+        self.assertEqual(response.status_code, 200)
+
+    def test_new_block_applies_on_next_request(self):
+        self.assertEqual(self.middleware(self._make_request(ip='6.6.6.6')).status_code, 200)
+        BlockedIP.objects.create(ip_address='6.6.6.6')
+        self.assertEqual(self.middleware(self._make_request(ip='6.6.6.6')).status_code, 403)
+
+    def test_settings_change_applies_on_next_request(self):
+        BlockedIP.objects.create(ip_address='6.6.6.6')
+        self.assertEqual(self.middleware(self._make_request(ip='6.6.6.6')).status_code, 403)
+        settings = SecuritySettings.get_settings()
+        settings.ip_blocking_enabled = False
+        settings.save()
+        self.assertEqual(self.middleware(self._make_request(ip='6.6.6.6')).status_code, 200)
+
+
+class IPNetworkIndexTest(TestCase):
+
+    def test_longest_prefix_first(self):
+        index = IPNetworkIndex([
+            ('10.0.0.0/8', 'wide'),
+            ('10.1.0.0/16', 'narrow'),
+            ('10.1.2.3', 'host'),
+        ])
+        self.assertEqual(index.lookup('10.1.2.3'), 'host')
+        self.assertEqual(index.lookup('10.1.9.9'), 'narrow')
+        self.assertEqual(index.lookup('10.9.9.9'), 'wide')
+        self.assertEqual(list(index.iter_matches('10.1.2.3')), ['host', 'narrow', 'wide'])
+        self.assertIsNone(index.lookup('11.0.0.1'))
+
+    def test_ipv6_and_mapped_ipv4(self):
+        index = IPNetworkIndex([('2001:db8::/48', 1), ('203.0.113.0/24', 2)])
+        self.assertIn('2001:db8:0:ffff::1', index)
+        self.assertNotIn('2001:db8:1::1', index)
+        self.assertIn('::ffff:203.0.113.9', index)
+
+    def test_none_value_still_counts_as_match(self):
+        index = IPNetworkIndex([('203.0.113.0/24', None)])
+        self.assertIn('203.0.113.1', index)
+
+    def test_invalid_input_is_ignored(self):
+        index = IPNetworkIndex([('not-an-ip', 1)])
+        self.assertEqual(len(index), 0)
+        self.assertNotIn('garbage', IPNetworkIndex([('10.0.0.0/8', 1)]))
+
+
+class NetworkBlockMiddlewareTest(TestCase):
+    """Network rows apply in the default (cache) mode as well as snapshot mode."""
+
+    def setUp(self):
+        cache.clear()
+        reset_policy_snapshot()
+        self.factory = RequestFactory()
+        self.middleware = SecurityMiddleware(lambda req: HttpResponse('OK'))
+        SecuritySettings.get_settings()
+
+    def _make_request(self, ip):
+        request = self.factory.get('/')
+        request.META['REMOTE_ADDR'] = ip
+        request.META['HTTP_USER_AGENT'] = 'Mozilla/5.0'
+        request.user = AnonymousUser()
+        return request
+
+    def test_blocked_network(self):
+        BlockedIP.objects.create(ip_address='203.0.113.0', prefix_length=24)
+        self.assertEqual(self.middleware(self._make_request('203.0.113.200')).status_code, 403)
+        self.assertEqual(self.middleware(self._make_request('203.0.114.1')).status_code, 200)
+
+    def test_expired_network_passes(self):
+        BlockedIP.objects.create(
+            ip_address='203.0.113.0', prefix_length=24,
+            expires_at=timezone.now() - timedelta(hours=1),
+        )
+        self.assertEqual(self.middleware(self._make_request('203.0.113.5')).status_code, 200)
+
+    def test_network_added_after_cached_verdict(self):
+        self.assertEqual(self.middleware(self._make_request('203.0.113.5')).status_code, 200)
+        BlockedIP.objects.create(ip_address='203.0.113.0', prefix_length=24)
+        self.assertEqual(self.middleware(self._make_request('203.0.113.5')).status_code, 403)
+
+    def test_whitelisted_network_overrides_block(self):
+        BlockedIP.objects.create(ip_address='2001:db8::1')
+        WhitelistedIP.objects.create(ip_address='2001:db8::', prefix_length=48)
+        self.assertEqual(self.middleware(self._make_request('2001:db8::1')).status_code, 200)
+
+    def _generation_reads(self):
+        chain = SecurityMiddleware(RateLimitMiddleware(lambda req: HttpResponse('OK')))
+        chain(self._make_request('203.0.113.5'))
+        get = cache.get
+        with patch.object(cache, 'get', side_effect=get) as cache_get:
+            self.assertEqual(chain(self._make_request('203.0.113.5')).status_code, 200)
+        return len([call for call in cache_get.call_args_list if call.args[0] == POLICY_GENERATION_CACHE_KEY])
+
+    def test_no_generation_read_per_request_without_snapshot(self):
+        self.assertEqual(self._generation_reads(), 0)
+
+    @override_settings(NAI_SECURITY_POLICY_SNAPSHOT=True)
+    def test_one_generation_read_per_request(self):
+        self.assertEqual(self._generation_reads(), 1)
+
+    def test_network_block_from_another_worker_seen_after_the_check_interval(self):
+        self.assertEqual(self.middleware(self._make_request('203.0.113.5')).status_code, 200)
+        with patch('nai_security.utils._local_bumps', {}):
+            BlockedIP.objects.create(ip_address='203.0.113.0', prefix_length=24)
+        self.assertEqual(self.middleware(self._make_request('203.0.113.5')).status_code, 200)
+        with patch('nai_security.services.policy_snapshot.time.monotonic', return_value=time.monotonic() + 2):
+            self.assertEqual(self.middleware(self._make_request('203.0.113.5')).status_code, 403)
+
+    @override_settings(NAI_SECURITY_POLICY_SNAPSHOT=True)
+    def test_blocked_network_in_snapshot_mode(self):
+        middleware = SecurityMiddleware(lambda req: HttpResponse('OK'))
+        BlockedIP.objects.create(ip_address='2001:db8::', prefix_length=48)
+        self.assertEqual(middleware(self._make_request('2001:db8::42')).status_code, 403)
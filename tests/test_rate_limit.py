@@ -0,0 +1,325 @@
+import multiprocessing
+import threading
+import time
+from unittest import skipUnless
+from unittest.mock import patch
+
+import fakeredis
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, RequestFactory, override_settings
+
+from nai_security.middleware import RateLimitMiddleware, RateLimitLoggingMiddleware
+from nai_security.models import RateLimitRule, SecurityLog, WhitelistedUser
+from nai_security.services.rate_limiter import (
+    CacheSlidingWindow, CompiledRule, LocalTokenLimiter, RateLimitPolicy, RedisSlidingWindow,
+    SlidingWindowCounter, evaluate, parse_rate, reset_rate_limit_policy,
+)
+
+User = get_user_model()
+
+
+class ParseRateTest(TestCase):
+
+    def test_parse(self):
+        self.assertEqual(parse_rate('10/m'), (10, 60))
+        self.assertEqual(parse_rate('5/h'), (5, 3600))
+        self.assertEqual(parse_rate('1000/d'), (1000, 86400))
+        self.assertEqual(parse_rate('3/10s'), (3, 10))
+
+    def test_invalid(self):
+        for rate in ('10', '10/x', '0/m', 'a/m'):
+            with self.assertRaises(ValueError):
+                parse_rate(rate)
+
+
+class EvaluateTest(TestCase):
+
+    def test_within_limit(self):
+        self.assertTrue(evaluate(5, 0, 5, 60, 10).allowed)
+
+    def test_previous_window_counts_by_overlap(self):
+        # Half of the previous window still overlaps: 10 * 0.5 + 1 = 6 > 5
+        result = evaluate(1, 10, 5, 60, 30)
+        self.assertFalse(result.allowed)
+        # One more fits once 10 * (30 - t) / 60 + 2 <= 5, i.e. t >= 12
+        self.assertEqual(result.retry_after, 12)
+
+    def test_current_window_full_waits_for_rollover(self):
+        result = evaluate(6, 0, 5, 60, 20)
+        self.assertFalse(result.allowed)
+        self.assertGreaterEqual(result.retry_after, 40)
+
+
+class RateLimitPolicyTest(TestCase):
+
+    def test_longest_prefix_and_method(self):
+        policy = RateLimitPolicy.from_rules(1, [
+            (1, '/api/', 'ALL', '100/m'),
+            (2, '/api/auth/', 'ALL', '10/m'),
+            (3, '/api/auth/', 'POST', '5/m'),
+        ])
+        self.assertEqual(policy.match('/api/auth/login/', 'POST').pk, 3)
+        self.assertEqual(policy.match('/api/auth/login/', 'GET').pk, 2)
+        self.assertEqual(policy.match('/api/chat/', 'GET').pk, 1)
+        self.assertIsNone(policy.match('/admin/', 'GET'))
+
+    def test_invalid_rate_skipped(self):
+        policy = RateLimitPolicy.from_rules(1, [(1, '/api/', 'ALL', 'lots')])
+        self.assertIsNone(policy.match('/api/', 'GET'))
+
+
+class SlidingWindowTest(TestCase):
+
+    rule = CompiledRule(pk=1, path_pattern='/api/', method='ALL', limit=3, window=60)
+
+    def setUp(self):
+        cache.clear()
+
+    def _exercise(self, limiter):
+        results = [limiter.hit(self.rule, '1.2.3.4').allowed for _ in range(4)]
+        self.assertEqual(results, [True, True, True, False])
+        self.assertTrue(limiter.hit(self.rule, '5.6.7.8').allowed)
+
+    def test_cache_backend(self):
+        self._exercise(CacheSlidingWindow())
+
+    def test_redis_backend(self):
+        self._exercise(RedisSlidingWindow(fakeredis.FakeRedis()))
+
+    @patch('nai_security.services.rate_limiter.time.time')
+    def test_redis_previous_window_weighted(self, mock_time):
+        limiter = RedisSlidingWindow(fakeredis.FakeRedis())
+        mock_time.return_value = 6000.0  # start of a window
+        for _ in range(3):
+            limiter.hit(self.rule, 'ip')
+        mock_time.return_value = 6060.0 + 15  # quarter into the next one
+        self.assertFalse(limiter.hit(self.rule, 'ip').allowed)  # 3 * 0.75 + 1 > 3
+        mock_time.return_value = 6060.0 + 45
+        self.assertTrue(limiter.hit(self.rule, 'ip').allowed)  # 3 * 0.25 + 2 <= 3
+
+
+class SharedDictCounter(SlidingWindowCounter):
+    """Shared counter over a (possibly multiprocessing-managed) dict; counts round-trips."""
+
+    def __init__(self, store, lock, latency=0.0):
+        self.store = store
+        self.lock = lock
+        self.latency = latency
+        self.calls = 0
+
+    def consume(self, rule, identity, index, amount):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        key = self._key(rule, identity, index)
+        with self.lock:
+            current = self.store.get(key, 0) + amount
+            self.store[key] = current
+            return current, self.store.get(self._key(rule, identity, index - 1), 0)
+
+
+class LocalTokenLimiterTest(SimpleTestCase):
+
+    rule = CompiledRule(pk=1, path_pattern='/api/', method='ALL', limit=100, window=86400)
+
+    def _limiter(self, **kwargs):
+        shared = SharedDictCounter({}, threading.Lock())
+        return LocalTokenLimiter(shared, **kwargs), shared
+
+    def test_most_requests_decided_locally(self):
+        limiter, shared = self._limiter(sync_tokens=10, sync_interval=60)
+        results = [limiter.hit(self.rule, 'ip').allowed for _ in range(50)]
+        self.assertTrue(all(results))
+        self.assertLessEqual(shared.calls, 6)
+        self.assertEqual(limiter.local_decisions + limiter.syncs, 50)
+
+    def test_single_worker_is_exact(self):
+        limiter, _ = self._limiter(sync_tokens=10, sync_interval=60)
+        admitted = sum(limiter.hit(self.rule, 'ip').allowed for _ in range(150))
+        self.assertEqual(admitted, 100)
+
+    def test_over_limit_refused_without_round_trip(self):
+        limiter, shared = self._limiter(sync_tokens=10, sync_interval=60)
+        for _ in range(101):
+            limiter.hit(self.rule, 'ip')
+        calls = shared.calls
+        for _ in range(20):
+            self.assertFalse(limiter.hit(self.rule, 'ip').allowed)
+        self.assertEqual(shared.calls, calls)
+
+    def test_other_workers_hits_seen_on_sync(self):
+        shared = SharedDictCounter({}, threading.Lock())
+        a = LocalTokenLimiter(shared, sync_tokens=5, sync_interval=60)
+        b = LocalTokenLimiter(shared, sync_tokens=5, sync_interval=60)
+        for _ in range(60):
+            a.hit(self.rule, 'ip')
+        admitted = sum(b.hit(self.rule, 'ip').allowed for _ in range(60))
+        self.assertLessEqual(admitted, 40 + 5)
+
+    def test_evicted_window_pending_hits_pushed(self):
+        limiter, shared = self._limiter(sync_tokens=10, sync_interval=60, max_entries=1)
+        limiter.hit(self.rule, 'a')
+        limiter.hit(self.rule, 'a')  # pending locally
+        limiter.hit(self.rule, 'b')  # evicts 'a'
+        index = int(time.time() // self.rule.window)
+        self.assertEqual(shared.store[SlidingWindowCounter._key(self.rule, 'a', index)], 2)
+
+    def test_failed_sync_keeps_pending_hits(self):
+        limiter, shared = self._limiter(sync_tokens=2, sync_interval=60)
+        limiter.hit(self.rule, 'ip')
+        limiter.hit(self.rule, 'ip')
+        with patch.object(shared, 'consume', side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                limiter.hit(self.rule, 'ip')
+        limiter.hit(self.rule, 'ip')
+        index = int(time.time() // self.rule.window)
+        self.assertEqual(shared.store[SlidingWindowCounter._key(self.rule, 'ip', index)], 4)
+
+    @override_settings(NAI_SECURITY_RATE_LIMIT_MODE='approximate', NAI_SECURITY_RATE_LIMIT_SYNC_TOKENS=20)
+    def test_selected_by_setting(self):
+        from nai_security.services.rate_limiter import get_rate_limiter
+        limiter = get_rate_limiter()
+        self.assertIsInstance(limiter, LocalTokenLimiter)
+        self.assertEqual(limiter.sync_tokens, 20)
+
+
+def _worker(store, lock, rule, requests, sync_tokens, results):
+    shared = SharedDictCounter(store, lock, latency=0.0005)
+    limiter = LocalTokenLimiter(shared, sync_tokens=sync_tokens, sync_interval=0.05) if sync_tokens else shared
+    started = time.perf_counter()
+    admitted = sum(limiter.hit(rule, 'client').allowed for _ in range(requests))
+    results.put((admitted, shared.calls, time.perf_counter() - started))
+
+
+@skipUnless('fork' in multiprocessing.get_all_start_methods(), 'needs fork')
+class LocalTokenLimiterMultiProcessTest(SimpleTestCase):
+    """
+    Several worker processes share one counter (a manager dict standing in for
+    Redis, with a 0.5 ms round-trip). Approximate mode must keep the global
+    limit within (workers - 1) * sync_tokens while making far fewer round-trips.
+    """
+
+    WORKERS = 4
+    REQUESTS = 400
+    SYNC_TOKENS = 10
+    rule = CompiledRule(pk=7, path_pattern='/api/', method='ALL', limit=600, window=86400)
+
+    def _run(self, sync_tokens):
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Manager() as manager:
+            store, lock, results = manager.dict(), manager.Lock(), manager.Queue()
+            procs = [
+                ctx.Process(target=_worker, args=(store, lock, self.rule, self.REQUESTS, sync_tokens, results))
+                for _ in range(self.WORKERS)
+            ]
+            for proc in procs:
+                proc.start()
+            for proc in procs:
+                proc.join(60)
+            rows = [results.get(timeout=5) for _ in procs]
+        admitted = sum(r[0] for r in rows)
+        calls = sum(r[1] for r in rows)
+        elapsed = max(r[2] for r in rows)
+        return admitted, calls, elapsed
+
+    def test_error_bound_and_round_trips(self):
+        strict_admitted, strict_calls, strict_time = self._run(sync_tokens=0)
+        admitted, calls, approx_time = self._run(sync_tokens=self.SYNC_TOKENS)
+
+        self.assertEqual(strict_admitted, self.rule.limit)
+        self.assertEqual(strict_calls, self.WORKERS * self.REQUESTS)
+
+        self.assertGreaterEqual(admitted, self.rule.limit - self.SYNC_TOKENS * self.WORKERS)
+        self.assertLessEqual(admitted, self.rule.limit + (self.WORKERS - 1) * self.SYNC_TOKENS)
+        self.assertLess(calls, strict_calls / 3)
+        self.assertLess(approx_time, strict_time)
+
+
+class RateLimitMiddlewareTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        reset_rate_limit_policy()
+        self.factory = RequestFactory()
+        self.middleware = RateLimitMiddleware(lambda req: HttpResponse('OK'))
+
+    def _make_request(self, path='/api/auth/login/', method='post', ip='8.8.8.8', user=None):
+        request = getattr(self.factory, method)(path)
+        request.META['REMOTE_ADDR'] = ip
+        request.user = user or AnonymousUser()
+        return request
+
+    def test_limit_returns_429_with_retry_after(self):
+        RateLimitRule.objects.create(name='auth', path_pattern='/api/auth/', rate='1/m')
+        self.assertEqual(self.middleware(self._make_request()).status_code, 200)
+        request = self._make_request()
+        response = self.middleware(request)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertTrue(request.limited)
+        self.assertTrue(SecurityLog.objects.filter(action='RATE_LIMIT', ip_address='8.8.8.8').exists())
+
+    def test_unmatched_path_and_method(self):
+        RateLimitRule.objects.create(name='auth', path_pattern='/api/auth/', rate='1/m', method='POST')
+        for _ in range(3):
+            self.assertEqual(self.middleware(self._make_request(path='/other/')).status_code, 200)
+            self.assertEqual(self.middleware(self._make_request(method='get')).status_code, 200)
+
+    def test_inactive_rule_not_enforced(self):
+        rule = RateLimitRule.objects.create(name='auth', path_pattern='/api/auth/', rate='1/m')
+        self.middleware(self._make_request())
+        rule.is_active = False
+        rule.save()
+        self.assertEqual(self.middleware(self._make_request()).status_code, 200)
+
+    def test_rate_limit_exemption(self):
+        RateLimitRule.objects.create(name='auth', path_pattern='/api/auth/', rate='1/m')
+        user = User.objects.create_user(username='rl', password='pass')
+        WhitelistedUser.objects.create(user=user, exemption_type='rate_limit')
+        for _ in range(3):
+            self.assertEqual(self.middleware(self._make_request(user=user)).status_code, 200)
+
+    def test_ip_block_exemption_does_not_bypass(self):
+        RateLimitRule.objects.create(name='auth', path_pattern='/api/auth/', rate='1/m')
+        user = User.objects.create_user(username='ipb', password='pass')
+        WhitelistedUser.objects.create(user=user, exemption_type='ip_block')
+        self.middleware(self._make_request(user=user))
+        self.assertEqual(self.middleware(self._make_request(user=user)).status_code, 429)
+
+    def test_block_count_batched(self):
+        rule = RateLimitRule.objects.create(name='auth', path_pattern='/api/auth/', rate='1/m')
+        for _ in range(4):
+            self.middleware(self._make_request())
+        rule.refresh_from_db()
+        self.assertEqual(rule.block_count, 0)
+        self.assertEqual(cache.get(f"sec_rl_count:{rule.pk}"), 3)
+
+    def test_counter_failure_fails_open(self):
+        RateLimitRule.objects.create(name='auth', path_pattern='/api/auth/', rate='1/m')
+        with patch.object(self.middleware.limiter, 'hit', side_effect=ConnectionError('down')):
+            for _ in range(3):
+                self.assertEqual(self.middleware(self._make_request()).status_code, 200)
+
+    def test_logging_middleware_does_not_log_twice(self):
+        RateLimitRule.objects.create(name='auth', path_pattern='/api/auth/', rate='1/m')
+        chain = RateLimitLoggingMiddleware(self.middleware)
+        chain(self._make_request())
+        chain(self._make_request())
+        self.assertEqual(SecurityLog.objects.filter(action='RATE_LIMIT').count(), 1)
+
+    def test_uses_redis_when_configured(self):
+        with patch('nai_security.services.rate_limiter.get_redis_client', return_value=fakeredis.FakeRedis()):
+            middleware = RateLimitMiddleware(lambda req: HttpResponse('OK'))
+        self.assertIsInstance(middleware.limiter, RedisSlidingWindow)
+
+    async def test_async_path(self):
+        async def ok(request):
+            return HttpResponse('OK')
+
+        await RateLimitRule.objects.acreate(name='auth', path_pattern='/api/auth/', rate='1/m')
+        middleware = RateLimitMiddleware(ok)
+        self.assertEqual((await middleware(self._make_request())).status_code, 200)
+        self.assertEqual((await middleware(self._make_request())).status_code, 429)
@@ -0,0 +1,191 @@
+import random
+from types import SimpleNamespace
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from nai_security.models import BlockedUserAgent
+from nai_security.models.blocked_user_agent import UA_PATTERN_CACHE_KEY, UA_PATTERN_VERSION_KEY
+from nai_security.services.ua_matcher import (
+    PATTERN_CACHE_FORMAT, AhoCorasick, UAPattern, UserAgentMatcher, VerdictCache, get_ua_matcher, reset_ua_matcher,
+    ua_verdict_stats,
+)
+
+
+def _p(pattern, block_type='contains', pk=None):
+    return SimpleNamespace(pk=pk, pattern=pattern, block_type=block_type)
+
+
+class AhoCorasickTest(TestCase):
+
+    def test_overlapping_keywords(self):
+        automaton = AhoCorasick([(k, k) for k in ('he', 'she', 'his', 'hers')])
+        self.assertEqual(automaton.search('ushers'), 'she')
+        self.assertEqual(automaton.search('ahis'), 'his')
+        self.assertIsNone(automaton.search('xyz'))
+
+    def test_suffix_keyword_found_through_failure_link(self):
+        automaton = AhoCorasick([('abcd', 1), ('bc', 2)])
+        self.assertEqual(automaton.search('xabce'), 2)
+
+    def test_agrees_with_substring_search(self):
+        rng = random.Random(7)
+        keywords = {''.join(rng.choice('abc') for _ in range(rng.randint(1, 4))) for _ in range(30)}
+        automaton = AhoCorasick((k, k) for k in keywords)
+        for _ in range(300):
+            text = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 12)))
+            found = automaton.search(text)
+            if found is None:
+                self.assertFalse(any(k in text for k in keywords), text)
+            else:
+                self.assertIn(found, text)
+
+    def test_least_value_found(self):
+        automaton = AhoCorasick([('hers', 1), ('she', 2), ('he', 3)])
+        self.assertEqual(automaton.search('ushers'), 2)
+        self.assertEqual(automaton.least('ushers'), 1)
+        self.assertEqual(automaton.least('ashe'), 2)
+        self.assertIsNone(automaton.least('xyz'))
+
+    def test_empty(self):
+        self.assertIsNone(AhoCorasick([]).search('anything'))
+        self.assertIsNone(AhoCorasick([]).least('anything'))
+
+
+class UserAgentMatcherTest(TestCase):
+
+    def test_reports_matched_pattern(self):
+        bot = _p('AhrefsBot', pk=1)
+        exact = _p('curl', 'exact', pk=2)
+        regex = _p(r'zgrab/\d+', 'regex', pk=3)
+        matcher = UserAgentMatcher([bot, exact, regex])
+        self.assertIs(matcher.match('Mozilla/5.0 (compatible; ahrefsbot/7.0)'), bot)
+        self.assertIs(matcher.match('CURL'), exact)
+        self.assertIsNone(matcher.match('curl/8.0'))
+        self.assertIs(matcher.match('ZGrab/2'), regex)
+        self.assertIsNone(matcher.match('Mozilla/5.0'))
+
+    def test_first_pattern_in_order_wins(self):
+        regex = _p(r'bot/\d', 'regex', pk=1)
+        contains = _p('ahrefs', pk=2)
+        exact = _p('ahrefsbot/7', 'exact', pk=3)
+        grouped = _p(r'(ahr)efs', 'regex', pk=4)
+        for patterns in ([regex, contains, exact, grouped], [grouped, exact, contains, regex],
+                         [exact, grouped, regex, contains], [contains, regex, grouped, exact]):
+            matcher = UserAgentMatcher(patterns)
+            self.assertIs(matcher.match('AhrefsBot/7'), patterns[0])
+
+    def test_regex_with_own_groups(self):
+        grouped = _p(r'(bot)-\1', 'regex')
+        plain = _p(r'scan\d', 'regex')
+        matcher = UserAgentMatcher([grouped, plain])
+        self.assertIs(matcher.match('bot-bot'), grouped)
+        self.assertIs(matcher.match('scan9'), plain)
+        self.assertIsNone(matcher.match('bot-cat'))
+
+    def test_uppercase_regex_keeps_ignorecase(self):
+        pattern = _p(r'Crawler[A-Z]{2}', 'regex')
+        matcher = UserAgentMatcher([pattern, _p(r'spider\d', 'regex')])
+        self.assertIs(matcher.match('crawlerxy'), pattern)
+        self.assertIsNotNone(matcher.match('SPIDER1'))
+
+    def test_invalid_regex_is_skipped(self):
+        matcher = UserAgentMatcher([_p('([bad', 'regex'), _p('good', 'regex')])
+        self.assertEqual(matcher.size, 1)
+        self.assertIsNotNone(matcher.match('good'))
+
+    def test_inline_global_flag_falls_back_to_separate(self):
+        matcher = UserAgentMatcher([_p('foo', 'regex'), _p('(?s)bar.baz', 'regex')])
+        self.assertIsNotNone(matcher.match('bar\nbaz'))
+        self.assertIsNotNone(matcher.match('foo'))
+
+
+class VerdictCacheTest(TestCase):
+
+    def test_hits_and_misses(self):
+        bot = _p('AhrefsBot')
+        matcher = UserAgentMatcher([bot], verdict_cache_size=10)
+        self.assertIs(matcher.match('AhrefsBot/7'), bot)
+        self.assertIs(matcher.match('AhrefsBot/7'), bot)
+        self.assertIsNone(matcher.match('Mozilla/5.0'))
+        self.assertIsNone(matcher.match('Mozilla/5.0'))
+        stats = matcher.verdicts.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (2, 2, 2))
+
+    def test_long_user_agents_not_cached(self):
+        matcher = UserAgentMatcher([_p('bot')], verdict_cache_size=10, verdict_max_length=20)
+        self.assertIsNotNone(matcher.match('x' * 30 + 'bot'))
+        self.assertEqual(len(matcher.verdicts), 0)
+        self.assertEqual(matcher.verdicts.stats()['skipped'], 1)
+
+    def test_one_off_user_agents_do_not_evict_hot_entries(self):
+        verdicts = VerdictCache(maxsize=10)
+        verdicts.put('hot', 'verdict')
+        verdicts.get('hot')  # second touch: promoted to the protected segment
+        for i in range(100):
+            verdicts.put(f'scan-{i}', None)
+        self.assertEqual(verdicts.get('hot'), 'verdict')
+        self.assertLessEqual(len(verdicts), 10)
+
+    def test_disabled_by_default_on_bare_matcher(self):
+        self.assertIsNone(UserAgentMatcher([]).verdicts)
+
+
+class CompiledMatcherCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        reset_ua_matcher()
+
+    def test_compiled_once_per_version(self):
+        BlockedUserAgent.objects.create(pattern='AhrefsBot')
+        first = get_ua_matcher()
+        with self.assertNumQueries(0):
+            self.assertIs(get_ua_matcher(), first)
+
+    def test_save_recompiles(self):
+        BlockedUserAgent.objects.create(pattern='AhrefsBot')
+        first = get_ua_matcher()
+        BlockedUserAgent.objects.create(pattern='SemrushBot')
+        self.assertIsNone(cache.get(UA_PATTERN_VERSION_KEY))
+        second = get_ua_matcher()
+        self.assertIsNot(second, first)
+        self.assertIsNotNone(second.match('SemrushBot/7'))
+
+    def test_other_worker_picks_up_cached_version(self):
+        BlockedUserAgent.objects.create(pattern='AhrefsBot')
+        get_ua_matcher()
+        reset_ua_matcher()
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(get_ua_matcher().match('AhrefsBot'))
+
+    def test_pattern_change_invalidates_verdicts(self):
+        self.assertFalse(BlockedUserAgent.is_user_agent_blocked('SemrushBot/7')[0])
+        BlockedUserAgent.objects.create(pattern='SemrushBot')
+        self.assertTrue(BlockedUserAgent.is_user_agent_blocked('SemrushBot/7')[0])
+
+    def test_attributes_hit_in_model_ordering(self):
+        BlockedUserAgent.objects.create(pattern='bot', block_type='contains', block_count=1)
+        top = BlockedUserAgent.objects.create(pattern=r'^ahrefs', block_type='regex', block_count=9)
+        self.assertEqual(BlockedUserAgent.is_user_agent_blocked('AhrefsBot/7')[1].pk, top.pk)
+
+    @override_settings(NAI_SECURITY_UA_VERDICT_CACHE_SIZE=0)
+    def test_verdict_cache_can_be_disabled(self):
+        BlockedUserAgent.is_user_agent_blocked('Mozilla/5.0')
+        self.assertEqual(ua_verdict_stats(), {})
+
+    def test_patterns_cached_as_plain_tuples(self):
+        ua = BlockedUserAgent.objects.create(pattern='AhrefsBot')
+        blocked, pattern = BlockedUserAgent.is_user_agent_blocked('AhrefsBot/7')
+        self.assertTrue(blocked)
+        self.assertIsInstance(pattern, UAPattern)
+        self.assertEqual(pattern.pk, ua.pk)
+        fmt, version, rows = cache.get(UA_PATTERN_CACHE_KEY)
+        self.assertEqual(fmt, PATTERN_CACHE_FORMAT)
+        self.assertEqual(rows, ((ua.pk, 'AhrefsBot', 'contains'),))
+
+    def test_entry_in_older_format_is_reloaded(self):
+        BlockedUserAgent.objects.create(pattern='AhrefsBot')
+        cache.set(UA_PATTERN_CACHE_KEY, (1, []))
+        cache.delete(UA_PATTERN_VERSION_KEY)
+        self.assertTrue(BlockedUserAgent.is_user_agent_blocked('AhrefsBot/7')[0])
@@ -0,0 +1,141 @@
+import importlib
+import time
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+
+from nai_security.models import LoginHistory, SecurityLog, UserAgentString
+from nai_security.services.log_writer import BufferedLogWriter
+from nai_security.services.user_agents import (
+    PURGE_CHECK_INTERVAL, PURGE_VERSION_CACHE_KEY, clear_user_agent_cache, user_agent_ids,
+)
+
+CHROME = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0'
+CURL = 'curl/8.4.0'
+
+
+class UserAgentDedupeTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        clear_user_agent_cache()
+
+    def tearDown(self):
+        clear_user_agent_cache()
+
+    def test_log_rows_share_one_string(self):
+        first = SecurityLog.log_event('1.1.1.1', 'IP_BLOCK', '/', user_agent=CHROME)
+        second = SecurityLog.log_event('2.2.2.2', 'IP_BLOCK', '/', user_agent=CHROME)
+        self.assertEqual(UserAgentString.objects.count(), 1)
+        self.assertEqual(first.user_agent_string_id, second.user_agent_string_id)
+        self.assertEqual(SecurityLog.objects.get(pk=first.pk).user_agent, CHROME)
+
+    def test_login_history_uses_the_same_table(self):
+        SecurityLog.log_event('1.1.1.1', 'IP_BLOCK', '/', user_agent=CHROME)
+        user = get_user_model().objects.create_user(username='u', email='u@example.com', password='x')
+        login = LoginHistory.objects.create(user=user, ip_address='1.1.1.1', user_agent=CHROME)
+        self.assertEqual(UserAgentString.objects.count(), 1)
+        self.assertEqual(LoginHistory.objects.get(pk=login.pk).user_agent, CHROME)
+
+    def test_empty_user_agent_is_null(self):
+        log = SecurityLog.log_event('1.1.1.1', 'IP_BLOCK', '/')
+        self.assertIsNone(log.user_agent_string_id)
+        self.assertEqual(SecurityLog.objects.get(pk=log.pk).user_agent, '')
+        self.assertFalse(UserAgentString.objects.exists())
+
+    def test_batched_writer_resolves_in_bulk(self):
+        writer = BufferedLogWriter(autostart=False)
+        for i in range(30):
+            writer.write(SecurityLog(**SecurityLog._event_fields(
+                f'10.0.0.{i}', 'IP_BLOCK', '/', user_agent=(CHROME, CURL, 'x')[i % 3],
+            )))
+        # Known hashes, insert of the new strings, their ids, the log rows.
+        with self.assertNumQueries(4):
+            writer.flush()
+        self.assertEqual(UserAgentString.objects.count(), 3)
+        self.assertEqual(
+            SecurityLog.objects.filter(user_agent_string__value=CURL).count(), 10,
+        )
+
+    def test_ids_cached_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ids = user_agent_ids([CHROME, CURL])
+        with self.assertNumQueries(0):
+            self.assertEqual(user_agent_ids([CURL, CHROME, '']), ids)
+
+    def test_ids_not_cached_before_commit(self):
+        user_agent_ids([CHROME])
+        with self.assertNumQueries(1):
+            user_agent_ids([CHROME])
+
+    def test_cached_ids_dropped_after_a_purge_elsewhere(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            user_agent_ids([CHROME])
+        # Another process purges CHROME as unused.
+        UserAgentString.objects.all().delete()
+        cache.set(PURGE_VERSION_CACHE_KEY, 1, None)
+        later = time.monotonic() + PURGE_CHECK_INTERVAL
+        with self.captureOnCommitCallbacks(execute=True), \
+                patch('nai_security.services.user_agents.time.monotonic', return_value=later):
+            ids = user_agent_ids([CHROME])
+        self.assertEqual(ids[CHROME], UserAgentString.objects.get().pk)
+
+    def test_purge_version_read_once_per_interval(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            user_agent_ids([CHROME])
+        with patch.object(cache, 'get', wraps=cache.get) as get:
+            for _ in range(3):
+                user_agent_ids([CHROME])
+        get.assert_not_called()
+
+    def test_text_column_still_written(self):
+        log = SecurityLog.log_event('1.1.1.1', 'IP_BLOCK', '/', user_agent=CHROME)
+        row = SecurityLog.objects.filter(user_agent=CHROME).get()
+        self.assertEqual(row.pk, log.pk)
+        self.assertEqual(row.user_agent_string.value, CHROME)
+
+    def test_changed_user_agent_moves_the_reference(self):
+        log = SecurityLog.log_event('1.1.1.1', 'IP_BLOCK', '/', user_agent=CHROME)
+        log.user_agent = CURL
+        log.save()
+        self.assertEqual(SecurityLog.objects.get(pk=log.pk).user_agent_string.value, CURL)
+        log.user_agent = ''
+        log.save()
+        self.assertIsNone(SecurityLog.objects.get(pk=log.pk).user_agent_string_id)
+
+
+class BackfillMigrationTest(TransactionTestCase):
+
+    before = ('nai_security', '0012_useragentstring')
+    after = ('nai_security', '0013_backfill_user_agent_strings')
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate([self.before])
+        executor.loader.build_graph()
+        apps = executor.loader.project_state([self.before]).apps
+        OldLog = apps.get_model('nai_security', 'SecurityLog')
+        OldLog.objects.bulk_create([
+            OldLog(ip_address='1.1.1.1', action='IP_BLOCK', path='/', user_agent=ua)
+            for ua in (CHROME, CURL, CHROME, '')
+        ])
+
+    def tearDown(self):
+        clear_user_agent_cache()
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_backfill_in_chunks(self):
+        migration = importlib.import_module('nai_security.migrations.0013_backfill_user_agent_strings')
+        executor = MigrationExecutor(connection)
+        with patch.object(migration, 'CHUNK_SIZE', 2):
+            executor.migrate([self.after])
+        self.assertEqual(UserAgentString.objects.count(), 2)
+        self.assertEqual(
+            list(SecurityLog.objects.order_by('pk').values_list('user_agent_string__value', flat=True)),
+            [CHROME, CURL, CHROME, None],
+        )
@@ -1,5 +1,8 @@
 from unittest.mock import patch, MagicMock
 import os
+import tempfile
+import threading
+import time
 
 from django.core.cache import cache
 from django.test import TestCase, RequestFactory, override_settings
@@ -7,7 +10,11 @@ from django.test import TestCase, RequestFactory, override_settings
 from nai_security.utils import (
     get_client_ip,
     get_country_from_ip,
+    get_country_from_ip_async,
+    geoip_cache_stats,
+    get_geoip_reader,
     parse_user_agent,
+    reset_geoip_reader,
     resolve_geoip_db_path,
 )
 
@@ -110,6 +117,7 @@ class ResolveGeoipDbPathTest(TestCase):
 # get_country_from_ip
 # ------------------------------------------------------------------
 
+@override_settings(NAI_SECURITY_GEOIP_CACHE='shared')
 class GetCountryFromIPTest(TestCase):
 
     def setUp(self):
@@ -160,6 +168,162 @@ class GetCountryFromIPTest(TestCase):
         self.assertEqual(cache.get('geoip_country:8.8.4.4'), '__NONE__')
 
 
+class GeoIPCacheModeTest(TestCase):
+    """get_country_from_ip against a real (generated) database in each cache mode."""
+
+    def setUp(self):
+        from tests.mmdb import write_country_mmdb
+
+        cache.clear()
+        reset_geoip_reader()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = write_country_mmdb(
+            os.path.join(self.tmpdir.name, 'GeoLite2-Country.mmdb'),
+            {'192.0.2.0/24': 'US', '198.51.100.0/24': 'DE'},
+        )
+        self.addCleanup(self.tmpdir.cleanup)
+        self.addCleanup(reset_geoip_reader)
+
+    def test_local_mode_is_default_and_skips_shared_cache(self):
+        with override_settings(GEOIP_PATH=self.path):
+            self.assertEqual(get_country_from_ip('192.0.2.1'), 'US')
+            self.assertEqual(get_country_from_ip('192.0.2.1'), 'US')
+            self.assertIsNone(get_country_from_ip('203.0.113.1'))
+            self.assertIsNone(get_country_from_ip('203.0.113.1'))
+            stats = geoip_cache_stats()
+        self.assertIsNone(cache.get('geoip_country:192.0.2.1'))
+        self.assertEqual((stats['mode'], stats['hits'], stats['misses'], stats['size']), ('local', 2, 2, 2))
+
+    def test_local_cache_is_bounded(self):
+        with override_settings(GEOIP_PATH=self.path, NAI_SECURITY_GEOIP_CACHE_SIZE=3):
+            for i in range(10):
+                get_country_from_ip(f'192.0.2.{i + 1}')
+            self.assertEqual(geoip_cache_stats()['size'], 3)
+
+    def test_local_cache_cleared_on_reload(self):
+        from tests.mmdb import write_country_mmdb
+
+        with override_settings(GEOIP_PATH=self.path, NAI_SECURITY_GEOIP_RELOAD_INTERVAL=0.01):
+            self.assertEqual(get_country_from_ip('192.0.2.1'), 'US')
+            tmp = write_country_mmdb(self.path + '.tmp', {'192.0.2.0/24': 'FR'})
+            os.replace(tmp, self.path)
+            time.sleep(0.02)
+            self.assertEqual(get_country_from_ip('192.0.2.1'), 'FR')
+
+    def test_shared_mode_uses_django_cache(self):
+        with override_settings(GEOIP_PATH=self.path, NAI_SECURITY_GEOIP_CACHE='shared'):
+            self.assertEqual(get_country_from_ip('198.51.100.5'), 'DE')
+            self.assertEqual(get_country_from_ip('198.51.100.5'), 'DE')
+            stats = geoip_cache_stats()
+        self.assertEqual(cache.get('geoip_country:198.51.100.5'), 'DE')
+        self.assertEqual(stats['mode'], 'shared')
+        self.assertGreaterEqual(stats['hits'], 1)
+
+    def test_none_mode_reads_database_every_time(self):
+        with override_settings(GEOIP_PATH=self.path, NAI_SECURITY_GEOIP_CACHE='none'):
+            self.assertEqual(get_country_from_ip('198.51.100.5'), 'DE')
+            self.assertEqual(geoip_cache_stats(), {'mode': 'none'})
+        self.assertIsNone(cache.get('geoip_country:198.51.100.5'))
+
+    async def test_async_local_mode(self):
+        with override_settings(GEOIP_PATH=self.path):
+            self.assertEqual(await get_country_from_ip_async('198.51.100.5'), 'DE')
+            self.assertEqual(await get_country_from_ip_async('198.51.100.5'), 'DE')
+
+
+# ------------------------------------------------------------------
+# get_geoip_reader
+# ------------------------------------------------------------------
+
+class GetGeoipReaderTest(TestCase):
+
+    def setUp(self):
+        reset_geoip_reader()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'GeoLite2-Country.mmdb')
+        with open(self.path, 'wb') as f:
+            f.write(b'v1')
+        patcher = patch('geoip2.database.Reader', side_effect=lambda *a, **kw: MagicMock())
+        self.mock_reader = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmpdir.cleanup)
+        self.addCleanup(reset_geoip_reader)
+
+    def _replace_file(self, content):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, self.path)
+
+    def test_opened_memory_mapped(self):
+        import maxminddb
+        with override_settings(GEOIP_PATH=self.path):
+            self.assertIsNotNone(get_geoip_reader())
+        mode = self.mock_reader.call_args.kwargs['mode']
+        self.assertIn(mode, (maxminddb.MODE_MMAP_EXT, maxminddb.MODE_MMAP))
+
+    def test_reused_while_file_unchanged(self):
+        with override_settings(GEOIP_PATH=self.path, NAI_SECURITY_GEOIP_RELOAD_INTERVAL=0.01):
+            first = get_geoip_reader()
+            time.sleep(0.02)
+            self.assertIs(get_geoip_reader(), first)
+        self.assertEqual(self.mock_reader.call_count, 1)
+
+    def test_reloaded_after_file_replaced(self):
+        with override_settings(GEOIP_PATH=self.path, NAI_SECURITY_GEOIP_RELOAD_INTERVAL=0.01):
+            first = get_geoip_reader()
+            self._replace_file(b'version-2')
+            time.sleep(0.02)
+            second = get_geoip_reader()
+        self.assertIsNot(second, first)
+        self.assertEqual(self.mock_reader.call_count, 2)
+
+    def test_file_check_rate_limited(self):
+        with override_settings(GEOIP_PATH=self.path, NAI_SECURITY_GEOIP_RELOAD_INTERVAL=60):
+            first = get_geoip_reader()
+            self._replace_file(b'version-2')
+            with patch('nai_security.utils.os.stat') as mock_stat:
+                self.assertIs(get_geoip_reader(), first)
+            mock_stat.assert_not_called()
+
+    def test_failed_reload_keeps_previous_reader(self):
+        with override_settings(GEOIP_PATH=self.path, NAI_SECURITY_GEOIP_RELOAD_INTERVAL=0.01):
+            first = get_geoip_reader()
+            self._replace_file(b'corrupt')
+            self.mock_reader.side_effect = ValueError('bad database')
+            time.sleep(0.02)
+            self.assertIs(get_geoip_reader(), first)
+
+    def test_missing_file_returns_none(self):
+        with override_settings(GEOIP_PATH=os.path.join(self.tmpdir.name, 'missing.mmdb')):
+            self.assertIsNone(get_geoip_reader())
+        self.mock_reader.assert_not_called()
+
+    def test_concurrent_first_calls_open_once(self):
+        barrier = threading.Barrier(8)
+        results = []
+
+        def slow_open(*args, **kwargs):
+            time.sleep(0.05)
+            return MagicMock()
+
+        self.mock_reader.side_effect = slow_open
+
+        def worker():
+            barrier.wait()
+            results.append(get_geoip_reader())
+
+        with override_settings(GEOIP_PATH=self.path):
+            threads = [threading.Thread(target=worker) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(self.mock_reader.call_count, 1)
+        self.assertEqual(len({id(r) for r in results}), 1)
+
+
 # ------------------------------------------------------------------
 # parse_user_agent
 # ------------------------------------------------------------------